@@ -4,11 +4,23 @@ This module should be used to initialize the whole server.
 """
 
 # !/usr/bin/env python
+import errno
+import os
+import signal
+import socket
+import sys
+import time
 import tornado.httpserver
 import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+import tornado.process
 import tornado.web
 from tornado.options import options
 import logging
+from handlers import auction_updates
+from lib import db_crud, security
+from lib.db_executor import executor as db_executor
 from lib.scheduled_tasks import Scheduler
 
 from settings import settings
@@ -16,19 +28,34 @@ from urls import url_patterns
 
 logger = logging.getLogger('artmego.' + __name__)
 
+# Exit status used by a worker after a graceful restart, so that its parent forks a new one
+WORKER_RESTART_EXIT_STATUS = 3
+
 
 class ArtMeGoAPIServer(tornado.web.Application):
 	"""
 	Wrapper class for the Tornado Application.
 	"""
-	def __init__(self):
-		tornado.web.Application.__init__(self, url_patterns, autoreload=settings['debug'], **settings)
+	def __init__(self, autoreload=settings['debug']):
+		tornado.web.Application.__init__(self, url_patterns, autoreload=autoreload, **settings)
 
 def main():
 	"""
 	Initialize the ArtMeGo API Server.
 	"""
+	if options.workers != 1:
+		if security.revocation_list.enabled and not security.revocation_list.store.shared:
+			# A User who logs out would stay logged in on the other workers
+			raise ValueError("TOKEN_REVOCATION_STORE must be shared by the workers (sqlite) when workers != 1")
+		main_multiprocess()
+		return
+
 	app = ArtMeGoAPIServer()
+	db_crud.warm_up()
+	if db_crud.counter_buffer.enabled:
+		# Also writes the counter increments left by a crashed process
+		db_crud.counter_buffer.start()
+	security.revocation_list.start()
 	http_server = tornado.httpserver.HTTPServer(app)
 	http_server.listen(options.port)
 	logger.info("Starting ArtMeGo_API_Server (debug=%s)..." % (app.settings['debug']))
@@ -46,5 +73,119 @@ def main():
 	logger.info("ArtMeGo_API_Server terminated")
 
 
+def main_multiprocess():
+	"""
+	Initialize the ArtMeGo API Server in pre-fork mode: options.workers processes serve the same port.
+	By default the listening socket is bound once and shared by all workers. With options.reuse_port, every worker
+	binds its own socket with SO_REUSEPORT and the kernel balances connections between them.
+	Sending SIGHUP to a worker restarts it gracefully. Restarts (graceful or not) are limited to options.max_restarts.
+	"""
+	# Autoreload is not compatible with multiple processes
+	app = ArtMeGoAPIServer(autoreload=False)
+
+	sockets = None
+	if not options.reuse_port:
+		sockets = tornado.netutil.bind_sockets(options.port)
+
+	logger.info("Starting ArtMeGo_API_Server with {0} workers (reuse_port={1})...".format(
+		options.workers if options.workers > 0 else tornado.process.cpu_count(), options.reuse_port))
+
+	# Only the worker processes return from here. Workers that exit abnormally are forked again.
+	task_id = tornado.process.fork_processes(options.workers, max_restarts=options.max_restarts)
+
+	# The engine created at import time must not be shared with the parent process
+	db_crud.init_engine()
+	db_crud.warm_up()
+	if db_crud.counter_buffer.enabled:
+		db_crud.counter_buffer.start()
+	security.revocation_list.start()
+
+	if options.reuse_port:
+		sockets = bind_reuse_port_sockets(options.port)
+
+	http_server = tornado.httpserver.HTTPServer(app)
+	http_server.add_sockets(sockets)
+	main_loop = tornado.ioloop.IOLoop.instance()
+
+	signal.signal(signal.SIGHUP, lambda signum, frame: main_loop.add_callback_from_signal(
+		graceful_restart, http_server, sockets, main_loop))
+
+	logger.info("ArtMeGo_API_Server worker {0} (pid {1}) running at {2}:{3}".format(task_id, os.getpid(),
+	                                                                                  options.host, options.port))
+	main_loop.start()
+
+	logger.info("ArtMeGo_API_Server worker {0} (pid {1}) terminated".format(task_id, os.getpid()))
+	sys.exit(WORKER_RESTART_EXIT_STATUS)
+
+
+def bind_reuse_port_sockets(port):
+	"""
+	Bind listening sockets for the given port with the SO_REUSEPORT option, so that several processes can bind them.
+	:param port: the port to listen to
+	:return: a list of sockets
+	"""
+	sockets = []
+	for family, socktype, proto, canonname, sockaddr in \
+			set(socket.getaddrinfo(None, port, socket.AF_INET, socket.SOCK_STREAM, 0, socket.AI_PASSIVE)):
+		sock = socket.socket(family, socktype, proto)
+		tornado.netutil.set_close_exec(sock.fileno())
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_REUSEPORT', 15), 1)
+		sock.setblocking(0)
+		sock.bind(sockaddr)
+		sock.listen(128)
+		sockets.append(sock)
+
+	return sockets
+
+
+def graceful_restart(http_server, sockets, main_loop):
+	"""
+	Stop accepting connections, end the live updates of the Artwork Auctions (see auction_updates.end_live_updates)
+	and stop the worker once its pending web services, bids and live updates have finished (or after
+	options.graceful_timeout seconds). The worker then exits with WORKER_RESTART_EXIT_STATUS and is forked again.
+	:param http_server: the HTTPServer of the worker
+	:param sockets: the listening sockets of the HTTPServer
+	:param main_loop: the IOLoop of the worker
+	"""
+	logger.info("Gracefully restarting worker (pid {0})...".format(os.getpid()))
+	stop_accepting(http_server, sockets)
+	auction_updates.end_live_updates()
+	deadline = time.time() + options.graceful_timeout
+
+	def stop_when_idle():
+		if (db_executor.pending == 0 and db_crud.auction_engine.pending == 0 and
+		    auction_updates.live_update_count() == 0) or time.time() > deadline:
+			main_loop.stop()
+		else:
+			main_loop.add_timeout(time.time() + 0.1, stop_when_idle)
+
+	stop_when_idle()
+
+
+def stop_accepting(http_server, sockets):
+	"""
+	Stop accepting connections. With options.reuse_port, the kernel queues the connections sent to a worker in the
+	backlog of its own socket, and closing the socket resets them: they're accepted (and served) before the socket is
+	closed instead.
+	:param http_server: the HTTPServer of the worker
+	:param sockets: the listening sockets of the HTTPServer (non-blocking)
+	"""
+	if options.reuse_port:
+		for sock in sockets:
+			while True:
+				try:
+					connection, address = sock.accept()
+				except socket.error, e:
+					if e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+						break
+					if e.args[0] == errno.ECONNABORTED:
+						continue
+					raise
+				http_server.handle_stream(tornado.iostream.IOStream(connection), address)
+
+	http_server.stop()
+
+
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
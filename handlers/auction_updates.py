@@ -0,0 +1,268 @@
+# coding=utf-8
+"""
+Module to push the new bids on an Artwork Auction to the Mobile APP, over a WebSocket or with long-poll requests,
+instead of polling the artwork_auction web service (see lib.auction_events).
+"""
+
+import logging
+from datetime import timedelta
+
+from tornado import gen
+from tornado import websocket
+from tornado.concurrent import Future
+from tornado.httputil import HTTPHeaders
+from tornado.web import MissingArgumentError
+
+import lib.db_crud
+
+from handlers.base import BaseHandler
+from handlers.base import construct_error_json
+from lib import security, serializer
+from lib.exceptions import InexistentResourceError, AuthenticationError, WrongArgumentValueError
+from settings import settings
+
+# Global variables
+
+logger = logging.getLogger('artmego.' + __name__)
+db_crud = lib.db_crud
+
+# The live updates served by this process (see end_live_updates)
+_websockets = set()  # The open AuctionUpdatesWebSocketHandlers
+_poll_futures = set()  # The Futures of the long-poll requests waiting for a new bid
+_ending = False  # Whether the process is stopping, so new live updates end at once
+
+
+class AuctionUpdatesWebSocketHandler(websocket.WebSocketHandler):
+	"""
+	4E - Artwork Auction live updates (WebSocket)
+	Sends the state of an Artwork Auction when the connection is opened, and every time it gets a new bid.
+	The connection is closed after an error message.
+	URL: ws://host:port/artwork_auction_updates?artwork_auction_id=123
+	Messages: see artwork_auction_update()
+	"""
+
+	def open(self):
+		self.artwork_auction_id = None
+		self.sent_state = None
+
+		try:
+			user_id = authenticate_request(self.request)
+			artwork_auction_id = parse_integer('artwork_auction_id', self.get_argument('artwork_auction_id'))
+		except Exception, e:
+			self.send_error_message(error_code(e))
+			return
+
+		if not db_crud.auction_events.enabled:
+			self.send_error_message("0004")
+			return
+
+		if _ending:
+			self.close(1001, "Server restarting")
+			return
+
+		self.user_id = user_id
+		self.artwork_auction_id = artwork_auction_id
+		_websockets.add(self)
+		db_crud.auction_events.subscribe(artwork_auction_id, self.on_auction_state)
+
+	def on_auction_state(self, state):
+		"""
+		Send the new state of the Artwork Auction (an auction_events listener).
+		:param state: the state of the Artwork Auction, None if it doesn't exist
+		"""
+		if self.ws_connection is None:
+			return
+		if state is None:
+			self.send_error_message("0002")
+			return
+		if state == self.sent_state:
+			return
+
+		self.sent_state = state
+		self.write_message(serializer.dumps(artwork_auction_update(state, self.user_id)))
+
+	def on_message(self, message):
+		pass
+
+	def on_close(self):
+		_websockets.discard(self)
+		if self.artwork_auction_id is not None:
+			db_crud.auction_events.unsubscribe(self.artwork_auction_id, self.on_auction_state)
+
+	def send_error_message(self, error_code):
+		"""
+		Send an error message and close the connection.
+		:param error_code: the code number as a string, e.g. "0001"
+		"""
+		self.write_message(serializer.dumps(construct_error_json(error_code)))
+		self.close()
+
+
+class AuctionUpdatesPollHandler(BaseHandler):
+	"""
+	4F - Artwork Auction live updates (long-poll GET)
+	Waits until the bid count of an Artwork Auction is not the one known by the client, for up to
+	settings['AUCTION_LONG_POLL_SECONDS'], and returns its state then (even if it has no new bids). Without bid_count,
+	the state is returned at once.
+	URL: http://host:port/artwork_auction_poll?artwork_auction_id=123&bid_count=3
+	Result: see artwork_auction_update()
+	"""
+
+	# Private attributes
+	_static_headers = HTTPHeaders({"content-type": "application/json; charset=utf-8"})
+
+	def initialize(self):
+		for header in self._static_headers:
+			self.set_header(header, self._static_headers[header])
+
+	@gen.coroutine
+	def get(self):
+		try:
+			user_id = authenticate_request(self.request)
+			artwork_auction_id = parse_integer('artwork_auction_id', self.get_argument('artwork_auction_id'))
+			bid_count = self.get_argument('bid_count', None)
+			bid_count = parse_integer('bid_count', bid_count) if bid_count is not None else None
+			if not db_crud.auction_events.enabled:
+				raise NotImplementedError
+
+			state = yield wait_for_auction_state(artwork_auction_id, bid_count)
+			if state is None:
+				raise InexistentResourceError()
+			result = artwork_auction_update(state, user_id)
+		except Exception, e:
+			result = construct_error_json(error_code(e))
+
+		self.write(serializer.dumps(result))
+
+
+@gen.coroutine
+def wait_for_auction_state(artwork_auction_id, bid_count):
+	"""
+	Wait until an Artwork Auction has a number of bids other than bid_count, for up to
+	settings['AUCTION_LONG_POLL_SECONDS'].
+	Raises a tornado.gen.TimeoutError if the state of the Artwork Auction can't be loaded in time.
+	:param artwork_auction_id: the id of the Artwork Auction
+	:param bid_count: the number of bids known by the client, None to get the state at once
+	:return: a Future with the state of the Artwork Auction (see lib.auction_events), None if it doesn't exist
+	"""
+	future = Future()
+
+	def on_auction_state(state):
+		if not future.done() and (state is None or state['bid_count'] != bid_count):
+			future.set_result(state)
+
+	db_crud.auction_events.subscribe(artwork_auction_id, on_auction_state)
+	_poll_futures.add(future)
+	if _ending:
+		future.set_exception(gen.TimeoutError())
+	try:
+		state = yield gen.with_timeout(timedelta(seconds=settings['AUCTION_LONG_POLL_SECONDS']), future)
+	except gen.TimeoutError, e:
+		state = db_crud.auction_events.get_state(artwork_auction_id)
+		if state is None:
+			raise e
+	finally:
+		_poll_futures.discard(future)
+		db_crud.auction_events.unsubscribe(artwork_auction_id, on_auction_state)
+
+	raise gen.Return(state)
+
+
+def end_live_updates():
+	"""
+	End the live updates of this process, which is stopping (see app.graceful_restart): the WebSocket connections are
+	closed with the "going away" code, so that their clients connect again (to another process), and the long-poll
+	requests return the current state of their Artwork Auction at once. New live updates end at once too.
+	"""
+	global _ending
+	_ending = True
+
+	for handler in list(_websockets):
+		handler.close(1001, "Server restarting")
+	for future in list(_poll_futures):
+		if not future.done():
+			future.set_exception(gen.TimeoutError())
+
+
+def live_update_count():
+	"""
+	:return: the number of WebSocket connections and long-poll requests of this process not finished yet
+	"""
+	return len(_websockets) + len(_poll_futures)
+
+
+def artwork_auction_update(state, user_id):
+	"""
+	Build the message of a new state of an Artwork Auction.
+	:param state: the state of the Artwork Auction (see lib.auction_events)
+	:param user_id: the user_id of the watching User
+	:return: {
+			  "response":"success",
+			  "artwork_auction":
+			  {
+			    "artwork_auction_id":123,
+			    "current_bid":1000.0,
+			    "high_bidder_name":"pa****",
+			    "user_is_high_bidder":false,
+			    "bid_count":3
+			  }
+			}
+	"""
+	artwork_auction_dictionary = dict(artwork_auction_id=state['artwork_auction_id'],
+	                                  current_bid=state['current_bid'],
+	                                  high_bidder_name=state['high_bidder_name'],
+	                                  user_is_high_bidder=state['high_bidder_user_id'] is not None and
+	                                                      state['high_bidder_user_id'] == user_id,
+	                                  bid_count=state['bid_count'])
+
+	return dict(response="success",
+	            artwork_auction=artwork_auction_dictionary)
+
+
+def authenticate_request(request):
+	"""
+	Get the User of a request from its JWT token.
+	Raises a KeyError if the request has no Authorization header.
+	Raises an AuthenticationError if the token is not valid.
+	:param request: the tornado.httputil.HTTPServerRequest
+	:return: the user_id of the User
+	"""
+	token = request.headers['Authorization'].split(' ')[1]
+	return security.authenticate_user_token(token)
+
+
+def parse_integer(name, value):
+	"""
+	Raises a WrongArgumentValueError if the value is not an integer.
+	:param name: the name of the argument
+	:param value: the value of the argument
+	:return: the integer
+	"""
+	try:
+		return int(value)
+	except ValueError:
+		raise WrongArgumentValueError(name)
+
+
+def error_code(exception):
+	"""
+	:param exception: an exception raised while serving a live update
+	:return: the error code of the exception (see handlers.base.RESULT_ERROR_CODES)
+	"""
+	if isinstance(exception, (KeyError, IndexError)):
+		return "0009"  # No Authorization header, or no token in it
+	elif isinstance(exception, AuthenticationError):
+		return "0005"
+	elif isinstance(exception, InexistentResourceError):
+		return "0002"
+	elif isinstance(exception, MissingArgumentError):
+		return "0003"
+	elif isinstance(exception, NotImplementedError):
+		return "0004"
+	elif isinstance(exception, WrongArgumentValueError):
+		return "0006"
+	elif isinstance(exception, gen.TimeoutError):
+		return "0012"
+
+	logger.log(logging.ERROR, "Error in auction_updates: {0}".format(exception))
+	return "0001"
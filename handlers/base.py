@@ -7,6 +7,9 @@ from tornado import escape
 import tornado.web
 import logging
 
+from lib import db_crud
+from lib.db_executor import executor as db_executor
+
 logger = logging.getLogger('artmego.' + __name__)
 
 # Handler result error codes
@@ -21,6 +24,8 @@ RESULT_ERROR_CODES = {
     '0008': "user already exists",
     '0009': "unauthorized",
 	'0010': "insufficient funds",
+	'0011': "server busy",
+	'0012': "request timeout",
 }
 
 def construct_error_json(error_code):
@@ -44,6 +49,30 @@ class BaseHandler(tornado.web.RequestHandler):
 	def data_received(self, chunk):
 		pass
 
+	def prepare(self):
+		"""
+		Open the unit of work of this request. All db_crud functions called while serving the request share the
+		same database session (see db_crud.RequestSession).
+		"""
+		self.db_session = db_crud.RequestSession()
+
+	def on_finish(self):
+		"""
+		Close the unit of work of this request, discarding any uncommitted writes.
+		"""
+		db_session = getattr(self, 'db_session', None)
+		if db_session is not None:
+			db_session.close()
+
+	def run_db(self, function, *args, **kwargs):
+		"""
+		Run a function that uses db_crud as the unit of work of this request, in the database thread pool.
+		The writes made by the function are committed once it returns.
+		:param function: the function to run (e.g. a web service)
+		:return: a Future with the result of the function
+		"""
+		return db_executor.run(self.db_session, function, *args, **kwargs)
+
 	def load_json(self):
 		"""
 	        Load JSON from the request body and store them in
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""
+Module to handle access to the internal web services (monitoring, diagnostics), which are only available to the
+clients in settings['INTERNAL_API_ALLOWED_IPS'].
+"""
+
+import logging
+
+from tornado.httputil import HTTPHeaders
+
+import lib.db_crud
+
+from handlers.base import BaseHandler
+from handlers.base import construct_error_json
+from lib import serializer
+from lib.db_executor import executor as db_executor
+from lib.response_cache import cache as response_cache
+from settings import settings
+
+# Global variables
+
+logger = logging.getLogger('artmego.' + __name__)
+db_crud = lib.db_crud
+
+
+class InternalAPIHandler(BaseHandler):
+	"""
+	A class to handle all calls to the internal web services.
+	"""
+
+	# Private attributes
+	_static_headers = HTTPHeaders({"content-type": "application/json; charset=utf-8"})
+
+	def initialize(self):
+		for header in self._static_headers:
+			self.set_header(header, self._static_headers[header])
+
+	def data_received(self, chunk):
+		pass
+
+	def get(self):
+		"""
+		Fetches the required internal web service (a dictionary) using the GET method and displays it as a Json object
+		:return: the result of a web service in Json format
+		"""
+		ws_name = self.request.path[len("/internal/"):]  # original path is like "/internal/db_pool_stats"
+
+		try:
+			if self.request.remote_ip not in settings['INTERNAL_API_ALLOWED_IPS']:
+				result = construct_error_json("0009")
+			else:
+				result = get_internal_ws(ws_name)
+		except NotImplementedError:
+			result = construct_error_json("0004")
+		except Exception, e:
+			logger.log(logging.ERROR, "Error in internal_api get(): {0}".format(e.message))
+			result = construct_error_json("0001")
+
+		self.write(serializer.dumps(result))
+
+
+def get_internal_ws(ws_name):
+	"""
+	Get the internal web service named ws_name. These web services run in the IOLoop thread and must not block.
+	:param ws_name: the name of the web service, e.g. "db_pool_stats"
+	:return: a dictionary with the result of the web service
+	"""
+	if ws_name == "db_pool_stats":
+		result = db_pool_stats()
+	elif ws_name == "response_cache_stats":
+		result = response_cache_stats()
+	else:
+		raise NotImplementedError
+
+	return result
+
+
+def db_pool_stats():
+	"""
+	Web service: the statistics of the database connection pool and the database executor of this process.
+	With several worker processes, each worker reports its own statistics.
+	:return: a dictionary like {"response": "success", "pool": {...}, "executor": {...}}
+	"""
+	result = {'response': "success",
+	          'pool': db_crud.get_pool_statistics(),
+	          'executor': {'enabled': db_executor.enabled,
+	                       'pool_size': db_executor.pool_size,
+	                       'queue_depth': db_executor.queue_depth,
+	                       'pending': db_executor.pending}}
+
+	return result
+
+
+def response_cache_stats():
+	"""
+	Web service: the size and hit/miss counters of the response cache of this process.
+	:return: a dictionary like {"response": "success", "response_cache": {...}}
+	"""
+	result = {'response': "success",
+	          'response_cache': response_cache.statistics()}
+
+	return result
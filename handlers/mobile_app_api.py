@@ -3,10 +3,11 @@
 Module to handle access to the Mobile APP web services.
 """
 
-import json
 import logging
+import time
 from random import randint
 
+from tornado import gen
 from tornado import httpclient
 from tornado.httputil import HTTPHeaders
 
@@ -14,18 +15,46 @@ import lib.db_crud
 
 from handlers.base import BaseHandler, callback
 from handlers.base import construct_error_json
-from lib import security
+from lib import entity_versions, security, serializer
+from lib.data_loader import RequestLoaders
+from lib.db_executor import AsyncResult
+from lib.pagination import combine_cursors, split_cursors
+from lib.response_cache import cache as response_cache
 from lib.exceptions import InexistentResourceError, MissingArgumentsError, UnauthorizedError, UserExistsError, \
-	UserInexistentError, WrongArgumentValueError, AuthenticationError, InsufficientFundsError
+	UserInexistentError, WrongArgumentValueError, AuthenticationError, InsufficientFundsError, ServerBusyError
 from settings import settings
 
-from lib.utils import DecimalEncoder, deprecated
+from lib.utils import deprecated
+from lib.web_services import WebServiceRegistry, INTEGER, NUMBER, STRING, BOOLEAN
 
 # Global variables
 
 logger = logging.getLogger('artmego.' + __name__)
 db_crud = lib.db_crud
 
+# Web services whose responses are the same for every caller, and the data they depend on:
+# {ws_name: {table name: columns whose updates change the response (None for any column)}}
+CACHED_WEB_SERVICES = {
+	"banner_list": {"Banner": None, "Image": frozenset(["image_path"])},
+	"artist_list": {"Artist": frozenset(["user_id", "artist_nickname", "image_id"]),
+	                "Image": frozenset(["image_path"])},
+	"gallery_list": {"Gallery": frozenset(["user_id", "gallery_name", "banner_image_id"]),
+	                 "Image": frozenset(["image_path"])},
+	"auction_house_list": {"Auction_House": frozenset(["user_id", "auction_house_name", "banner_image_id"]),
+	                       "Image": frozenset(["image_path"])},
+	"label_list": {"Label": None},
+}
+
+# Web services answered with "304 Not Modified" when the client already has the current version of the page
+CONDITIONAL_WEB_SERVICES = ("artwork_page", "artist_page", "gallery_auction_page")
+
+# The lists of the following_lists web service, which share a cursor
+FOLLOWING_LISTS = ("followed_artwork", "followed_artists", "followed_galleries", "followed_auction_houses",
+                   "followed_critics", "favorite_artwork", "owned_artwork")
+
+# Web services that accept a JWT token expired less than settings['JWT_REFRESH_LEEWAY_SECONDS'] ago
+REFRESH_WEB_SERVICES = ("login", "refresh_token")
+
 
 # @require_basic_auth
 class MobileAppAPIHandler(BaseHandler):
@@ -52,6 +81,7 @@ class MobileAppAPIHandler(BaseHandler):
 	def write(self, chunk):
 		super(MobileAppAPIHandler, self).write(chunk)
 
+	@gen.coroutine
 	def get(self, **kwargs):
 		"""
 		Fetches the required web service (a dictionary) using the GET method and displays it as a Json object
@@ -66,6 +96,21 @@ class MobileAppAPIHandler(BaseHandler):
 		ws_name = self.request.path[1:]  # original path is like "/banner"
 		arguments = self.request.arguments
 
+		# Anonymous catalog web services are served from the response cache, unless the client asks to bypass it
+		cache_key = None
+		if settings['RESPONSE_CACHE_ENABLED'] and not self.require_token and ws_name in CACHED_WEB_SERVICES:
+			cache_key = response_cache.make_key(ws_name, dict((name, values) for name, values in arguments.iteritems()
+			                                                  if name != "callback"))
+			cache_generation = response_cache.generation()  # Before the read (see ResponseCache.set)
+			if self.request.headers.get(settings['RESPONSE_CACHE_BYPASS_HEADER']) is None:
+				cached_result = response_cache.get(cache_key)
+				if cached_result is not None:
+					self.set_header("X-Cache", "HIT")
+					self.write(cached_result)
+					return
+			self.set_header("X-Cache", "MISS")
+			self.db_session.primary_reads = True  # A lagging replica would be cached under the new generation
+
 		try:
 			# First, check if it requires a JWT token
 			if self.require_token:
@@ -75,7 +120,17 @@ class MobileAppAPIHandler(BaseHandler):
 			else:
 				user_id = None
 
-			result = get_ws(ws_name, arguments, user_id)
+			self.db_session.user_id = user_id  # Pins the User to the primary database after writing
+			if ws_name in CONDITIONAL_WEB_SERVICES:
+				etag, result = yield self.run_db(get_ws_if_modified, ws_name, arguments, user_id,
+				                                 self.request.headers.get("If-None-Match"))
+				if etag is not None:
+					self.set_header("Etag", etag)
+				if result is None:
+					self.set_status(304)
+					return
+			else:
+				result = yield self.run_db(get_ws, ws_name, arguments, user_id)
 		except httpclient.HTTPError, e:
 			if e.code == 401:  # Authentication error
 				result = construct_error_json("0005")
@@ -99,15 +154,23 @@ class MobileAppAPIHandler(BaseHandler):
 			result = construct_error_json("0008")
 		except UnauthorizedError:
 			result = construct_error_json("0009")
+		except ServerBusyError:
+			result = construct_error_json("0011")
+		except gen.TimeoutError:
+			result = construct_error_json("0012")
 		except Exception, e:
 			logger.log(logging.ERROR, "Error in mobile_app_api post(): {0}".format(e.message))
 			result = construct_error_json("0001")
 
 		# Convert result to JSON
-		result = json.dumps(result, cls=DecimalEncoder)
+		cacheable = cache_key is not None and 'error_code' not in result
+		result = serializer.dumps(result)
+		if cacheable:
+			response_cache.set(cache_key, result, CACHED_WEB_SERVICES[ws_name], cache_generation)
 
 		self.write(result)
 
+	@gen.coroutine
 	def post(self, **kwargs):
 		"""
 		Fetches the required web service (a dictionary) using the POST method and displays it as a Json object
@@ -122,6 +185,7 @@ class MobileAppAPIHandler(BaseHandler):
 		ws_name = self.request.path[1:]  # original path is like "/login"
 		arguments = self.request.arguments
 		request_body = self.request.body
+		token = None
 
 		try:
 			# First, check if it requires a JWT token
@@ -129,7 +193,12 @@ class MobileAppAPIHandler(BaseHandler):
 				try:
 					token_header = self.request.headers['Authorization']  # Produce KeyError if not provided
 					token = token_header.split(' ')[1]
-					user_id = security.authenticate_user_token(token)
+					if ws_name == "login":
+						user_id = authenticate_login_token(token)
+					elif ws_name in REFRESH_WEB_SERVICES:
+						user_id = security.authenticate_refresh_token(token)
+					else:
+						user_id = security.authenticate_user_token(token)
 				except KeyError, e:
 					# JWT token is optional for some web services (i.e. login)
 					if ws_name != "login":
@@ -139,7 +208,8 @@ class MobileAppAPIHandler(BaseHandler):
 			else:
 				user_id = None
 
-			result = post_ws(ws_name, arguments, request_body, user_id)
+			self.db_session.user_id = user_id  # Pins the User to the primary database after writing
+			result = yield self.run_db(post_ws, ws_name, arguments, request_body, user_id, token)
 		except httpclient.HTTPError, e:
 			if e.code == 401:  # Authentication error
 				result = construct_error_json("0005")
@@ -165,12 +235,16 @@ class MobileAppAPIHandler(BaseHandler):
 			result = construct_error_json("0009")
 		except InsufficientFundsError:
 			result = construct_error_json("0010")
+		except ServerBusyError:
+			result = construct_error_json("0011")
+		except gen.TimeoutError:
+			result = construct_error_json("0012")
 		except Exception, e:
 			logger.log(logging.ERROR, "Error in mobile_app_api post(): {0}".format(e.message))
 			result = construct_error_json("0001")
 
 		# Convert result to JSON
-		result = json.dumps(result, cls=DecimalEncoder)
+		result = serializer.dumps(result)
 
 		self.write(result)
 
@@ -188,64 +262,14 @@ def get_ws(ws_name, arguments, user_id=None):
 	"""
 
 	try:
+		web_service = web_services.get("GET", ws_name)
+		arguments = web_service.parse_query(arguments)
+
 		# Common arguments
+		if 'cursor' in arguments and 'offset' in web_service.arguments:
+			arguments['offset'] = 0  # Keyset pagination (see lib.pagination) is used instead of the offset
 
-		if ws_name == "banner_list":
-			return home_banner_list()
-		elif ws_name == "home_artwork":
-			sorting_rule = int(arguments['sorting_rule'][0])
-			limit = int(arguments['limit'][0])
-			offset = int(arguments['offset'][0])
-			if sorting_rule == 5:
-				location = arguments['location'][0]
-			else:
-				location = None
-			return home_artwork(sorting_rule, limit, offset, user_id, location)
-		elif ws_name == "artwork_page":
-			artwork_id = long(arguments['artwork_id'][0])
-			return artwork_page(artwork_id, user_id)
-		elif ws_name == "artwork_auction":
-			artwork_id = long(arguments['artwork_id'][0])
-			return artwork_auction(artwork_id, user_id)
-		elif ws_name == "artist_page":
-			artist_id = long(arguments['artist_id'][0])
-			sorting_rule = int(arguments['sorting_rule'][0])
-			limit = int(arguments['limit'][0])
-			offset = int(arguments['offset'][0])
-			return artist_page(artist_id, sorting_rule, limit, offset, user_id)
-		elif ws_name == "gallery_auction_page":
-			id = long(arguments['id'][0])
-			type = arguments['type'][0]
-			return gallery_auction_page(id, type, user_id)
-		elif ws_name == "artist_list":
-			limit = int(arguments['limit'][0])
-			offset = int(arguments['offset'][0])
-			return artist_list(limit, offset)
-		elif ws_name == "gallery_list":
-			limit = int(arguments['limit'][0])
-			offset = int(arguments['offset'][0])
-			return gallery_list(limit, offset)
-		elif ws_name == "auction_house_list":
-			limit = int(arguments['limit'][0])
-			offset = int(arguments['offset'][0])
-			return auction_house_list(limit, offset)
-		elif ws_name == "label_list":
-			limit = int(arguments['limit'][0])
-			offset = int(arguments['offset'][0])
-			return label_list(limit, offset)
-		elif ws_name == "about_me":
-			top_n_labels = int(arguments['top_n_labels'][0])
-			top_n_artists = int(arguments['top_n_artists'][0])
-			return about_me(user_id, top_n_labels, top_n_artists)
-		elif ws_name == "following_lists":
-			limit = int(arguments['limit'][0])
-			offset = int(arguments['offset'][0])
-			return following_lists(user_id, limit, offset)
-		elif ws_name == "user_auction_list":
-			sorting_rule = int(arguments['sorting_rule'][0])
-			return user_auction_list(user_id, sorting_rule)
-		else:
-			raise InexistentResourceError()
+		return web_service.call(arguments, user_id=user_id)
 	except KeyError, e:
 		raise MissingArgumentsError()
 	except ValueError, e:
@@ -254,6 +278,42 @@ def get_ws(ws_name, arguments, user_id=None):
 		raise e
 
 
+def get_ws_if_modified(ws_name, arguments, user_id, if_none_match):
+	"""
+	Get a GET web service unless the client already has its current version. The ETag of the response is built from the
+	version stamps of the entities in the page (see lib.entity_versions), which is much cheaper than building the page.
+	:param ws_name: the name of the web service to access (one of CONDITIONAL_WEB_SERVICES)
+	:param arguments: the URL arguments for the web service
+	:param user_id: the user_id of the requesting User (when applicable)
+	:param if_none_match: the If-None-Match header of the request, or None
+	:return: a tuple (etag, result), where result is None if the client has the current version. etag is None if the
+		page doesn't exist (or the arguments are wrong)
+	"""
+
+	try:
+		if ws_name == "artwork_page":
+			versions = db_crud.get_artwork_page_versions(long(arguments['artwork_id'][0]), user_id)
+		elif ws_name == "artist_page":
+			versions = db_crud.get_artist_page_versions(long(arguments['artist_id'][0]), user_id)
+		elif ws_name == "gallery_auction_page":
+			versions = db_crud.get_place_page_versions(long(arguments['id'][0]), user_id)
+			# The page only lists current events, so it also changes as time passes
+			versions[("MINUTE", 0)] = int(time.time() // 60)
+		else:
+			versions = None
+	except (KeyError, ValueError):
+		versions = None  # get_ws reports the wrong arguments
+
+	if versions is None:
+		return None, get_ws(ws_name, arguments, user_id)
+
+	etag = entity_versions.make_etag(ws_name, arguments, user_id, versions)
+	if entity_versions.etag_matches(if_none_match, etag):
+		return etag, None
+
+	return etag, get_ws(ws_name, arguments, user_id)
+
+
 def home_banner_list():
 	"""
 	2A - Home Banner list (GET)
@@ -289,11 +349,11 @@ def home_banner_list():
 	return result
 
 
-def home_artwork(sorting_rule, limit, offset, user_id, location=None):
+def home_artwork(sorting_rule, limit, offset, user_id, location=None, cursor=None):
 	"""
 	2B - Home Artwork list (GET)
 	List of Artwork to display in Home screen, sorted by one of several rules.
-	URL: http://host:port/home_artwork?sorting_rule=1&limit=10&offset=10[&location=long,lat]
+	URL: http://host:port/home_artwork?sorting_rule=1&limit=10&offset=10[&location=lat,long]
 	:param sorting_rule:
 		1: most popular Artwork
 		2: my watched Critics
@@ -304,6 +364,8 @@ def home_artwork(sorting_rule, limit, offset, user_id, location=None):
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
 	:param user_id: the user_id of the requesting User
 	:param location: "lat,long" (optional) e.g. 24.971059,121.241765
+	:param cursor: the next_cursor of the previous page ("" for the first page) to use instead of offset; the result then
+		includes the "next_cursor" of the following page (null after the last page)
 	:return: {
 			  "response":"success",
 			  "artwork_list":[
@@ -332,7 +394,11 @@ def home_artwork(sorting_rule, limit, offset, user_id, location=None):
 
 	# Get Artwork list and Images
 	artwork_list, artwork_image_dictionary = \
-		db_crud.get_artwork_list(sorting_rule, None, limit, offset, user_id, location)
+		db_crud.get_artwork_list(sorting_rule, None, limit, offset, user_id, location, cursor)
+
+	# Batch the Artist, owner and follow state lookups of the whole page
+	loaders = RequestLoaders(user_id)
+	loaders.prime_artwork_list(artwork_list)
 
 	# Build dictionaries
 	artwork_dictionary_list = []
@@ -346,29 +412,15 @@ def home_artwork(sorting_rule, limit, offset, user_id, location=None):
 		else:
 			rand_image = None
 
-		artist, artist_image = db_crud.get_artist(artwork.artist_user_id)
+		artist, artist_image = loaders.artist.load(artwork.artist_user_id)
 
 		# Owner
-		owner, owner_type, owner_image = db_crud.get_artwork_owner(artwork)
-
-		if owner is None:
-			owner_id = None
-			owner_type = None
-			owner_name = None
-		else:
-			owner_id = owner.user_id
-
-			if owner_type.lower() == "buyer":
-				owner_name = owner.buyer_nickname
-			elif owner_type.lower() == "artist":
-				owner_name = owner.artist_nickname
-			elif owner_type.lower() == "auction_house":
-				owner_name = owner.auction_house_name
-			else:
-				owner_name = owner.gallery_name
+		owner = loaders.artwork_owner.load(artwork)
+		owner_id, owner_type, owner_name, owner_image_path = \
+			owner if owner is not None else (None, None, None, None)
 
 		# Following or not
-		following = db_crud.artwork_is_followed(user_id, artwork.artwork_id)
+		following = loaders.artwork_followed.load(artwork.artwork_id)
 
 		artwork_dictionary = dict(display_order=i,
 								  artwork_id=artwork.artwork_id,
@@ -382,8 +434,8 @@ def home_artwork(sorting_rule, limit, offset, user_id, location=None):
 								  owner_id=owner_id,
 								  owner_type=owner_type,
 								  owner_name=owner_name,
-								  owner_image_path=owner_image.image_path if owner_image is not None else None,
-								  follower_count=artwork.artwork_followed_count,
+								  owner_image_path=owner_image_path,
+								  follower_count=db_crud.counter_value(artwork, "artwork_followed_count"),
 								  critique_count=artwork.artwork_critique_count)
 		artwork_dictionary_list.append(artwork_dictionary)
 
@@ -391,6 +443,9 @@ def home_artwork(sorting_rule, limit, offset, user_id, location=None):
 				  artwork_list=artwork_dictionary_list,
 				  count=len(artwork_list))
 
+	if cursor is not None:
+		result['next_cursor'] = db_crud.get_artwork_list_order(sorting_rule, location).next_cursor(artwork_list, limit)
+
 	return result
 
 
@@ -461,23 +516,9 @@ def artwork_page(artwork_id, user_id):
 	critiques = db_crud.get_critique_list(artwork.artwork_id)
 
 	# Owner
-	owner, owner_type, owner_image = db_crud.get_artwork_owner(artwork)
-
-	if owner is None:
-		owner_id = None
-		owner_type = None
-		owner_name = None
-	else:
-		owner_id = owner.user_id
-
-		if owner_type.lower() == "buyer":
-			owner_name = owner.buyer_nickname
-		elif owner_type.lower() == "artist":
-			owner_name = owner.artist_nickname
-		elif owner_type.lower() == "auction_house":
-			owner_name = owner.auction_house_name
-		else:
-			owner_name = owner.gallery_name
+	owner = db_crud.get_artwork_owners([artwork])[artwork.artwork_id]
+	owner_id, owner_type, owner_name, owner_image_path = \
+		owner if owner is not None else (None, None, None, None)
 
 	# Following or not
 	following = db_crud.artwork_is_followed(user_id, artwork.artwork_id)
@@ -494,35 +535,40 @@ def artwork_page(artwork_id, user_id):
 	                          owner_id=owner_id,
 	                          owner_type=owner_type,
 	                          owner_name=owner_name,
-	                          owner_image_path=owner_image.image_path if owner_image is not None else None,
-	                          follower_count=artwork.artwork_followed_count,
+	                          owner_image_path=owner_image_path,
+	                          follower_count=db_crud.counter_value(artwork, "artwork_followed_count"),
 	                          critique_count=artwork.artwork_critique_count
 	                          )
 
+	# Batch the purchase and vote state lookups of all the Critiques
+	loaders = RequestLoaders(user_id)
+	loaders.prime_critique_list(critiques)
+
 	critique_dictionary_list = []
 	for critique in critiques:
+		critique_key = (critique.artwork_id, critique.critic_user_id)
 
 		# Check if Critique is purchased
-		critique_purchased = db_crud.critique_purchased(user_id, artwork_id, critique.critic_user_id)
+		critique_purchased = loaders.critique_purchased.load(critique_key)
 		if critique_purchased:
 			critique_text = critique.critique_text
 		else:
 			critique_text = ""
 
 		# Check Critique vote type
-		critique_liked = db_crud.get_critique_vote_type(user_id, artwork_id, critique.critic_user_id)
+		critique_liked = loaders.critique_vote_type.load(critique_key)
 
 		critique_dictionary = \
 			dict(critique_date=critique.critique_creation_time.strftime(settings['DATE_DISPLAY_FORMAT']),
 			     critique_point_price=critique.critique_point_price,
 			     critique_text=critique_text,
-			     critique_upvote_count=critique.critique_upvote_count,
-			     critique_downvote_count=critique.critique_downvote_count,
+			     critique_upvote_count=db_crud.counter_value(critique, "critique_upvote_count"),
+			     critique_downvote_count=db_crud.counter_value(critique, "critique_downvote_count"),
 			     critique_vote_type=critique_liked,
 			     critique_purchased=critique_purchased,
 			     critic_id=critique.critic.user_id,
 			     critic_name=critique.critic.critic_nickname,
-			     critic_follower_count=critique.critic.critic_followed_count
+			     critic_follower_count=db_crud.counter_value(critique.critic, "critic_followed_count")
 			     )
 		critique_dictionary_list.append(critique_dictionary)
 
@@ -539,6 +585,7 @@ def artwork_auction(artwork_id, user_id):
 	4A - Artwork Auction page (GET)
 	Current Auction page for a given Artwork. Displays current Auction information and time left for Auction.
 	If the given Artwork has no current Auction, then an empty result is returned.
+	The new bids are pushed by 4E and 4F, so clients shouldn't poll this web service (see handlers.auction_updates).
 	URL: http://host:port/artwork_auction?artwork_id=123
 	:param artwork_id: the id of the Artwork
 	:param user_id: the user_id of the requesting User
@@ -567,7 +614,7 @@ def artwork_auction(artwork_id, user_id):
 
 	# Build Artwork Auction dictionary
 	current_bid = artwork_auction.current_bid
-	current_bid_amount = current_bid.artwork_auction_bid_amount if current_bid is not None else 0
+	current_bid_amount = artwork_auction.artwork_auction_max_bid or 0
 	high_bidder = current_bid.buyer if current_bid is not None else None
 	high_bidder_name = high_bidder.buyer_nickname if high_bidder is not None else None
 	if high_bidder is not None:
@@ -577,7 +624,7 @@ def artwork_auction(artwork_id, user_id):
 			user_is_high_bidder = False
 	else:
 		user_is_high_bidder = False
-	bid_count = len(artwork_auction.artwork_auction_bids)
+	bid_count = artwork_auction.artwork_auction_bid_count or 0
 
 	artwork_auction_dictionary = dict(artwork_auction_id=artwork_auction.artwork_auction_id,
 	                                  minimum_bid=artwork_auction.artwork_auction_minimum_bid,
@@ -599,7 +646,54 @@ def artwork_auction(artwork_id, user_id):
 	return result
 
 
-def artist_page(artist_id, sorting_rule, limit, offset, user_id):
+def auction_bid_history(artwork_auction_id, limit, user_id, cursor=""):
+	"""
+	4G - Artwork Auction bid history (GET)
+	The bids on an Artwork Auction, newest first, paginated with cursors.
+	URL: http://host:port/auction_bid_history?artwork_auction_id=123&limit=20[&cursor=...]
+	:param artwork_auction_id: the id of the Artwork Auction
+	:param limit: the max number of bids to return (must be positive)
+	:param user_id: the user_id of the requesting User
+	:param cursor: the next_cursor of the previous page ("" for the first page)
+	:return: {
+			  "response":"success",
+			  "bid_list":[
+			  {
+			    "bid_amount":1000.0,
+			    "bidder_name":"pa****",
+			    "user_is_bidder":true,
+			    "bid_time":"2015-08-21 13:10:00"
+			  },
+			  ...
+			  ],
+			  "count":20,
+			  "next_cursor":"WyJhdWN0aW9uX2JpZF9oaXN0b3J5IixbMTIzXV0="
+			}
+	"""
+
+	if limit <= 0:
+		raise WrongArgumentValueError('limit')
+
+	bid_list = db_crud.get_auction_bid_history(artwork_auction_id, limit, cursor)
+	bid_dictionary_list = []
+	for bid in bid_list:
+		bid_dictionary = dict(bid_amount=bid.artwork_auction_bid_amount,
+		                      bidder_name=bid.buyer.buyer_nickname if bid.buyer is not None else None,
+		                      user_is_bidder=bid.buyer_user_id == user_id,
+		                      bid_time=bid.artwork_auction_bid_creation_time.strftime(
+			                      settings['DATETIME_DISPLAY_FORMAT'])
+		                      if bid.artwork_auction_bid_creation_time is not None else None)
+		bid_dictionary_list.append(bid_dictionary)
+
+	result = dict(response="success",
+	              bid_list=bid_dictionary_list,
+	              count=len(bid_dictionary_list),
+	              next_cursor=db_crud.AUCTION_BID_HISTORY_ORDER.next_cursor(bid_list, limit))
+
+	return result
+
+
+def artist_page(artist_id, sorting_rule, limit, offset, user_id, cursor=None):
 	"""
 	5A - Artist fan page (GET)
 	Fan page for Artist. Includes an image, description and a list of Artwork.
@@ -615,6 +709,8 @@ def artist_page(artist_id, sorting_rule, limit, offset, user_id):
 	:param limit: the max number of rows to return for the artwork_list (0 for no limit)
 	:param offset: the offset (starting point) for the artwork_list. E.g. if offset=10, the list will begin at row 11
 	:param user_id: the user_id of the requesting User
+	:param cursor: the next_cursor of the previous artwork_list page ("" for the first page) to use instead of offset;
+		the result then includes the "next_cursor" of the following page (null after the last page)
 	:return: {
 			  "response":"success",
 			  "artist":
@@ -672,7 +768,13 @@ def artist_page(artist_id, sorting_rule, limit, offset, user_id):
 	}
 	sorting_rule = sorting_rule_map[sorting_rule]
 
-	artwork_list, artwork_image_dictionary = db_crud.get_artwork_list(sorting_rule, artist_id, limit, offset, user_id)
+	artwork_list, artwork_image_dictionary = db_crud.get_artwork_list(sorting_rule, artist_id, limit, offset, user_id,
+	                                                                  cursor=cursor)
+
+	# Batch the owner and follow state lookups of the whole page
+	loaders = RequestLoaders(user_id)
+	loaders.artwork_owner.prime(artwork_list)
+	loaders.artwork_followed.prime(artwork.artwork_id for artwork in artwork_list)
 
 	# Build dictionaries
 	artwork_dictionary_list = []
@@ -687,26 +789,12 @@ def artist_page(artist_id, sorting_rule, limit, offset, user_id):
 			rand_image = None
 
 		# Owner
-		owner, owner_type, owner_image = db_crud.get_artwork_owner(artwork)
-
-		if owner is None:
-			owner_id = None
-			owner_type = None
-			owner_name = None
-		else:
-			owner_id = owner.user_id
-
-			if owner_type.lower() == "buyer":
-				owner_name = owner.buyer_nickname
-			elif owner_type.lower() == "artist":
-				owner_name = owner.artist_nickname
-			elif owner_type.lower() == "auction_house":
-				owner_name = owner.auction_house_name
-			else:
-				owner_name = owner.gallery_name
+		owner = loaders.artwork_owner.load(artwork)
+		owner_id, owner_type, owner_name, owner_image_path = \
+			owner if owner is not None else (None, None, None, None)
 
 		# Following or not
-		following = db_crud.artwork_is_followed(user_id, artwork.artwork_id)
+		following = loaders.artwork_followed.load(artwork.artwork_id)
 
 		artwork_dictionary = dict(display_order=i,
 						  artwork_id=artwork.artwork_id,
@@ -717,8 +805,8 @@ def artist_page(artist_id, sorting_rule, limit, offset, user_id):
 						  owner_id=owner_id,
 						  owner_type=owner_type,
 						  owner_name=owner_name,
-						  owner_image_path=owner_image.image_path if owner_image is not None else None,
-						  follower_count=artwork.artwork_followed_count,
+						  owner_image_path=owner_image_path,
+						  follower_count=db_crud.counter_value(artwork, "artwork_followed_count"),
 						  critique_count=artwork.artwork_critique_count)
 
 		artwork_dictionary_list.append(artwork_dictionary)
@@ -736,7 +824,7 @@ def artist_page(artist_id, sorting_rule, limit, offset, user_id):
 	                         artist_description=artist.artist_description,
 	                         artist_image_path=artist_image.image_path if artist_image is not None else None,
 	                         following=following,
-	                         follower_count=artist.artist_followed_count,
+	                         follower_count=db_crud.counter_value(artist, "artist_followed_count"),
 	                         followers=follower_dictionary_list
 	                         )
 
@@ -745,6 +833,9 @@ def artist_page(artist_id, sorting_rule, limit, offset, user_id):
 	              artwork_list=artwork_dictionary_list,
 	              count=1)
 
+	if cursor is not None:
+		result['next_cursor'] = db_crud.ARTWORK_LIST_ORDERS[sorting_rule].next_cursor(artwork_list, limit)
+
 	return result
 
 
@@ -869,13 +960,15 @@ def gallery_auction_page(id, type, user_id):
 	return result
 
 
-def artist_list(limit, offset):
+def artist_list(limit, offset, cursor=None):
 	"""
 	7A - Artist list (GET)
 	Get a list of Artists in alphabetical order.
 	URL: http://host:port/artist_list?limit=0&offset=0
 	:param limit: the max number of rows to return for the list (0 for no limit)
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: the next_cursor of the previous page ("" for the first page) to use instead of offset; the result then
+		includes the "next_cursor" of the following page (null after the last page)
 	:return: {
 			  "response":"success",
 			  "artist_list":[
@@ -890,7 +983,7 @@ def artist_list(limit, offset):
 			}
 	"""
 
-	artist_list = db_crud.get_artist_list(limit, offset)
+	artist_list = db_crud.get_artist_list(limit, offset, cursor=cursor)
 	artist_dictionary_list = []
 	for artist in artist_list:
 		artist_dictionary = dict(artist_id=artist.user_id,
@@ -902,16 +995,21 @@ def artist_list(limit, offset):
 	              artist_list=artist_dictionary_list,
 	              count=len(artist_dictionary_list))
 
+	if cursor is not None:
+		result['next_cursor'] = db_crud.ARTIST_LIST_ORDER.next_cursor(artist_list, limit)
+
 	return result
 
 
-def gallery_list(limit, offset):
+def gallery_list(limit, offset, cursor=None):
 	"""
 	7B - Gallery list (GET)
 	Get a list of Galleries in alphabetical order.
 	URL: http://host:port/gallery_list?limit=0&offset=0
 	:param limit: the max number of rows to return for the list (0 for no limit)
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: the next_cursor of the previous page ("" for the first page) to use instead of offset; the result then
+		includes the "next_cursor" of the following page (null after the last page)
 	:return: {
 			  "response":"success",
 			  "gallery_list":[
@@ -926,7 +1024,7 @@ def gallery_list(limit, offset):
 			}
 	"""
 
-	gallery_list = db_crud.get_gallery_list(limit, offset)
+	gallery_list = db_crud.get_gallery_list(limit, offset, cursor)
 	gallery_dictionary_list = []
 	for gallery in gallery_list:
 		gallery_dictionary = dict(gallery_id=gallery.user_id,
@@ -938,16 +1036,21 @@ def gallery_list(limit, offset):
 	              gallery_list=gallery_dictionary_list,
 	              count=len(gallery_dictionary_list))
 
+	if cursor is not None:
+		result['next_cursor'] = db_crud.GALLERY_LIST_ORDER.next_cursor(gallery_list, limit)
+
 	return result
 
 
-def auction_house_list(limit, offset):
+def auction_house_list(limit, offset, cursor=None):
 	"""
 	7C - Auction House list (GET)
 	Get a list of Auction Houses in alphabetical order.
 	URL: http://host:port/auction_house_list?limit=0&offset=0
 	:param limit: the max number of rows to return for the list (0 for no limit)
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: the next_cursor of the previous page ("" for the first page) to use instead of offset; the result then
+		includes the "next_cursor" of the following page (null after the last page)
 	:return: {
 			  "response":"success",
 			  "auction_house_list":[
@@ -962,7 +1065,7 @@ def auction_house_list(limit, offset):
 			}
 	"""
 
-	auction_house_list = db_crud.get_auction_house_list(limit, offset)
+	auction_house_list = db_crud.get_auction_house_list(limit, offset, cursor)
 	auction_house_dictionary_list = []
 	for auction_house in auction_house_list:
 		auction_house_dictionary = dict(auction_house_id=auction_house.user_id,
@@ -975,16 +1078,21 @@ def auction_house_list(limit, offset):
 	              auction_house_list=auction_house_dictionary_list,
 	              count=len(auction_house_dictionary_list))
 
+	if cursor is not None:
+		result['next_cursor'] = db_crud.AUCTION_HOUSE_LIST_ORDER.next_cursor(auction_house_list, limit)
+
 	return result
 
 
-def label_list(limit, offset):
+def label_list(limit, offset, cursor=None):
 	"""
 	7D - Label list (GET)
 	Get a list of Labels in alphabetical order.
 	URL: http://host:port/label_list?limit=0&offset=0
 	:param limit: the max number of rows to return for the list (0 for no limit)
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: the next_cursor of the previous page ("" for the first page) to use instead of offset; the result then
+		includes the "next_cursor" of the following page (null after the last page)
 	:return: {
 			  "response":"success",
 			  "label_list":[
@@ -998,7 +1106,7 @@ def label_list(limit, offset):
 			}
 	"""
 
-	label_list = db_crud.get_label_list(limit, offset)
+	label_list = db_crud.get_label_list(limit, offset, cursor)
 	label_dictionary_list = []
 	for label in label_list:
 		label_dictionary = dict(label_id=label.label_id,
@@ -1009,6 +1117,9 @@ def label_list(limit, offset):
 	              label_list=label_dictionary_list,
 	              count=len(label_dictionary_list))
 
+	if cursor is not None:
+		result['next_cursor'] = db_crud.LABEL_LIST_ORDER.next_cursor(label_list, limit)
+
 	return result
 
 
@@ -1094,7 +1205,7 @@ def about_me(user_id, top_n_labels, top_n_artists):
 	return result
 
 
-def following_lists(user_id, limit, offset):
+def following_lists(user_id, limit, offset, cursor=None):
 	"""
 	11B - Following lists (GET)
 	List of people and objects being followed, including My Favorites and owned Artwork.
@@ -1102,6 +1213,9 @@ def following_lists(user_id, limit, offset):
 	:param user_id: the user_id of the requesting User
 	:param limit: the max number of rows to return (0 for no limit)
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: the next_cursor of the previous page ("" for the first page) to use instead of offset; the result then
+		includes the "next_cursor" of the following page (null after the last page of every list). Each list is
+		paginated on its own, and the lists that have no more pages are returned empty
 	:return: {
 			  "response":"success",
 			  "followed_artwork":[
@@ -1162,7 +1276,10 @@ def following_lists(user_id, limit, offset):
 			}
 	"""
 
-	followed_artwork = db_crud.get_followed_artwork(user_id, limit, offset)
+	cursors = split_cursors(cursor, FOLLOWING_LISTS) if cursor is not None else None
+
+	followed_artwork = _get_following_list(db_crud.get_followed_artwork, user_id, limit, offset, cursors,
+	                                       "followed_artwork")
 	followed_artwork_dictionary_list = []
 	for artwork in followed_artwork:
 		random_artwork_image_index = \
@@ -1175,7 +1292,8 @@ def following_lists(user_id, limit, offset):
 		                                        if random_artwork_image is not None else None)
 		followed_artwork_dictionary_list.append(followed_artwork_dictionary)
 
-	followed_artists = db_crud.get_followed_artists(user_id, limit, offset)
+	followed_artists = _get_following_list(db_crud.get_followed_artists, user_id, limit, offset, cursors,
+	                                       "followed_artists")
 	followed_artist_dictionary_list = []
 	for artist in followed_artists:
 		followed_artist_dictionary = dict(artist_id=artist.user_id,
@@ -1183,7 +1301,8 @@ def following_lists(user_id, limit, offset):
 		                                  artist_image=artist.image.image_path if artist.image is not None else None)
 		followed_artist_dictionary_list.append(followed_artist_dictionary)
 
-	followed_galleries = db_crud.get_followed_galleries(user_id, limit, offset)
+	followed_galleries = _get_following_list(db_crud.get_followed_galleries, user_id, limit, offset, cursors,
+	                                         "followed_galleries")
 	followed_gallery_dictionary_list = []
 	for gallery in followed_galleries:
 		followed_gallery_dictionary = dict(gallery_id=gallery.user_id,
@@ -1191,7 +1310,8 @@ def following_lists(user_id, limit, offset):
 		                                   gallery_image=gallery.banner_image.image_path if gallery.banner_image is not None else None)
 		followed_gallery_dictionary_list.append(followed_gallery_dictionary)
 
-	followed_auction_houses = db_crud.get_followed_auction_houses(user_id, limit, offset)
+	followed_auction_houses = _get_following_list(db_crud.get_followed_auction_houses, user_id, limit, offset, cursors,
+	                                              "followed_auction_houses")
 	followed_auction_house_dictionary_list = []
 	for auction_house in followed_auction_houses:
 		followed_auction_house_dictionary = dict(auction_house_id=auction_house.user_id,
@@ -1200,14 +1320,16 @@ def following_lists(user_id, limit, offset):
 		                                            if auction_house.banner_image is not None else None)
 		followed_auction_house_dictionary_list.append(followed_auction_house_dictionary)
 
-	followed_critics = db_crud.get_followed_critics(user_id, limit, offset)
+	followed_critics = _get_following_list(db_crud.get_followed_critics, user_id, limit, offset, cursors,
+	                                       "followed_critics")
 	followed_critic_dictionary_list = []
 	for critic in followed_critics:
 		followed_critic_dictionary = dict(critic_id=critic.user_id,
 		                                  critic_name=critic.critic_nickname)
 		followed_critic_dictionary_list.append(followed_critic_dictionary)
 
-	favorite_artwork = db_crud.get_followed_artwork(user_id, limit, offset, True)
+	favorite_artwork = _get_following_list(db_crud.get_followed_artwork, user_id, limit, offset, cursors,
+	                                       "favorite_artwork", True)
 	favorite_artwork_dictionary_list = []
 	for artwork in favorite_artwork:
 		random_artwork_image_index = \
@@ -1220,7 +1342,8 @@ def following_lists(user_id, limit, offset):
 		                                        if random_artwork_image is not None else None)
 		favorite_artwork_dictionary_list.append(favorite_artwork_dictionary)
 
-	owned_artwork = db_crud.get_buyer_artwork(user_id, limit, offset)
+	owned_artwork = _get_following_list(db_crud.get_buyer_artwork, user_id, limit, offset, cursors,
+	                                    "owned_artwork")
 	owned_artwork_dictionary_list = []
 	for artwork in owned_artwork:
 		random_artwork_image_index = \
@@ -1242,9 +1365,36 @@ def following_lists(user_id, limit, offset):
 	              favorite_artwork=favorite_artwork_dictionary_list,
 	              owned_artwork=owned_artwork_dictionary_list)
 
+	if cursor is not None:
+		result['next_cursor'] = combine_cursors({
+			"followed_artwork": db_crud.FOLLOWED_ARTWORK_ORDER.next_cursor(followed_artwork, limit),
+			"followed_artists": db_crud.FOLLOWED_ARTISTS_ORDER.next_cursor(followed_artists, limit),
+			"followed_galleries": db_crud.FOLLOWED_GALLERIES_ORDER.next_cursor(followed_galleries, limit),
+			"followed_auction_houses": db_crud.FOLLOWED_AUCTION_HOUSES_ORDER.next_cursor(followed_auction_houses, limit),
+			"followed_critics": db_crud.FOLLOWED_CRITICS_ORDER.next_cursor(followed_critics, limit),
+			"favorite_artwork": db_crud.FOLLOWED_ARTWORK_ORDER.next_cursor(favorite_artwork, limit),
+			"owned_artwork": db_crud.BUYER_ARTWORK_ORDER.next_cursor(owned_artwork, limit)})
+
 	return result
 
 
+def _get_following_list(function, user_id, limit, offset, cursors, name, *args):
+	"""
+	Get a page of one of the following lists.
+	:param function: the db_crud function of the list
+	:param cursors: the cursors of the lists (see pagination.split_cursors), or None to use offset
+	:param name: the name of the list in FOLLOWING_LISTS
+	:param args: the extra arguments of the db_crud function
+	:return: a list of rows
+	"""
+	if cursors is None:
+		return function(user_id, limit, offset, *args)
+	if cursors[name] is None:
+		return []  # No more pages
+
+	return function(user_id, limit, 0, *args, cursor=cursors[name])
+
+
 def user_auction_list(user_id, sorting_rule):
 	"""
 	11C - User Auction list (GET)
@@ -1296,39 +1446,47 @@ def user_auction_list(user_id, sorting_rule):
 
 	artwork_auction_list = db_crud.get_artwork_auction_list(user_id, sorting_rule)
 
+	# Get the top three Critiques of every Artwork, and batch their purchase and vote state lookups
+	critique_lists = db_crud.get_critique_lists([artwork_auction.artwork.artwork_id
+	                                             for artwork_auction in artwork_auction_list], limit=3)
+	loaders = RequestLoaders(user_id)
+	for critique_list in critique_lists.itervalues():
+		loaders.prime_critique_list(critique_list)
+
 	artwork_auction_dictionary_list = []
 	for artwork_auction in artwork_auction_list:
-		critique_list = db_crud.get_critique_list(artwork_auction.artwork.artwork_id, limit=3)
+		critique_list = critique_lists[artwork_auction.artwork.artwork_id]
 		critique_dictionary_list = []
 		for critique in critique_list:
+			critique_key = (critique.artwork_id, critique.critic_user_id)
 
 			# Check if Critique is purchased
-			critique_purchased = db_crud.critique_purchased(user_id, critique.artwork_id, critique.critic_user_id)
+			critique_purchased = loaders.critique_purchased.load(critique_key)
 			if critique_purchased:
 				critique_text = critique.critique_text
 			else:
 				critique_text = ""
 
 			# Check Critique vote type
-			critique_liked = db_crud.get_critique_vote_type(user_id, critique.artwork_id, critique.critic.user_id)
+			critique_liked = loaders.critique_vote_type.load(critique_key)
 
 			critique_dictionary = \
 				dict(critique_date=critique.critique_creation_time.strftime(settings['DATE_DISPLAY_FORMAT']),
 				     critique_point_price=critique.critique_point_price,
 				     critique_text=critique_text,
-				     critique_upvote_count=critique.critique_upvote_count,
-				     critique_downvote_count=critique.critique_downvote_count,
+				     critique_upvote_count=db_crud.counter_value(critique, "critique_upvote_count"),
+				     critique_downvote_count=db_crud.counter_value(critique, "critique_downvote_count"),
 				     critique_vote_type=critique_liked,
 				     critique_purchased=critique_purchased,
 				     critic_id=critique.critic.user_id,
 				     critic_name=critique.critic.critic_nickname,
-				     critic_follower_count=critique.critic.critic_followed_count
+				     critic_follower_count=db_crud.counter_value(critique.critic, "critic_followed_count")
 				     )
 			critique_dictionary_list.append(critique_dictionary)
 
 		# Build Artwork Auction dictionary
 		current_bid = artwork_auction.current_bid
-		current_bid_amount = current_bid.artwork_auction_bid_amount if current_bid is not None else 0
+		current_bid_amount = artwork_auction.artwork_auction_max_bid or 0
 		high_bidder = current_bid.buyer if current_bid is not None else None
 		high_bidder_name = high_bidder.buyer_nickname if high_bidder is not None else None
 		if high_bidder is not None:
@@ -1338,7 +1496,7 @@ def user_auction_list(user_id, sorting_rule):
 				user_is_high_bidder = False
 		else:
 			user_is_high_bidder = False
-		bid_count = len(artwork_auction.artwork_auction_bids)
+		bid_count = artwork_auction.artwork_auction_bid_count or 0
 
 		# Artwork and Artist
 		artwork = artwork_auction.artwork
@@ -1356,7 +1514,7 @@ def user_auction_list(user_id, sorting_rule):
 		                                  artist_name=artwork_auction.artwork.artist.artist_nickname,
 		                                  artwork_name=artwork.artwork_name,
 		                                  artwork_image=rand_image.image_path if rand_image is not None else None,
-		                                  artwork_follower_count=artwork.artwork_followed_count,
+		                                  artwork_follower_count=db_crud.counter_value(artwork, "artwork_followed_count"),
 		                                  artwork_critique_count=artwork.artwork_critique_count,
 		                                  minimum_bid=artwork_auction.artwork_auction_minimum_bid,
 		                                  current_bid=current_bid_amount,
@@ -1382,78 +1540,23 @@ def user_auction_list(user_id, sorting_rule):
 ################################### POST REQUESTS ###################################
 
 
-def post_ws(ws_name, arguments, request_body, user_id=None):
+def post_ws(ws_name, arguments, request_body, user_id=None, token=None):
 	"""
 	Get a POST web service given its name and arguments and return it as a dictionary
 	:param ws_name: the name of the web service to access
 	:param arguments: the URL arguments for the web service
 	:param request_body: the raw body of the request (usually expecting a JSON object as text)
 	:param user_id: the id of the requesting User (when applicable)
+	:param token: the JWT token of the requesting User (when applicable)
 	:return: a dictionary with the requested web service information
 	"""
 
 	try:
 		# Common arguments
-		request_body_dict = json.loads(request_body)
-
-		if ws_name == "login":
-			user_email = request_body_dict['user_email']  # Hash-encrypted using SHA256
-			user_password = request_body_dict['user_password']  # Hash-encrypted using SHA256
-			return login_buyer(user_email, user_password, user_id)
-		if ws_name == "logout":
-			return logout_buyer(user_id)
-		elif ws_name == "signup":
-			user_email = request_body_dict['user_email']
-			user_password = request_body_dict['user_password']  # Hash-encrypted using SHA256
-			return signup_buyer(user_email, user_password)
-		elif ws_name == "signup_facebook":
-			fb_id = request_body_dict['fb_id']
-			user_name = request_body_dict['user_name']
-			user_email = request_body_dict['user_email']
-			user_image = request_body_dict['user_image']
-			return signup_buyer_facebook(fb_id, user_name, user_email, user_image)
-		elif ws_name == "like_dislike_critique":
-			artwork_id = request_body_dict['artwork_id']
-			critic_id = request_body_dict['critic_id']
-			vote_type = request_body_dict['vote_type']
-			return like_dislike_critique(user_id, artwork_id, critic_id, vote_type)
-		elif ws_name == "make_bid":
-			artwork_auction_id = request_body_dict['artwork_auction_id']
-			bid_amount = request_body_dict['bid_amount']
-			return make_bid(user_id, artwork_auction_id, bid_amount)
-		elif ws_name == "buy_critique":
-			artwork_id = request_body_dict['artwork_id']
-			critic_id = request_body_dict['critic_id']
-			return buy_critique(user_id, artwork_id, critic_id)
-		elif ws_name == "buy_coins":
-			coin_amount = request_body_dict['coin_amount']
-			return buy_coins(user_id, coin_amount)
-		elif ws_name == "follow_artwork":
-			artwork_id = request_body_dict['artwork_id']
-			follow = request_body_dict['follow']
-			return follow_something(user_id, 'ARTWORK', artwork_id, follow)
-		elif ws_name == "follow_artist":
-			artist_id = request_body_dict['artist_id']
-			follow = request_body_dict['follow']
-			return follow_something(user_id, 'ARTIST', artist_id, follow)
-		elif ws_name == "follow_gallery":
-			gallery_id = request_body_dict['gallery_id']
-			follow = request_body_dict['follow']
-			return follow_something(user_id, 'GALLERY', gallery_id, follow)
-		elif ws_name == "follow_auction_house":
-			auction_house_id = request_body_dict['auction_house_id']
-			follow = request_body_dict['follow']
-			return follow_something(user_id, 'AUCTION_HOUSE', auction_house_id, follow)
-		elif ws_name == "follow_critic":
-			critic_id = request_body_dict['critic_id']
-			follow = request_body_dict['follow']
-			return follow_something(user_id, 'CRITIC', critic_id, follow)
-		elif ws_name == "add_favorite_artwork":
-			artwork_id = request_body_dict['artwork_id']
-			is_favorite = request_body_dict['is_favorite']
-			return add_favorite_artwork(user_id, artwork_id, is_favorite)
-		else:
-			raise InexistentResourceError()
+		request_body_dict = serializer.loads(request_body)
+
+		web_service = web_services.get("POST", ws_name)
+		return web_service.call(web_service.parse_body(request_body_dict), user_id=user_id, token=token)
 	except KeyError, e:
 		raise MissingArgumentsError()
 	except ValueError, e:
@@ -1462,6 +1565,20 @@ def post_ws(ws_name, arguments, request_body, user_id=None):
 		raise e
 
 
+def authenticate_login_token(token):
+	"""
+	Get the user_id of the JWT token sent to the login web service, like a token of refresh_token. The token is optional
+	for login, so a token that can't be refreshed anymore (e.g. expired, or revoked by logging out) is ignored, and the
+	User logs in with its credentials only.
+	:param token: the JWT token sent with the login
+	:return: the user_id of the token, None if the token is not valid
+	"""
+	try:
+		return security.authenticate_refresh_token(token)
+	except AuthenticationError:
+		return None
+
+
 def login_buyer(user_email, user_password, user_id=None):
 	"""
 	1A - Log in (POST)
@@ -1511,18 +1628,21 @@ def login_buyer(user_email, user_password, user_id=None):
 	return result
 
 
-def logout_buyer(user_id=None):
+def logout_buyer(user_id=None, token=None):
 	"""
 	1B - Log out (POST)
-	Log out of the ArtMeGo API.
+	Log out of the ArtMeGo API. The JWT token is revoked: it's no longer accepted by the web services that require a
+	token, nor refreshed.
 	URL: http://host:port/logout
 	:param user_id: The user if of the requesting Buyer.
+	:param token: The JWT token of the requesting Buyer.
 	:return: if success: {
 						  "response":"success"
 						 }
 	"""
 
-	# TODO: Perform necessary log out (e.g. make JWT token invalid, etc.)
+	if token is not None:
+		security.revoke_token(token)
 
 	result = dict(response="success")
 
@@ -1598,6 +1718,49 @@ def signup_buyer_facebook(fb_id, user_name, user_email, user_image):
 	return result
 
 
+def refresh_token(user_id, token):
+	"""
+	1F - Refresh JWT token (POST)
+	Exchange the JWT token of a Buyer for a new one, before it expires (or less than
+	settings['JWT_REFRESH_LEEWAY_SECONDS'] after it). The token is revoked, so it can only be exchanged once, and the
+	new token belongs to the same session: the session can't be refreshed after settings['JWT_MAX_SESSION_SECONDS'].
+	URL: http://host:port/refresh_token
+	:param user_id: The user id of the requesting Buyer
+	:param token: The JWT token of the requesting Buyer
+	:return: if success: {
+						  "response":"success",
+						  "jwt_token":"xxxxx.yyyy.zzzz"
+						 }
+			 else:  {
+					  "response":"fail",
+					  "error_code":"0005",
+					  "reason":"authentication error"
+					}
+					{
+					  "response":"fail",
+					  "error_code":"0007",
+					  "reason":"user inexistent"
+					}
+					{
+					  "response":"fail",
+					  "error_code":"0009",
+					  "reason":"unauthorized"
+					}
+	"""
+
+	user = db_crud.get_user(user_id)
+
+	# Check user type
+	if user.user_type.lower() != "buyer":
+		raise UnauthorizedError()
+
+	jwt_token = security.refresh_jwt(token, user)
+
+	result = dict(response="success", jwt_token=jwt_token)
+
+	return result
+
+
 def like_dislike_critique(user_id, artwork_id, critic_user_id, vote_type):
 	"""
 	3B - Like/dislike Critique
@@ -1652,11 +1815,10 @@ def make_bid(user_id, artwork_auction_id, bid_amount):
 					}
 	"""
 
-	current_bid_amount = db_crud.make_bid(user_id, artwork_auction_id, bid_amount)
-
-	result = dict(response="success")
+	bid = db_crud.make_bid(user_id, artwork_auction_id, bid_amount)
 
-	return result
+	# The response is sent once the auction engine has written the bid
+	return AsyncResult(bid, lambda current_bid_amount: dict(response="success"))
 
 
 def buy_critique(user_id, artwork_id, critic_user_id):
@@ -1768,4 +1930,127 @@ def add_favorite_artwork(user_id, artwork_id, is_favorite):
 
 	result = dict(response="success")
 
-	return result
\ No newline at end of file
+	return result
+
+
+################################### WEB SERVICES ###################################
+
+# The web services of the Mobile APP, dispatched by get_ws and post_ws (the URL patterns are generated from it too)
+web_services = WebServiceRegistry()
+
+# The arguments of the paginated lists: a cursor (see lib.pagination) can be sent instead of the offset
+PAGE_ARGUMENTS = dict(limit=INTEGER, offset=INTEGER, cursor=STRING)
+OFFSET_OR_CURSOR = {"anyOf": [{"required": ["offset"]}, {"required": ["cursor"]}]}
+
+# **** 1. Login and Register ****
+# 1A - Log in
+web_services.add("login", "POST", login_buyer, dict(user_email=STRING, user_password=STRING),
+                 required=["user_email", "user_password"])
+# 1B - Log out
+web_services.add("logout", "POST", logout_buyer)
+# 1C - Sign up
+web_services.add("signup", "POST", signup_buyer, dict(user_email=STRING, user_password=STRING),
+                 required=["user_email", "user_password"], require_token=False)
+# 1D - Facebook signup
+web_services.add("signup_facebook", "POST", signup_buyer_facebook,
+                 dict(fb_id={"type": ["integer", "string"]}, user_name=STRING, user_email=STRING, user_image=STRING),
+                 required=["fb_id", "user_name", "user_email", "user_image"], require_token=False)
+# 1E - Facebook login
+# web_services.add("login_facebook", "POST", login_buyer_facebook, require_token=False)
+# 1F - Refresh JWT token
+web_services.add("refresh_token", "POST", refresh_token)
+
+# **** 2. Home Screen ****
+# 2A - Home Banner list
+web_services.add("banner_list", "GET", home_banner_list, require_token=False)
+# 2B - Home Artwork list
+web_services.add("home_artwork", "GET", home_artwork, dict(PAGE_ARGUMENTS, sorting_rule=INTEGER, location=STRING),
+                 required=["sorting_rule", "limit"],
+                 allOf=[OFFSET_OR_CURSOR,
+                        # The nearby feed requires a location
+                        {"anyOf": [{"properties": {"sorting_rule": {"not": {"enum": [5]}}}},
+                                   {"required": ["location"]}]}])
+
+# **** 3. Artwork ****
+# 3A - Artwork page and Critique list
+web_services.add("artwork_page", "GET", artwork_page, dict(artwork_id=INTEGER), required=["artwork_id"])
+# 3B - Like/dislike Critique
+web_services.add("like_dislike_critique", "POST",
+                 lambda user_id, artwork_id, critic_id, vote_type:
+                 like_dislike_critique(user_id, artwork_id, critic_id, vote_type),
+                 dict(artwork_id=INTEGER, critic_id=INTEGER, vote_type=STRING),
+                 required=["artwork_id", "critic_id", "vote_type"])
+
+# **** 4. Purchases ****
+# 4A - Artwork Auction page
+web_services.add("artwork_auction", "GET", artwork_auction, dict(artwork_id=INTEGER), required=["artwork_id"])
+# 4B - Make bid
+web_services.add("make_bid", "POST", make_bid, dict(artwork_auction_id=INTEGER, bid_amount=NUMBER),
+                 required=["artwork_auction_id", "bid_amount"])
+# 4C - Buy Critique
+web_services.add("buy_critique", "POST",
+                 lambda user_id, artwork_id, critic_id: buy_critique(user_id, artwork_id, critic_id),
+                 dict(artwork_id=INTEGER, critic_id=INTEGER), required=["artwork_id", "critic_id"])
+# 4D - Buy coins
+web_services.add("buy_coins", "POST", buy_coins, dict(coin_amount=INTEGER), required=["coin_amount"])
+# 4G - Artwork Auction bid history
+web_services.add("auction_bid_history", "GET", auction_bid_history,
+                 dict(artwork_auction_id=INTEGER, limit=INTEGER, cursor=STRING),
+                 required=["artwork_auction_id", "limit"])
+
+# **** 5. Fan Pages ****
+# 5A - Artist fan page
+web_services.add("artist_page", "GET", artist_page, dict(PAGE_ARGUMENTS, artist_id=INTEGER, sorting_rule=INTEGER),
+                 required=["artist_id", "sorting_rule", "limit"], **OFFSET_OR_CURSOR)
+# 5B - Gallery and Auction House fan page
+web_services.add("gallery_auction_page", "GET", gallery_auction_page, dict(id=INTEGER, type=STRING),
+                 required=["id", "type"])
+
+# **** 6. Follow ****
+# 6A - Follow Artwork
+web_services.add("follow_artwork", "POST",
+                 lambda user_id, artwork_id, follow: follow_something(user_id, 'ARTWORK', artwork_id, follow),
+                 dict(artwork_id=INTEGER, follow=BOOLEAN), required=["artwork_id", "follow"])
+# 6B - Follow Artist
+web_services.add("follow_artist", "POST",
+                 lambda user_id, artist_id, follow: follow_something(user_id, 'ARTIST', artist_id, follow),
+                 dict(artist_id=INTEGER, follow=BOOLEAN), required=["artist_id", "follow"])
+# 6C - Follow Gallery
+web_services.add("follow_gallery", "POST",
+                 lambda user_id, gallery_id, follow: follow_something(user_id, 'GALLERY', gallery_id, follow),
+                 dict(gallery_id=INTEGER, follow=BOOLEAN), required=["gallery_id", "follow"])
+# 6D - Follow Auction House
+web_services.add("follow_auction_house", "POST",
+                 lambda user_id, auction_house_id, follow:
+                 follow_something(user_id, 'AUCTION_HOUSE', auction_house_id, follow),
+                 dict(auction_house_id=INTEGER, follow=BOOLEAN), required=["auction_house_id", "follow"])
+# 6E - Follow Critic
+web_services.add("follow_critic", "POST",
+                 lambda user_id, critic_id, follow: follow_something(user_id, 'CRITIC', critic_id, follow),
+                 dict(critic_id=INTEGER, follow=BOOLEAN), required=["critic_id", "follow"])
+# 6F - Add Artwork to My Favorites
+web_services.add("add_favorite_artwork", "POST", add_favorite_artwork, dict(artwork_id=INTEGER, is_favorite=BOOLEAN),
+                 required=["artwork_id", "is_favorite"])
+
+# **** 7. Explore ****
+# 7A - Artist list
+web_services.add("artist_list", "GET", artist_list, PAGE_ARGUMENTS, required=["limit"], require_token=False,
+                 **OFFSET_OR_CURSOR)
+# 7B - Gallery list
+web_services.add("gallery_list", "GET", gallery_list, PAGE_ARGUMENTS, required=["limit"], require_token=False,
+                 **OFFSET_OR_CURSOR)
+# 7C - Auction House list
+web_services.add("auction_house_list", "GET", auction_house_list, PAGE_ARGUMENTS, required=["limit"],
+                 require_token=False, **OFFSET_OR_CURSOR)
+# 7D - Label list
+web_services.add("label_list", "GET", label_list, PAGE_ARGUMENTS, required=["limit"], require_token=False,
+                 **OFFSET_OR_CURSOR)
+
+# **** 11. Profile ****
+# 11A - About me
+web_services.add("about_me", "GET", about_me, dict(top_n_labels=INTEGER, top_n_artists=INTEGER),
+                 required=["top_n_labels", "top_n_artists"])
+# 11B - Following lists
+web_services.add("following_lists", "GET", following_lists, PAGE_ARGUMENTS, required=["limit"], **OFFSET_OR_CURSOR)
+# 11C - Auction list
+web_services.add("user_auction_list", "GET", user_auction_list, dict(sorting_rule=INTEGER), required=["sorting_rule"])
@@ -0,0 +1,288 @@
+# coding=utf-8
+"""
+This module serializes the bids on each Artwork Auction through an in-memory queue, so that two concurrent bids can't
+both pass the "higher than the current bid" check.
+The engine keeps the live state of the auctions (their Artwork_Auction values) in memory, so a bid is validated
+without queries. The bids of an auction are processed in arrival order by one thread of the engine at a time, which
+validates the waiting bids and writes the accepted ones in a single transaction (see db_crud.write_auction_bids). A
+hot auction is then written once per batch of bids instead of once per bid. A bid is a Future, resolved once it is
+written or rejected, so the bidding request doesn't hold a thread (or a database connection) while it waits.
+
+Bids made by other worker processes are detected when a batch is written: the current bid is only replaced if it is
+still the one the batch was validated against. Otherwise the state is reloaded and the batch validated again.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from lib.exceptions import InexistentResourceError, UnauthorizedError, ServerBusyError
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+# Times a batch is validated again after other processes bid on its auction, before its bids fail
+_MAX_CONFLICTS = 10
+
+
+class _Bid(object):
+	"""
+	A bid waiting in the queue of an auction.
+	"""
+
+	def __init__(self, user_id, amount, bid_time):
+		self.user_id = user_id
+		self.amount = amount
+		self.bid_time = bid_time
+		self.previous_amount = None  # The current bid amount before this bid, once accepted
+		self.error = None  # The exception raised to the bidder, once rejected
+		self.future = Future()  # Resolved with previous_amount, or error, once the bid is done
+
+
+class _AuctionQueue(object):
+	"""
+	The bids waiting on an auction, and its live state.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.bids = deque()
+		self.processing = False  # Whether a thread of the engine is processing the queue
+		self.auction = None  # The live state of the auction (see AuctionEngine), None until it's loaded
+		self.loaded_time = 0
+		self.changes = []  # The values committed by other code while a batch is processed (None if unknown)
+
+
+class AuctionEngine(object):
+	"""
+	The auction engine of a process. All methods are thread-safe.
+	The live state of an auction is a dictionary with the columns of its Artwork_Auction row.
+	"""
+
+	def __init__(self, load_auction, write_bids, refresh_seconds, max_batch=100, max_queue=1000, workers=4,
+	             enabled=True):
+		"""
+		:param load_auction: a function that receives an artwork_auction_id and returns the live state of the auction,
+			or None if it doesn't exist (see db_crud.get_live_auction)
+		:param write_bids: a function that receives the live state of an auction and a list of (user_id, amount,
+			bid time), and writes the bids in a single transaction; it returns the new live state of the auction, or
+			None if the current bid of the auction is no longer the one of the state (see db_crud.write_auction_bids)
+		:param refresh_seconds: the max age of the live state of an auction before it is reloaded
+		:param max_batch: the max number of bids written in a single transaction
+		:param max_queue: the max number of bids waiting on an auction; more bids are rejected with a ServerBusyError
+		:param workers: the number of threads processing the queues (one auction at a time each)
+		:param enabled: whether the bids go through the engine at all
+		"""
+		self.load_auction = load_auction
+		self.write_bids = write_bids
+		self.refresh_seconds = refresh_seconds
+		self.max_batch = max_batch
+		self.max_queue = max_queue
+		self.workers = workers
+		self.enabled = enabled
+
+		self._lock = threading.Lock()
+		self._queues = {}  # artwork_auction_id -> _AuctionQueue
+		self._pool = None
+		self._pending = 0
+
+	def _get_pool(self):
+		# Create the pool lazily, so that its threads are never created before forking
+		with self._lock:
+			if self._pool is None:
+				self._pool = ThreadPoolExecutor(self.workers)
+			return self._pool
+
+	@property
+	def pending(self):
+		"""
+		The number of bids waiting to be written or rejected.
+		"""
+		return self._pending
+
+	def submit(self, artwork_auction_id, user_id, amount, bid_time=None):
+		"""
+		Make a bid, without waiting until it is written.
+		Raises a ServerBusyError if too many bids are waiting on the auction.
+		:param artwork_auction_id: the id of the Artwork Auction
+		:param user_id: the user_id of the bidding Buyer
+		:param amount: the bid amount
+		:param bid_time: the time of the bid, now by default
+		:return: a concurrent.futures.Future with the current bid amount before the bid (0 if there was none). It
+			raises an InexistentResourceError if the Artwork Auction doesn't exist, hasn't started or is already
+			finished, or an UnauthorizedError if the amount is not higher than the current bid, is lower than the
+			minimum bid or is not a multiple of the bid increment
+		"""
+		queue = self._get_queue(artwork_auction_id)
+		bid = _Bid(user_id, amount, bid_time or datetime.now())
+
+		with queue.lock:
+			if len(queue.bids) >= self.max_queue:
+				raise ServerBusyError()
+			queue.bids.append(bid)
+			start_processing = not queue.processing
+			queue.processing = True
+
+		with self._lock:
+			self._pending += 1
+
+		if start_processing:
+			try:
+				self._get_pool().submit(self._process_queue, artwork_auction_id, queue)
+			except Exception, e:
+				with queue.lock:
+					bids = list(queue.bids)
+					queue.bids.clear()
+					queue.processing = False
+				with self._lock:
+					self._pending -= len(bids)
+				for waiting_bid in bids:
+					waiting_bid.future.set_exception(e)
+				raise e
+
+		return bid.future
+
+	def bid(self, artwork_auction_id, user_id, amount, bid_time=None):
+		"""
+		Make a bid, and wait until it is written (see submit). This blocks the calling thread: the web services
+		wait for the Future of submit in the IOLoop instead.
+		:return: the current bid amount before the bid (0 if there was none)
+		"""
+		return self.submit(artwork_auction_id, user_id, amount, bid_time).result()
+
+	def apply_changes(self, changes):
+		"""
+		Drop the live state of the auctions written by other code (a db_changes commit listener), so that it's
+		reloaded on the next bid.
+		:param changes: a list of db_changes.RowChange
+		"""
+		for change in changes:
+			if change.table != "Artwork_Auction":
+				continue
+			if change.values is None or 'artwork_auction_id' not in change.values:
+				with self._lock:
+					queues = self._queues.values()
+				for queue in queues:
+					self._invalidate(queue, None)
+				continue
+
+			queue = self._queues.get(change.values['artwork_auction_id'])
+			if queue is not None:
+				self._invalidate(queue, change.values)
+
+	def _invalidate(self, queue, values):
+		with queue.lock:
+			auction = queue.auction
+			if auction is not None and (values is None or
+			                            any(auction.get(column) != value for column, value in values.iteritems())):
+				queue.auction = None
+			if queue.processing:
+				# The state loaded or written by the batch being processed may be older than the change
+				queue.changes.append(values)
+
+	def _set_state(self, queue, auction, loaded_time=None):
+		# Keep the live state loaded or written by a batch, unless a change committed since the batch started isn't in
+		# it (e.g. an edit of the end time committed while the bids were written)
+		with queue.lock:
+			if auction is not None and all(values is not None and
+			                               all(auction.get(column) == value for column, value in values.iteritems())
+			                               for values in queue.changes):
+				queue.auction = auction
+				if loaded_time is not None:
+					queue.loaded_time = loaded_time
+			else:
+				queue.auction = None
+			queue.changes = []
+
+	def _get_queue(self, artwork_auction_id):
+		with self._lock:
+			queue = self._queues.get(artwork_auction_id)
+			if queue is None:
+				queue = self._queues[artwork_auction_id] = _AuctionQueue()
+			return queue
+
+	def _process_queue(self, artwork_auction_id, queue):
+		# Process batches of bids until the queue is empty (in a thread of the engine)
+		while True:
+			with queue.lock:
+				if not queue.bids:
+					queue.processing = False
+					return
+				batch = [queue.bids.popleft() for _ in xrange(min(self.max_batch, len(queue.bids)))]
+			self._process_batch(artwork_auction_id, queue, batch)
+
+	def _process_batch(self, artwork_auction_id, queue, batch):
+		try:
+			with queue.lock:
+				queue.changes = []
+			for conflicts in xrange(_MAX_CONFLICTS + 1):
+				with queue.lock:
+					auction = queue.auction
+					if auction is not None and time.time() - queue.loaded_time >= self.refresh_seconds:
+						auction = None
+				if auction is None:
+					loaded_time = time.time()
+					auction = self.load_auction(artwork_auction_id)
+					self._set_state(queue, auction, loaded_time)
+
+				accepted_bids = []
+				current_amount = (auction['artwork_auction_max_bid'] or 0) if auction is not None else 0
+				for bid in batch:
+					bid.error = _validate(auction, current_amount, bid)
+					if bid.error is None:
+						bid.previous_amount = current_amount
+						current_amount = bid.amount
+						accepted_bids.append(bid)
+				if not accepted_bids:
+					return
+
+				auction = self.write_bids(auction, [(bid.user_id, bid.amount, bid.bid_time) for bid in accepted_bids])
+				if auction is not None:
+					self._set_state(queue, auction)
+					return
+
+				# Another process bid on the auction: validate the batch again with its current state
+				logger.debug("Bid conflict on the Artwork Auction {0}, reloading it".format(artwork_auction_id))
+				self._set_state(queue, None)
+
+			for bid in accepted_bids:
+				bid.error = ServerBusyError()
+		except Exception, e:
+			logger.exception("Error processing the bids on the Artwork Auction {0}: {1}".format(artwork_auction_id, e))
+			self._set_state(queue, None)
+			for bid in batch:
+				if bid.error is None:
+					bid.error = e
+		finally:
+			# Before the bidders see the result, so that they never see their own bid pending
+			with self._lock:
+				self._pending -= len(batch)
+			for bid in batch:
+				if bid.error is not None:
+					bid.future.set_exception(bid.error)
+				else:
+					bid.future.set_result(bid.previous_amount)
+
+
+def _validate(auction, current_amount, bid):
+	# The exception that rejects a bid, or None if it's accepted
+	if auction is None:
+		return InexistentResourceError()
+
+	# Check that the Artwork Auction is still available
+	if auction['artwork_auction_start_time'] > bid.bid_time or auction['artwork_auction_end_time'] < bid.bid_time:
+		return InexistentResourceError()
+
+	# Check that the bid amount is higher than the minimum bid and higher than the current bid
+	if bid.amount <= current_amount or bid.amount < auction['artwork_auction_minimum_bid']:
+		return UnauthorizedError()
+
+	# Check that the bid amount is a multiple of the bid increment
+	if bid.amount % auction['artwork_auction_bid_increment'] != 0:
+		return UnauthorizedError()
+
+	return None
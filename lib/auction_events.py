@@ -0,0 +1,182 @@
+# coding=utf-8
+"""
+This module pushes the bids on the Artwork Auctions to the clients watching them (see handlers.auction_updates), so
+that they don't poll the artwork_auction web service.
+A single background thread per process loads the state of the watched auctions (current bid, high bidder and bid
+count) and notifies their listeners when it changes. The thread is woken up by the bids committed by this process (a
+db_changes commit listener), and polls the current bids of the watched auctions every poll_seconds to pick up the bids
+made by other worker processes, with one query for all of them.
+"""
+
+import logging
+import threading
+import time
+
+from tornado.ioloop import IOLoop
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+# The known current bid of the watched auctions that are not loaded yet (so that they're loaded by the next poll)
+_NOT_LOADED = object()
+
+
+class AuctionEventHub(object):
+	"""
+	The watched Artwork Auctions of a process. All methods are thread-safe, and the listeners are called in the IOLoop
+	thread.
+	The state of an auction is a dictionary with its "artwork_auction_id", "bid_id" (the artwork_auction_bid_id of the
+	current bid, None if it has no bids), "current_bid" (its amount, 0 if it has no bids), "high_bidder_user_id",
+	"high_bidder_name" and "bid_count".
+	"""
+
+	def __init__(self, load_current_bids, load_states, poll_seconds, enabled=True):
+		"""
+		:param load_current_bids: a function that receives a list of artwork_auction_id and returns a dictionary
+			{artwork_auction_id: artwork_auction_current_bid} of the existing ones (see db_crud.get_auction_current_bids)
+		:param load_states: a function that receives a list of artwork_auction_id and returns a dictionary
+			{artwork_auction_id: state} of the existing ones (see db_crud.get_auction_states)
+		:param poll_seconds: the interval between the polls of the current bids, i.e. the max delay of the bids made
+			by other processes
+		:param enabled: whether the auctions can be watched at all
+		"""
+		self.load_current_bids = load_current_bids
+		self.load_states = load_states
+		self.poll_seconds = poll_seconds
+		self.enabled = enabled
+
+		self._lock = threading.Lock()
+		self._listeners = {}  # artwork_auction_id -> list of listeners
+		self._states = {}  # artwork_auction_id -> state, of the watched auctions
+		self._dirty = set()  # Watched auctions to reload on the next wake-up
+		self._wake = threading.Event()
+		self._io_loop = None
+		self._thread = None
+
+	def subscribe(self, artwork_auction_id, listener):
+		"""
+		Watch an Artwork Auction. The listener is called with its current state first, and then with every new state.
+		It's called with None if the Artwork Auction doesn't exist.
+		Must be called from the IOLoop thread.
+		:param artwork_auction_id: the id of the Artwork Auction
+		:param listener: a function that receives the state of the Artwork Auction
+		"""
+		with self._lock:
+			self._io_loop = IOLoop.current()
+			self._listeners.setdefault(artwork_auction_id, []).append(listener)
+			state = self._states.get(artwork_auction_id)
+			if state is None:
+				self._dirty.add(artwork_auction_id)
+			if self._thread is None:
+				# Started lazily, so that the thread is never created before forking
+				self._thread = threading.Thread(target=self._run, name="auction-events")
+				self._thread.daemon = True
+				self._thread.start()
+
+		if state is None:
+			self._wake.set()
+		else:
+			self._io_loop.add_callback(listener, state)
+
+	def unsubscribe(self, artwork_auction_id, listener):
+		"""
+		Stop calling a listener. The Artwork Auction is no longer watched once it has no listeners.
+		:param artwork_auction_id: the id of the Artwork Auction
+		:param listener: a listener given to subscribe()
+		"""
+		with self._lock:
+			listeners = self._listeners.get(artwork_auction_id, [])
+			if listener in listeners:
+				listeners.remove(listener)
+			if not listeners:
+				self._listeners.pop(artwork_auction_id, None)
+				self._states.pop(artwork_auction_id, None)
+				self._dirty.discard(artwork_auction_id)
+
+	def get_state(self, artwork_auction_id):
+		"""
+		:param artwork_auction_id: the id of the Artwork Auction
+		:return: the last state of a watched Artwork Auction, None if it's not loaded yet
+		"""
+		with self._lock:
+			return self._states.get(artwork_auction_id)
+
+	def apply_changes(self, changes):
+		"""
+		Reload the watched auctions whose current bid was changed by a transaction of this process (a db_changes
+		commit listener).
+		:param changes: a list of db_changes.RowChange
+		"""
+		with self._lock:
+			dirty_count = len(self._dirty)
+			for change in changes:
+				if change.table != "Artwork_Auction" or \
+						(change.changed is not None and 'artwork_auction_current_bid' not in change.changed):
+					continue
+				if change.values is None or 'artwork_auction_id' not in change.values:
+					self._dirty.update(self._listeners)
+				elif change.values['artwork_auction_id'] in self._listeners:
+					self._dirty.add(change.values['artwork_auction_id'])
+			woken = len(self._dirty) > dirty_count
+
+		if woken:
+			self._wake.set()
+
+	def poll(self, all_auctions=True):
+		"""
+		Reload the watched auctions whose current bid changed, and notify their listeners.
+		:param all_auctions: whether to poll the current bids of all the watched auctions, or only reload the ones
+			changed by this process
+		"""
+		with self._lock:
+			dirty, self._dirty = self._dirty, set()
+			if all_auctions:
+				known_bids = dict((artwork_auction_id, self._states[artwork_auction_id]['bid_id']
+				                   if artwork_auction_id in self._states else _NOT_LOADED)
+				                  for artwork_auction_id in self._listeners)
+
+		if all_auctions and known_bids:
+			current_bids = self.load_current_bids(sorted(known_bids))
+			dirty.update(artwork_auction_id for artwork_auction_id, bid_id in known_bids.iteritems()
+			             if artwork_auction_id not in current_bids or current_bids[artwork_auction_id] != bid_id)
+		if not dirty:
+			return
+
+		states = self.load_states(sorted(dirty))
+		with self._lock:
+			io_loop = self._io_loop
+			for artwork_auction_id in dirty:
+				if artwork_auction_id not in self._listeners:
+					continue  # No longer watched
+				state = states.get(artwork_auction_id)
+				if state is None:
+					self._states.pop(artwork_auction_id, None)
+				elif state == self._states.get(artwork_auction_id):
+					continue
+				else:
+					self._states[artwork_auction_id] = state
+				io_loop.add_callback(self._notify, artwork_auction_id, state)
+
+	def _notify(self, artwork_auction_id, state):
+		with self._lock:
+			listeners = list(self._listeners.get(artwork_auction_id, ()))
+
+		for listener in listeners:
+			try:
+				listener(state)
+			except Exception, e:
+				logger.exception("Error in auction listener {0}: {1}".format(listener, e))
+
+	def _run(self):
+		last_poll_time = 0
+		while True:
+			self._wake.wait(self.poll_seconds)
+			self._wake.clear()
+			# The bids of this process don't delay the polls of the bids of other processes
+			all_auctions = time.time() - last_poll_time >= self.poll_seconds
+			if all_auctions:
+				last_poll_time = time.time()
+			try:
+				self.poll(all_auctions)
+			except Exception, e:
+				logger.exception("Error polling the watched auctions: {0}".format(e))
@@ -0,0 +1,259 @@
+# coding=utf-8
+"""
+This module buffers the increments of the hot counter columns (e.g. Artwork.artwork_followed_count or
+Critique.critique_upvote_count) in memory, so that the transactions that follow an Artwork or vote a Critique don't
+lock its row. The buffered deltas are added to the database in batches every flush_seconds, with
+"UPDATE ... SET column = column + delta" statements (see db_crud.write_counter_deltas), and the reads of this process
+add the deltas that are not written yet to the values they load (see CounterBuffer.get_delta).
+
+Every delta is appended to a local log before it is buffered, so that the deltas of a process that crashes are not
+lost. The log is split into segments, one per flush: a segment is deleted once its deltas are committed, and the
+segments left by a crashed process are written by the next flush of any process sharing the log directory. A segment
+is written in a single transaction together with a Counter_Flush row with its id, so it is never added twice.
+"""
+
+import atexit
+import errno
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+SEGMENT_PREFIX = "counters-"
+SEGMENT_SUFFIX = ".log"
+
+
+def read_segment(segment_file):
+	"""
+	Read the deltas of a segment of the log. A line left incomplete by a crash is ignored.
+	:param segment_file: the segment, open for reading
+	:return: a dictionary {(table name, primary key tuple, column): delta}
+	"""
+	deltas = {}
+	for line in segment_file:
+		if not line.endswith("\n"):
+			break
+		try:
+			records = json.loads(line)
+		except ValueError:
+			break
+		for table, row_id, column, delta in records:
+			key = (table, tuple(row_id), column)
+			deltas[key] = deltas.get(key, 0) + delta
+
+	return deltas
+
+
+class CounterBuffer(object):
+	"""
+	The buffered counter increments of a process. All methods are thread-safe.
+	"""
+
+	def __init__(self, write_deltas, log_dir, flush_seconds, enabled=True, fsync=False):
+		"""
+		:param write_deltas: a function that adds the deltas of a segment to the database in a single transaction,
+			unless that segment was already written; it receives the segment id and a dictionary
+			{(table name, primary key tuple, column): delta} (see db_crud.write_counter_deltas)
+		:param log_dir: the directory of the log segments
+		:param flush_seconds: the interval between flushes
+		:param enabled: whether the counters are buffered at all (if not, db_crud updates them in its transactions)
+		:param fsync: whether every delta is synced to disk (to survive an OS crash too) before it is buffered
+		"""
+		self.write_deltas = write_deltas
+		self.log_dir = log_dir
+		self.flush_seconds = flush_seconds
+		self.enabled = enabled
+		self.fsync = fsync
+
+		self._lock = threading.Lock()
+		self._flush_lock = threading.Lock()
+		self._listeners = []
+		self._pending = {}  # The deltas of the open segment
+		self._segment = None  # (segment id, path, file) of the open segment
+		self._segments = []  # (segment id, path, file, deltas) of the full segments not written yet, oldest first
+		self._totals = {}  # The deltas of all the segments not written yet
+		self._thread = None
+		self._stopped = threading.Event()
+		self._exit_handler_registered = False
+
+	def add_listener(self, listener):
+		"""
+		Register a function to be called with the deltas of every add() (e.g. to update an in-memory view).
+		:param listener: a function that receives a list of (table name, primary key tuple, column, delta)
+		"""
+		self._listeners.append(listener)
+
+	def add(self, deltas):
+		"""
+		Log and buffer the increments of a committed transaction. They are logged together, so after a crash either
+		all of them or none are written.
+		:param deltas: a list of (table name, primary key tuple, column, delta)
+		"""
+		deltas = [(table, tuple(row_id), column, delta) for table, row_id, column, delta in deltas if delta]
+		if not deltas:
+			return
+
+		with self._lock:
+			if self._segment is None:
+				self._open_segment()
+			segment_file = self._segment[2]
+			segment_file.write(json.dumps(deltas) + "\n")
+			segment_file.flush()
+			if self.fsync:
+				os.fsync(segment_file.fileno())
+
+			for table, row_id, column, delta in deltas:
+				key = (table, row_id, column)
+				self._pending[key] = self._pending.get(key, 0) + delta
+				self._add_total(key, delta)
+
+		if self._thread is None:
+			self.start()
+
+		for listener in list(self._listeners):
+			try:
+				listener(deltas)
+			except Exception, e:
+				logger.exception("Error in counter listener {0}: {1}".format(listener, e))
+
+	def get_delta(self, table, row_id, column):
+		"""
+		:param table: the name of the table, e.g. "Artwork"
+		:param row_id: the primary key of the row, as a tuple
+		:param column: the counter column
+		:return: the sum of the deltas of the counter that are not written to the database yet
+		"""
+		with self._lock:
+			return self._totals.get((table, tuple(row_id), column), 0)
+
+	def start(self):
+		"""
+		Start flushing the buffer every flush_seconds in a background thread, and once more when the process exits.
+		"""
+		with self._lock:
+			if self._thread is not None:
+				return
+			self._stopped.clear()
+			self._thread = threading.Thread(target=self._run, name="counter-buffer")
+			self._thread.daemon = True
+			self._thread.start()
+			if not self._exit_handler_registered:
+				atexit.register(self.stop)
+				self._exit_handler_registered = True
+
+	def stop(self):
+		"""
+		Stop the background thread and flush the buffer.
+		"""
+		with self._lock:
+			thread, self._thread = self._thread, None
+		if thread is not None:
+			self._stopped.set()
+			thread.join()
+		self.flush()
+
+	def flush(self):
+		"""
+		Write the buffered deltas, and the segments left by crashed processes, to the database. The segments that
+		can't be written (e.g. if the database is down) are retried on the next flush.
+		"""
+		with self._flush_lock:
+			with self._lock:
+				if self._pending:
+					# The next deltas go to a new segment, so that this one is written exactly once
+					self._segments.append(self._segment + (self._pending,))
+					self._segment = None
+					self._pending = {}
+				segments = list(self._segments)
+
+			for segment_id, path, segment_file, deltas in segments:
+				try:
+					self.write_deltas(segment_id, deltas)
+				except Exception, e:
+					logger.exception("Error writing the counter log segment {0}, retrying later: {1}".format(path, e))
+					return
+				_remove(path)
+				segment_file.close()
+				with self._lock:
+					self._segments.pop(0)
+					for key, delta in deltas.iteritems():
+						self._add_total(key, -delta)
+
+			self._recover()
+
+	def _run(self):
+		while not self._stopped.wait(self.flush_seconds):
+			try:
+				self.flush()
+			except Exception, e:
+				logger.exception("Error flushing the counter buffer: {0}".format(e))
+
+	def _open_segment(self):
+		if not os.path.isdir(self.log_dir):
+			try:
+				os.makedirs(self.log_dir)
+			except OSError, e:
+				if e.errno != errno.EEXIST:
+					raise e
+
+		segment_id = uuid.uuid4().hex
+		path = os.path.join(self.log_dir, SEGMENT_PREFIX + segment_id + SEGMENT_SUFFIX)
+		segment_file = open(path + ".new", "ab")
+		# The lock is held until the segment is written, so that no other process takes it for the segment of a
+		# crashed process. It is taken before the segment gets its name, for the same reason.
+		fcntl.flock(segment_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+		os.rename(path + ".new", path)
+		self._segment = (segment_id, path, segment_file)
+
+	def _recover(self):
+		# Write the segments that are not locked by a live process, i.e. those left by crashed processes
+		try:
+			names = os.listdir(self.log_dir)
+		except OSError:
+			return
+
+		for name in sorted(names):
+			if not name.startswith(SEGMENT_PREFIX) or not name.endswith(SEGMENT_SUFFIX):
+				continue
+			segment_id = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+			path = os.path.join(self.log_dir, name)
+			try:
+				segment_file = open(path, "rb")
+			except IOError:
+				continue  # Written and removed by another process
+			try:
+				try:
+					fcntl.flock(segment_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+				except IOError:
+					continue  # Open in a live process
+
+				deltas = read_segment(segment_file)
+				if deltas:
+					self.write_deltas(segment_id, deltas)
+				_remove(path)
+				logger.info("Wrote the counter log segment {0} of a stopped process".format(path))
+			except Exception, e:
+				logger.exception("Error writing the counter log segment {0}, retrying later: {1}".format(path, e))
+				return
+			finally:
+				segment_file.close()
+
+	def _add_total(self, key, delta):
+		total = self._totals.get(key, 0) + delta
+		if total:
+			self._totals[key] = total
+		else:
+			self._totals.pop(key, None)
+
+
+def _remove(path):
+	try:
+		os.remove(path)
+	except OSError, e:
+		if e.errno != errno.ENOENT:
+			raise e
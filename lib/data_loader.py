@@ -0,0 +1,134 @@
+# coding=utf-8
+"""
+This module contains request-scoped batch loaders, in the style of Facebook's DataLoader.
+Handlers register the keys they are going to need for a whole page (e.g. the Artist of every Artwork in a list),
+and the loader resolves all of them with a single batched query the first time a value is requested.
+Loaders cache their results, so they must only live for the duration of a single request.
+"""
+
+import logging
+
+import lib.db_crud
+
+
+logger = logging.getLogger('artmego.' + __name__)
+db_crud = lib.db_crud
+
+
+class DataLoader(object):
+	"""
+	Collects keys and resolves them in batches using a batch load function.
+	"""
+
+	def __init__(self, batch_load_fn, default=None):
+		"""
+		:param batch_load_fn: a function that receives a list of keys and returns a dictionary with a value per key
+		:param default: the value returned for keys that the batch load function did not resolve
+		"""
+		self.batch_load_fn = batch_load_fn
+		self.default = default
+		self._queue = []
+		self._cache = {}
+
+	def prime(self, keys):
+		"""
+		Queue keys to be resolved on the next dispatch.
+		:param keys: an iterable with the keys to queue
+		"""
+		for key in keys:
+			if key not in self._cache:
+				self._queue.append(key)
+
+	def dispatch(self):
+		"""
+		Resolve all queued keys with a single call to the batch load function.
+		"""
+		if not self._queue:
+			return
+
+		keys = list(set(self._queue))
+		self._queue = []
+
+		values = self.batch_load_fn(keys)
+		for key in keys:
+			self._cache[key] = values.get(key, self.default)
+
+	def load(self, key):
+		"""
+		Get the value for a key. If the key hasn't been resolved yet, it is resolved together with all queued keys.
+		:param key: the key to load
+		:return: the value for the given key
+		"""
+		if key not in self._cache:
+			self._queue.append(key)
+			self.dispatch()
+
+		return self._cache[key]
+
+	def load_many(self, keys):
+		"""
+		Get the values for several keys, resolving the missing ones in a single batch.
+		:param keys: a list of keys to load
+		:return: a list of values in the same order as keys
+		"""
+		self.prime(keys)
+		self.dispatch()
+
+		return [self._cache[key] for key in keys]
+
+
+class RequestLoaders(object):
+	"""
+	The set of DataLoaders available while serving a single request.
+	"""
+
+	def __init__(self, user_id=None):
+		"""
+		:param user_id: the user_id of the requesting User (when applicable)
+		"""
+		self.user_id = user_id
+
+		# user_id -> (Artist, Image)
+		self.artist = DataLoader(db_crud.get_artists, default=(None, None))
+		# Artwork -> owner_directory.Owner (user_id, owner_type, owner_name, image_path), or None
+		self.artwork_owner = DataLoader(self._load_artwork_owners)
+		# artwork_id -> whether the requesting User follows the Artwork
+		self.artwork_followed = DataLoader(self._load_artwork_followed, default=False)
+		# (artwork_id, critic_user_id) -> whether the requesting User purchased the Critique
+		self.critique_purchased = DataLoader(self._load_critique_purchased, default=False)
+		# (artwork_id, critic_user_id) -> the vote type of the requesting User on the Critique ("N" for no vote)
+		self.critique_vote_type = DataLoader(self._load_critique_vote_types, default="N")
+
+	def prime_artwork_list(self, artwork_list):
+		"""
+		Queue the artist, owner and follow state of every Artwork in a list.
+		:param artwork_list: the list of Artwork that is going to be displayed
+		"""
+		self.artist.prime(artwork.artist_user_id for artwork in artwork_list)
+		self.artwork_owner.prime(artwork_list)
+		self.artwork_followed.prime(artwork.artwork_id for artwork in artwork_list)
+
+	def prime_critique_list(self, critique_list):
+		"""
+		Queue the purchase and vote state of every Critique in a list.
+		:param critique_list: the list of Critiques that is going to be displayed
+		"""
+		critique_keys = [(critique.artwork_id, critique.critic_user_id) for critique in critique_list]
+		self.critique_purchased.prime(critique_keys)
+		self.critique_vote_type.prime(critique_keys)
+
+	@staticmethod
+	def _load_artwork_owners(artwork_list):
+		owners = db_crud.get_artwork_owners(artwork_list)
+		return dict((artwork, owners[artwork.artwork_id]) for artwork in artwork_list)
+
+	def _load_artwork_followed(self, artwork_ids):
+		followed_artwork_ids = db_crud.get_followed_artwork_ids(self.user_id, artwork_ids)
+		return dict((artwork_id, artwork_id in followed_artwork_ids) for artwork_id in artwork_ids)
+
+	def _load_critique_purchased(self, critique_keys):
+		purchased_keys = db_crud.critiques_purchased(self.user_id, critique_keys)
+		return dict((critique_key, critique_key in purchased_keys) for critique_key in critique_keys)
+
+	def _load_critique_vote_types(self, critique_keys):
+		return db_crud.get_critique_vote_types(self.user_id, critique_keys)
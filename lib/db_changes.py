@@ -0,0 +1,152 @@
+# coding=utf-8
+"""
+This module captures the rows written by db_crud sessions and publishes them once the session commits.
+Every flush records a RowChange per inserted, updated or deleted row; when the transaction commits, the changes are
+handed to the registered commit listeners (e.g. caches that must be invalidated). Changes of rolled back transactions
+are discarded. Commit listeners run in the thread that committed, after the commit, so they must be quick and
+thread-safe.
+"""
+
+import logging
+
+from sqlalchemy import event, inspect
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+ACTION_INSERT = "insert"
+ACTION_UPDATE = "update"
+ACTION_DELETE = "delete"
+
+_commit_listeners = []
+
+
+class RowChange(object):
+	"""
+	A row written in a committed transaction.
+	"""
+
+	def __init__(self, table, action, values=None, changed=None):
+		"""
+		:param table: the name of the table, e.g. "Artist"
+		:param action: ACTION_INSERT, ACTION_UPDATE or ACTION_DELETE
+		:param values: a dictionary with the column values of the row after the write (before it, for deletes), or
+			None if the rows are unknown (bulk updates and deletes made with Query.update() or Query.delete()).
+			Columns that were not loaded in the session (or not set, for inserts) are missing from the dictionary
+		:param changed: for updates, the set of columns that changed, or None if unknown
+		"""
+		self.table = table
+		self.action = action
+		self.values = values
+		self.changed = changed
+
+	def __repr__(self):
+		return "RowChange({0}, {1}, {2})".format(self.table, self.action, self.values)
+
+
+def add_commit_listener(listener):
+	"""
+	Register a function to be called with the list of RowChange of every committed transaction.
+	:param listener: a function that receives a list of RowChange
+	"""
+	_commit_listeners.append(listener)
+
+
+def remove_commit_listener(listener):
+	"""
+	Unregister a function added with add_commit_listener.
+	:param listener: the function to remove
+	"""
+	if listener in _commit_listeners:
+		_commit_listeners.remove(listener)
+
+
+def after_commit(session, callback):
+	"""
+	Run a function once the current transaction of a session commits. If the transaction is rolled back, the function
+	is not called.
+	:param session: the session (or a db_crud shared session)
+	:param callback: a function without arguments
+	"""
+	session.info.setdefault('after_commit_callbacks', []).append(callback)
+
+
+def record_change(session, change):
+	"""
+	Record a row written without the ORM (e.g. with an UPDATE statement), so that it's published with the changes of
+	the current transaction of a session.
+	:param session: the session (or a db_crud shared session)
+	:param change: a RowChange
+	"""
+	session.info.setdefault('pending_changes', []).append(change)
+
+
+def install(session_factory):
+	"""
+	Capture the changes of all the sessions created by a session factory.
+	:param session_factory: a sessionmaker (or Session class)
+	"""
+	event.listen(session_factory, 'after_flush', _after_flush)
+	event.listen(session_factory, 'after_bulk_update', _after_bulk_update)
+	event.listen(session_factory, 'after_bulk_delete', _after_bulk_delete)
+	event.listen(session_factory, 'after_commit', _after_commit)
+	event.listen(session_factory, 'after_rollback', _after_rollback)
+
+
+def _row_values(instance):
+	# Read the loaded values only, since lazy loads are not allowed during a flush
+	state = inspect(instance)
+	return dict((column.key, state.dict[column.key]) for column in state.mapper.column_attrs
+	            if column.key in state.dict)
+
+
+def _after_flush(session, flush_context):
+	changes = session.info.setdefault('pending_changes', [])
+
+	for instance in session.new:
+		changes.append(RowChange(instance.__tablename__, ACTION_INSERT, _row_values(instance)))
+
+	for instance in session.dirty:
+		if not session.is_modified(instance, include_collections=False):
+			continue
+		state = inspect(instance)
+		changed = set(attribute.key for attribute in state.mapper.column_attrs
+		              if state.attrs[attribute.key].history.has_changes())
+		changes.append(RowChange(instance.__tablename__, ACTION_UPDATE, _row_values(instance), changed))
+
+	for instance in session.deleted:
+		changes.append(RowChange(instance.__tablename__, ACTION_DELETE, _row_values(instance)))
+
+
+def _after_bulk_update(update_context):
+	changed = set(getattr(key, 'key', key) for key in update_context.values)
+	update_context.session.info.setdefault('pending_changes', []).append(
+		RowChange(update_context.primary_table.name, ACTION_UPDATE, None, changed))
+
+
+def _after_bulk_delete(delete_context):
+	delete_context.session.info.setdefault('pending_changes', []).append(
+		RowChange(delete_context.primary_table.name, ACTION_DELETE))
+
+
+def _after_commit(session):
+	changes = session.info.pop('pending_changes', [])
+	callbacks = session.info.pop('after_commit_callbacks', [])
+
+	if changes:
+		for listener in list(_commit_listeners):
+			try:
+				listener(changes)
+			except Exception, e:
+				logger.exception("Error in commit listener {0}: {1}".format(listener, e))
+
+	for callback in callbacks:
+		try:
+			callback()
+		except Exception, e:
+			logger.exception("Error in after commit callback {0}: {1}".format(callback, e))
+
+
+def _after_rollback(session):
+	session.info.pop('pending_changes', None)
+	session.info.pop('after_commit_callbacks', None)
@@ -4,23 +4,41 @@ This module contains CRUD (Create, Read, Update, Delete) functions for database
 The ORM used is the SQLAlchemy package.
 """
 
+import bisect
 import logging
 from datetime import datetime
 from datetime import timedelta
 import re
+import functools
 import hashlib
-
-from sqlalchemy import create_engine, and_, func
-from sqlalchemy.orm import sessionmaker
+import os
+import threading
+
+from concurrent.futures import Future
+from sqlalchemy import and_, or_, func, bindparam, exists, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, object_mapper, sessionmaker, Session as OrmSession
+from sqlalchemy.sql.expression import UpdateBase
 from sqlalchemy.orm.exc import NoResultFound
 import sys
 
+from lib import db_changes, entity_versions
+from lib.db_pool import create_pooled_engine
+from lib.db_routing import ReplicaRouter
+from lib.auction_engine import AuctionEngine
+from lib.auction_events import AuctionEventHub
+from lib.counter_buffer import CounterBuffer
+from lib.feed_materializer import FeedMaterializer, FEED_COLUMNS, AUCTION_COLUMNS
+from lib.follow_graph import FollowGraph, FOLLOW_TABLES, CRITIQUE
+from lib.geo_index import GeoIndex, VENUE_TABLES, parse_geolocation
+from lib.owner_directory import OwnerDirectory, Owner, OWNER_TABLES, owner_key
+from lib.pagination import Keyset
 from lib.db_tables import Country, City, Address, Image, Banner, Buyer, Administrator, User, Artist, Auction_House, \
 	Gallery, Critic, Artwork, Artwork_Image, Critique, Follow_Artist, Gallery_Event, Auction_House_Event, \
 	Critique_Purchase, Artwork_Auction, Artwork_Auction_Bid, Follow_Artwork, Follow_Gallery, Follow_Auction, \
-	Follow_Critic, Critique_Vote, Artwork_Label, Label
+	Follow_Critic, Critique_Vote, Artwork_Label, Label, Entity_Version, Counter_Flush, Buyer_Ledger
 from lib.exceptions import WrongArgumentValueError, UserExistsError, UserInexistentError, AuthenticationError, \
-	InexistentResourceError, InsufficientFundsError, UnauthorizedError
+	InexistentResourceError, InsufficientFundsError, UnauthorizedError, ServerBusyError
 from lib.utils import deprecated
 from settings import settings
 
@@ -31,10 +49,582 @@ DB_CONNECTION_STRING = "{0}://{1}:{2}@{3}:{4}/{5}?charset=utf8".format(settings[
                                                                        settings['DB_USER'], settings['DB_PASSWORD'],
                                                                        settings['DB_HOST'], settings['DB_PORT'],
                                                                        settings['DB_SCHEMA'])
-engine = create_engine(DB_CONNECTION_STRING)
-Session = sessionmaker(bind=engine)
+DB_REPLICA_CONNECTION_STRINGS = ["{0}://{1}:{2}@{3}:{4}/{5}?charset=utf8".format(
+	settings['DB_ENGINE_ORM_MAP'][settings['DB_ENGINE']], settings['DB_USER'], settings['DB_PASSWORD'], replica_host,
+	settings['DB_PORT'], settings['DB_SCHEMA']) for replica_host in settings['DB_REPLICA_HOSTS']]
+engine = create_pooled_engine(DB_CONNECTION_STRING)
+replica_router = ReplicaRouter([create_pooled_engine(replica_connection_string)
+                                for replica_connection_string in DB_REPLICA_CONNECTION_STRINGS],
+                               settings['DB_REPLICA_ROUTING'], settings['DB_READ_YOUR_WRITES_SECONDS'])
 COIN_PRICES = settings['COIN_PRICES']
 
+_engine_pid = os.getpid()  # The process that created the current engine
+
+_request_context = threading.local()  # Holds the RequestSession bound to the current thread (if any)
+
+# The order of the lists that can be paginated with cursors (see lib.pagination)
+ARTIST_LIST_ORDER = Keyset("artist_list", [(Artist.artist_nickname, False)], [Artist.user_id])
+AUCTION_HOUSE_LIST_ORDER = Keyset("auction_house_list", [(Auction_House.auction_house_name, False)],
+                                  [Auction_House.user_id])
+GALLERY_LIST_ORDER = Keyset("gallery_list", [(Gallery.gallery_name, False)], [Gallery.user_id])
+LABEL_LIST_ORDER = Keyset("label_list", [(Label.label_name, False)], [Label.label_id])
+# Newest bids first (the bid id is unique, so it's the whole keyset)
+AUCTION_BID_HISTORY_ORDER = Keyset("auction_bid_history", [(Artwork_Auction_Bid.artwork_auction_bid_id, True)], [])
+BUYER_ARTWORK_ORDER = Keyset("buyer_artwork", [(Artwork.artwork_display_weight, False)], [Artwork.artwork_id])
+CRITIQUE_LIST_ORDER = Keyset("critique_list", [(Critique.critique_upvote_count, True)],
+                             [Critique.artwork_id, Critique.critic_user_id])
+FOLLOWED_ARTISTS_ORDER = Keyset("followed_artists", [(Artist.artist_nickname, False)], [Artist.user_id])
+FOLLOWED_ARTWORK_ORDER = Keyset("followed_artwork", [(Artwork.artwork_name, False)], [Artwork.artwork_id])
+FOLLOWED_AUCTION_HOUSES_ORDER = Keyset("followed_auction_houses", [(Auction_House.auction_house_name, False)],
+                                       [Auction_House.user_id])
+FOLLOWED_CRITICS_ORDER = Keyset("followed_critics", [(Critic.critic_nickname, False)], [Critic.user_id])
+FOLLOWED_GALLERIES_ORDER = Keyset("followed_galleries", [(Gallery.gallery_name, False)], [Gallery.user_id])
+# One order per sorting rule of get_artwork_list
+ARTWORK_LIST_ORDERS = {
+	# 1: most popular Artwork
+	1: Keyset("artwork_list_1", [(Artwork.artwork_followed_count, True), (Artwork.artwork_display_weight, True)],
+	          [Artwork.artwork_id]),
+	# 2: my watched Critics (the Artwork critiqued by the Critics followed by the Buyer)
+	2: Keyset("artwork_list_2", [(Artwork.artwork_display_weight, True)], [Artwork.artwork_id]),
+	# 3: my watched Artists (the Artwork of the Artists followed by the Buyer)
+	3: Keyset("artwork_list_3", [(Artwork.artwork_display_weight, True)], [Artwork.artwork_id]),
+	# 4: my watched Artwork (the Artwork followed by the Buyer)
+	4: Keyset("artwork_list_4", [(Artwork.artwork_display_weight, True)], [Artwork.artwork_id]),
+	# 5: nearby Galleries, without a location (see NEARBY_ARTWORK_ORDER)
+	5: Keyset("artwork_list_5", [(Artwork.artwork_display_weight, True)], [Artwork.artwork_id]),
+	# 6: latest Artwork (uploaded)
+	6: Keyset("artwork_list_6", [(Artwork.artwork_creation_time, True)], [Artwork.artwork_id]),
+	# 7: most Critiques
+	7: Keyset("artwork_list_7", [(Artwork.artwork_critique_count, True), (Artwork.artwork_display_weight, True)],
+	          [Artwork.artwork_id]),
+	# 8: highest to lowest price. Artwork has no price column, so the price order is only materialized (see
+	# lib.feed_materializer), and the cursors store the Artwork whose current price is then looked up in the feed
+	8: Keyset("artwork_list_8", [(Artwork.artwork_display_weight, True)], [Artwork.artwork_id]),
+	# 9: lowest to highest price (same as 8)
+	9: Keyset("artwork_list_9", [(Artwork.artwork_display_weight, True)], [Artwork.artwork_id]),
+	# 10: most popular critique
+	10: Keyset("artwork_list_10", [(Artwork.artwork_top_critique_upvote_count, True),
+	                               (Artwork.artwork_display_weight, True)], [Artwork.artwork_id]),
+}
+# The order of the nearby Galleries (sorting_rule=5) with a location: by distance of the owner, then display weight.
+# The list is sorted in memory (see _get_nearby_artwork_list), so this order is only used for its cursors, which store
+# the owner columns to get the distance of their Artwork back.
+NEARBY_ARTWORK_ORDER = Keyset("artwork_list_5_nearby", [(Artwork.owner_gallery_user_id, False),
+                                                        (Artwork.owner_auction_house_user_id, False),
+                                                        (Artwork.artwork_display_weight, True)],
+                              [Artwork.artwork_id])
+_NEARBY_VENUE_BATCH = 100  # The number of venues whose Artwork are loaded by each query of _get_nearby_artwork_list
+
+################################### SESSIONS ###################################
+
+
+class RoutingSession(OrmSession):
+	"""
+	A Session that sends the reads made by functions decorated with read_from_replica to a replica (see
+	replica_router), and everything else to the primary. Once a session writes, all its statements go to the primary.
+	Reads of a user that wrote in the last DB_READ_YOUR_WRITES_SECONDS seconds also go to the primary, and so do the
+	reads of the requests whose results are cached (see RequestSession.primary_reads).
+	"""
+
+	def __init__(self, *args, **kwargs):
+		super(RoutingSession, self).__init__(*args, **kwargs)
+		self._has_written = False
+
+	def get_bind(self, mapper=None, clause=None):
+		primary = super(RoutingSession, self).get_bind(mapper, clause)
+
+		if self._flushing or isinstance(clause, UpdateBase):
+			self._has_written = True
+		if self._has_written or not getattr(_request_context, 'replica_reads', 0):
+			return primary
+
+		request_session = getattr(_request_context, 'request_session', None)
+		if request_session is not None and (request_session.primary_reads or
+		                                    replica_router.is_pinned(request_session.user_id)):
+			return primary
+
+		return replica_router.choose() or primary
+
+
+Session = sessionmaker(class_=RoutingSession, bind=engine)
+db_changes.install(Session)  # Publish the rows written by every committed transaction
+entity_versions.install(Session)  # Bump the version stamps of the written entities (used in ETags)
+
+# The in-memory views below are loaded from the primary (see read_from_primary), never from a replica: they're kept up
+# to date by the writes committed after they're loaded, so a lagging snapshot would miss the writes committed before it.
+# For the same reason they're loaded in a Session of their own, not in the shared session of the request that triggers
+# the load: its transaction may have started before the load (missing the writes committed since) or hold writes that
+# are flushed but not committed yet (which could still be rolled back).
+
+# The home feeds of get_artwork_list, materialized in memory and kept up to date by the committed writes
+feed_materializer = FeedMaterializer(lambda: get_artwork_ranking_rows(), settings['FEED_REFRESH_SECONDS'],
+                                     settings['FEED_MATERIALIZER_ENABLED'])
+db_changes.add_commit_listener(feed_materializer.apply_changes)
+
+# The owners of the Artwork (see get_artwork_owners), materialized in memory and kept up to date by the committed writes
+owner_directory = OwnerDirectory(lambda: get_owner_rows(), settings['OWNER_DIRECTORY_REFRESH_SECONDS'],
+                                 settings['OWNER_DIRECTORY_ENABLED'])
+db_changes.add_commit_listener(owner_directory.apply_changes)
+
+# The venue locations of the nearby feed (see _get_nearby_artwork_list), kept up to date by the committed writes
+geo_index = GeoIndex(lambda: get_venue_location_rows(), settings['GEO_INDEX_REFRESH_SECONDS'],
+                     settings['GEO_INDEX_ENABLED'])
+db_changes.add_commit_listener(geo_index.apply_changes)
+
+# The follows of the Buyers (see _get_watched_artwork_ids), kept in memory and up to date by the committed writes
+follow_graph = FollowGraph(lambda: get_follow_graph_rows(),
+                           lambda buyer_user_id: get_follow_graph_rows(buyer_user_id),
+                           settings['FOLLOW_GRAPH_REFRESH_SECONDS'], settings['FOLLOW_GRAPH_ENABLED'])
+db_changes.add_commit_listener(follow_graph.apply_changes)
+
+# The increments of the counter columns (see _increment_counters), buffered in memory and written in batches
+counter_buffer = CounterBuffer(lambda segment_id, deltas: write_counter_deltas(segment_id, deltas),
+                               settings['COUNTER_LOG_DIR'], settings['COUNTER_FLUSH_SECONDS'],
+                               settings['COUNTER_BUFFER_ENABLED'], settings['COUNTER_LOG_FSYNC'])
+counter_buffer.add_listener(feed_materializer.apply_counter_deltas)
+
+# The bids on the Artwork Auctions (see make_bid), validated in memory and written in batches
+auction_engine = AuctionEngine(lambda artwork_auction_id: get_live_auction(artwork_auction_id),
+                               lambda auction, bids: write_auction_bids(auction, bids),
+                               settings['AUCTION_REFRESH_SECONDS'], settings['AUCTION_MAX_BATCH'],
+                               settings['AUCTION_MAX_QUEUE'], settings['AUCTION_ENGINE_WORKERS'],
+                               settings['AUCTION_ENGINE_ENABLED'])
+db_changes.add_commit_listener(auction_engine.apply_changes)
+
+# The Artwork Auctions watched by clients (see handlers.auction_updates), reloaded when their current bid changes
+auction_events = AuctionEventHub(lambda artwork_auction_ids: get_auction_current_bids(artwork_auction_ids),
+                                 lambda artwork_auction_ids: get_auction_states(artwork_auction_ids),
+                                 settings['AUCTION_EVENTS_POLL_SECONDS'], settings['AUCTION_EVENTS_ENABLED'])
+db_changes.add_commit_listener(auction_events.apply_changes)
+
+# The tables with counter columns, by name
+COUNTER_TABLES = dict((table.__tablename__, table) for table in (Artwork, Artist, Gallery, Auction_House, Critic,
+                                                                  Critique))
+_COUNTER_FLUSH_RETENTION_DAYS = 7  # Days a written segment of the counter log is remembered (to not write it twice)
+
+
+def init_engine(connection_string=DB_CONNECTION_STRING, replica_connection_strings=DB_REPLICA_CONNECTION_STRINGS):
+	"""
+	Create a new engine (and connection pool) and bind Session to it, and new engines for the read replicas.
+	This must be called in every worker process after forking, since the engines created when this module is
+	imported hold connection pools that cannot be shared between processes.
+	:param connection_string: the database URL for the new engine
+	:param replica_connection_strings: the database URLs of the read replicas
+	:return: the new engine
+	"""
+	global engine, replica_router, _engine_pid
+
+	old_engine = engine
+	old_replica_router = replica_router
+	engine = create_pooled_engine(connection_string)
+	Session.configure(bind=engine)
+	replica_router = ReplicaRouter([create_pooled_engine(replica_connection_string)
+	                                for replica_connection_string in replica_connection_strings],
+	                               settings['DB_REPLICA_ROUTING'], settings['DB_READ_YOUR_WRITES_SECONDS'])
+
+	# Only close the old connections in the process that opened them. A forked child just drops its copy of the
+	# pool, since closing inherited connections would also close them for the parent process.
+	if _engine_pid == os.getpid():
+		old_engine.dispose()
+		old_replica_router.dispose()
+	_engine_pid = os.getpid()
+
+	return engine
+
+
+def get_pool_statistics():
+	"""
+	Get the statistics of the connection pools of the current engine and replicas (see db_pool.PoolStatistics).
+	:return: a dictionary with the statistics of the primary pool, and a list with the statistics of each replica
+	"""
+	pool_statistics = engine.pool.statistics.as_dict(engine.pool)
+	pool_statistics['replicas'] = [replica.pool.statistics.as_dict(replica.pool) for replica in replica_router.engines]
+
+	return pool_statistics
+
+
+def warm_up():
+	"""
+	Build the in-memory views (home feeds, owner directory, geo index and follow graph) of this process before it serves
+	any request. If a view can't be built (e.g. the database is down), the error is logged and the view is built on its
+	first read instead.
+	"""
+	for view in (feed_materializer, owner_directory, geo_index, follow_graph):
+		if view.enabled:
+			try:
+				view.rebuild()
+			except Exception, e:
+				logger.exception("Error building the {0}: {1}".format(view.name, e))
+
+
+def counter_value(instance, column):
+	"""
+	Get the value of a counter column of a row, including the increments of this process that are not written to the
+	database yet (see counter_buffer). Web services show the counters with this instead of reading the column.
+	:param instance: the row, e.g. an Artwork
+	:param column: the name of the counter column, e.g. "artwork_followed_count"
+	:return: the value of the counter
+	"""
+	return _overlay_counter(instance.__tablename__, _counter_row_id(instance), column, getattr(instance, column))
+
+
+def _overlay_counter(table_name, row_id, column, value):
+	delta = counter_buffer.get_delta(table_name, row_id, column)
+	return (value or 0) + delta if delta else value
+
+
+def _counter_row_id(instance):
+	return tuple(object_mapper(instance).primary_key_from_instance(instance))
+
+
+def _increment_counters(curr_session, instance, **deltas):
+	"""
+	Add to the counter columns of a row. With the counter buffer enabled, the deltas are buffered once the transaction
+	commits, so that the transaction doesn't lock the row; otherwise, the row is updated in the transaction.
+	:param curr_session: the session of the transaction
+	:param instance: the row, e.g. an Artwork
+	:param deltas: the delta of each counter column, e.g. artwork_followed_count=1
+	"""
+	if counter_buffer.enabled:
+		table_name, row_id = instance.__tablename__, _counter_row_id(instance)
+		increments = [(table_name, row_id, column, delta) for column, delta in sorted(deltas.iteritems())]
+		db_changes.after_commit(curr_session, lambda: counter_buffer.add(increments))
+	else:
+		for column, delta in deltas.iteritems():
+			setattr(instance, column, getattr(instance, column) + delta)
+
+
+def write_counter_deltas(segment_id, deltas):
+	"""
+	Add the deltas of a segment of the counter log (see lib.counter_buffer) to the counter columns, update the upvote
+	count of the most popular Critique of the Artwork whose Critiques were upvoted, and bump the versions of their
+	entities, in a single transaction. A segment that was already written is ignored.
+	:param segment_id: the id of the segment
+	:param deltas: a dictionary {(table name, primary key tuple, column): delta}
+	"""
+
+	now = datetime.now()
+	curr_session = Session()
+
+	try:
+		curr_session.add(Counter_Flush(counter_flush_id=segment_id, counter_flush_time=now))
+		try:
+			curr_session.flush()
+		except IntegrityError:
+			curr_session.rollback()
+			logger.info("The counter log segment {0} was already written".format(segment_id))
+			return
+
+		# One batch of updates per column, in the same order in every process to avoid deadlocks
+		parameters = {}
+		version_keys = set()
+		for (table_name, row_id, column), delta in sorted(deltas.iteritems()):
+			if delta:
+				key_columns = COUNTER_TABLES[table_name].__table__.primary_key.columns
+				parameter = dict(("key_{0}".format(index), value) for index, value in enumerate(row_id))
+				parameter['counter_delta'] = delta
+				parameters.setdefault((table_name, column), []).append(parameter)
+				version_keys.update(entity_versions.version_keys(db_changes.RowChange(
+					table_name, db_changes.ACTION_UPDATE,
+					dict((key_column.key, value) for key_column, value in zip(key_columns, row_id)), set([column]))))
+
+		for (table_name, column), column_parameters in sorted(parameters.iteritems()):
+			table = COUNTER_TABLES[table_name].__table__
+			update = table.update(). \
+				where(and_(*[key_column == bindparam("key_{0}".format(index))
+				             for index, key_column in enumerate(table.primary_key.columns)])). \
+				values({column: func.coalesce(table.c[column], 0) + bindparam("counter_delta")})
+			curr_session.execute(update, column_parameters)
+
+		upvoted_artwork_ids = sorted(set(row_id[0] for (table_name, row_id, column), delta in deltas.iteritems()
+		                                 if delta and table_name == "Critique" and column == "critique_upvote_count"))
+		if upvoted_artwork_ids:
+			_update_top_critique_upvote_counts(curr_session, upvoted_artwork_ids)
+			# Their versions are bumped with the changes of the Artwork when the transaction commits
+			version_keys.difference_update((entity_versions.ARTWORK, artwork_id) for artwork_id in upvoted_artwork_ids)
+
+		entity_versions.bump_versions(curr_session, version_keys)
+
+		counter_flush_table = Counter_Flush.__table__
+		curr_session.execute(counter_flush_table.delete().
+		                     where(counter_flush_table.c.counter_flush_time <
+		                           now - timedelta(days=_COUNTER_FLUSH_RETENTION_DAYS)))
+
+		curr_session.commit()
+	except Exception, e:
+		curr_session.rollback()
+		raise e
+	finally:
+		curr_session.close()
+
+
+def read_from_replica(function):
+	"""
+	Decorator for read-only db_crud functions whose results may come from a read replica (i.e. may lag slightly behind
+	the primary). Reads made by the decorated function, and by the functions it calls, are routed by RoutingSession.
+	"""
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		_request_context.replica_reads = getattr(_request_context, 'replica_reads', 0) + 1
+		try:
+			return function(*args, **kwargs)
+		finally:
+			_request_context.replica_reads -= 1
+
+	return wrapper
+
+
+def read_from_primary(function):
+	"""
+	Decorator for read-only db_crud functions whose results must include the latest writes, even when they're called by
+	a function decorated with read_from_replica (e.g. the loads of the in-memory views, which can happen on any read).
+	"""
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		replica_reads = getattr(_request_context, 'replica_reads', 0)
+		_request_context.replica_reads = 0
+		try:
+			return function(*args, **kwargs)
+		finally:
+			_request_context.replica_reads = replica_reads
+
+	return wrapper
+
+
+class RequestSession(object):
+	"""
+	A unit of work shared by all the db_crud functions called while serving a single request.
+	While it is bound to the current thread (see bind_request_session), every db_crud function uses the same
+	underlying Session, so a request checks out a single pool connection. Writes made by db_crud functions are only
+	flushed; they are committed once, when the request calls commit().
+	"""
+
+	def __init__(self, user_id=None, primary_reads=False):
+		"""
+		:param user_id: the user_id of the requesting User (when applicable). After the User writes, its reads are
+			pinned to the primary for a few seconds (see RoutingSession)
+		:param primary_reads: True to send all the reads of the request to the primary, e.g. for a response that is
+			cached: a lagging replica read right after an invalidation would be cached as the fresh response
+		"""
+		self._session = None
+		self._lock = threading.Lock()
+		self._in_use = False
+		self._close_on_unbind = False
+		self._abandoned = False  # The request stopped waiting for the unit of work (see abandon)
+		self._committing = False
+		self._released = False  # The writes were committed before the end of the unit of work (see release)
+		self.has_writes = False
+		self.user_id = user_id
+		self.primary_reads = primary_reads
+
+	def bind(self):
+		"""
+		Bind this RequestSession to the current thread, so that db_crud functions called from it use this session.
+		"""
+		with self._lock:
+			self._in_use = True
+		bind_request_session(self)
+
+	def unbind(self):
+		"""
+		Unbind this RequestSession from the current thread. If close() was called while it was bound (e.g. the
+		request timed out while a worker thread was still using it), the session is closed now.
+		"""
+		unbind_request_session()
+		with self._lock:
+			self._in_use = False
+			close = self._close_on_unbind
+		if close:
+			self.close()
+
+	def get_session(self):
+		"""
+		Get the shared session for a db_crud function, creating the underlying Session the first time.
+		:return: a _SharedSession wrapping the Session of this request
+		"""
+		if self._session is None:
+			self._session = Session(expire_on_commit=False)
+		return _SharedSession(self, self._session)
+
+	def commit(self):
+		"""
+		Commit all the writes made during the request. If the request was abandoned (see abandon), the writes are
+		rolled back instead, since the client was told that the request failed.
+		"""
+		with self._lock:
+			abandoned = self._abandoned
+			self._committing = not abandoned
+		if abandoned:
+			if self.has_writes:
+				logger.warning("Rolling back the writes of an abandoned request")
+			self.rollback()
+			return
+
+		try:
+			if self._session is not None and self.has_writes:
+				try:
+					self._session.commit()
+				except Exception, e:
+					self.rollback()
+					raise e
+				replica_router.pin(self.user_id)
+			self.has_writes = False
+		finally:
+			with self._lock:
+				self._committing = False
+
+	def release(self):
+		"""
+		Commit the writes made so far and return the connection to the pool, e.g. before the request waits for the
+		auction engine. The request can't be abandoned afterwards, since what it waits for may succeed. The db_crud
+		functions called afterwards check out a new connection.
+		:return: False if the request was already abandoned (the writes are then rolled back), True otherwise
+		"""
+		with self._lock:
+			self._released = not self._abandoned
+		self.commit()
+		if self._session is not None:
+			self._session.close()
+			self._session = None
+
+		return self._released
+
+	def abandon(self):
+		"""
+		Stop waiting for the unit of work of the request (e.g. it timed out), so that its writes are rolled back
+		instead of committed.
+		:return: True if the writes won't be committed, False if they're being committed right now or the request
+			was released (the caller must then wait for the unit of work, whose writes may succeed)
+		"""
+		with self._lock:
+			if self._committing or self._released:
+				return False
+			self._abandoned = True
+			return True
+
+	def rollback(self):
+		"""
+		Discard all the writes made during the request.
+		"""
+		if self._session is not None:
+			self._session.rollback()
+		self.has_writes = False
+
+	def close(self):
+		"""
+		Close the underlying Session, discarding any uncommitted writes, and return its connection to the pool.
+		If the session is bound to a thread at the moment, it will be closed when it is unbound.
+		"""
+		with self._lock:
+			if self._in_use:
+				self._close_on_unbind = True
+				return
+			self._close_on_unbind = False
+
+		if self._session is not None:
+			self._session.close()
+			self._session = None
+		self.has_writes = False
+
+
+class _SharedSession(object):
+	"""
+	The session handed to db_crud functions while a RequestSession is bound. It behaves like a Session, except that
+	commit() only flushes and close() does nothing, so that the RequestSession can commit once at the end.
+	"""
+
+	def __init__(self, request_session, session):
+		self._request_session = request_session
+		self._session = session
+
+	def __getattr__(self, name):
+		return getattr(self._session, name)
+
+	def commit(self):
+		self._session.flush()
+		self._request_session.has_writes = True
+
+	def rollback(self):
+		self._request_session.rollback()
+
+	def close(self):
+		pass
+
+
+def bind_request_session(request_session):
+	"""
+	Make all db_crud functions called from the current thread use the given RequestSession.
+	:param request_session: an instance of RequestSession
+	"""
+	_request_context.request_session = request_session
+
+
+def unbind_request_session():
+	"""
+	Stop using the RequestSession bound to the current thread (if any).
+	"""
+	_request_context.request_session = None
+
+
+def release_request_session():
+	"""
+	Release the RequestSession bound to the current thread, if any (see RequestSession.release).
+	:return: False if the request was abandoned, True otherwise
+	"""
+	request_session = getattr(_request_context, 'request_session', None)
+	if request_session is not None:
+		return request_session.release()
+
+	return True
+
+
+def run_unit_of_work(request_session, function, *args, **kwargs):
+	"""
+	Run a function in the current thread with the given RequestSession bound, and commit its writes if it succeeds.
+	:param request_session: the RequestSession of the request
+	:param function: the function to run (e.g. a web service), which calls db_crud functions
+	:return: the result of the function
+	"""
+	request_session.bind()
+	try:
+		result = function(*args, **kwargs)
+		request_session.commit()
+
+		return result
+	finally:
+		request_session.unbind()
+
+
+def get_session(**kwargs):
+	"""
+	Get the session to be used by a db_crud function. If a RequestSession is bound to the current thread, its shared
+	session is returned; otherwise, a new Session is created.
+	:param kwargs: the arguments for creating a new Session (e.g. expire_on_commit)
+	:return: a Session, or a _SharedSession if a RequestSession is bound
+	"""
+	request_session = getattr(_request_context, 'request_session', None)
+	if request_session is not None:
+		return request_session.get_session()
+
+	return Session(**kwargs)
+
+
+def _query_after_cursor(query, order, cursor, limit):
+	"""
+	Get a page of a list query with keyset pagination (see lib.pagination).
+	:param query: the query of the list, without ORDER BY, LIMIT or OFFSET
+	:param order: the Keyset of the list
+	:param cursor: a cursor of the Keyset, or "" for the first page
+	:param limit: the max number of rows to return
+	:return: the list of rows after the cursor
+	"""
+	cursor_filter = order.filter(cursor)
+	if cursor_filter is not None:
+		query = query.filter(cursor_filter)
+
+	return query.order_by(*order.order_by()).limit(limit).all()
+
+
 ################################### CREATE ###################################
 
 
@@ -47,7 +637,7 @@ def add_favorite_artwork(user_id, artwork_id, is_favorite):
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Get Buyer
@@ -62,12 +652,13 @@ def add_favorite_artwork(user_id, artwork_id, is_favorite):
 				first()
 
 		if follow_artwork is None and is_favorite:
-			follow_artwork(buyer_user_id=user_id, artwork_id=artwork_id, follow_artwork_status="FOLLOWING",
-			               is_favorite=True, follow_artwork_creation_time=now, follow_artwork_modification_time=now)
+			follow_artwork = Follow_Artwork(buyer_user_id=user_id, artwork_id=artwork_id,
+			                                follow_artwork_status="FOLLOWING", is_favorite=True,
+			                                follow_artwork_creation_time=now, follow_artwork_modification_time=now)
 			curr_session.add(follow_artwork)
 			curr_session.flush()
 			artwork = follow_artwork.artwork
-			artwork.artwork_followed_count += 1
+			_increment_counters(curr_session, artwork, artwork_followed_count=1)
 		elif follow_artwork is not None and follow_artwork.is_favorite != is_favorite:
 			follow_artwork.is_favorite = is_favorite
 			curr_session.add(follow_artwork)
@@ -85,6 +676,49 @@ def add_favorite_artwork(user_id, artwork_id, is_favorite):
 		curr_session.close()
 
 
+def _change_buyer_balance(curr_session, user_id, ledger_type, cash_change=0, points_change=0, condition=None,
+                          **ledger_values):
+	"""
+	Add to the cash and points of a Buyer with a single conditional UPDATE, which fails instead of leaving a negative
+	balance, so that concurrent requests of the Buyer can neither overdraw it nor lose an update. The change is
+	recorded in the Buyer_Ledger, in the same transaction.
+	:param curr_session: the session of the transaction
+	:param user_id: the user_id of the Buyer
+	:param ledger_type: the type of the Buyer_Ledger row, e.g. "BUY_COINS"
+	:param cash_change: the amount to add to the cash (negative to subtract)
+	:param points_change: the amount to add to the points (negative to subtract)
+	:param condition: an additional condition for the UPDATE, if any
+	:param ledger_values: other columns of the Buyer_Ledger row (e.g. artwork_id)
+	:return: True if the balance was changed, False if the Buyer doesn't exist, the balance is insufficient or the
+		condition is false
+	"""
+
+	buyer_table = Buyer.__table__
+	conditions = [buyer_table.c.user_id == user_id]
+	values = {}
+	for column, change in ((buyer_table.c.buyer_cash, cash_change), (buyer_table.c.buyer_points, points_change)):
+		if change:
+			values[column.key] = column + change
+			if change < 0:
+				conditions.append(column >= -change)
+	if condition is not None:
+		conditions.append(condition)
+	if not values:
+		# Still check the conditions and lock the row (e.g. for a free Critique)
+		values['buyer_points'] = buyer_table.c.buyer_points
+
+	if curr_session.execute(buyer_table.update().where(and_(*conditions)).values(values)).rowcount == 0:
+		return False
+
+	db_changes.record_change(curr_session, db_changes.RowChange("Buyer", db_changes.ACTION_UPDATE,
+	                                                            dict(user_id=user_id), set(values)))
+	curr_session.add(Buyer_Ledger(buyer_user_id=user_id, buyer_ledger_type=ledger_type,
+	                              buyer_ledger_cash_change=cash_change, buyer_ledger_points_change=points_change,
+	                              buyer_ledger_creation_time=datetime.now(), **ledger_values))
+
+	return True
+
+
 def buy_coins(user_id, coin_amount):
 	"""
 	Buyer makes a purchase of a certain amount of coins for his/her account.
@@ -95,25 +729,17 @@ def buy_coins(user_id, coin_amount):
 	:return: the amount of coins bought (0 for error)
 	"""
 
-	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
-		# Get Buyer
-		buyer = curr_session.query(Buyer). \
-			filter_by(user_id=user_id). \
-			one()
-
-		# Check that the Buyer has enough cash to buy the coins
+		# Make purchase, if the Buyer has enough cash to buy the coins
 		price = COIN_PRICES[coin_amount]
-		if buyer.buyer_cash < price:
+		if not _change_buyer_balance(curr_session, user_id, "BUY_COINS", cash_change=-price, points_change=coin_amount):
+			curr_session.query(Buyer.user_id). \
+				filter_by(user_id=user_id). \
+				one()
 			raise InsufficientFundsError()
 
-		# Make purchase
-		buyer.buyer_points = buyer.buyer_points + coin_amount
-		buyer.buyer_cash = buyer.buyer_cash - price
-
-		curr_session.add(buyer)
 		curr_session.commit()
 
 		return coin_amount
@@ -139,7 +765,7 @@ def create_buyer_user(user_email, user_password):
 	"""
 
 	now = datetime.now()
-	curr_session = Session(expire_on_commit=False)
+	curr_session = get_session(expire_on_commit=False)
 
 	try:
 		# Check e-mail address format
@@ -190,7 +816,7 @@ def create_buyer_user_facebook(fb_id, user_name, user_email, user_image):
 	"""
 
 	now = datetime.now()
-	curr_session = Session(expire_on_commit=False)
+	curr_session = get_session(expire_on_commit=False)
 
 	try:
 		# Check e-mail address format
@@ -258,7 +884,7 @@ def follow_something(user_id, type, object_id, follow):
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Get Buyer
@@ -317,19 +943,19 @@ def follow_something(user_id, type, object_id, follow):
 		if follow_object is not None:
 			if  type.lower() == 'artwork' and status.lower() != follow_object.follow_artwork_status.lower():
 				follow_object.follow_artwork_status = status
-				object_to_follow.artwork_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, artwork_followed_count=followed_count_sum)
 			elif type.lower() == 'artist' and status.lower() != follow_object.follow_artist_status.lower():
 				follow_object.follow_artist_status = status
-				object_to_follow.artist_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, artist_followed_count=followed_count_sum)
 			elif type.lower() == 'gallery' and status.lower() != follow_object.follow_gallery_status.lower():
 				follow_object.follow_gallery_status = status
-				object_to_follow.gallery_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, gallery_followed_count=followed_count_sum)
 			elif type.lower() == 'auction_house' and status.lower() != follow_object.follow_auction_status.lower():
 				follow_object.follow_auction_status = status
-				object_to_follow.auction_house_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, auction_house_followed_count=followed_count_sum)
 			elif type.lower() == 'critic' and status.lower() != follow_object.follow_critic_status.lower():
 				follow_object.follow_critic_status = status
-				object_to_follow.critic_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, critic_followed_count=followed_count_sum)
 			else:
 				return None
 
@@ -338,24 +964,24 @@ def follow_something(user_id, type, object_id, follow):
 				follow_object = follow_table(buyer_user_id=user_id, artwork_id=object_id, follow_artwork_status=status,
 				                             is_favorite=False, follow_artwork_creation_time=now,
 				                             follow_artwork_modification_time=now)
-				object_to_follow.artwork_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, artwork_followed_count=followed_count_sum)
 			elif type.lower() == 'artist':
 				follow_object = follow_table(buyer_user_id=user_id, artist_user_id=object_id, follow_artist_status=status,
 				                             follow_artist_creation_time=now, follow_artist_modification_time=now)
-				object_to_follow.artist_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, artist_followed_count=followed_count_sum)
 			elif type.lower() == 'gallery':
 				follow_object = follow_table(buyer_user_id=user_id, gallery_user_id=object_id, follow_gallery_status=status,
 				                             follow_gallery_creation_time=now, follow_gallery_modification_time=now)
-				object_to_follow.gallery_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, gallery_followed_count=followed_count_sum)
 			elif type.lower() == 'auction_house':
 				follow_object = follow_table(buyer_user_id=user_id, auction_house_user_id=object_id,
 				                             follow_auction_status=status, follow_auction_creation_time=now,
 				                             follow_auction_modification_time=now)
-				object_to_follow.auction_house_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, auction_house_followed_count=followed_count_sum)
 			elif type.lower() == 'critic':
 				follow_object = follow_table(buyer_user_id=user_id, critic_user_id=object_id, follow_critic_status=status,
 				                             follow_critic_creation_time=now, follow_critic_modification_time=now)
-				object_to_follow.critic_followed_count += followed_count_sum
+				_increment_counters(curr_session, object_to_follow, critic_followed_count=followed_count_sum)
 
 		else:
 			return None
@@ -387,7 +1013,7 @@ def like_dislike_critique(user_id, artwork_id, critic_user_id, vote_type):
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Get Buyer
@@ -457,10 +1083,33 @@ def like_dislike_critique(user_id, artwork_id, critic_user_id, vote_type):
 		curr_session.add(critique_vote)
 
 		# Increase upvote/downvote count
-		critique.critique_upvote_count += upvote_increment
-		critique.critique_downvote_count += downvote_increment
-
-		curr_session.add(critique)
+		upvote_count = counter_value(critique, "critique_upvote_count") + upvote_increment
+		_increment_counters(curr_session, critique, critique_upvote_count=upvote_increment,
+		                    critique_downvote_count=downvote_increment)
+
+		# Update the upvote count of the most popular Critique of the Artwork (sorting rule 10). With the counter buffer,
+		# it's updated when the upvotes are written instead (see write_counter_deltas), so the vote doesn't lock the
+		# Artwork row
+		if upvote_increment != 0 and not counter_buffer.enabled:
+			artwork = curr_session.query(Artwork). \
+				filter_by(artwork_id=artwork_id). \
+				one()
+			top_upvote_count = artwork.artwork_top_critique_upvote_count
+			if upvote_increment > 0 and top_upvote_count is not None:
+				top_upvote_count = max(top_upvote_count, upvote_count)
+			elif top_upvote_count is None or top_upvote_count == upvote_count - upvote_increment:
+				# The most popular Critique may have changed (or the count was never set)
+				upvote_counts = [upvote_count]
+				for other_critic_user_id, other_upvote_count in \
+						curr_session.query(Critique.critic_user_id, Critique.critique_upvote_count). \
+						filter_by(artwork_id=artwork_id). \
+						filter_by(critique_status="APPROVED"). \
+						filter(Critique.critic_user_id != critic_user_id):
+					upvote_counts.append(_overlay_counter("Critique", (artwork_id, other_critic_user_id),
+					                                      "critique_upvote_count", other_upvote_count))
+				upvote_counts = [count for count in upvote_counts if count is not None]
+				top_upvote_count = max(upvote_counts) if upvote_counts else None
+			artwork.artwork_top_critique_upvote_count = top_upvote_count
 
 		curr_session.commit()
 
@@ -478,21 +1127,22 @@ def like_dislike_critique(user_id, artwork_id, critic_user_id, vote_type):
 def make_bid(user_id, artwork_auction_id, bid_amount):
 	"""
 	A specific Buyer makes a bid on an Artwork Auction. Buyer's cash is checked, as well as starting and ending
-	time of the Artwork Auction.
-	Returns the current bid after making the bid (if successful)
+	time of the Artwork Auction. The bids are serialized per Artwork Auction by the auction engine, unless it's disabled
+	(see lib.auction_engine): the bid is then written after the request session is released, and the returned Future
+	is resolved once it's done.
 	Raises an InsufficientFundsError if Buyer does not have enough cash.
-	Raises an InexistentResourceError if Artwork Auction hasn't started or is already finished.
-	Raises an UnauthorizedError if bid_amount is lower than minimum bid or lower than previous bid.
-	Raises an UnauthorizedError if bid_amount is not a multiple of bid increment.
+	Raises (or the Future raises) an InexistentResourceError if Artwork Auction hasn't started or is already finished.
+	Raises (or the Future raises) an UnauthorizedError if bid_amount is lower than minimum bid or lower than previous
+	bid, or if bid_amount is not a multiple of bid increment.
 	:param user_id: the user_id of the Buyer making the bid
 	:param artwork_auction_id: the id of the Artwork Auction
 	:param bid_amount: the total bid amount made by the user
-	:return: the current bid value after making the bid (if successful)
+	:return: a concurrent.futures.Future with the current bid value before making the bid (if successful)
 	"""
 
 	now = datetime.now()
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Get Buyer
@@ -500,6 +1150,17 @@ def make_bid(user_id, artwork_auction_id, bid_amount):
 			filter_by(user_id=user_id). \
 			one()
 
+		if auction_engine.enabled:
+			# Check that the Buyer has enough cash to make a bid
+			if buyer.buyer_cash < bid_amount:
+				raise InsufficientFundsError()
+
+			# The auction engine checks the Artwork Auction and the bid amount, and writes the bid in its own
+			# transaction. The request doesn't need its connection while it waits
+			if not release_request_session():
+				raise ServerBusyError()  # The request timed out, the client won't see the bid
+			return auction_engine.submit(artwork_auction_id, user_id, bid_amount, now)
+
 		# Get Artwork Auction
 		artwork_auction = curr_session.query(Artwork_Auction). \
 				filter_by(artwork_auction_id=artwork_auction_id). \
@@ -514,10 +1175,7 @@ def make_bid(user_id, artwork_auction_id, bid_amount):
 			raise InsufficientFundsError()
 
 		# Check that the Buyer's bid_amount is higher than minimum_bid and higher than previous bid
-		if artwork_auction.current_bid is None:
-			current_bid_amount = 0
-		else:
-			current_bid_amount = artwork_auction.current_bid.artwork_auction_bid_amount
+		current_bid_amount = artwork_auction.artwork_auction_max_bid or 0
 
 		if bid_amount <= current_bid_amount:
 			raise UnauthorizedError()
@@ -536,13 +1194,17 @@ def make_bid(user_id, artwork_auction_id, bid_amount):
 		curr_session.add(artwork_auction_bid)
 		curr_session.flush()
 
-		# Update current bid in Artwork Auction
+		# Update current bid, bid count and max bid in Artwork Auction
 		artwork_auction.artwork_auction_current_bid = artwork_auction_bid.artwork_auction_bid_id
+		artwork_auction.artwork_auction_bid_count = (artwork_auction.artwork_auction_bid_count or 0) + 1
+		artwork_auction.artwork_auction_max_bid = bid_amount
 		curr_session.add(artwork_auction)
 
 		curr_session.commit()
 
-		return current_bid_amount
+		result = Future()
+		result.set_result(current_bid_amount)
+		return result
 	except NoResultFound, e:
 		curr_session.rollback()
 		raise InexistentResourceError()
@@ -553,6 +1215,115 @@ def make_bid(user_id, artwork_auction_id, bid_amount):
 		curr_session.close()
 
 
+def get_live_auction(artwork_auction_id):
+	"""
+	Load the state of an Artwork Auction for the auction engine (see lib.auction_engine). It's read from the primary
+	database, since the bids are validated against it.
+	:param artwork_auction_id: the id of the Artwork Auction
+	:return: a dictionary with the columns of the Artwork Auction, or None if it doesn't exist
+	"""
+
+	curr_session = Session()
+
+	try:
+		artwork_auction = curr_session.query(Artwork_Auction). \
+			filter_by(artwork_auction_id=artwork_auction_id). \
+			first()
+		if artwork_auction is None:
+			return None
+
+		return dict((column.key, getattr(artwork_auction, column.key)) for column in Artwork_Auction.__table__.columns)
+	finally:
+		curr_session.close()
+
+
+def _update_top_critique_upvote_counts(curr_session, artwork_ids):
+	"""
+	Set the upvote count of the most popular APPROVED Critique of some Artwork (sorting rule 10) from their Critiques.
+	:param curr_session: the session of the transaction
+	:param artwork_ids: a list of artwork_id
+	"""
+
+	artwork_table = Artwork.__table__
+	critique_table = Critique.__table__
+	top_upvote_count = select([func.max(critique_table.c.critique_upvote_count)]). \
+		where(and_(critique_table.c.artwork_id == artwork_table.c.artwork_id,
+		           critique_table.c.critique_status == "APPROVED")). \
+		as_scalar()
+	curr_session.execute(artwork_table.update().
+	                     where(artwork_table.c.artwork_id.in_(artwork_ids)).
+	                     values(artwork_top_critique_upvote_count=top_upvote_count))
+
+	# Publish the new counts (e.g. for the materialized feed of sorting rule 10)
+	for artwork_id, top_upvote_count in curr_session.query(Artwork.artwork_id,
+	                                                       Artwork.artwork_top_critique_upvote_count). \
+			filter(Artwork.artwork_id.in_(artwork_ids)):
+		db_changes.record_change(curr_session, db_changes.RowChange(
+			"Artwork", db_changes.ACTION_UPDATE,
+			dict(artwork_id=artwork_id, artwork_top_critique_upvote_count=top_upvote_count),
+			set(['artwork_top_critique_upvote_count'])))
+
+
+def write_auction_bids(auction, bids):
+	"""
+	Insert the bids accepted by the auction engine (see lib.auction_engine) on an Artwork Auction, and make the last
+	one its current bid, in a single transaction. Nothing is written if the current bid of the Artwork Auction is no
+	longer the one the bids were validated against (i.e. another process made a bid).
+	:param auction: the state of the Artwork Auction (see get_live_auction)
+	:param bids: a list of (user_id, bid amount, bid time), in order
+	:return: the new state of the Artwork Auction, or None if the current bid changed
+	"""
+
+	now = datetime.now()
+	artwork_auction_id = auction['artwork_auction_id']
+	auction_table = Artwork_Auction.__table__
+	current_bid = auction['artwork_auction_current_bid']
+	curr_session = Session()
+
+	try:
+		# Lock the Artwork Auction first, if it still has the expected current bid (the bids reference it)
+		if current_bid is None:
+			current_bid_condition = auction_table.c.artwork_auction_current_bid.is_(None)
+		else:
+			current_bid_condition = auction_table.c.artwork_auction_current_bid == current_bid
+		if curr_session.execute(auction_table.update().
+		                        where(and_(auction_table.c.artwork_auction_id == artwork_auction_id,
+		                                   current_bid_condition)).
+		                        values(artwork_auction_modification_time=now)).rowcount == 0:
+			curr_session.rollback()
+			return None
+
+		artwork_auction_bids = [Artwork_Auction_Bid(artwork_auction_id=artwork_auction_id, buyer_user_id=user_id,
+		                                            artwork_auction_bid_amount=bid_amount,
+		                                            artwork_auction_bid_creation_time=bid_time)
+		                        for user_id, bid_amount, bid_time in bids]
+		curr_session.add_all(artwork_auction_bids)
+		curr_session.flush()
+
+		# Update current bid, bid count and max bid in Artwork Auction (the count can't have changed, since the
+		# current bid didn't)
+		bid_values = dict(artwork_auction_current_bid=artwork_auction_bids[-1].artwork_auction_bid_id,
+		                  artwork_auction_bid_count=(auction['artwork_auction_bid_count'] or 0) + len(bids),
+		                  artwork_auction_max_bid=artwork_auction_bids[-1].artwork_auction_bid_amount)
+		curr_session.execute(auction_table.update().
+		                     where(auction_table.c.artwork_auction_id == artwork_auction_id).
+		                     values(bid_values))
+
+		auction = dict(auction, artwork_auction_modification_time=now, **bid_values)
+		db_changes.record_change(curr_session, db_changes.RowChange(
+			"Artwork_Auction", db_changes.ACTION_UPDATE, dict(auction),
+			set(bid_values) | set(['artwork_auction_modification_time'])))
+
+		curr_session.commit()
+
+		return auction
+	except Exception, e:
+		curr_session.rollback()
+		raise e
+	finally:
+		curr_session.close()
+
+
 def purchase_critique(user_id, artwork_id, critic_user_id):
 	"""
 	A specific Buyer buys a Critique using his/her points.
@@ -564,14 +1335,9 @@ def purchase_critique(user_id, artwork_id, critic_user_id):
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
-		# Get Buyer
-		buyer = curr_session.query(Buyer). \
-			filter_by(user_id=user_id). \
-			one()
-
 		# Get Critique
 		critique = curr_session.query(Critique). \
 				filter_by(artwork_id=artwork_id). \
@@ -582,28 +1348,32 @@ def purchase_critique(user_id, artwork_id, critic_user_id):
 		if critique.critique_status.lower() != "approved":
 			raise UnauthorizedError()
 
-		# Check if Buyer already bought this Critique
-		critique_purchase = curr_session.query(Critique_Purchase). \
+		# Subtract user points, unless the Buyer already bought this Critique. The check is part of the UPDATE, which
+		# locks the Buyer row, so that concurrent requests can't buy the same Critique twice
+		purchase_table = Critique_Purchase.__table__
+		not_purchased = ~exists().where(and_(purchase_table.c.artwork_id == artwork_id,
+		                                     purchase_table.c.critic_user_id == critic_user_id,
+		                                     purchase_table.c.buyer_user_id == user_id))
+		if not _change_buyer_balance(curr_session, user_id, "PURCHASE_CRITIQUE",
+		                             points_change=-(critique.critique_point_price or 0), condition=not_purchased,
+		                             artwork_id=artwork_id, critic_user_id=critic_user_id):
+			# Find out why
+			critique_purchase = curr_session.query(Critique_Purchase.critique_purchase_id). \
 				filter_by(artwork_id=artwork_id). \
 				filter_by(critic_user_id=critic_user_id). \
 				filter_by(buyer_user_id=user_id). \
 				first()
-		if critique_purchase is not None:
-			return critique
-
-		# Check that the Buyer has enough points to buy the Critique
-		if buyer.buyer_points < critique.critique_point_price:
+			if critique_purchase is not None:
+				return critique
+			curr_session.query(Buyer.user_id). \
+				filter_by(user_id=user_id). \
+				one()
 			raise InsufficientFundsError()
 
 		# Make Critique Purchase
 		critique_purchase = Critique_Purchase(artwork_id=artwork_id, critic_user_id=critic_user_id,
 		                                      buyer_user_id=user_id, critique_purchase_creation_time=now)
 		curr_session.add(critique_purchase)
-		curr_session.flush()
-
-		# Subtract user points
-		buyer.buyer_points = buyer.buyer_points - critique.critique_point_price
-		curr_session.add(buyer)
 
 		curr_session.commit()
 
@@ -628,7 +1398,7 @@ def artist_is_followed(user_id, artist_id):
 	:return True if the Artist is being followed by this Buyer, False otherwise
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		follow_artist = curr_session.query(Follow_Artist). \
@@ -658,7 +1428,7 @@ def artwork_is_followed(user_id, artwork_id):
 	:return True if the Artwork is being followed by this Buyer, False otherwise
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		follow_artwork = curr_session.query(Follow_Artwork). \
@@ -688,7 +1458,7 @@ def auction_house_is_followed(user_id, auction_house_id):
 	:return True if the Auction House is being followed by this Buyer, False otherwise
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		follow_auction_house = curr_session.query(Follow_Auction). \
@@ -718,7 +1488,7 @@ def gallery_is_followed(user_id, gallery_id):
 	:return True if the Gallery is being followed by this Buyer, False otherwise
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		follow_gallery = curr_session.query(Follow_Gallery). \
@@ -749,7 +1519,7 @@ def critique_purchased(buyer_user_id, artwork_id, critic_user_id):
 	:return: True if the Critique has been bought, False otherwise
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		critique_purchase = curr_session.query(Critique_Purchase). \
@@ -769,6 +1539,38 @@ def critique_purchased(buyer_user_id, artwork_id, critic_user_id):
 		curr_session.close()
 
 
+def critiques_purchased(buyer_user_id, critique_keys):
+	"""
+	Which of the given Critiques have been purchased by this Buyer, using a single query
+	:param buyer_user_id: the id of the Buyer
+	:param critique_keys: an iterable with the (artwork_id, critic_user_id) keys of the Critiques to check
+	:return: a set with the keys of the Critiques bought by this Buyer
+	"""
+
+	critique_keys = set(critique_keys)
+	if buyer_user_id is None or not critique_keys:
+		return set()
+
+	curr_session = get_session()
+	try:
+
+		purchased_keys = set()
+		for artwork_id, critic_user_id in \
+				curr_session.query(Critique_Purchase.artwork_id, Critique_Purchase.critic_user_id). \
+				filter_by(buyer_user_id=buyer_user_id). \
+				filter(Critique_Purchase.artwork_id.in_(set(key[0] for key in critique_keys))). \
+				filter(Critique_Purchase.critic_user_id.in_(set(key[1] for key in critique_keys))). \
+				all():
+			if (artwork_id, critic_user_id) in critique_keys:
+				purchased_keys.add((artwork_id, critic_user_id))
+
+		return purchased_keys
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
 def get_artist(user_id):
 	"""
 	Get an instance of an Artist given his/her user_id, together with his/her Image
@@ -776,7 +1578,7 @@ def get_artist(user_id):
 	:return an instance of Artist, an instance of Image
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		artist = curr_session.query(Artist). \
@@ -798,6 +1600,35 @@ def get_artist(user_id):
 		curr_session.close()
 
 
+@read_from_replica
+def get_artists(user_ids):
+	"""
+	Get several Artists at once given their user_ids, together with their Images, using a single query
+	:param user_ids: an iterable with the Artists' user_ids
+	:return a dictionary with an (instance of Artist, instance of Image) tuple per user_id found
+	"""
+
+	user_ids = set(user_ids)
+	if not user_ids:
+		return {}
+
+	curr_session = get_session()
+	try:
+
+		artist_dictionary = {}
+		for artist, image in curr_session.query(Artist, Image). \
+				outerjoin(Image, Image.image_id == Artist.image_id). \
+				filter(Artist.user_id.in_(user_ids)). \
+				all():
+			artist_dictionary[artist.user_id] = (artist, image)
+
+		return artist_dictionary
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
 def get_artist_followers(artist_id, limit=0, offset=0):
 	"""
 	Get the followers (list of Buyer) of this Artist.
@@ -807,7 +1638,7 @@ def get_artist_followers(artist_id, limit=0, offset=0):
 	:return: a list of Buyer
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check limit
@@ -840,16 +1671,18 @@ def get_artist_followers(artist_id, limit=0, offset=0):
 		curr_session.close()
 
 
-def get_artist_list(limit=0, offset=0, randomize=False):
+@read_from_replica
+def get_artist_list(limit=0, offset=0, randomize=False, cursor=None):
 	"""
 	A list of all Artists in alphabetical order.
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
-	:param randomize: whether to randomize the list or not
+	:param randomize: whether to randomize the list or not (not supported with a cursor)
+	:param cursor: a cursor of ARTIST_LIST_ORDER ("" for the first page) to use instead of offset
 	return: a list of Artists
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 
@@ -863,11 +1696,17 @@ def get_artist_list(limit=0, offset=0, randomize=False):
 		else:
 			order_by = Artist.artist_nickname.asc()
 
-		artist_list = curr_session.query(Artist). \
-			order_by(order_by). \
-			limit(limit). \
-			offset(offset). \
-			all()
+		if cursor is not None:
+			# Only ACTIVE Artists, so that the last row of the page is the position of the next cursor
+			artist_list = _query_after_cursor(curr_session.query(Artist).join(Artist.user).
+			                                  filter(func.lower(User.user_status) == "active"),
+			                                  ARTIST_LIST_ORDER, cursor, limit)
+		else:
+			artist_list = curr_session.query(Artist). \
+				order_by(order_by). \
+				limit(limit). \
+				offset(offset). \
+				all()
 
 		# Check that Artists are ACTIVE
 		artist_list[:] = [artist for artist in artist_list if artist.user.user_status.lower() == "active"]
@@ -885,6 +1724,37 @@ def get_artist_list(limit=0, offset=0, randomize=False):
 		curr_session.close()
 
 
+def get_artist_page_versions(artist_id, user_id):
+	"""
+	Get the versions of the entities shown in the fan page of an Artist (see lib.entity_versions).
+	:param artist_id: the id of the Artist
+	:param user_id: the user_id of the requesting User
+	:return: a dictionary {(entity_type, entity_id): version}
+	"""
+
+	curr_session = get_session()
+
+	try:
+
+		artwork_rows = curr_session.query(Artwork.artwork_id, Artwork.owner_buyer_user_id,
+		                                  Artwork.owner_gallery_user_id, Artwork.owner_auction_house_user_id,
+		                                  Artwork.owner_artist_user_id). \
+			filter_by(artist_user_id=artist_id). \
+			all()
+
+		keys = [entity_versions.GLOBAL_KEY, (entity_versions.PROFILE, artist_id), (entity_versions.USER, user_id)]
+		for artwork_id, buyer_id, gallery_id, auction_house_id, owner_artist_id in artwork_rows:
+			keys.append((entity_versions.ARTWORK, artwork_id))
+			keys.extend((entity_versions.PROFILE, owner_id)
+			            for owner_id in (buyer_id, gallery_id, auction_house_id, owner_artist_id) if owner_id is not None)
+
+		return get_entity_versions(keys)
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
 def get_artwork(artwork_id):
 	"""
 	Get an instance of an Artwork given its artwork_id, together with its Images
@@ -892,7 +1762,7 @@ def get_artwork(artwork_id):
 	:return an instance of Artwork, a list of Images
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		artwork = curr_session.query(Artwork). \
@@ -932,7 +1802,7 @@ def get_artwork_auction(artwork_id, artwork_auction_id=None):
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		if artwork_auction_id is None:
@@ -947,10 +1817,9 @@ def get_artwork_auction(artwork_id, artwork_auction_id=None):
 				filter_by(artwork_auction_id=artwork_auction_id). \
 				one()
 
-		# Touch related objects
+		# Touch related objects (the bid count and max bid are columns of the Artwork Auction)
 		if artwork_auction is not None:
 			current_bid = artwork_auction.current_bid
-			all_bids = artwork_auction.artwork_auction_bids
 			if current_bid is not None:
 				high_bidder = current_bid.buyer
 				if high_bidder is not None:
@@ -967,6 +1836,79 @@ def get_artwork_auction(artwork_id, artwork_auction_id=None):
 		curr_session.close()
 
 
+def get_auction_current_bids(artwork_auction_ids):
+	"""
+	Get the current bids of some Artwork Auctions, for the polls of the watched auctions (see lib.auction_events).
+	:param artwork_auction_ids: a list of artwork_auction_id
+	:return: a dictionary {artwork_auction_id: artwork_auction_current_bid} of the existing Artwork Auctions
+	"""
+
+	curr_session = Session()
+
+	try:
+		return dict(curr_session.query(Artwork_Auction.artwork_auction_id,
+		                               Artwork_Auction.artwork_auction_current_bid).
+		            filter(Artwork_Auction.artwork_auction_id.in_(artwork_auction_ids)).
+		            all())
+	finally:
+		curr_session.close()
+
+
+def get_auction_states(artwork_auction_ids):
+	"""
+	Get the current bid, high bidder and bid count of some Artwork Auctions, for the clients watching them (see
+	lib.auction_events).
+	:param artwork_auction_ids: a list of artwork_auction_id
+	:return: a dictionary {artwork_auction_id: state} of the existing Artwork Auctions, where the state is a dictionary
+		with the "artwork_auction_id", "bid_id", "current_bid", "high_bidder_user_id", "high_bidder_name" and
+		"bid_count"
+	"""
+
+	curr_session = Session()
+
+	try:
+		states = {}
+		for artwork_auction_id, bid_id, bid_amount, bid_count, buyer_user_id, buyer_nickname in \
+				curr_session.query(Artwork_Auction.artwork_auction_id, Artwork_Auction.artwork_auction_current_bid,
+				                   Artwork_Auction.artwork_auction_max_bid, Artwork_Auction.artwork_auction_bid_count,
+				                   Buyer.user_id, Buyer.buyer_nickname). \
+						outerjoin(Artwork_Auction_Bid, Artwork_Auction_Bid.artwork_auction_bid_id ==
+						          Artwork_Auction.artwork_auction_current_bid). \
+						outerjoin(Buyer, Buyer.user_id == Artwork_Auction_Bid.buyer_user_id). \
+						filter(Artwork_Auction.artwork_auction_id.in_(artwork_auction_ids)). \
+						all():
+			states[artwork_auction_id] = dict(artwork_auction_id=artwork_auction_id, bid_id=bid_id,
+			                                  current_bid=bid_amount if bid_amount is not None else 0,
+			                                  high_bidder_user_id=buyer_user_id, high_bidder_name=buyer_nickname,
+			                                  bid_count=bid_count or 0)
+
+		return states
+	finally:
+		curr_session.close()
+
+
+@read_from_replica
+def get_auction_bid_history(artwork_auction_id, limit, cursor=""):
+	"""
+	A page of the bids on an Artwork Auction, newest first. A page costs the same at any depth (the bids are read from
+	the index of their Artwork Auction, which ends with the bid id).
+	:param artwork_auction_id: the id of the Artwork Auction
+	:param limit: the max number of bids to return
+	:param cursor: a cursor of AUCTION_BID_HISTORY_ORDER, "" for the first page
+	:return: a list of Artwork_Auction_Bid, with their Buyer
+	"""
+
+	curr_session = get_session()
+
+	try:
+		return _query_after_cursor(curr_session.query(Artwork_Auction_Bid).
+		                           options(joinedload(Artwork_Auction_Bid.buyer)).
+		                           filter(Artwork_Auction_Bid.artwork_auction_id == artwork_auction_id),
+		                           AUCTION_BID_HISTORY_ORDER, cursor, limit)
+	finally:
+		curr_session.close()
+
+
 def get_artwork_auction_list(user_id, sorting_rule):
 	"""
 	A list of Artwork Auction in which the given Buyer is participating
@@ -978,7 +1920,7 @@ def get_artwork_auction_list(user_id, sorting_rule):
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	# TODO: Check sorting rule
 	try:
@@ -1005,9 +1947,8 @@ def get_artwork_auction_list(user_id, sorting_rule):
 					image = artwork_image.image
 				artist = artwork.artist
 
-				# Bids
+				# Current bid (the bid count and max bid are columns of the Artwork Auction)
 				current_bid = artwork_auction.current_bid
-				all_bids = artwork_auction.artwork_auction_bids
 				if current_bid is not None:
 					high_bidder = current_bid.buyer
 					if high_bidder is not None:
@@ -1022,6 +1963,7 @@ def get_artwork_auction_list(user_id, sorting_rule):
 		curr_session.close()
 
 
+@read_from_replica
 def get_artwork_list_from_label(label_id, limit=0, offset=0):
 	"""
 	A list of Artwork belonging to the given Label.
@@ -1032,7 +1974,7 @@ def get_artwork_list_from_label(label_id, limit=0, offset=0):
 	return: a list of Artwork
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	# Check limit
 	if limit == 0:
@@ -1063,12 +2005,13 @@ def get_artwork_list_from_label(label_id, limit=0, offset=0):
 		curr_session.close()
 
 
-def get_artwork_list(sorting_rule, artist_id=None, limit=0, offset=0, user_id=None, location=None):
+@read_from_replica
+def get_artwork_list(sorting_rule, artist_id=None, limit=0, offset=0, user_id=None, location=None, cursor=None):
 	"""
 	A list of Artwork, together with each corresponding ArtworkImages in a dictionary, sorted by one of several rules.
 	The artist_id can also be given to return the Artwork of a single Artist.
 	Only the Artwork with artwork_status = "AVAILABLE" will be returned.
-	:param sorting_rule: the rule to sort by, below are the possible rules:
+	:param sorting_rule: the rule to sort by, below are the possible rules (see ARTWORK_LIST_ORDERS):
 		1: most popular Artwork
 		2: my watched Critics
 		3: my watched Artists
@@ -1083,43 +2026,25 @@ def get_artwork_list(sorting_rule, artist_id=None, limit=0, offset=0, user_id=No
 	:param limit: the max number of rows to return (0 for no limit), default=0
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11, default=0
 	:param user_id: the user_id of the requesting User
-	:param location: "lat,long" (optional) e.g. 24.971059,121.241765
+	:param location: "lat,long" (optional) e.g. 24.971059,121.241765. With sorting_rule=5, only the Artwork owned by
+		the Galleries and Auction Houses within NEARBY_RADIUS_KM are returned, the nearest first
+	:param cursor: a cursor of get_artwork_list_order() ("" for the first page) to use instead of offset
 	return: a list of sorted Artwork, a dictionary with ArtworkImages per Artwork
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check sorting_rule
-		filter_by = None
-		order_by2 = None
-		if sorting_rule == 1:
-			order_by1 = Artwork.artwork_followed_count.desc()
-			order_by2 = Artwork.artwork_display_weight.desc()
-		elif sorting_rule == 2:
-			filter_by = None  # TODO: change to only show those followed by my watched Critics
-			order_by1 = Artwork.artwork_display_weight.desc()
-		elif sorting_rule == 3:
-			filter_by = None  # TODO: change to only show those followed by my watched Artists
-			order_by1 = Artwork.artwork_display_weight.desc()
-		elif sorting_rule == 4:
-			filter_by = None  # TODO: change to only show those followed by my watched Artwork
-			order_by1 = Artwork.artwork_display_weight.desc()
-		elif sorting_rule == 5:
-			order_by1 = Artwork.artwork_display_weight.desc()  # TODO: Change for location proximity
-		elif sorting_rule == 6:
-			order_by1 = Artwork.artwork_creation_time.desc()
-		elif sorting_rule == 7:
-			order_by1 = Artwork.artwork_critique_count.desc()
-			order_by2 = Artwork.artwork_display_weight.desc()
-		elif sorting_rule == 8:
-			order_by1 = Artwork.artwork_display_weight.desc()  # TODO: Change for highest to lowest price
-		elif sorting_rule == 9:
-			order_by1 = Artwork.artwork_display_weight.desc()  # TODO: Change for lowest to highest price
-		elif sorting_rule == 10:
-			order_by1 = Artwork.artwork_display_weight.desc()  # TODO: Change for most popular critique
+		if sorting_rule not in ARTWORK_LIST_ORDERS:
+			raise WrongArgumentValueError('sorting_rule')
+		order = ARTWORK_LIST_ORDERS[sorting_rule]
+		watched = sorting_rule in (2, 3, 4) and artist_id is None and follow_graph.enabled and \
+			feed_materializer.enabled
+		if sorting_rule in (2, 3, 4) and not watched:
+			filter_by = _get_watched_filter(curr_session, sorting_rule, user_id)
 		else:
-			raise WrongArgumentValueError()
+			filter_by = None
 
 		# Check artist_id
 		if artist_id is not None:
@@ -1131,102 +2056,355 @@ def get_artwork_list(sorting_rule, artist_id=None, limit=0, offset=0, user_id=No
 		if limit == 0:
 			limit = sys.maxint
 
-		if filter_by is None:
+		nearby = artist_id is None and get_artwork_list_order(sorting_rule, location) is NEARBY_ARTWORK_ORDER
+		materialized = feed_materializer.serves(sorting_rule)
+		if nearby:
+			artwork_list = _get_nearby_artwork_list(curr_session, location, limit, offset,
+			                                        NEARBY_ARTWORK_ORDER.decode(cursor) if cursor is not None else None)
+		elif watched:
+			# Select and rank the watched Artwork in memory, without joining the Follow tables
+			artwork_ids = _get_watched_artwork_ids(sorting_rule, user_id, limit, offset,
+			                                       order.decode(cursor) if cursor is not None else None)
+			artwork_list = _get_artworks_in_order(curr_session, artwork_ids)
+		elif materialized:
+			# Slice the materialized feed, so that the cost doesn't depend on the offset
+			artwork_ids = feed_materializer.get_page(sorting_rule, limit, offset,
+			                                         order.decode(cursor) if cursor is not None else None, artist_id)
+			artwork_list = _get_artworks_in_order(curr_session, artwork_ids)
+		elif cursor is not None:
+			# Start right after the cursor, so that the cost doesn't depend on the depth of the page
+			artwork_query = curr_session.query(Artwork). \
+				filter(artist_filter). \
+				filter_by(artwork_status="AVAILABLE")
+			if filter_by is not None:
+				artwork_query = artwork_query.filter(filter_by)
+			artwork_list = _query_after_cursor(artwork_query, order, cursor, limit)
+		elif filter_by is None:
 			artwork_list = curr_session.query(Artwork). \
 				filter(artist_filter). \
 				filter_by(artwork_status="AVAILABLE"). \
-				order_by(order_by1, order_by2). \
+				order_by(*order.order_by(unique=False)). \
 				limit(limit). \
 				offset(offset). \
 				all()
 		else:
 			artwork_list = curr_session.query(Artwork). \
 				filter(artist_filter). \
-				filter_by(filter_by). \
+				filter(filter_by). \
 				filter_by(artwork_status="AVAILABLE"). \
-				order_by(order_by1, order_by2). \
+				order_by(*order.order_by(unique=False)). \
 				limit(limit). \
 				offset(offset). \
 				all()
 
 		# If empty, just get all the Artwork, ordered by popularity (sorting_rule=1)
-		if not artwork_list:
+		# (a materialized feed already contains all the AVAILABLE Artwork, so the fallback would be empty too, and the
+		# pages of a cursor must all follow the same order)
+		if not artwork_list and not materialized and cursor is None:
 			artwork_list = curr_session.query(Artwork). \
 				filter(artist_filter). \
 				filter_by(artwork_status="AVAILABLE"). \
-				order_by(Artwork.artwork_followed_count.desc(), Artwork.artwork_display_weight.desc()). \
+				order_by(*ARTWORK_LIST_ORDERS[1].order_by(unique=False)). \
 				limit(limit). \
 				offset(offset). \
 				all()
 
-		# Load Images per Artwork
-		artwork_image_dictionary = {}
-		for artwork in artwork_list:
-			images = []
-			for image, artwork_images in curr_session.query(Image, Artwork_Image). \
-					filter(and_(Image.image_id == Artwork_Image.image_id,
-			               Artwork_Image.artwork_id == artwork.artwork_id)). \
-					all():
-				images.append(image)
-			artwork_image_dictionary[artwork] = images
+		# Load Images for all Artwork in a single query
+		artwork_image_dictionary = _load_artwork_images(curr_session, artwork_list)
+
+		curr_session.close()
+
+		return artwork_list, artwork_image_dictionary
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
+def _get_watched_artwork_ids(sorting_rule, user_id, limit, offset=0, after=None):
+	"""
+	Get a page of the Artwork watched by a Buyer (sorting rules 2, 3 and 4 of get_artwork_list) from the follow graph,
+	ranked by the feed materializer.
+	:param sorting_rule: 2 (my watched Critics), 3 (my watched Artists) or 4 (my watched Artwork)
+	:param user_id: the user_id of the Buyer, None for an anonymous User (who watches nothing)
+	:param limit: the max number of Artwork to return
+	:param offset: the position of the first Artwork in the list
+	:param after: the values of a cursor of ARTWORK_LIST_ORDERS[sorting_rule]; if given, the page starts after that
+		Artwork and offset is ignored
+	:return: a list of artwork_id
+	"""
+
+	if user_id is None:
+		return []
+
+	# The follows of the Buyer may have been written by another process
+	follow_graph.sync_buyer(user_id, get_user_version(user_id))
+
+	if sorting_rule == 2:
+		return feed_materializer.get_selection_page(limit, offset, after,
+		                                            artwork_ids=follow_graph.get_critiqued_by_followed(user_id))
+	elif sorting_rule == 3:
+		return feed_materializer.get_selection_page(limit, offset, after,
+		                                            artist_ids=follow_graph.get_following("ARTIST", user_id))
+	else:
+		return feed_materializer.get_selection_page(limit, offset, after,
+		                                            artwork_ids=follow_graph.get_following("ARTWORK", user_id))
+
+
+def _get_watched_filter(curr_session, sorting_rule, user_id):
+	"""
+	Get the SQL condition that selects the Artwork watched by a Buyer (sorting rules 2, 3 and 4 of get_artwork_list),
+	for when the follow graph is not materialized.
+	:param curr_session: the session used to build the subqueries
+	:param sorting_rule: 2 (my watched Critics), 3 (my watched Artists) or 4 (my watched Artwork)
+	:param user_id: the user_id of the Buyer, None for an anonymous User (who watches nothing)
+	:return: a condition on Artwork
+	"""
+
+	if sorting_rule == 2:
+		followed_critics = curr_session.query(Follow_Critic.critic_user_id). \
+			filter(Follow_Critic.buyer_user_id == user_id). \
+			filter(func.lower(Follow_Critic.follow_critic_status) == "following")
+		critiqued_artwork = curr_session.query(Critique.artwork_id). \
+			filter(Critique.critic_user_id.in_(followed_critics.subquery())). \
+			filter(func.lower(Critique.critique_status) == "approved")
+		return Artwork.artwork_id.in_(critiqued_artwork.subquery())
+	elif sorting_rule == 3:
+		followed_artists = curr_session.query(Follow_Artist.artist_user_id). \
+			filter(Follow_Artist.buyer_user_id == user_id). \
+			filter(func.lower(Follow_Artist.follow_artist_status) == "following")
+		return Artwork.artist_user_id.in_(followed_artists.subquery())
+	else:
+		followed_artwork = curr_session.query(Follow_Artwork.artwork_id). \
+			filter(Follow_Artwork.buyer_user_id == user_id). \
+			filter(func.lower(Follow_Artwork.follow_artwork_status) == "following")
+		return Artwork.artwork_id.in_(followed_artwork.subquery())
+
+
+def get_artwork_list_order(sorting_rule, location=None):
+	"""
+	Get the order of the cursors of get_artwork_list.
+	:param sorting_rule: the sorting rule of the list
+	:param location: the location of the list, if any
+	:return: a Keyset
+	"""
+	if sorting_rule == 5 and location is not None and geo_index.enabled:
+		return NEARBY_ARTWORK_ORDER
+
+	return ARTWORK_LIST_ORDERS[sorting_rule]
+
+
+def _get_nearby_artwork_list(curr_session, location, limit, offset=0, after=None):
+	"""
+	Get a page of the AVAILABLE Artwork owned by the Galleries and Auction Houses near a location, sorted by the
+	distance of their owner, then by display weight (see NEARBY_ARTWORK_ORDER). The venues are found in the geo index,
+	nearest first, and their Artwork are loaded in batches until the page is full.
+	:param curr_session: the session used to run the queries
+	:param location: "lat,long" e.g. 24.971059,121.241765
+	:param limit: the max number of Artwork to return
+	:param offset: the position of the first Artwork in the list
+	:param after: the values of a cursor of NEARBY_ARTWORK_ORDER; if given, the page starts after that Artwork and
+		offset is ignored
+	:return: a list of Artwork
+	"""
+
+	coordinates = parse_geolocation(location)
+	if coordinates is None:
+		raise WrongArgumentValueError('location')
+	latitude, longitude = coordinates
+
+	venues = geo_index.nearest(latitude, longitude, radius=settings['NEARBY_RADIUS_KM'])
+
+	after_key = None
+	if after is not None:
+		if after['owner_gallery_user_id'] is not None:
+			venue_key = ("GALLERY", after['owner_gallery_user_id'])
+		else:
+			venue_key = ("AUCTION_HOUSE", after['owner_auction_house_user_id'])
+		distance = geo_index.distance(venue_key, latitude, longitude)
+		if distance is None:
+			raise WrongArgumentValueError('cursor')
+
+		after_key = _nearby_sort_key(distance, after['artwork_display_weight'], after['artwork_id'])
+		venues = venues[bisect.bisect_left([venue_distance for venue_distance, venue in venues], distance):]
+		offset = 0
+
+	artwork_list = []
+	start = 0
+	while start < len(venues) and len(artwork_list) < offset + limit:
+		# Keep the venues at the same distance in the same batch, since their Artwork are sorted together
+		end = min(start + _NEARBY_VENUE_BATCH, len(venues))
+		while end < len(venues) and venues[end][0] == venues[end - 1][0]:
+			end += 1
+		distances = dict((venue_key, distance) for distance, venue_key in venues[start:end])
+		start = end
+
+		# The owner of an Artwork is its first owner column set (see lib.owner_directory.owner_key)
+		gallery_ids = [user_id for owner_type, user_id in distances if owner_type == "GALLERY"]
+		auction_house_ids = [user_id for owner_type, user_id in distances if owner_type == "AUCTION_HOUSE"]
+		venue_filters = []
+		if gallery_ids:
+			venue_filters.append(Artwork.owner_gallery_user_id.in_(gallery_ids))
+		if auction_house_ids:
+			venue_filters.append(and_(Artwork.owner_gallery_user_id.is_(None),
+			                          Artwork.owner_auction_house_user_id.in_(auction_house_ids)))
+
+		batch = []
+		for artwork in curr_session.query(Artwork). \
+				filter(Artwork.owner_buyer_user_id.is_(None)). \
+				filter(or_(*venue_filters)). \
+				filter_by(artwork_status="AVAILABLE"):
+			sort_key = _nearby_sort_key(distances[owner_key(artwork)], artwork.artwork_display_weight,
+			                            artwork.artwork_id)
+			if after_key is None or sort_key > after_key:
+				batch.append((sort_key, artwork))
+
+		batch.sort(key=lambda (sort_key, artwork): sort_key)
+		artwork_list.extend(artwork for sort_key, artwork in batch)
+
+	return artwork_list[offset:offset + limit]
+
+
+def _nearby_sort_key(distance, display_weight, artwork_id):
+	# The display weight is descending, with NULLs last
+	return distance, display_weight is None, -(display_weight or 0), artwork_id
+
+
+def _get_artworks_in_order(curr_session, artwork_ids):
+	"""
+	Load several AVAILABLE Artwork with a single query.
+	:param curr_session: the session used to run the query
+	:param artwork_ids: a list of artwork_id
+	:return: a list of Artwork in the same order as artwork_ids
+	"""
+
+	if len(artwork_ids) == 0:
+		return []
 
-		curr_session.close()
+	artwork_dictionary = dict((artwork.artwork_id, artwork) for artwork in curr_session.query(Artwork).
+	                          filter(Artwork.artwork_id.in_(artwork_ids)).
+	                          filter_by(artwork_status="AVAILABLE"))
 
-		return artwork_list, artwork_image_dictionary
+	return [artwork_dictionary[artwork_id] for artwork_id in artwork_ids if artwork_id in artwork_dictionary]
+
+
+@read_from_primary
+def get_artwork_ranking_rows():
+	"""
+	Get the columns used to rank the home feeds (see lib.feed_materializer) of all the Artwork, and their Artwork
+	Auctions (for their price).
+	:return: a list of dictionaries with the FEED_COLUMNS of each Artwork, and its "auctions": a list of dictionaries
+		with the AUCTION_COLUMNS of each Artwork Auction and the "current_bid_amount"
+	"""
+
+	curr_session = Session()  # A session of its own, not the one of the request (see feed_materializer)
+
+	try:
+
+		columns = [getattr(Artwork, column) for column in FEED_COLUMNS]
+		ranking_rows = [dict(zip(FEED_COLUMNS, row), auctions=[]) for row in curr_session.query(*columns)]
+
+		# Include the increments of the followed counts that are not written yet (see counter_buffer)
+		for ranking_row in ranking_rows:
+			ranking_row['artwork_followed_count'] = _overlay_counter("Artwork", (ranking_row['artwork_id'],),
+			                                                         "artwork_followed_count",
+			                                                         ranking_row['artwork_followed_count'])
+
+		ranking_row_dictionary = dict((ranking_row['artwork_id'], ranking_row) for ranking_row in ranking_rows)
+		auction_columns = [getattr(Artwork_Auction, column) for column in AUCTION_COLUMNS]
+		for row in curr_session.query(*(auction_columns + [Artwork_Auction_Bid.artwork_auction_bid_amount])). \
+				outerjoin(Artwork_Auction_Bid,
+				          Artwork_Auction_Bid.artwork_auction_bid_id == Artwork_Auction.artwork_auction_current_bid):
+			auction = dict(zip(AUCTION_COLUMNS, row), current_bid_amount=row[-1])
+			if auction['artwork_id'] in ranking_row_dictionary:
+				ranking_row_dictionary[auction['artwork_id']]['auctions'].append(auction)
+
+		return ranking_rows
 	except Exception, e:
 		raise e
 	finally:
 		curr_session.close()
 
 
-def get_artwork_owner(artwork):
+def _load_artwork_images(curr_session, artwork_list):
 	"""
-	Get an instance of a Buyer, Gallery, Auction_House or Artist, which owns this Artwork.
-	:param artwork: the Artwork whose owner will be fetched
-	:return an instance of Buyer, Gallery, Auction_House or Artist,
-		a string with the owner type:
-			"BUYER", "GALLERY", "AUCTION_HOUSE", "ARTIST",
-		an instance of Image
+	Load the Images of several Artwork with a single query.
+	:param curr_session: the session used to run the query
+	:param artwork_list: the list of Artwork whose Images will be loaded
+	:return: a dictionary with a list of Images per Artwork
 	"""
 
-	curr_session = Session()
-	try:
+	artwork_image_dictionary = dict((artwork, []) for artwork in artwork_list)
+	if not artwork_list:
+		return artwork_image_dictionary
 
-		if artwork.owner_buyer_user_id is not None:
-			table = Buyer
-			owner_user_id = artwork.owner_buyer_user_id
-			owner_type = "BUYER"
-		elif artwork.owner_gallery_user_id is not None:
-			table = Gallery
-			owner_user_id = artwork.owner_gallery_user_id
-			owner_type = "GALLERY"
-		elif artwork.owner_auction_house_user_id is not None:
-			table = Auction_House
-			owner_user_id = artwork.owner_auction_house_user_id
-			owner_type = "AUCTION_HOUSE"
-		elif artwork.owner_artist_user_id is not None:
-			table = Artist
-			owner_user_id = artwork.owner_artist_user_id
-			owner_type = "ARTIST"
-		else:
-			return None, None, None
+	artwork_dictionary = dict((artwork.artwork_id, artwork) for artwork in artwork_list)
+	for image, artwork_image in curr_session.query(Image, Artwork_Image). \
+			filter(Image.image_id == Artwork_Image.image_id). \
+			filter(Artwork_Image.artwork_id.in_(artwork_dictionary.keys())). \
+			order_by(Artwork_Image.artwork_id, Artwork_Image.image_id). \
+			all():
+		artwork_image_dictionary[artwork_dictionary[artwork_image.artwork_id]].append(image)
+
+	return artwork_image_dictionary
+
+
+def get_artwork_owners(artwork_list):
+	"""
+	Get the owners of several Artwork at once (a Buyer, Gallery, Auction House or Artist), from the owner directory,
+	or with at most one query per owner table if the directory is disabled.
+	:param artwork_list: the list of Artwork whose owners will be fetched
+	:return a dictionary with an Owner (user_id, owner_type, owner_name, image_path) per artwork_id, or None if the
+		Artwork has no owner
+	"""
+
+	artwork_owner_keys = dict((artwork.artwork_id, owner_key(artwork)) for artwork in artwork_list)
+	owner_keys = set(key for key in artwork_owner_keys.itervalues() if key is not None)
+
+	if owner_directory.enabled:
+		owners = owner_directory.get_owners(owner_keys)
+	else:
+		owner_ids = {}
+		for owner_type, user_id in owner_keys:
+			owner_ids.setdefault(owner_type, set()).add(user_id)
+		owners = dict(((row['owner_type'], row['user_id']), Owner(row['user_id'], row['owner_type'], row['owner_name'],
+		                                                          row['image_path']))
+		              for row in get_owner_rows(owner_ids))
+
+	return dict((artwork_id, owners.get(key) if key is not None else None)
+	            for artwork_id, key in artwork_owner_keys.iteritems())
+
+
+def get_artwork_page_versions(artwork_id, user_id):
+	"""
+	Get the versions of the entities shown in the page of an Artwork (see lib.entity_versions).
+	:param artwork_id: the id of the Artwork
+	:param user_id: the user_id of the requesting User
+	:return: a dictionary {(entity_type, entity_id): version}, or None if the Artwork doesn't exist
+	"""
+
+	curr_session = get_session()
 
-		owner = curr_session.query(table). \
-			filter_by(user_id=owner_user_id). \
+	try:
+
+		artwork_row = curr_session.query(Artwork.artist_user_id, Artwork.owner_buyer_user_id,
+		                                 Artwork.owner_gallery_user_id, Artwork.owner_auction_house_user_id,
+		                                 Artwork.owner_artist_user_id). \
+			filter_by(artwork_id=artwork_id). \
 			first()
 
-		# Load Image
-		if owner is not None:
-			if owner_type.lower() == "buyer" or owner_type.lower() == "artist":
-				owner_image = curr_session.query(Image).filter_by(image_id=owner.image_id).first()
-			else:
-				owner_image = curr_session.query(Image).filter_by(image_id=owner.banner_image_id).first()
-		else:
-			owner_image = None
+		if artwork_row is None:
+			return None
 
-		curr_session.close()
+		critic_rows = curr_session.query(Critique.critic_user_id). \
+			filter_by(artwork_id=artwork_id). \
+			all()
 
-		return owner, owner_type, owner_image
+		keys = [entity_versions.GLOBAL_KEY, (entity_versions.ARTWORK, artwork_id), (entity_versions.USER, user_id)]
+		keys.extend((entity_versions.PROFILE, profile_id) for profile_id in artwork_row if profile_id is not None)
+		keys.extend((entity_versions.PROFILE, critic_user_id) for critic_user_id, in critic_rows)
+
+		return get_entity_versions(keys)
 	except Exception, e:
 		raise e
 	finally:
@@ -1240,7 +2418,7 @@ def get_auction_house(user_id):
 	:return an instance of Auction_house
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		auction_house = curr_session.query(Auction_House). \
@@ -1273,7 +2451,7 @@ def get_auction_house_events(user_id, current=False):
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check current
@@ -1302,15 +2480,17 @@ def get_auction_house_events(user_id, current=False):
 		curr_session.close()
 
 
-def get_auction_house_list(limit=0, offset=0):
+@read_from_replica
+def get_auction_house_list(limit=0, offset=0, cursor=None):
 	"""
 	A list of all Auction Houses in alphabetical order.
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: a cursor of AUCTION_HOUSE_LIST_ORDER ("" for the first page) to use instead of offset
 	return: a list of Auction Houses
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 
@@ -1318,11 +2498,17 @@ def get_auction_house_list(limit=0, offset=0):
 		if limit == 0:
 			limit = sys.maxint
 
-		auction_house_list = curr_session.query(Auction_House). \
-			order_by(Auction_House.auction_house_name.asc()). \
-			limit(limit). \
-			offset(offset). \
-			all()
+		if cursor is not None:
+			# Only ACTIVE Auction Houses, so that the last row of the page is the position of the next cursor
+			auction_house_list = _query_after_cursor(curr_session.query(Auction_House).join(Auction_House.user).
+			                                         filter(func.lower(User.user_status) == "active"),
+			                                         AUCTION_HOUSE_LIST_ORDER, cursor, limit)
+		else:
+			auction_house_list = curr_session.query(Auction_House). \
+				order_by(Auction_House.auction_house_name.asc()). \
+				limit(limit). \
+				offset(offset). \
+				all()
 
 		# Check that Auction Houses are ACTIVE
 		auction_house_list[:] = [auction_house for auction_house in auction_house_list
@@ -1349,7 +2535,7 @@ def get_banner():
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check available banner for current date
@@ -1380,6 +2566,7 @@ def get_banner():
 		curr_session.close()
 
 
+@read_from_replica
 def get_banner_list():
 	"""
 	Obtain a list of Banners to display in Home screen based on the banners' start_time and end_time.
@@ -1387,7 +2574,7 @@ def get_banner_list():
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check available banners for current date
@@ -1424,7 +2611,7 @@ def get_buyer(user_id):
 	:return an instance of Buyer
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		buyer = curr_session.query(Buyer). \
@@ -1442,28 +2629,33 @@ def get_buyer(user_id):
 		curr_session.close()
 
 
-def get_buyer_artwork(user_id, limit=0, offset=0):
+def get_buyer_artwork(user_id, limit=0, offset=0, cursor=None):
 	"""
 	Get the Artworks owned by the given Buyer
 	:param user_id: the id of the Buyer
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: a cursor of BUYER_ARTWORK_ORDER ("" for the first page) to use instead of offset
 	:return: a list of owned Artworks
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check limit
 		if limit == 0:
 			limit = sys.maxint
 
-		artwork_list = curr_session.query(Artwork). \
-			filter_by(owner_buyer_user_id=user_id). \
-			order_by(Artwork.artwork_display_weight). \
-			limit(limit). \
-			offset(offset). \
-			all()
+		if cursor is not None:
+			artwork_list = _query_after_cursor(curr_session.query(Artwork).filter_by(owner_buyer_user_id=user_id),
+			                                   BUYER_ARTWORK_ORDER, cursor, limit)
+		else:
+			artwork_list = curr_session.query(Artwork). \
+				filter_by(owner_buyer_user_id=user_id). \
+				order_by(Artwork.artwork_display_weight). \
+				limit(limit). \
+				offset(offset). \
+				all()
 
 		# Touch images
 		for artwork in artwork_list:
@@ -1480,7 +2672,7 @@ def get_buyer_artwork(user_id, limit=0, offset=0):
 		curr_session.close()
 
 
-def get_critique_list(artwork_id=None, critic_id=None, limit=0, offset=0, user_id=None):
+def get_critique_list(artwork_id=None, critic_id=None, limit=0, offset=0, user_id=None, cursor=None):
 	"""
 	A list of Critique given an artwork_id or a critic_id.
 	:param artwork_id: the id of the Artwork whose Critiques will be retrieved
@@ -1488,11 +2680,12 @@ def get_critique_list(artwork_id=None, critic_id=None, limit=0, offset=0, user_i
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
 	:param user_id: the user_id of the requesting User
+	:param cursor: a cursor of CRITIQUE_LIST_ORDER ("" for the first page) to use instead of offset
 	return: a list of Critiques
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 
@@ -1501,8 +2694,18 @@ def get_critique_list(artwork_id=None, critic_id=None, limit=0, offset=0, user_i
 			limit = sys.maxint
 
 		# Check filter
-		if artwork_id is not None:
+		if cursor is not None and (artwork_id is not None or critic_id is not None):
+			critique_query = curr_session.query(Critique). \
+				options(joinedload(Critique.critic)). \
+				filter_by(critique_status="APPROVED")
+			if artwork_id is not None:
+				critique_query = critique_query.filter_by(artwork_id=artwork_id)
+			else:
+				critique_query = critique_query.filter_by(critic_user_id=critic_id)
+			critique_list = _query_after_cursor(critique_query, CRITIQUE_LIST_ORDER, cursor, limit)
+		elif artwork_id is not None:
 			critique_list = curr_session.query(Critique). \
+				options(joinedload(Critique.critic)). \
 				filter_by(artwork_id=artwork_id). \
 				filter_by(critique_status="APPROVED"). \
 				order_by(Critique.critique_upvote_count.desc()). \
@@ -1511,6 +2714,7 @@ def get_critique_list(artwork_id=None, critic_id=None, limit=0, offset=0, user_i
 				all()
 		elif critic_id is not None:
 			critique_list = curr_session.query(Critique). \
+				options(joinedload(Critique.critic)). \
 				filter_by(critic_id=critic_id). \
 				filter_by(critique_status="APPROVED"). \
 				order_by(Critique.critique_upvote_count.desc()). \
@@ -1520,7 +2724,7 @@ def get_critique_list(artwork_id=None, critic_id=None, limit=0, offset=0, user_i
 		else:
 			return None
 
-		# Touch Critics
+		# Touch Critics (already loaded with the Critiques)
 		for critique in critique_list:
 			critic = critique.critic
 
@@ -1533,6 +2737,39 @@ def get_critique_list(artwork_id=None, critic_id=None, limit=0, offset=0, user_i
 		curr_session.close()
 
 
+def get_critique_lists(artwork_ids, limit=0):
+	"""
+	The Critique lists of several Artwork at once (as get_critique_list), using a single query.
+	:param artwork_ids: an iterable with the ids of the Artwork whose Critiques will be retrieved
+	:param limit: the max number of Critiques to return per Artwork, 0 for no limit
+	:return: a dictionary with a list of Critiques per artwork_id (empty lists included)
+	"""
+
+	critique_lists = dict((artwork_id, []) for artwork_id in artwork_ids)
+	if not critique_lists:
+		return critique_lists
+
+	curr_session = get_session()
+
+	try:
+
+		for critique in curr_session.query(Critique). \
+				options(joinedload(Critique.critic)). \
+				filter(Critique.artwork_id.in_(critique_lists.keys())). \
+				filter_by(critique_status="APPROVED"). \
+				order_by(Critique.artwork_id, Critique.critique_upvote_count.desc()). \
+				all():
+			critique_list = critique_lists[critique.artwork_id]
+			if limit == 0 or len(critique_list) < limit:
+				critique_list.append(critique)
+
+		return critique_lists
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
 def get_critique_vote_type(buyer_user_id, artwork_id, critic_user_id):
 	"""
 	Get type of Critique vote ("LIKED", "DISLIKED", "NONE")
@@ -1542,7 +2779,7 @@ def get_critique_vote_type(buyer_user_id, artwork_id, critic_user_id):
 	:return: "LIKED", "DISLIKED", or None if user hasn't voted
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		critique_vote = curr_session.query(Critique_Vote). \
@@ -1564,16 +2801,95 @@ def get_critique_vote_type(buyer_user_id, artwork_id, critic_user_id):
 		curr_session.close()
 
 
-def get_followed_artists(user_id, limit=0, offset=0):
+def get_critique_vote_types(buyer_user_id, critique_keys):
+	"""
+	Get the votes of a Buyer on several Critiques at once, using a single query
+	:param buyer_user_id: the id of the Buyer
+	:param critique_keys: an iterable with the (artwork_id, critic_user_id) keys of the Critiques
+	:return: a dictionary with the vote type ("L" or "D") per key of the Critiques the Buyer has voted on
+	"""
+
+	critique_keys = set(critique_keys)
+	if buyer_user_id is None or not critique_keys:
+		return {}
+
+	curr_session = get_session()
+	try:
+
+		vote_types = {}
+		for artwork_id, critic_user_id, critique_vote_type in \
+				curr_session.query(Critique_Vote.artwork_id, Critique_Vote.critic_user_id,
+				                   Critique_Vote.critique_vote_type). \
+				filter_by(buyer_user_id=buyer_user_id). \
+				filter(Critique_Vote.artwork_id.in_(set(key[0] for key in critique_keys))). \
+				filter(Critique_Vote.critic_user_id.in_(set(key[1] for key in critique_keys))). \
+				all():
+			if (artwork_id, critic_user_id) in critique_keys:
+				vote_types[(artwork_id, critic_user_id)] = critique_vote_type
+
+		return vote_types
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
+def get_entity_versions(keys):
+	"""
+	Get the version stamps of several entities (see lib.entity_versions).
+	:param keys: a list of (entity_type, entity_id) keys
+	:return: a dictionary {(entity_type, entity_id): version}, with version 0 for entities never written
+	"""
+
+	versions = dict((key, 0) for key in keys if key[1] is not None)
+	if len(versions) == 0:
+		return versions
+
+	ids_by_type = {}
+	for entity_type, entity_id in versions:
+		ids_by_type.setdefault(entity_type, set()).add(entity_id)
+
+	curr_session = get_session()
+
+	try:
+
+		version_rows = curr_session.query(Entity_Version.entity_type, Entity_Version.entity_id,
+		                                  Entity_Version.entity_version). \
+			filter(or_(*[and_(Entity_Version.entity_type == entity_type, Entity_Version.entity_id.in_(entity_ids))
+			             for entity_type, entity_ids in ids_by_type.iteritems()])). \
+			all()
+
+		for entity_type, entity_id, entity_version in version_rows:
+			versions[(entity_type, entity_id)] = entity_version
+
+		return versions
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
+@read_from_primary
+def get_user_version(user_id):
+	"""
+	Get the USER version of a Buyer (see lib.entity_versions), including the latest writes of every process.
+	:param user_id: the user_id of the Buyer
+	:return: the version, 0 if the Buyer's private state was never written
+	"""
+	return get_entity_versions([(entity_versions.USER, user_id)])[(entity_versions.USER, user_id)]
+
+
+def get_followed_artists(user_id, limit=0, offset=0, cursor=None):
 	"""
 	Get the Artists followed by the given Buyer
 	:param user_id: the id of the requesting Buyer
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: a cursor of FOLLOWED_ARTISTS_ORDER ("" for the first page) to use instead of offset
 	:return: a list of followed Artists sorted by name
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check limit
@@ -1581,15 +2897,20 @@ def get_followed_artists(user_id, limit=0, offset=0):
 			limit = sys.maxint
 
 		artist_list = []
-		for followed_artist, artist in curr_session.query(Follow_Artist, Artist). \
-				filter_by(buyer_user_id=user_id). \
-				filter_by(follow_artist_status="following"). \
-				filter(Follow_Artist.artist_user_id == Artist.user_id). \
+		follow_query = curr_session.query(Follow_Artist, Artist). \
+			filter_by(buyer_user_id=user_id). \
+			filter_by(follow_artist_status="following"). \
+			filter(Follow_Artist.artist_user_id == Artist.user_id)
+		if cursor is not None:
+			rows = _query_after_cursor(follow_query, FOLLOWED_ARTISTS_ORDER, cursor, limit)
+		else:
+			rows = follow_query. \
 				order_by(Artist.artist_nickname). \
 				limit(limit). \
 				offset(offset). \
-				all():
+				all()
 
+		for followed_artist, artist in rows:
 			artist_list.append(artist)
 
 			# Touch image
@@ -1604,17 +2925,48 @@ def get_followed_artists(user_id, limit=0, offset=0):
 		curr_session.close()
 
 
-def get_followed_artwork(user_id, limit=0, offset=0, get_favorite=False):
+def get_followed_artwork_ids(user_id, artwork_ids):
+	"""
+	Which of the given Artwork are being followed by a particular Buyer, using a single query
+	:param user_id: the user id of the Buyer
+	:param artwork_ids: an iterable with the ids of the Artwork to check
+	:return: a set with the ids of the Artwork followed by this Buyer
+	"""
+
+	artwork_ids = set(artwork_ids)
+	if user_id is None or not artwork_ids:
+		return set()
+
+	curr_session = get_session()
+	try:
+
+		followed_artwork_ids = set()
+		for follow_artwork in curr_session.query(Follow_Artwork). \
+				filter_by(buyer_user_id=user_id). \
+				filter(Follow_Artwork.artwork_id.in_(artwork_ids)). \
+				all():
+			if follow_artwork.follow_artwork_status.lower() == "following":
+				followed_artwork_ids.add(follow_artwork.artwork_id)
+
+		return followed_artwork_ids
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
+def get_followed_artwork(user_id, limit=0, offset=0, get_favorite=False, cursor=None):
 	"""
 	Get the Artwork followed by the given Buyer
 	:param user_id: the id of the requesting Buyer
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
 	:param get_favorite: whether to only retrieve the favorite Artwork of the Buyer or not
+	:param cursor: a cursor of FOLLOWED_ARTWORK_ORDER ("" for the first page) to use instead of offset
 	:return: a list of followed Artwork sorted by name
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check limit
@@ -1624,16 +2976,21 @@ def get_followed_artwork(user_id, limit=0, offset=0, get_favorite=False):
 		favorite_filter = Follow_Artwork.is_favorite == True if get_favorite else True == True
 
 		artwork_list = []
-		for followed_artwork, artwork in curr_session.query(Follow_Artwork, Artwork). \
-				filter_by(buyer_user_id=user_id). \
-				filter_by(follow_artwork_status="following"). \
-				filter(Follow_Artwork.artwork_id == Artwork.artwork_id). \
-				filter(favorite_filter). \
+		follow_query = curr_session.query(Follow_Artwork, Artwork). \
+			filter_by(buyer_user_id=user_id). \
+			filter_by(follow_artwork_status="following"). \
+			filter(Follow_Artwork.artwork_id == Artwork.artwork_id). \
+			filter(favorite_filter)
+		if cursor is not None:
+			rows = _query_after_cursor(follow_query, FOLLOWED_ARTWORK_ORDER, cursor, limit)
+		else:
+			rows = follow_query. \
 				order_by(Artwork.artwork_name). \
 				limit(limit). \
 				offset(offset). \
-				all():
+				all()
 
+		for followed_artwork, artwork in rows:
 			artwork_list.append(artwork)
 
 			# Touch images
@@ -1650,16 +3007,17 @@ def get_followed_artwork(user_id, limit=0, offset=0, get_favorite=False):
 		curr_session.close()
 
 
-def get_followed_auction_houses(user_id, limit=0, offset=0):
+def get_followed_auction_houses(user_id, limit=0, offset=0, cursor=None):
 	"""
 	Get the Auction Houses followed by the given Buyer
 	:param user_id: the id of the requesting Buyer
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: a cursor of FOLLOWED_AUCTION_HOUSES_ORDER ("" for the first page) to use instead of offset
 	:return: a list of followed Auction Houses sorted by name
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check limit
@@ -1667,15 +3025,20 @@ def get_followed_auction_houses(user_id, limit=0, offset=0):
 			limit = sys.maxint
 
 		auction_house_list = []
-		for followed_auction_house, auction_house in curr_session.query(Follow_Auction, Auction_House). \
-				filter_by(buyer_user_id=user_id). \
-				filter_by(follow_auction_status="following"). \
-				filter(Follow_Auction.auction_house_user_id == Auction_House.user_id). \
+		follow_query = curr_session.query(Follow_Auction, Auction_House). \
+			filter_by(buyer_user_id=user_id). \
+			filter_by(follow_auction_status="following"). \
+			filter(Follow_Auction.auction_house_user_id == Auction_House.user_id)
+		if cursor is not None:
+			rows = _query_after_cursor(follow_query, FOLLOWED_AUCTION_HOUSES_ORDER, cursor, limit)
+		else:
+			rows = follow_query. \
 				order_by(Auction_House.auction_house_name). \
 				limit(limit). \
 				offset(offset). \
-				all():
+				all()
 
+		for followed_auction_house, auction_house in rows:
 			auction_house_list.append(auction_house)
 
 			# Touch image
@@ -1690,16 +3053,17 @@ def get_followed_auction_houses(user_id, limit=0, offset=0):
 		curr_session.close()
 
 
-def get_followed_critics(user_id, limit=0, offset=0):
+def get_followed_critics(user_id, limit=0, offset=0, cursor=None):
 	"""
 	Get the Critics followed by the given Buyer
 	:param user_id: the id of the requesting Buyer
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: a cursor of FOLLOWED_CRITICS_ORDER ("" for the first page) to use instead of offset
 	:return: a list of followed Critics sorted by name
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check limit
@@ -1707,15 +3071,20 @@ def get_followed_critics(user_id, limit=0, offset=0):
 			limit = sys.maxint
 
 		critic_list = []
-		for followed_critic, critic in curr_session.query(Follow_Critic, Critic). \
-				filter_by(buyer_user_id=user_id). \
-				filter_by(follow_critic_status="following"). \
-				filter(Follow_Critic.critic_user_id == Critic.user_id). \
+		follow_query = curr_session.query(Follow_Critic, Critic). \
+			filter_by(buyer_user_id=user_id). \
+			filter_by(follow_critic_status="following"). \
+			filter(Follow_Critic.critic_user_id == Critic.user_id)
+		if cursor is not None:
+			rows = _query_after_cursor(follow_query, FOLLOWED_CRITICS_ORDER, cursor, limit)
+		else:
+			rows = follow_query. \
 				order_by(Critic.critic_nickname). \
 				limit(limit). \
 				offset(offset). \
-				all():
+				all()
 
+		for followed_critic, critic in rows:
 			critic_list.append(critic)
 
 		curr_session.close()
@@ -1727,16 +3096,17 @@ def get_followed_critics(user_id, limit=0, offset=0):
 		curr_session.close()
 
 
-def get_followed_galleries(user_id, limit=0, offset=0):
+def get_followed_galleries(user_id, limit=0, offset=0, cursor=None):
 	"""
 	Get the Galleries followed by the given Buyer
 	:param user_id: the id of the requesting Buyer
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: a cursor of FOLLOWED_GALLERIES_ORDER ("" for the first page) to use instead of offset
 	:return: a list of followed Galleries sorted by name
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check limit
@@ -1744,15 +3114,20 @@ def get_followed_galleries(user_id, limit=0, offset=0):
 			limit = sys.maxint
 
 		gallery_list = []
-		for followed_gallery, gallery in curr_session.query(Follow_Gallery, Gallery). \
-				filter_by(buyer_user_id=user_id). \
-				filter_by(follow_gallery_status="following"). \
-				filter(Follow_Gallery.gallery_user_id == Gallery.user_id). \
+		follow_query = curr_session.query(Follow_Gallery, Gallery). \
+			filter_by(buyer_user_id=user_id). \
+			filter_by(follow_gallery_status="following"). \
+			filter(Follow_Gallery.gallery_user_id == Gallery.user_id)
+		if cursor is not None:
+			rows = _query_after_cursor(follow_query, FOLLOWED_GALLERIES_ORDER, cursor, limit)
+		else:
+			rows = follow_query. \
 				order_by(Gallery.gallery_name). \
 				limit(limit). \
 				offset(offset). \
-				all():
+				all()
 
+		for followed_gallery, gallery in rows:
 			gallery_list.append(gallery)
 
 			# Touch image
@@ -1774,7 +3149,7 @@ def get_gallery(user_id):
 	:return an instance of Auction_house
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 
 		gallery = curr_session.query(Gallery). \
@@ -1807,7 +3182,7 @@ def get_gallery_events(user_id, current=False):
 	"""
 
 	now = datetime.now()
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check current
@@ -1836,15 +3211,17 @@ def get_gallery_events(user_id, current=False):
 		curr_session.close()
 
 
-def get_gallery_list(limit=0, offset=0):
+@read_from_replica
+def get_gallery_list(limit=0, offset=0, cursor=None):
 	"""
 	A list of all Galleries in alphabetical order.
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: a cursor of GALLERY_LIST_ORDER ("" for the first page) to use instead of offset
 	return: a list of Galleries
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 
@@ -1852,11 +3229,17 @@ def get_gallery_list(limit=0, offset=0):
 		if limit == 0:
 			limit = sys.maxint
 
-		gallery_list = curr_session.query(Gallery). \
-			order_by(Gallery.gallery_name.asc()). \
-			limit(limit). \
-			offset(offset). \
-			all()
+		if cursor is not None:
+			# Only ACTIVE Galleries, so that the last row of the page is the position of the next cursor
+			gallery_list = _query_after_cursor(curr_session.query(Gallery).join(Gallery.user).
+			                                   filter(func.lower(User.user_status) == "active"),
+			                                   GALLERY_LIST_ORDER, cursor, limit)
+		else:
+			gallery_list = curr_session.query(Gallery). \
+				order_by(Gallery.gallery_name.asc()). \
+				limit(limit). \
+				offset(offset). \
+				all()
 
 		# Check that Galleries are ACTIVE
 		gallery_list[:] = [gallery for gallery in gallery_list if gallery.user.user_status.lower() == "active"]
@@ -1874,15 +3257,17 @@ def get_gallery_list(limit=0, offset=0):
 		curr_session.close()
 
 
-def get_label_list(limit=0, offset=0):
+@read_from_replica
+def get_label_list(limit=0, offset=0, cursor=None):
 	"""
 	A list of all Labels in alphabetical order.
 	:param limit: the max number of rows to return, 0 for no limit
 	:param offset: the offset (starting point) for the list. E.g. if offset=10, the list will begin at row 11
+	:param cursor: a cursor of LABEL_LIST_ORDER ("" for the first page) to use instead of offset
 	return: a list of Labels
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 
@@ -1890,11 +3275,14 @@ def get_label_list(limit=0, offset=0):
 		if limit == 0:
 			limit = sys.maxint
 
-		label_list = curr_session.query(Label). \
-			order_by(Label.label_name.asc()). \
-			limit(limit). \
-			offset(offset). \
-			all()
+		if cursor is not None:
+			label_list = _query_after_cursor(curr_session.query(Label), LABEL_LIST_ORDER, cursor, limit)
+		else:
+			label_list = curr_session.query(Label). \
+				order_by(Label.label_name.asc()). \
+				limit(limit). \
+				offset(offset). \
+				all()
 
 		curr_session.close()
 
@@ -1905,6 +3293,122 @@ def get_label_list(limit=0, offset=0):
 		curr_session.close()
 
 
+@read_from_primary
+def get_owner_rows(owner_ids=None):
+	"""
+	Get the users that can own Artwork (Buyers, Galleries, Auction Houses and Artists), with the name and image shown
+	for them, running one query per owner table.
+	:param owner_ids: a dictionary {owner_type: set of user_id} with the owners to get, or None to get all of them
+	:return: a list of dictionaries with the keys owner_type, user_id, owner_name, image_id and image_path
+	"""
+
+	curr_session = Session()  # A session of its own, not the one of the request (see feed_materializer)
+
+	try:
+
+		owner_tables = dict(Buyer=Buyer, Gallery=Gallery, Auction_House=Auction_House, Artist=Artist)
+		owner_rows = []
+		for table_name, owner_type, owner_column, name_column, image_column in OWNER_TABLES:
+			if owner_ids is not None and not owner_ids.get(owner_type):
+				continue
+
+			table = owner_tables[table_name]
+			owner_query = curr_session.query(table.user_id, getattr(table, name_column), getattr(table, image_column),
+			                                 Image.image_path). \
+				outerjoin(Image, Image.image_id == getattr(table, image_column))
+			if owner_ids is not None:
+				owner_query = owner_query.filter(table.user_id.in_(owner_ids[owner_type]))
+
+			for user_id, owner_name, image_id, image_path in owner_query.all():
+				owner_rows.append(dict(owner_type=owner_type, user_id=user_id, owner_name=owner_name, image_id=image_id,
+				                       image_path=image_path))
+
+		return owner_rows
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
+@read_from_primary
+def get_follow_graph_rows(buyer_user_id=None):
+	"""
+	Get the edges of the follow graph (see lib.follow_graph): the follows with status "following" of every follow
+	table, and the APPROVED Critiques.
+	:param buyer_user_id: the Buyer whose follows to get (without the Critiques), or None to get the whole graph
+	:return: a list of tuples (relation, source id, target id)
+	"""
+
+	curr_session = Session()  # A session of its own, not the one of the request (see feed_materializer)
+
+	try:
+
+		follow_tables = dict(Follow_Artist=Follow_Artist, Follow_Artwork=Follow_Artwork, Follow_Auction=Follow_Auction,
+		                     Follow_Critic=Follow_Critic, Follow_Gallery=Follow_Gallery)
+		edges = []
+		for table_name, followed_type, followed_column, status_column in FOLLOW_TABLES:
+			table = follow_tables[table_name]
+			follow_query = curr_session.query(table.buyer_user_id, getattr(table, followed_column)). \
+				filter(func.lower(getattr(table, status_column)) == "following")
+			if buyer_user_id is not None:
+				follow_query = follow_query.filter(table.buyer_user_id == buyer_user_id)
+			edges.extend((followed_type, source_id, followed_id) for source_id, followed_id in follow_query)
+
+		if buyer_user_id is not None:
+			return edges
+
+		edges.extend((CRITIQUE, critic_user_id, artwork_id)
+		             for critic_user_id, artwork_id in curr_session.query(Critique.critic_user_id, Critique.artwork_id).
+		             filter(func.lower(Critique.critique_status) == "approved"))
+
+		return edges
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
+@read_from_primary
+def get_venue_location_rows():
+	"""
+	Get the geolocation of the Address of every venue (Galleries and Auction Houses), see lib.geo_index.
+	:return: a list of dictionaries with the keys owner_type, user_id, address_id and geolocation
+	"""
+
+	curr_session = Session()  # A session of its own, not the one of the request (see feed_materializer)
+
+	try:
+
+		venue_tables = dict(Gallery=Gallery, Auction_House=Auction_House)
+		venue_rows = []
+		for table_name, owner_type in VENUE_TABLES:
+			table = venue_tables[table_name]
+			venue_query = curr_session.query(table.user_id, table.address_id, Address.geolocation). \
+				outerjoin(Address, Address.address_id == table.address_id)
+
+			for user_id, address_id, geolocation in venue_query.all():
+				venue_rows.append(dict(owner_type=owner_type, user_id=user_id, address_id=address_id,
+				                       geolocation=geolocation))
+
+		return venue_rows
+	except Exception, e:
+		raise e
+	finally:
+		curr_session.close()
+
+
+def get_place_page_versions(place_id, user_id):
+	"""
+	Get the versions of the entities shown in the fan page of a Gallery or Auction House (see lib.entity_versions).
+	:param place_id: the user_id of the Gallery or Auction House
+	:param user_id: the user_id of the requesting User
+	:return: a dictionary {(entity_type, entity_id): version}
+	"""
+
+	return get_entity_versions([entity_versions.GLOBAL_KEY, (entity_versions.PROFILE, place_id),
+	                            (entity_versions.USER, user_id)])
+
+
 def get_preferred_labels(user_id, top_n=0):
 	"""
 	Get the top n Labels preferred by the given Buyer
@@ -1913,7 +3417,7 @@ def get_preferred_labels(user_id, top_n=0):
 	:return: a list of top n preferred Labels
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 
 	try:
 		# Check top_n
@@ -1950,7 +3454,7 @@ def login(user_email, user_password):
 	:return: an instance of the User class
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 		user = curr_session.query(User).filter_by(user_hashed_email=user_email).one()
 
@@ -1971,6 +3475,22 @@ def login(user_email, user_password):
 		curr_session.close()
 
 
+def get_user(user_id):
+	"""
+	Get an instance of a User given its user_id
+	:param user_id: the user_id
+	:return: an instance of the User class
+	"""
+
+	curr_session = get_session()
+	try:
+		return curr_session.query(User).filter_by(user_id=user_id).one()
+	except NoResultFound, e:
+		raise UserInexistentError()
+	finally:
+		curr_session.close()
+
+
 def login_facebook(fb_id, user_email):
 	"""
 	Log in to the ArtMeGo system using the given user email and password (hash-encrypted using SHA-256)
@@ -1979,7 +3499,7 @@ def login_facebook(fb_id, user_email):
 	:return: an instance of the User class
 	"""
 
-	curr_session = Session()
+	curr_session = get_session()
 	try:
 		buyer = curr_session.query(Buyer).filter_by(facebook_id=fb_id).one()
 
@@ -2006,7 +3526,7 @@ def login_facebook(fb_id, user_email):
 
 
 def add_sample_data1():
-	curr_session = Session()
+	curr_session = get_session()
 	now = datetime.now()
 	one_month = timedelta(days=30)
 	later = now + one_month
@@ -2085,7 +3605,7 @@ def add_sample_data1():
 
 
 def add_sample_data2():
-	curr_session = Session()
+	curr_session = get_session()
 	now = datetime.now()
 	one_month = timedelta(days=30)
 	later = now + one_month
@@ -2192,7 +3712,7 @@ def add_sample_data2():
 
 
 def test_queries():
-	curr_session = Session()
+	curr_session = get_session()
 
 	for user in curr_session.query(User).order_by(User.user_id):
 		print user
@@ -0,0 +1,154 @@
+# coding=utf-8
+"""
+This module contains the executor used to run database work off the Tornado IOLoop thread.
+The db_crud functions use blocking MySQL calls, so web services are dispatched to a thread pool as a single unit of
+work (see db_crud.run_unit_of_work). The IOLoop keeps serving other clients while the database works.
+The pool size, queue depth and per-request timeout are configured in the settings.
+A unit of work that ends by waiting for something else than the database (e.g. a bid written by the auction engine)
+returns an AsyncResult instead of blocking its thread.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from lib import db_crud
+from lib.exceptions import Error, ServerBusyError
+from settings import settings
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+
+class AsyncResult(object):
+	"""
+	The result of a unit of work that is only known once a Future is resolved by another thread (e.g. the auction
+	engine). DBExecutor.run waits for it in the IOLoop, without holding a thread of the pool.
+	"""
+
+	def __init__(self, future, make_result):
+		"""
+		:param future: a concurrent.futures.Future
+		:param make_result: a function that receives the result of the future and returns the result of the unit of
+			work (the exception of the future is raised instead, if any)
+		"""
+		self.future = future
+		self.make_result = make_result
+
+
+class DBExecutor(object):
+	"""
+	Runs units of work in a thread pool, with a bounded queue and a timeout per unit of work.
+	If the executor is disabled, units of work run directly in the IOLoop thread.
+	"""
+
+	def __init__(self, enabled, pool_size, queue_depth, timeout_seconds):
+		"""
+		:param enabled: whether to use the thread pool or run units of work in the calling thread
+		:param pool_size: the number of worker threads
+		:param queue_depth: the max number of units of work waiting for a free thread. Units of work submitted
+			when the queue is full are rejected with a ServerBusyError
+		:param timeout_seconds: the max number of seconds to wait for a unit of work, 0 for no timeout
+		"""
+		self.enabled = enabled
+		self.pool_size = pool_size
+		self.queue_depth = queue_depth
+		self.timeout_seconds = timeout_seconds
+
+		self._pool = None
+		self._pending = 0
+		self._lock = threading.Lock()
+
+	def _get_pool(self):
+		# Create the pool lazily, so that worker threads are never created before forking
+		if self._pool is None:
+			self._pool = ThreadPoolExecutor(self.pool_size)
+		return self._pool
+
+	@property
+	def pending(self):
+		"""
+		The number of units of work running or waiting for a free thread.
+		"""
+		return self._pending
+
+	@gen.coroutine
+	def run(self, request_session, function, *args, **kwargs):
+		"""
+		Run a function as the unit of work of a request.
+		Raises a ServerBusyError if the queue is full.
+		Raises a tornado.gen.TimeoutError if the unit of work does not finish in time (its writes are then rolled
+		back, see db_crud.RequestSession.abandon). If it returns an AsyncResult, the wait for its future is not
+		subject to the timeout: the writes of the unit of work are already committed by then, and the future is
+		resolved by code with its own transactions.
+		:param request_session: the db_crud.RequestSession of the request
+		:param function: the function to run, which calls db_crud functions
+		:return: a Future with the result of the function
+		"""
+		if not self.enabled:
+			response = db_crud.run_unit_of_work(request_session, function, *args, **kwargs)
+			if isinstance(response, AsyncResult):
+				response = response.make_result((yield response.future))
+			raise gen.Return(response)
+
+		with self._lock:
+			if self._pending >= self.pool_size + self.queue_depth:
+				raise ServerBusyError()
+			self._pending += 1
+
+		# Resolve the result in the IOLoop thread, since Tornado Futures are not thread-safe
+		io_loop = IOLoop.current()
+		result = Future()
+
+		def copy_result(concurrent_future):
+			with self._lock:
+				self._pending -= 1
+			io_loop.add_callback(_copy_future, concurrent_future, result)
+
+		try:
+			concurrent_future = self._get_pool().submit(db_crud.run_unit_of_work, request_session, function,
+			                                            *args, **kwargs)
+		except Exception, e:
+			with self._lock:
+				self._pending -= 1
+			raise e
+		concurrent_future.add_done_callback(copy_result)
+
+		if self.timeout_seconds:
+			try:
+				response = yield gen.with_timeout(timedelta(seconds=self.timeout_seconds), result,
+				                                  quiet_exceptions=Error)
+			except gen.TimeoutError, e:
+				# The client is told that the request failed, so its writes must not be committed. If they're being
+				# committed right now, wait for the outcome instead
+				if request_session.abandon():
+					raise e
+				response = yield result
+		else:
+			response = yield result
+
+		if isinstance(response, AsyncResult):
+			response = response.make_result((yield response.future))
+
+		raise gen.Return(response)
+
+
+def _copy_future(source, destination):
+	"""
+	Copy the result (or exception) of a finished concurrent Future into a Tornado Future.
+	"""
+	if destination.done():
+		return
+	if source.exception() is not None:
+		destination.set_exception(source.exception())
+	else:
+		destination.set_result(source.result())
+
+
+executor = DBExecutor(settings['DB_EXECUTOR_ENABLED'], settings['DB_EXECUTOR_POOL_SIZE'],
+                      settings['DB_EXECUTOR_QUEUE_DEPTH'], settings['DB_EXECUTOR_TIMEOUT_SECONDS'])
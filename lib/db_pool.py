@@ -0,0 +1,175 @@
+# coding=utf-8
+"""
+This module creates the SQLAlchemy engines used by db_crud, with a connection pool configured from the settings:
+pool size, overflow, recycle time, checkout timeout and pre-ping (health check) of idle connections.
+The pool also collects statistics (checked-out connections, checkout wait times, overflow events, etc.), which are
+exposed through the internal API to help sizing the pool.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import QueuePool
+
+from settings import settings
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+# Upper bounds (in milliseconds) of the buckets of the checkout wait time histogram
+WAIT_TIME_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolStatistics(object):
+	"""
+	Counters and a wait time histogram for a connection pool. All methods are thread-safe.
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.checkouts = 0
+		self.checkout_timeouts = 0
+		self.connections_opened = 0
+		self.overflow_events = 0
+		self.ping_failures = 0
+		self.total_wait_seconds = 0.0
+		self.max_wait_seconds = 0.0
+		self.wait_histogram = [0] * (len(WAIT_TIME_BUCKETS_MS) + 1)
+
+	def record_checkout(self, wait_seconds):
+		"""
+		Record a successful checkout and the time it took.
+		:param wait_seconds: seconds spent waiting for the connection
+		"""
+		wait_ms = wait_seconds * 1000
+		bucket = len(WAIT_TIME_BUCKETS_MS)
+		for i, upper_bound in enumerate(WAIT_TIME_BUCKETS_MS):
+			if wait_ms <= upper_bound:
+				bucket = i
+				break
+
+		with self._lock:
+			self.checkouts += 1
+			self.total_wait_seconds += wait_seconds
+			self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+			self.wait_histogram[bucket] += 1
+
+	def record_timeout(self):
+		with self._lock:
+			self.checkout_timeouts += 1
+
+	def record_connect(self, overflow):
+		"""
+		Record a new database connection.
+		:param overflow: whether the connection was opened beyond the pool size
+		"""
+		with self._lock:
+			self.connections_opened += 1
+			if overflow:
+				self.overflow_events += 1
+
+	def record_ping_failure(self):
+		with self._lock:
+			self.ping_failures += 1
+
+	def as_dict(self, pool):
+		"""
+		Get a snapshot of the statistics, together with the current state of the pool.
+		:param pool: the pool whose statistics are collected
+		:return: a dictionary with the statistics
+		"""
+		with self._lock:
+			histogram = dict(("<={0}".format(upper_bound), self.wait_histogram[i])
+			                 for i, upper_bound in enumerate(WAIT_TIME_BUCKETS_MS))
+			histogram[">{0}".format(WAIT_TIME_BUCKETS_MS[-1])] = self.wait_histogram[-1]
+			mean_wait_ms = self.total_wait_seconds * 1000 / self.checkouts if self.checkouts else 0
+
+			return dict(pid=os.getpid(),
+			            pool_size=pool.size(),
+			            max_overflow=pool._max_overflow,
+			            checked_out=pool.checkedout(),
+			            checked_in=pool.checkedin(),
+			            overflow=max(pool.overflow(), 0),
+			            checkouts=self.checkouts,
+			            checkout_timeouts=self.checkout_timeouts,
+			            connections_opened=self.connections_opened,
+			            overflow_events=self.overflow_events,
+			            ping_failures=self.ping_failures,
+			            mean_wait_ms=mean_wait_ms,
+			            max_wait_ms=self.max_wait_seconds * 1000,
+			            wait_ms_histogram=histogram)
+
+
+class InstrumentedQueuePool(QueuePool):
+	"""
+	A QueuePool that records how long each checkout waits and how many checkouts time out.
+	"""
+
+	statistics = None
+
+	def connect(self):
+		start_time = time.time()
+		try:
+			connection = super(InstrumentedQueuePool, self).connect()
+		except exc.TimeoutError, e:
+			self.statistics.record_timeout()
+			raise e
+
+		self.statistics.record_checkout(time.time() - start_time)
+
+		return connection
+
+	def recreate(self):
+		pool = super(InstrumentedQueuePool, self).recreate()
+		pool.statistics = self.statistics
+
+		return pool
+
+
+def create_pooled_engine(connection_string):
+	"""
+	Create an engine whose connection pool is configured from the settings (DB_POOL_*).
+	:param connection_string: the database URL
+	:return: an engine, whose pool has a PoolStatistics instance in pool.statistics
+	"""
+	new_engine = create_engine(connection_string,
+	                           poolclass=InstrumentedQueuePool,
+	                           pool_size=settings['DB_POOL_SIZE'],
+	                           max_overflow=settings['DB_POOL_MAX_OVERFLOW'],
+	                           pool_recycle=settings['DB_POOL_RECYCLE_SECONDS'],
+	                           pool_timeout=settings['DB_POOL_TIMEOUT_SECONDS'])
+	statistics = PoolStatistics()
+	new_engine.pool.statistics = statistics
+
+	@event.listens_for(new_engine, 'connect')
+	def on_connect(dbapi_connection, connection_record):
+		connection_record.info['checkin_time'] = time.time()
+		statistics.record_connect(new_engine.pool.overflow() > 0)
+
+	@event.listens_for(new_engine, 'checkin')
+	def on_checkin(dbapi_connection, connection_record):
+		if connection_record is not None:
+			connection_record.info['checkin_time'] = time.time()
+
+	if settings['DB_POOL_PRE_PING']:
+		@event.listens_for(new_engine, 'checkout')
+		def ping_connection(dbapi_connection, connection_record, connection_proxy):
+			# Only ping connections that have been idle for a while, e.g. after MySQL's wait_timeout
+			checkin_time = connection_record.info.get('checkin_time')
+			if checkin_time is not None and time.time() - checkin_time < settings['DB_POOL_PRE_PING_IDLE_SECONDS']:
+				return
+
+			try:
+				cursor = dbapi_connection.cursor()
+				cursor.execute("SELECT 1")
+				cursor.close()
+			except Exception, e:
+				statistics.record_ping_failure()
+				logger.warning("Stale database connection detected, reconnecting: {0}".format(e))
+				# The pool discards this connection and retries the checkout with a new one
+				raise exc.DisconnectionError()
+
+	return new_engine
@@ -0,0 +1,120 @@
+# coding=utf-8
+"""
+This module contains the router that chooses the read replica used by the read-only db_crud functions.
+Replicas are chosen round-robin or by least latency (an exponentially weighted moving average of the duration of the
+queries run on each replica). After a user writes, the user is pinned to the primary for a few seconds, so that the
+user reads its own writes even if the replicas lag behind.
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+ROUTING_ROUND_ROBIN = "round_robin"
+ROUTING_LEAST_LATENCY = "least_latency"
+
+# Weight of the latest query in the latency moving average of a replica
+LATENCY_SMOOTHING = 0.2
+# Number of pins kept before expired pins are purged
+MAX_PINS_BEFORE_PURGE = 10000
+
+
+class ReplicaRouter(object):
+	"""
+	Chooses a replica engine for each read. All methods are thread-safe.
+	"""
+
+	def __init__(self, engines, routing=ROUTING_ROUND_ROBIN, pin_seconds=0):
+		"""
+		:param engines: the list of replica engines, which may be empty
+		:param routing: how to choose a replica, ROUTING_ROUND_ROBIN or ROUTING_LEAST_LATENCY
+		:param pin_seconds: the number of seconds a user reads from the primary after writing
+		"""
+		if routing not in (ROUTING_ROUND_ROBIN, ROUTING_LEAST_LATENCY):
+			raise ValueError("Unknown replica routing: {0}".format(routing))
+
+		self.engines = list(engines)
+		self.routing = routing
+		self.pin_seconds = pin_seconds
+
+		self._lock = threading.Lock()
+		self._round_robin = itertools.cycle(self.engines)
+		self._latencies = dict((replica, 0.0) for replica in self.engines)
+		self._pins = {}  # user_id -> time until which the user reads from the primary
+
+		if routing == ROUTING_LEAST_LATENCY:
+			for replica in self.engines:
+				self._track_latency(replica)
+
+	def _track_latency(self, replica):
+		@event.listens_for(replica, 'before_cursor_execute')
+		def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+			conn.info['query_start_time'] = time.time()
+
+		@event.listens_for(replica, 'after_cursor_execute')
+		def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+			start_time = conn.info.pop('query_start_time', None)
+			if start_time is not None:
+				self.record_latency(replica, time.time() - start_time)
+
+	def record_latency(self, replica, seconds):
+		"""
+		Add the duration of a query to the latency moving average of a replica.
+		:param replica: the replica engine
+		:param seconds: the duration of the query
+		"""
+		with self._lock:
+			average = self._latencies.get(replica, 0.0)
+			self._latencies[replica] = average + LATENCY_SMOOTHING * (seconds - average)
+
+	def choose(self):
+		"""
+		Choose the replica for the next read.
+		:return: a replica engine, or None if there are no replicas
+		"""
+		if not self.engines:
+			return None
+
+		with self._lock:
+			if self.routing == ROUTING_LEAST_LATENCY:
+				return min(self.engines, key=lambda replica: self._latencies[replica])
+			return next(self._round_robin)
+
+	def pin(self, user_id):
+		"""
+		Make a user read from the primary for the next pin_seconds seconds (call it after the user writes).
+		:param user_id: the user_id of the User
+		"""
+		if not self.engines or not self.pin_seconds or user_id is None:
+			return
+
+		now = time.time()
+		with self._lock:
+			if len(self._pins) >= MAX_PINS_BEFORE_PURGE:
+				self._pins = dict((pinned_user_id, until) for pinned_user_id, until in self._pins.iteritems()
+				                  if until > now)
+			self._pins[user_id] = now + self.pin_seconds
+
+	def is_pinned(self, user_id):
+		"""
+		:param user_id: the user_id of the User
+		:return: True if the User must read from the primary
+		"""
+		if user_id is None:
+			return False
+
+		with self._lock:
+			return self._pins.get(user_id, 0) > time.time()
+
+	def dispose(self):
+		"""
+		Close the connections of all the replica engines.
+		"""
+		for replica in self.engines:
+			replica.dispose()
@@ -84,6 +84,8 @@ class Artwork(BaseTable):
 	artwork_date = Column(String(30))
 	artwork_followed_count = Column(Integer)
 	artwork_critique_count = Column(Integer)
+	# The upvote count of the most popular APPROVED Critique (see db_crud.like_dislike_critique)
+	artwork_top_critique_upvote_count = Column(Integer)
 	artwork_status = Column(String(20))
 	artwork_blog_url = Column(String(100))
 	owner_buyer_user_id = Column(BigInteger, ForeignKey('Buyer.user_id'))
@@ -110,6 +112,8 @@ class Artwork_Auction(BaseTable):
 	artwork_auction_start_time = Column(DateTime)
 	artwork_auction_end_time = Column(DateTime)
 	artwork_auction_fixed_price = Column(Float(12, False, 2))
+	artwork_auction_bid_count = Column(Integer, default=0)  # Maintained by db_crud, with the current bid
+	artwork_auction_max_bid = Column(Float(12, False, 2))  # The amount of the current bid (the highest one)
 	artwork_auction_creation_time = Column(DateTime)
 	artwork_auction_modification_time = Column(DateTime)
 
@@ -230,6 +234,19 @@ class Buyer(BaseTable):
 	followed_artists = relationship("Follow_Artist")
 
 
+class Buyer_Ledger(BaseTable):
+	__tablename__ = "Buyer_Ledger"
+
+	buyer_ledger_id = Column(BigInteger, primary_key=True)
+	buyer_user_id = Column(BigInteger, ForeignKey('Buyer.user_id'), index=True)
+	buyer_ledger_type = Column(String(20))  # BUY_COINS, PURCHASE_CRITIQUE
+	buyer_ledger_cash_change = Column(Float(12, False, 2))
+	buyer_ledger_points_change = Column(Integer)
+	artwork_id = Column(BigInteger)  # The Critique purchased (PURCHASE_CRITIQUE)
+	critic_user_id = Column(BigInteger)
+	buyer_ledger_creation_time = Column(DateTime)
+
+
 class City(BaseTable):
 	__tablename__ = "City"
 
@@ -243,6 +260,13 @@ class City(BaseTable):
 	addresses = relationship("Address", backref="city")
 
 
+class Counter_Flush(BaseTable):
+	__tablename__ = "Counter_Flush"
+
+	counter_flush_id = Column(String(32), primary_key=True)  # A segment of the counter log (see lib.counter_buffer)
+	counter_flush_time = Column(DateTime, index=True)
+
+
 class Country(BaseTable):
 	__tablename__ = "Country"
 
@@ -323,6 +347,14 @@ class Critique_Vote(BaseTable):
 	buyer = relationship("Buyer")
 
 
+class Entity_Version(BaseTable):
+	__tablename__ = "Entity_Version"
+
+	entity_type = Column(String(20), primary_key=True)  # GLOBAL, ARTWORK, PROFILE, USER (see lib.entity_versions)
+	entity_id = Column(BigInteger, primary_key=True)
+	entity_version = Column(BigInteger, nullable=False, default=0)
+
+
 class Follow_Artist(BaseTable):
 	__tablename__ = "Follow_Artist"
 
@@ -0,0 +1,185 @@
+# coding=utf-8
+"""
+This module maintains the version stamps (Entity_Version table) used to build the ETags of the fan and artwork pages.
+Every db_crud transaction bumps, before it commits, the versions of the entities its rows belong to:
+	ARTWORK: an Artwork, its Images, its Critiques (including their vote counts) and its Artwork Auctions (including
+		their current bid)
+	PROFILE: the profile of a User (Artist, Auction_House, Buyer, Critic, Gallery, User rows, events and followers)
+	USER: the private state of a Buyer (its follows, purchased Critiques and votes)
+	GLOBAL: shared data that can't be attributed cheaply (Images, Addresses, Buyer nicknames and bulk updates)
+The counter columns (e.g. the vote counts, or the followed count of a profile) buffered by lib.counter_buffer bump
+the versions of their entities when they're written (see db_crud.write_counter_deltas), and so do the rows whose
+changes always come with a counter change: the Follow_Artist rows, shown as the followers of an Artist, don't bump its
+PROFILE version in the transaction of the follow, which would make all the followers of an Artist wait for each other.
+A page's ETag is a hash of the versions of all the entities it shows, so it can be checked with a couple of small
+queries instead of building and serializing the whole page. Since the versions live in the database, ETags are the
+same in every worker process.
+The GLOBAL version is shown by every page, so it's not bumped in the transaction of the writer (which would hold its row
+lock until it commits, making all such writers wait for each other) but in a transaction of its own, right after the
+writer commits. A page read between both commits may thus keep its former ETag for a few milliseconds.
+"""
+
+import hashlib
+import logging
+import re
+
+from sqlalchemy import and_, event
+from sqlalchemy.exc import IntegrityError
+
+from lib import db_changes
+from lib.db_tables import Entity_Version
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+GLOBAL = "GLOBAL"
+ARTWORK = "ARTWORK"
+PROFILE = "PROFILE"
+USER = "USER"
+
+GLOBAL_KEY = (GLOBAL, 0)
+
+_PROFILE_TABLES = ("Artist", "Auction_House", "Buyer", "Critic", "Gallery", "User")
+_USER_TABLES = ("Critique_Purchase", "Critique_Vote", "Follow_Artist", "Follow_Artwork", "Follow_Auction",
+                "Follow_Critic", "Follow_Gallery")
+_SHARED_TABLES = ("Address", "City", "Country", "Image")
+# Buyer columns shown on other users' pages (e.g. the followers of an Artist)
+_BUYER_PUBLIC_COLUMNS = frozenset(["buyer_nickname", "image_id"])
+
+_ETAG_REGEX = re.compile(r'\*|(?:W/)?"[^"]*"')
+
+
+def version_keys(change):
+	"""
+	Get the entities whose pages are affected by a written row.
+	:param change: a db_changes.RowChange
+	:return: a list of (entity_type, entity_id) keys
+	"""
+	table = change.table
+	values = change.values
+
+	if values is None:
+		# Bulk update or delete: the rows are unknown
+		return [] if table == Entity_Version.__tablename__ else [GLOBAL_KEY]
+
+	keys = []
+
+	def add_key(entity_type, column):
+		if column in values:
+			keys.append((entity_type, values[column]))
+		else:
+			keys.append(GLOBAL_KEY)  # The column wasn't loaded, so the entity is unknown
+
+	if table in ("Artwork", "Artwork_Image", "Critique"):
+		add_key(ARTWORK, 'artwork_id')
+	elif table == "Artwork_Auction":
+		# A new bid (Artwork_Auction_Bid row) is always written with the new current bid of its Artwork Auction
+		add_key(ARTWORK, 'artwork_id')
+	elif table in _PROFILE_TABLES:
+		add_key(PROFILE, 'user_id')
+		if table == "Buyer" and change.action != db_changes.ACTION_INSERT and \
+				(change.changed is None or not _BUYER_PUBLIC_COLUMNS.isdisjoint(change.changed)):
+			keys.append(GLOBAL_KEY)
+	elif table == "Gallery_Event":
+		add_key(PROFILE, 'gallery_user_id')
+	elif table == "Auction_House_Event":
+		add_key(PROFILE, 'auction_house_user_id')
+	elif table in _SHARED_TABLES:
+		# New rows only show up once another row references them
+		if change.action != db_changes.ACTION_INSERT:
+			keys.append(GLOBAL_KEY)
+
+	if table in _USER_TABLES:
+		add_key(USER, 'buyer_user_id')
+
+	return [key for key in keys if key[1] is not None]
+
+
+def install(session_factory):
+	"""
+	Bump the versions of the entities written by every transaction of the sessions created by a session factory.
+	lib.db_changes must be installed on the same session factory.
+	:param session_factory: a sessionmaker (or Session class)
+	"""
+	event.listen(session_factory, 'before_commit', _before_commit)
+
+
+def _before_commit(session):
+	# Flush first, so that the changes of the last flush are recorded too
+	session.flush()
+
+	keys = set()
+	for change in session.info.get('pending_changes', []):
+		keys.update(version_keys(change))
+
+	if GLOBAL_KEY in keys:
+		keys.remove(GLOBAL_KEY)
+		primary = session.get_bind(clause=Entity_Version.__table__.update())
+		db_changes.after_commit(session, lambda: _bump_global_version(primary))
+
+	bump_versions(session, keys)
+
+
+def bump_versions(session, keys):
+	"""
+	Bump the versions of some entities in the current transaction of a session, for the writes that are not made with
+	the ORM (e.g. the counters written by db_crud.write_counter_deltas).
+	:param session: the session
+	:param keys: an iterable of (entity_type, entity_id) keys (see version_keys)
+	"""
+	# Always bump in the same order, to avoid deadlocks between transactions
+	for entity_type, entity_id in sorted(set(keys)):
+		_bump_version(session, entity_type, entity_id)
+
+
+def _bump_global_version(engine):
+	with engine.begin() as connection:
+		_bump_version(connection, *GLOBAL_KEY)
+
+
+def _bump_version(session, entity_type, entity_id):
+	table = Entity_Version.__table__
+	update = table.update(). \
+		where(and_(table.c.entity_type == entity_type, table.c.entity_id == entity_id)). \
+		values(entity_version=table.c.entity_version + 1)
+
+	if session.execute(update).rowcount == 0:
+		try:
+			session.execute(table.insert().values(entity_type=entity_type, entity_id=entity_id, entity_version=1))
+		except IntegrityError:
+			# Inserted by a concurrent transaction
+			session.execute(update)
+
+
+def make_etag(ws_name, arguments, user_id, versions):
+	"""
+	Build the strong ETag of a web service response.
+	:param ws_name: the name of the web service
+	:param arguments: the request arguments (a dictionary with a list of values per argument)
+	:param user_id: the user_id of the requesting User (pages include per-user state)
+	:param versions: a dictionary {(entity_type, entity_id): version} with the versions of the entities shown
+	:return: the ETag, including the double quotes
+	"""
+	stamp = repr((ws_name,
+	              sorted((name, list(values)) for name, values in arguments.iteritems()),
+	              user_id,
+	              sorted(versions.iteritems())))
+
+	return '"{0}"'.format(hashlib.sha1(stamp).hexdigest())
+
+
+def etag_matches(if_none_match, etag):
+	"""
+	Check whether an ETag matches an If-None-Match header.
+	:param if_none_match: the value of the If-None-Match header (may be None)
+	:param etag: the current ETag
+	:return: True if the client has the current version of the response
+	"""
+	if not if_none_match or not etag:
+		return False
+
+	for client_etag in _ETAG_REGEX.findall(if_none_match):
+		if client_etag == "*" or client_etag.replace("W/", "", 1) == etag:
+			return True
+
+	return False
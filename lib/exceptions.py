@@ -10,6 +10,9 @@ The exceptions in this module more or less follow the errors in the base.py file
     '0007': "user inexistent",
     '0008': "user already exists",
     '0009': "unauthorized"
+    '0010': "insufficient funds"
+    '0011': "server busy"
+    '0012': "request timeout"
     ...
 """
 
@@ -92,4 +95,11 @@ class InsufficientFundsError(Error):
 	def __init__(self):
 		value = "0010"
 		msg = "insufficient funds"
-		super(InsufficientFundsError, self).__init__(value, msg)
\ No newline at end of file
+		super(InsufficientFundsError, self).__init__(value, msg)
+
+
+class ServerBusyError(Error):
+	def __init__(self):
+		value = "0011"
+		msg = "server busy"
+		super(ServerBusyError, self).__init__(value, msg)
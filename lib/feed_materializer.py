@@ -0,0 +1,326 @@
+# coding=utf-8
+"""
+This module keeps the home feeds (the AVAILABLE Artwork ranked by each sorting rule) materialized in memory, so that
+a page of the feed is an O(page) slice of a list of ids instead of a sort of the whole Artwork table. Each feed is also
+kept per Artist, for the Artwork list of the Artist page.
+The feeds are built from a single query over the ranking columns of Artwork (plus one over the auctions, for the
+price of each Artwork), and kept up to date with the Artwork, Artwork_Auction and Artwork_Auction_Bid rows written by
+the db_crud transactions of this process (follows and critiques update the Artwork counters in the same transaction,
+and make_bid moves the current bid of the auction). Writes made by other worker processes are picked up when the
+feeds are rebuilt, every FEED_REFRESH_SECONDS seconds (see lib.materialized_view).
+"""
+
+import bisect
+import logging
+
+from lib import db_changes
+from lib.materialized_view import MaterializedView
+from lib.sorted_index import SortedIndex, ascending, descending
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+# The Artwork columns needed to rank the feeds
+FEED_COLUMNS = ("artwork_id", "artwork_status", "artist_user_id", "artwork_followed_count", "artwork_display_weight",
+                "artwork_creation_time", "artwork_critique_count", "artwork_top_critique_upvote_count")
+
+# The Artwork_Auction columns needed to get the price of an Artwork
+AUCTION_COLUMNS = ("artwork_auction_id", "artwork_id", "artwork_auction_current_bid", "artwork_auction_minimum_bid",
+                   "artwork_auction_fixed_price", "artwork_auction_start_time")
+
+# Sort key of each materialized sorting rule (see db_crud.get_artwork_list), as a function of the Artwork row values
+# (the FEED_COLUMNS, and the artwork_price of the Artwork, see auction_price)
+FEED_SORT_KEYS = {
+	# 1: most popular Artwork
+	1: lambda row: (descending(row['artwork_followed_count']), descending(row['artwork_display_weight'])),
+	# 6: latest Artwork (uploaded)
+	6: lambda row: (descending(row['artwork_creation_time']),),
+	# 7: most Critiques
+	7: lambda row: (descending(row['artwork_critique_count']), descending(row['artwork_display_weight'])),
+	# 8: highest to lowest price (Artwork without a price last)
+	8: lambda row: (descending(row['artwork_price']), descending(row['artwork_display_weight'])),
+	# 9: lowest to highest price (Artwork without a price last)
+	9: lambda row: (row['artwork_price'] is None, ascending(row['artwork_price']),
+	                descending(row['artwork_display_weight'])),
+	# 10: most popular critique
+	10: lambda row: (descending(row['artwork_top_critique_upvote_count']), descending(row['artwork_display_weight'])),
+}
+
+# Sort key of the watched feeds (sorting rules 2, 3 and 4), which are a selection of Artwork ranked per request (see
+# FeedMaterializer.get_selection_page)
+SELECTION_SORT_KEY = lambda row: (descending(row['artwork_display_weight']),)
+
+
+def auction_price(auction, current_bid_amount):
+	"""
+	Get the price of an Artwork Auction: its current bid, or else its minimum bid, or else its fixed price.
+	:param auction: a dictionary with the AUCTION_COLUMNS of the Artwork Auction
+	:param current_bid_amount: the amount of the current bid of the Artwork Auction, None if it has no bids
+	:return: the price, or None if the Artwork Auction has none
+	"""
+	for price in (current_bid_amount, auction['artwork_auction_minimum_bid'], auction['artwork_auction_fixed_price']):
+		if price is not None:
+			return price
+
+	return None
+
+
+def _latest_auction_key(auction):
+	# The price of an Artwork is the price of its latest Artwork Auction
+	return ascending(auction['artwork_auction_start_time']), auction['artwork_auction_id']
+
+
+class FeedMaterializer(MaterializedView):
+	"""
+	The in-memory feeds of a process. All methods are thread-safe.
+	"""
+
+	name = "home feeds"
+	tables = ("Artwork", "Artwork_Auction", "Artwork_Auction_Bid")
+	referenced_tables = ("Artwork_Auction_Bid",)
+
+	def __init__(self, load_rows, refresh_seconds, enabled=True):
+		"""
+		:param load_rows: a function that returns the FEED_COLUMNS values of every Artwork, as a list of dictionaries
+			that also contain the list of its "auctions" (dictionaries with the AUCTION_COLUMNS values and the
+			"current_bid_amount")
+		:param refresh_seconds: the max age of the feeds before they are rebuilt from the database
+		:param enabled: whether the feeds are materialized at all
+		"""
+		super(FeedMaterializer, self).__init__(load_rows, refresh_seconds, enabled)
+
+		self._rows = None  # artwork_id -> dictionary with the FEED_COLUMNS values and the artwork_price
+		self._auctions = {}  # artwork_auction_id -> dictionary with the AUCTION_COLUMNS values
+		self._artwork_auctions = {}  # artwork_id -> set of artwork_auction_id
+		self._bid_amounts = {}  # artwork_auction_bid_id -> amount, for the current bids (and the new bids)
+		self._feeds = {}  # sorting_rule -> SortedIndex of the AVAILABLE Artwork
+		self._artist_feeds = {}  # (sorting_rule, artist_user_id) -> SortedIndex of the AVAILABLE Artwork of an Artist
+
+	def serves(self, sorting_rule):
+		"""
+		:param sorting_rule: a sorting rule of db_crud.get_artwork_list
+		:return: True if the feed of the sorting rule is materialized
+		"""
+		return self.enabled and sorting_rule in FEED_SORT_KEYS
+
+	def get_page(self, sorting_rule, limit, offset=0, after=None, artist_id=None):
+		"""
+		Get a page of a feed, rebuilding the feeds first if they are too old.
+		:param sorting_rule: a sorting rule for which serves() is True
+		:param limit: the max number of Artwork ids to return
+		:param offset: the position of the first Artwork in the feed
+		:param after: the Artwork values (artwork_id and sort columns) of a cursor (see lib.pagination); if given, the
+		page starts after that Artwork and offset is ignored. The current values of the Artwork in the feeds are used
+		instead of the values of the cursor (which are read from its row, without the buffered counter increments of
+		apply_counter_deltas, or lack the price), unless the Artwork is no longer in the feeds
+		:param artist_id: the Artist whose feed to read, None for the feed of all the Artwork
+		:return: a list of artwork_id
+		"""
+		self._refresh_if_needed()
+
+		with self._lock:
+			if after is not None:
+				after_row = dict(after, artwork_price=None)
+				after_row.update(self._rows.get(after['artwork_id'], {}))
+				after = (FEED_SORT_KEYS[sorting_rule](after_row), after['artwork_id'])
+
+			feed = self._feeds[sorting_rule] if artist_id is None else self._artist_feeds.get((sorting_rule, artist_id))
+			if feed is None:
+				return []
+			return feed.get_page(limit, offset, after)
+
+	def get_selection_page(self, limit, offset=0, after=None, artwork_ids=(), artist_ids=()):
+		"""
+		Get a page of the AVAILABLE Artwork among some Artwork and the Artwork of some Artists (e.g. the Artwork watched
+		by a Buyer), sorted by SELECTION_SORT_KEY, rebuilding the feeds first if they are too old.
+		:param limit: the max number of Artwork ids to return
+		:param offset: the position of the first Artwork in the selection
+		:param after: the Artwork values (artwork_id and sort columns) of a cursor (see lib.pagination); if given, the
+		page starts after that Artwork and offset is ignored
+		:param artwork_ids: an iterable of artwork_id to select
+		:param artist_ids: an iterable of artist_user_id whose Artwork to select
+		:return: a list of artwork_id
+		"""
+		self._refresh_if_needed()
+
+		with self._lock:
+			selected_ids = set(artwork_ids)
+			for artist_id in artist_ids:
+				# Every feed of an Artist holds all its AVAILABLE Artwork
+				selected_ids.update(self._artist_feeds.get((1, artist_id), ()))
+
+			entries = sorted((SELECTION_SORT_KEY(self._rows[artwork_id]), artwork_id) for artwork_id in selected_ids
+			                 if artwork_id in self._rows and _is_available(self._rows[artwork_id]))
+
+		if after is not None:
+			offset = bisect.bisect_right(entries, (SELECTION_SORT_KEY(after), after['artwork_id']))
+		return [artwork_id for sort_key, artwork_id in entries[offset:offset + limit]]
+
+	def apply_counter_deltas(self, deltas):
+		"""
+		Update the feeds with the buffered increments of the Artwork counters (a lib.counter_buffer listener), which
+		are not written to the Artwork rows yet.
+		:param deltas: a list of (table name, primary key tuple, column, delta)
+		"""
+		with self._lock:
+			for table, row_id, column, delta in deltas:
+				if table != "Artwork" or column not in FEED_COLUMNS or row_id[0] not in self._rows:
+					continue
+				old_row = self._rows[row_id[0]]
+				row = dict(old_row)
+				row[column] = (row[column] or 0) + delta
+				self._rows[row_id[0]] = row
+				self._update_feeds(row_id[0], old_row, row)
+
+	def _build(self, rows):
+		self._rows = {}
+		self._auctions = {}
+		self._artwork_auctions = {}
+		self._bid_amounts = {}
+		for row in rows:
+			for auction in row['auctions']:
+				self._auctions[auction['artwork_auction_id']] = dict((column, auction[column])
+				                                                     for column in AUCTION_COLUMNS)
+				self._artwork_auctions.setdefault(row['artwork_id'], set()).add(auction['artwork_auction_id'])
+				if auction['artwork_auction_current_bid'] is not None:
+					self._bid_amounts[auction['artwork_auction_current_bid']] = auction['current_bid_amount']
+
+			self._rows[row['artwork_id']] = dict((column, row[column]) for column in FEED_COLUMNS)
+			self._rows[row['artwork_id']]['artwork_price'] = self._artwork_price(row['artwork_id'])
+
+		available_rows = [row for row in self._rows.itervalues() if _is_available(row)]
+		self._feeds = {}
+		self._artist_feeds = {}
+		for sorting_rule, sort_key in FEED_SORT_KEYS.iteritems():
+			self._feeds[sorting_rule] = SortedIndex((row['artwork_id'], sort_key(row)) for row in available_rows)
+			artist_entries = {}
+			for row in available_rows:
+				artist_entries.setdefault(row['artist_user_id'], []).append((row['artwork_id'], sort_key(row)))
+			for artist_user_id, entries in artist_entries.iteritems():
+				self._artist_feeds[(sorting_rule, artist_user_id)] = SortedIndex(entries)
+
+	def _artwork_price(self, artwork_id):
+		auction_ids = self._artwork_auctions.get(artwork_id)
+		if not auction_ids:
+			return None
+
+		auction = max((self._auctions[auction_id] for auction_id in auction_ids), key=_latest_auction_key)
+		return auction_price(auction, self._bid_amounts.get(auction['artwork_auction_current_bid']))
+
+	def _apply_change(self, change):
+		if change.table == "Artwork_Auction_Bid":
+			self._apply_bid_change(change)
+		elif change.table == "Artwork_Auction":
+			self._apply_auction_change(change)
+		else:
+			self._apply_artwork_change(change)
+
+	def _apply_artwork_change(self, change):
+		if change.values is None or 'artwork_id' not in change.values:
+			# Unknown rows (e.g. a bulk update): rebuild on the next read
+			self._stale = True
+			return
+
+		artwork_id = change.values['artwork_id']
+		old_row = self._rows.get(artwork_id)
+
+		if change.action == db_changes.ACTION_DELETE:
+			self._rows.pop(artwork_id, None)
+			row = None
+		else:
+			row = dict(old_row) if old_row is not None else {}
+			if change.action == db_changes.ACTION_INSERT and old_row is None:
+				row.update((column, None) for column in FEED_COLUMNS)
+			row.update((column, value) for column, value in change.values.iteritems() if column in FEED_COLUMNS)
+			if not all(column in row for column in FEED_COLUMNS):
+				# An Artwork updated without its ranking columns loaded
+				self._stale = True
+				return
+			row['artwork_price'] = self._artwork_price(artwork_id)
+			self._rows[artwork_id] = row
+
+		self._update_feeds(artwork_id, old_row, row)
+
+	def _apply_auction_change(self, change):
+		values = change.values
+		if change.action == db_changes.ACTION_UPDATE and change.changed is not None and \
+				change.changed.isdisjoint(AUCTION_COLUMNS):
+			return
+
+		if values is None or not all(column in values for column in AUCTION_COLUMNS):
+			# Unknown rows (e.g. a bulk update), or an Artwork Auction updated without its price columns loaded
+			self._stale = True
+			return
+
+		auction_id = values['artwork_auction_id']
+		old_auction = self._auctions.pop(auction_id, None)
+		if old_auction is not None:
+			self._artwork_auctions.get(old_auction['artwork_id'], set()).discard(auction_id)
+			if old_auction['artwork_auction_current_bid'] != values['artwork_auction_current_bid']:
+				self._bid_amounts.pop(old_auction['artwork_auction_current_bid'], None)
+
+		if change.action != db_changes.ACTION_DELETE:
+			self._auctions[auction_id] = dict((column, values[column]) for column in AUCTION_COLUMNS)
+			self._artwork_auctions.setdefault(values['artwork_id'], set()).add(auction_id)
+			current_bid = values['artwork_auction_current_bid']
+			if current_bid is not None and current_bid not in self._bid_amounts:
+				# A bid made by another process
+				self._stale = True
+				return
+
+		self._reprice(values['artwork_id'])
+		if old_auction is not None and old_auction['artwork_id'] != values['artwork_id']:
+			self._reprice(old_auction['artwork_id'])
+
+	def _apply_bid_change(self, change):
+		values = change.values
+		if change.action == db_changes.ACTION_UPDATE and change.changed is not None and \
+				'artwork_auction_bid_amount' not in change.changed:
+			return
+
+		if values is None or 'artwork_auction_bid_id' not in values:
+			self._stale = True
+			return
+
+		bid_id = values['artwork_auction_bid_id']
+		if change.action == db_changes.ACTION_DELETE:
+			self._bid_amounts.pop(bid_id, None)
+		elif 'artwork_auction_bid_amount' in values:
+			# New bids are kept too, since the Artwork Auction is updated to point to them afterwards
+			self._bid_amounts[bid_id] = values['artwork_auction_bid_amount']
+		else:
+			self._stale = True
+			return
+
+		auction = self._auctions.get(values.get('artwork_auction_id'))
+		if auction is not None and auction['artwork_auction_current_bid'] == bid_id:
+			self._reprice(auction['artwork_id'])
+
+	def _reprice(self, artwork_id):
+		old_row = self._rows.get(artwork_id)
+		if old_row is None:
+			return
+
+		row = dict(old_row, artwork_price=self._artwork_price(artwork_id))
+		self._rows[artwork_id] = row
+		self._update_feeds(artwork_id, old_row, row)
+
+	def _update_feeds(self, artwork_id, old_row, row):
+		available = row is not None and _is_available(row)
+		for sorting_rule, feed in self._feeds.iteritems():
+			if old_row is not None and (not available or old_row['artist_user_id'] != row['artist_user_id']):
+				artist_feed = self._artist_feeds.get((sorting_rule, old_row['artist_user_id']))
+				if artist_feed is not None:
+					artist_feed.remove(artwork_id)
+
+			if available:
+				sort_key = FEED_SORT_KEYS[sorting_rule](row)
+				feed.upsert(artwork_id, sort_key)
+				self._artist_feeds.setdefault((sorting_rule, row['artist_user_id']), SortedIndex()). \
+					upsert(artwork_id, sort_key)
+			else:
+				feed.remove(artwork_id)
+
+
+def _is_available(row):
+	return (row['artwork_status'] or "").upper() == "AVAILABLE"
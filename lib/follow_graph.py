@@ -0,0 +1,190 @@
+# coding=utf-8
+"""
+This module keeps the follow graph (which Buyers follow which Artists, Artwork, Auction Houses, Critics and Galleries)
+in memory, together with the Artwork critiqued by each Critic, so that the candidates of the "watched" home feeds of a
+Buyer (see db_crud.get_artwork_list) are found without joining the Follow_* tables.
+The graph is stored as sorted arrays of ids, per Buyer and per followed user or Artwork. It is built with one query per
+table, and kept up to date with the Follow_* and Critique rows written by the db_crud transactions of this process
+(see lib.materialized_view). The follows written by other processes are picked up when the graph is rebuilt, except for
+the follows of the Buyer reading the graph, which are reloaded once they were written by any process (see sync_buyer).
+"""
+
+import bisect
+import logging
+from array import array
+
+from lib import db_changes
+from lib.materialized_view import MaterializedView
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+# The follow tables: (table name, followed type of db_crud.follow_something, followed column, status column)
+FOLLOW_TABLES = (("Follow_Artist", "ARTIST", "artist_user_id", "follow_artist_status"),
+                 ("Follow_Artwork", "ARTWORK", "artwork_id", "follow_artwork_status"),
+                 ("Follow_Auction", "AUCTION_HOUSE", "auction_house_user_id", "follow_auction_status"),
+                 ("Follow_Critic", "CRITIC", "critic_user_id", "follow_critic_status"),
+                 ("Follow_Gallery", "GALLERY", "gallery_user_id", "follow_gallery_status"))
+
+# The relation of the Critique edges (Critic -> Artwork) of the graph
+CRITIQUE = "CRITIQUE"
+
+_FOLLOW_TABLES_BY_NAME = dict((follow_table[0], follow_table) for follow_table in FOLLOW_TABLES)
+
+
+def _add(adjacency, key, item_id):
+	ids = adjacency.get(key)
+	if ids is None:
+		adjacency[key] = array('l', [item_id])
+		return
+
+	position = bisect.bisect_left(ids, item_id)
+	if position == len(ids) or ids[position] != item_id:
+		ids.insert(position, item_id)
+
+
+def _remove(adjacency, key, item_id):
+	ids = adjacency.get(key)
+	if ids is None:
+		return
+
+	position = bisect.bisect_left(ids, item_id)
+	if position < len(ids) and ids[position] == item_id:
+		ids.pop(position)
+		if not ids:
+			del adjacency[key]
+
+
+class FollowGraph(MaterializedView):
+	"""
+	The in-memory follow graph of a process. All methods are thread-safe.
+	"""
+
+	name = "follow graph"
+	tables = tuple(follow_table[0] for follow_table in FOLLOW_TABLES) + ("Critique",)
+
+	def __init__(self, load_rows, load_buyer_rows, refresh_seconds, enabled=True):
+		"""
+		:param load_rows: a function that returns every edge of the graph as a tuple (relation, source id, target id):
+			(followed type, buyer_user_id, followed id) for the follows with status "following", and
+			(CRITIQUE, critic_user_id, artwork_id) for the APPROVED Critiques (see db_crud.get_follow_graph_rows)
+		:param load_buyer_rows: a function that receives a buyer_user_id and returns the edges of its follows
+		:param refresh_seconds: the max age of the graph before it is rebuilt from the database
+		:param enabled: whether the graph is materialized at all
+		"""
+		super(FollowGraph, self).__init__(load_rows, refresh_seconds, enabled)
+		self.load_buyer_rows = load_buyer_rows
+
+		self._following = {}  # (relation, source id) -> sorted array of target ids
+		self._followers = {}  # (relation, target id) -> sorted array of source ids
+		self._buyer_versions = {}  # buyer_user_id -> the USER version its follows were reloaded at (see sync_buyer)
+
+	def sync_buyer(self, buyer_user_id, version):
+		"""
+		Reload the follows of a Buyer if they may have been written (by any process) since they were last loaded, i.e.
+		if its USER version (see lib.entity_versions) is not the one they were reloaded at. This is called before
+		reading the follows of the Buyer, so that it reads its own writes even if another process made them.
+		:param buyer_user_id: the user_id of the Buyer
+		:param version: the current USER version of the Buyer, read from the primary database
+		"""
+		self._refresh_if_needed()
+
+		with self._lock:
+			if self._buyer_versions.get(buyer_user_id) == version:
+				return
+
+		# If the follows are written again meanwhile, the version changes again and they're reloaded by the next read
+		rows = self.load_buyer_rows(buyer_user_id)
+
+		with self._lock:
+			for table_name, relation, target_column, status_column in FOLLOW_TABLES:
+				for target_id in self._following.pop((relation, buyer_user_id), ()):
+					_remove(self._followers, (relation, target_id), buyer_user_id)
+			for relation, source_id, target_id in rows:
+				_add(self._following, (relation, source_id), target_id)
+				_add(self._followers, (relation, target_id), source_id)
+			self._buyer_versions[buyer_user_id] = version
+
+	def get_following(self, relation, source_id):
+		"""
+		Get the targets of a source, rebuilding the graph first if it's too old.
+		:param relation: a followed type (e.g. "ARTIST") or CRITIQUE
+		:param source_id: the buyer_user_id (or critic_user_id for CRITIQUE)
+		:return: a sorted list of the followed ids (or critiqued artwork_id)
+		"""
+		self._refresh_if_needed()
+
+		with self._lock:
+			return self._following.get((relation, source_id), array('l')).tolist()
+
+	def get_followers(self, relation, target_id):
+		"""
+		Get the sources of a target, rebuilding the graph first if it's too old.
+		:param relation: a followed type (e.g. "ARTIST") or CRITIQUE
+		:param target_id: the followed id (or artwork_id for CRITIQUE)
+		:return: a sorted list of the buyer_user_id following it (or critic_user_id)
+		"""
+		self._refresh_if_needed()
+
+		with self._lock:
+			return self._followers.get((relation, target_id), array('l')).tolist()
+
+	def get_critiqued_by_followed(self, buyer_user_id):
+		"""
+		Get the Artwork critiqued by the Critics followed by a Buyer, rebuilding the graph first if it's too old.
+		:param buyer_user_id: the user_id of the Buyer
+		:return: a set of artwork_id
+		"""
+		self._refresh_if_needed()
+
+		artwork_ids = set()
+		with self._lock:
+			for critic_user_id in self._following.get(("CRITIC", buyer_user_id), ()):
+				artwork_ids.update(self._following.get((CRITIQUE, critic_user_id), ()))
+
+		return artwork_ids
+
+	def _build(self, rows):
+		following = {}
+		followers = {}
+		for relation, source_id, target_id in rows:
+			following.setdefault((relation, source_id), []).append(target_id)
+			followers.setdefault((relation, target_id), []).append(source_id)
+
+		self._following = dict((key, array('l', sorted(set(ids)))) for key, ids in following.iteritems())
+		self._followers = dict((key, array('l', sorted(set(ids)))) for key, ids in followers.iteritems())
+		self._buyer_versions = {}
+
+	def _apply_change(self, change):
+		values = change.values
+		if change.table == "Critique":
+			relation, source_column, target_column, status_column = CRITIQUE, "critic_user_id", "artwork_id", \
+				"critique_status"
+			edge_status = "approved"
+		else:
+			table_name, relation, target_column, status_column = _FOLLOW_TABLES_BY_NAME[change.table]
+			source_column = "buyer_user_id"
+			edge_status = "following"
+
+		if change.action == db_changes.ACTION_UPDATE and change.changed is not None:
+			if status_column not in change.changed and source_column not in change.changed and \
+					target_column not in change.changed:
+				return  # e.g. a vote on a Critique
+			if source_column in change.changed or target_column in change.changed:
+				# The previous edge is unknown
+				self._stale = True
+				return
+
+		if values is None or source_column not in values or target_column not in values or \
+				(change.action != db_changes.ACTION_DELETE and status_column not in values):
+			# Unknown rows (e.g. a bulk update): rebuild on the next read
+			self._stale = True
+			return
+
+		source_id, target_id = values[source_column], values[target_column]
+		if change.action != db_changes.ACTION_DELETE and (values[status_column] or "").lower() == edge_status:
+			_add(self._following, (relation, source_id), target_id)
+			_add(self._followers, (relation, target_id), source_id)
+		else:
+			_remove(self._following, (relation, source_id), target_id)
+			_remove(self._followers, (relation, target_id), source_id)
@@ -0,0 +1,336 @@
+# coding=utf-8
+"""
+This module keeps the locations of the venues (Galleries and Auction Houses) in an in-memory spatial index, used to
+rank the Artwork of the "nearby Galleries" home feed by the distance of their owner.
+Address.geolocation is free text ("lat,long" or e.g. 24°49′N 120°59′E), so it is parsed into numeric coordinates when
+the index is built. The index is kept up to date with the venue and Address rows written by the db_crud transactions
+of this process (see lib.materialized_view).
+
+The points are stored in a grid of cubic cells over their unit vectors (x, y, z) on the sphere. The straight-line
+(chord) distance between two unit vectors grows with their great-circle distance, so a point in a cell k cells away
+from the cell of the query is always at least (k - 1) cells away, and a k-nearest or radius query only visits the
+cells around the query point instead of every venue.
+"""
+
+import heapq
+import logging
+import math
+import re
+
+from lib import db_changes
+from lib.materialized_view import MaterializedView
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# The venue tables: (table name, owner type of lib.owner_directory)
+VENUE_TABLES = (("Gallery", "GALLERY"), ("Auction_House", "AUCTION_HOUSE"))
+
+_VENUE_TYPES = dict(VENUE_TABLES)
+
+_DECIMAL_REGEX = re.compile(r'^\s*([-+]?\d+(?:\.\d+)?)\s*[,;\s]\s*([-+]?\d+(?:\.\d+)?)\s*$')
+_DMS_REGEX = re.compile(u'(\\d+(?:\\.\\d+)?)\\s*[°º]\\s*(?:(\\d+(?:\\.\\d+)?)\\s*[′\']\\s*)?'
+                        u'(?:(\\d+(?:\\.\\d+)?)\\s*(?:[″"]|\'\')\\s*)?([NSEWnsew])')
+
+
+def parse_geolocation(text):
+	"""
+	Parse a location written as decimal degrees ("24.971059,121.241765") or as degrees, minutes and seconds with the
+	hemispheres (u"24°49′N 120°59′E").
+	:param text: the location (str or unicode), may be None
+	:return: a tuple (latitude, longitude) in decimal degrees, or None if the text is not a valid location
+	"""
+	if not text:
+		return None
+	if isinstance(text, str):
+		try:
+			text = text.decode('utf-8')
+		except UnicodeDecodeError:
+			return None
+
+	match = _DECIMAL_REGEX.match(text)
+	if match is not None:
+		latitude, longitude = float(match.group(1)), float(match.group(2))
+	else:
+		latitude = longitude = None
+		for degrees, minutes, seconds, hemisphere in _DMS_REGEX.findall(text):
+			value = float(degrees) + float(minutes or 0) / 60 + float(seconds or 0) / 3600
+			hemisphere = hemisphere.upper()
+			if hemisphere in "NS" and latitude is None:
+				latitude = -value if hemisphere == "S" else value
+			elif hemisphere in "EW" and longitude is None:
+				longitude = -value if hemisphere == "W" else value
+			else:
+				return None
+		if latitude is None or longitude is None:
+			return None
+
+	if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+		return None
+
+	return latitude, longitude
+
+
+def _unit_vector(latitude, longitude):
+	latitude, longitude = math.radians(latitude), math.radians(longitude)
+	return math.cos(latitude) * math.cos(longitude), math.cos(latitude) * math.sin(longitude), math.sin(latitude)
+
+
+def _chord(point, other_point):
+	dx, dy, dz = point[0] - other_point[0], point[1] - other_point[1], point[2] - other_point[2]
+	return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+
+def _chord_to_km(chord):
+	return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+def _km_to_chord(km):
+	return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+def _ring(center, ring):
+	# The cells at Chebyshev distance ring from the center cell
+	cx, cy, cz = center
+	for dx in xrange(-ring, ring + 1):
+		for dy in xrange(-ring, ring + 1):
+			if abs(dx) == ring or abs(dy) == ring:
+				dzs = xrange(-ring, ring + 1)
+			else:
+				dzs = (-ring, ring) if ring else (0,)
+			for dz in dzs:
+				yield cx + dx, cy + dy, cz + dz
+
+
+class GeoGrid(object):
+	"""
+	A spatial index of points on the Earth, each with a unique key. Not thread-safe.
+	"""
+
+	def __init__(self, cell_km=10.0):
+		"""
+		:param cell_km: the size of the cells, about the distance between the points of the typical query
+		"""
+		self._cell_size = _km_to_chord(cell_km)
+		self._points = {}  # key -> unit vector
+		self._cells = {}  # cell -> set of keys
+
+	def __len__(self):
+		return len(self._points)
+
+	def _cell(self, point):
+		return tuple(int(math.floor(coordinate / self._cell_size)) for coordinate in point)
+
+	def add(self, key, latitude, longitude):
+		"""
+		Add a point, replacing the previous point of the key.
+		"""
+		self.remove(key)
+		point = _unit_vector(latitude, longitude)
+		self._points[key] = point
+		self._cells.setdefault(self._cell(point), set()).add(key)
+
+	def remove(self, key):
+		"""
+		Remove the point of a key, if any.
+		"""
+		point = self._points.pop(key, None)
+		if point is not None:
+			cell = self._cell(point)
+			self._cells[cell].discard(key)
+			if not self._cells[cell]:
+				del self._cells[cell]
+
+	def distance(self, key, latitude, longitude):
+		"""
+		:return: the great-circle distance in km from a location to the point of a key, or None if it has no point
+		"""
+		point = self._points.get(key)
+		if point is None:
+			return None
+
+		return _chord_to_km(_chord(_unit_vector(latitude, longitude), point))
+
+	def nearest(self, latitude, longitude, k=None, radius=None):
+		"""
+		Find the points nearest to a location.
+		:param latitude: the latitude of the location
+		:param longitude: the longitude of the location
+		:param k: the max number of points to return, None for no limit
+		:param radius: the max distance in km of the points to return, None for no limit
+		:return: a list of (distance in km, key), sorted by distance (then key)
+		"""
+		if k is not None and k <= 0:
+			return []
+
+		center_point = _unit_vector(latitude, longitude)
+		center = self._cell(center_point)
+		max_chord = _km_to_chord(radius) if radius is not None else None
+
+		candidates = []  # (chord, key)
+		points = self._points
+		cells = self._cells
+
+		def add_candidates(keys):
+			for key in keys:
+				chord = _chord(center_point, points[key])
+				if max_chord is None or chord <= max_chord:
+					candidates.append((chord, key))
+
+		ring = 0
+		while True:
+			if 24 * ring * ring + 2 > len(cells):
+				# More cells on this ring than occupied cells: check the remaining occupied cells directly
+				for cell, keys in cells.iteritems():
+					if max(abs(a - b) for a, b in zip(cell, center)) >= ring:
+						add_candidates(keys)
+				break
+
+			for cell in _ring(center, ring):
+				if cell in cells:
+					add_candidates(cells[cell])
+
+			# The points in the next rings are at least ring cells away
+			bound = ring * self._cell_size
+			if max_chord is not None and bound > max_chord:
+				break
+			if k is not None and len(candidates) >= k and heapq.nsmallest(k, candidates)[-1][0] <= bound:
+				break
+			ring += 1
+
+		candidates = heapq.nsmallest(k, candidates) if k is not None else sorted(candidates)
+
+		return [(_chord_to_km(chord), key) for chord, key in candidates]
+
+
+class GeoIndex(MaterializedView):
+	"""
+	The in-memory index of the venue locations of a process. All methods are thread-safe.
+	The venues are identified by their (owner_type, user_id), as in lib.owner_directory.
+	"""
+
+	name = "geo index"
+	tables = tuple(venue_table[0] for venue_table in VENUE_TABLES) + ("Address",)
+	referenced_tables = ("Address",)
+
+	def __init__(self, load_rows, refresh_seconds, enabled=True, cell_km=10.0):
+		"""
+		:param load_rows: a function that returns every venue as a dictionary with the keys owner_type, user_id,
+			address_id and geolocation (see db_crud.get_venue_location_rows)
+		:param refresh_seconds: the max age of the index before it is rebuilt from the database
+		:param enabled: whether the index is materialized at all
+		:param cell_km: the size of the cells of the GeoGrid
+		"""
+		super(GeoIndex, self).__init__(load_rows, refresh_seconds, enabled)
+
+		self.cell_km = cell_km
+		self._venues = {}  # (owner_type, user_id) -> address_id
+		self._addresses = {}  # address_id -> (latitude, longitude), or None if the geolocation is not valid
+		self._address_venues = {}  # address_id -> set of (owner_type, user_id)
+		self._grid = GeoGrid(cell_km)
+
+	def nearest(self, latitude, longitude, k=None, radius=None):
+		"""
+		Find the venues nearest to a location (see GeoGrid.nearest), rebuilding the index first if it's too old.
+		:return: a list of (distance in km, (owner_type, user_id)), sorted by distance
+		"""
+		self._refresh_if_needed()
+
+		with self._lock:
+			return self._grid.nearest(latitude, longitude, k, radius)
+
+	def distance(self, venue_key, latitude, longitude):
+		"""
+		:param venue_key: the (owner_type, user_id) of a venue
+		:return: the distance in km from a location to the venue, or None if its location is unknown
+		"""
+		self._refresh_if_needed()
+
+		with self._lock:
+			return self._grid.distance(venue_key, latitude, longitude)
+
+	def _build(self, rows):
+		self._venues = {}
+		self._addresses = {}
+		self._address_venues = {}
+		self._grid = GeoGrid(self.cell_km)
+
+		for row in rows:
+			if row['address_id'] is not None:
+				self._addresses[row['address_id']] = parse_geolocation(row['geolocation'])
+			self._set_venue((row['owner_type'], row['user_id']), row['address_id'])
+
+	def _set_venue(self, venue_key, address_id):
+		old_address_id = self._venues.get(venue_key)
+		if old_address_id is not None:
+			self._address_venues[old_address_id].discard(venue_key)
+
+		self._venues[venue_key] = address_id
+		if address_id is not None:
+			self._address_venues.setdefault(address_id, set()).add(venue_key)
+		self._place(venue_key)
+
+	def _place(self, venue_key):
+		location = self._addresses.get(self._venues.get(venue_key))
+		if location is not None:
+			self._grid.add(venue_key, *location)
+		else:
+			self._grid.remove(venue_key)
+
+	def _apply_change(self, change):
+		values = change.values
+		if change.table == "Address":
+			self._apply_address_change(change)
+			return
+
+		if values is None or 'user_id' not in values:
+			# Unknown rows (e.g. a bulk update): rebuild on the next read
+			self._stale = True
+			return
+
+		venue_key = (_VENUE_TYPES[change.table], values['user_id'])
+
+		if change.action == db_changes.ACTION_DELETE:
+			self._set_venue(venue_key, None)
+			del self._venues[venue_key]
+			return
+
+		if change.action == db_changes.ACTION_UPDATE and change.changed is not None and \
+				'address_id' not in change.changed:
+			return
+		if change.action == db_changes.ACTION_UPDATE and 'address_id' not in values:
+			self._stale = True
+			return
+
+		address_id = values.get('address_id')
+		self._set_venue(venue_key, address_id)
+		if address_id is not None and address_id not in self._addresses:
+			# An Address written by another process, or not used by any venue until now
+			self._stale = True
+
+	def _apply_address_change(self, change):
+		values = change.values
+		if change.action == db_changes.ACTION_UPDATE and change.changed is not None and \
+				'geolocation' not in change.changed:
+			return
+
+		if values is None or 'address_id' not in values:
+			self._stale = True
+			return
+
+		address_id = values['address_id']
+		if change.action == db_changes.ACTION_DELETE:
+			self._addresses.pop(address_id, None)
+		elif 'geolocation' in values:
+			# New Addresses are kept too, since a venue may start using them later
+			self._addresses[address_id] = parse_geolocation(values['geolocation'])
+		elif change.action == db_changes.ACTION_INSERT:
+			self._addresses[address_id] = None
+		else:
+			self._stale = True
+			return
+
+		for venue_key in self._address_venues.get(address_id, ()):
+			self._place(venue_key)
@@ -0,0 +1,123 @@
+# coding=utf-8
+"""
+This module contains the base class of the in-memory views of database tables (e.g. the home feeds), which are built
+from a single query and kept up to date with the rows written by the db_crud transactions of this process (see
+lib.db_changes). Writes made by other worker processes are picked up when a view is rebuilt, every refresh_seconds.
+"""
+
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+
+class MaterializedView(object):
+	"""
+	An in-memory view of some database tables. All public methods are thread-safe.
+	Subclasses implement _build() and _apply_change(), which are called with the lock held, and read the view with
+	the lock held after calling _refresh_if_needed().
+	"""
+
+	# A description of the view, for the logs
+	name = "materialized view"
+	# The names of the tables whose changes are applied to the view
+	tables = ()
+	# The tables referenced by the rows of the other tables (e.g. Images), whose changes are applied first since the
+	# flush order of the rows of a transaction isn't fixed
+	referenced_tables = ()
+
+	def __init__(self, load_rows, refresh_seconds, enabled=True):
+		"""
+		:param load_rows: a function that returns the rows the view is built from
+		:param refresh_seconds: the max age of the view before it is rebuilt from the database
+		:param enabled: whether the view is materialized at all
+		"""
+		self.load_rows = load_rows
+		self.refresh_seconds = refresh_seconds
+		self.enabled = enabled
+
+		self._lock = threading.Lock()
+		self._reload_lock = threading.Lock()
+		self._built = False
+		self._loaded_time = 0
+		self._stale = True
+		self._replay = None  # Changes committed while the view is being rebuilt
+
+	def _refresh_if_needed(self):
+		if not self._stale and time.time() - self._loaded_time < self.refresh_seconds:
+			return
+
+		# If the view is already built, other threads keep reading it while one thread rebuilds it
+		if not self._reload_lock.acquire(not self._built):
+			return
+		try:
+			if self._stale or time.time() - self._loaded_time >= self.refresh_seconds:
+				self.rebuild()
+		except Exception, e:
+			if not self._built:
+				raise e
+			logger.exception("Error rebuilding the {0}, serving the previous one: {1}".format(self.name, e))
+		finally:
+			self._reload_lock.release()
+
+	def rebuild(self):
+		"""
+		Rebuild the view from the database.
+		"""
+		with self._lock:
+			self._replay = []
+			self._stale = False
+		loaded_time = time.time()
+
+		try:
+			rows = self.load_rows()
+		except Exception, e:
+			with self._lock:
+				self._replay = None
+				self._stale = True
+			raise e
+
+		with self._lock:
+			self._build(rows)
+			self._built = True
+			self._loaded_time = loaded_time
+
+			replay, self._replay = self._replay, None
+			for change in replay:
+				self._apply_change(change)
+
+		logger.debug("Rebuilt the {0} from {1} rows".format(self.name, len(rows)))
+
+	def apply_changes(self, changes):
+		"""
+		Update the view with the rows written by a committed transaction (a db_changes commit listener).
+		:param changes: a list of db_changes.RowChange
+		"""
+		changes = [change for change in changes if change.table in self.tables]
+		if not changes:
+			return
+		changes.sort(key=lambda change: change.table not in self.referenced_tables)
+
+		with self._lock:
+			if self._replay is not None:
+				self._replay.extend(changes)
+			if not self._built:
+				return
+			for change in changes:
+				self._apply_change(change)
+
+	def _build(self, rows):
+		"""
+		Replace the contents of the view.
+		:param rows: the rows returned by load_rows
+		"""
+		raise NotImplementedError
+
+	def _apply_change(self, change):
+		"""
+		Apply a written row to the view, or set self._stale to rebuild the view on the next read if that's not possible.
+		:param change: a db_changes.RowChange of one of the tables
+		"""
+		raise NotImplementedError
@@ -0,0 +1,138 @@
+# coding=utf-8
+"""
+This module keeps a directory of the users that can own Artwork (Buyers, Galleries, Auction Houses and Artists) in
+memory, with the name and image path shown for each of them, so that the owner fields of an Artwork cost no queries.
+The directory is built with one query per owner table, and kept up to date with the owner and Image rows written by
+the db_crud transactions of this process (see lib.materialized_view).
+"""
+
+import logging
+from collections import namedtuple
+
+from lib import db_changes
+from lib.materialized_view import MaterializedView
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+# The owner shown for an Artwork
+Owner = namedtuple('Owner', ['user_id', 'owner_type', 'owner_name', 'image_path'])
+
+# The owner tables, in the precedence order of the owner columns of Artwork:
+# (table name, owner type, Artwork owner column, name column, image column)
+OWNER_TABLES = (("Buyer", "BUYER", "owner_buyer_user_id", "buyer_nickname", "image_id"),
+                ("Gallery", "GALLERY", "owner_gallery_user_id", "gallery_name", "banner_image_id"),
+                ("Auction_House", "AUCTION_HOUSE", "owner_auction_house_user_id", "auction_house_name",
+                 "banner_image_id"),
+                ("Artist", "ARTIST", "owner_artist_user_id", "artist_nickname", "image_id"))
+
+_OWNER_TABLES_BY_NAME = dict((owner_table[0], owner_table) for owner_table in OWNER_TABLES)
+
+
+def owner_key(artwork):
+	"""
+	:param artwork: an Artwork
+	:return: the (owner_type, user_id) of the owner of the Artwork, or None if it has no owner
+	"""
+	for table_name, owner_type, owner_column, name_column, image_column in OWNER_TABLES:
+		owner_user_id = getattr(artwork, owner_column)
+		if owner_user_id is not None:
+			return owner_type, owner_user_id
+
+	return None
+
+
+class OwnerDirectory(MaterializedView):
+	"""
+	The in-memory owner directory of a process. All methods are thread-safe.
+	"""
+
+	name = "owner directory"
+	tables = tuple(owner_table[0] for owner_table in OWNER_TABLES) + ("Image",)
+	referenced_tables = ("Image",)
+
+	def __init__(self, load_rows, refresh_seconds, enabled=True):
+		"""
+		:param load_rows: a function that returns every owner as a dictionary with the keys owner_type, user_id,
+			owner_name, image_id and image_path (see db_crud.get_owner_rows)
+		:param refresh_seconds: the max age of the directory before it is rebuilt from the database
+		:param enabled: whether the directory is materialized at all
+		"""
+		super(OwnerDirectory, self).__init__(load_rows, refresh_seconds, enabled)
+
+		self._owners = {}  # (owner_type, user_id) -> (owner_name, image_id)
+		self._image_paths = {}  # image_id -> image_path
+
+	def get_owners(self, owner_keys):
+		"""
+		Get several owners, rebuilding the directory first if it's too old.
+		:param owner_keys: an iterable of (owner_type, user_id)
+		:return: a dictionary with an Owner per key found
+		"""
+		self._refresh_if_needed()
+
+		owners = {}
+		with self._lock:
+			for owner_type, user_id in owner_keys:
+				entry = self._owners.get((owner_type, user_id))
+				if entry is not None:
+					owner_name, image_id = entry
+					owners[(owner_type, user_id)] = Owner(user_id, owner_type, owner_name, self._image_paths.get(image_id))
+
+		return owners
+
+	def _build(self, rows):
+		self._owners = dict(((row['owner_type'], row['user_id']), (row['owner_name'], row['image_id'])) for row in rows)
+		self._image_paths = dict((row['image_id'], row['image_path']) for row in rows if row['image_id'] is not None)
+
+	def _apply_change(self, change):
+		values = change.values
+		if change.table == "Image":
+			self._apply_image_change(change)
+			return
+
+		if values is None or 'user_id' not in values:
+			# Unknown rows (e.g. a bulk update): rebuild on the next read
+			self._stale = True
+			return
+
+		table_name, owner_type, owner_column, name_column, image_column = _OWNER_TABLES_BY_NAME[change.table]
+		key = (owner_type, values['user_id'])
+
+		if change.action == db_changes.ACTION_UPDATE and change.changed is not None and \
+				name_column not in change.changed and image_column not in change.changed:
+			return  # e.g. the balance of a Buyer
+
+		if change.action == db_changes.ACTION_DELETE:
+			self._owners.pop(key, None)
+			return
+
+		if change.action == db_changes.ACTION_INSERT:
+			entry = (values.get(name_column), values.get(image_column))
+		elif name_column in values and image_column in values:
+			entry = (values[name_column], values[image_column])
+		else:
+			# An owner updated without its name or image loaded
+			self._stale = True
+			return
+
+		self._owners[key] = entry
+		if entry[1] is not None and entry[1] not in self._image_paths:
+			# An Image written by another process
+			self._stale = True
+
+	def _apply_image_change(self, change):
+		values = change.values
+		if change.action == db_changes.ACTION_UPDATE and change.changed is not None and \
+				'image_path' not in change.changed:
+			return
+
+		if values is None or 'image_id' not in values:
+			self._stale = True
+		elif change.action == db_changes.ACTION_DELETE:
+			self._image_paths.pop(values['image_id'], None)
+		elif 'image_path' in values:
+			# New Images are kept too, since an owner may start using them later
+			self._image_paths[values['image_id']] = values['image_path']
+		else:
+			self._stale = True
@@ -0,0 +1,161 @@
+# coding=utf-8
+"""
+This module implements the keyset (cursor) pagination of the list queries. Instead of skipping `offset` rows, which
+makes the database read and discard all of them, a page starts right after the last row of the previous page,
+identified by its sort key and primary key. That position is handed to the client as an opaque cursor, so a page costs
+O(page size) at any depth (given an index on the sort columns).
+"""
+
+import base64
+import json
+import logging
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import and_, or_
+
+from lib.exceptions import WrongArgumentValueError
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+class Keyset(object):
+	"""
+	The order of a list query: its sort columns, followed by the primary key columns that make the order total.
+	NULLs sort first in ascending columns and last in descending columns, like in MySQL.
+	"""
+
+	def __init__(self, name, sort_columns, primary_key):
+		"""
+		:param name: the name of the list, stored in its cursors so that they can't be used with another list
+		:param sort_columns: a list of (column, descending) e.g. [(Artist.artist_nickname, False)]
+		:param primary_key: the list of primary key columns of the rows, sorted in ascending order
+		"""
+		self.name = name
+		self.sort_columns = list(sort_columns)
+		self.columns = self.sort_columns + [(column, False) for column in primary_key]
+
+	def order_by(self, unique=True):
+		"""
+		:param unique: whether to break the ties of the sort columns by primary key (required for cursors)
+		:return: a list of ORDER BY clauses
+		"""
+		columns = self.columns if unique else self.sort_columns
+		return [column.desc() if descending else column.asc() for column, descending in columns]
+
+	def decode(self, cursor):
+		"""
+		:param cursor: a cursor returned by next_cursor(), or "" for the first page
+		:return: a dictionary {column name: value} with the position of the cursor, or None for the first page
+		"""
+		if not cursor:
+			return None
+
+		try:
+			name, values = json.loads(base64.urlsafe_b64decode(str(cursor)), object_hook=_decode_value)
+		except (TypeError, ValueError):
+			raise WrongArgumentValueError('cursor')
+
+		if name != self.name or not isinstance(values, list) or len(values) != len(self.columns):
+			raise WrongArgumentValueError('cursor')
+
+		return dict((column.key, value) for (column, descending), value in zip(self.columns, values))
+
+	def filter(self, cursor):
+		"""
+		:param cursor: a cursor returned by next_cursor(), or "" for the first page
+		:return: a SQL condition that selects the rows after the cursor, or None for the first page
+		"""
+		values = self.decode(cursor)
+		if values is None:
+			return None
+
+		# (c1 after v1) OR (c1 = v1 AND c2 after v2) OR ...
+		conditions = []
+		for position, (column, descending) in enumerate(self.columns):
+			after = _after(column, values[column.key], descending)
+			if after is not None:
+				conditions.append(and_(*([_equal(previous_column, values[previous_column.key])
+				                          for previous_column, previous_descending in self.columns[:position]] + [after])))
+
+		return or_(*conditions)
+
+	def next_cursor(self, rows, limit):
+		"""
+		:param rows: a page of rows (ORM objects with the keyset columns) returned by a query sorted by order_by()
+		:param limit: the page size requested, 0 for no limit
+		:return: the cursor of the next page, or None if this is the last page
+		"""
+		if limit == 0 or len(rows) < limit:
+			return None
+
+		values = [getattr(rows[-1], column.key) for column, descending in self.columns]
+
+		return base64.urlsafe_b64encode(json.dumps([self.name, values], default=_encode_value, separators=(',', ':')))
+
+
+def _after(column, value, descending):
+	# The condition on a column for the rows strictly after the value, or None if there can't be any
+	if descending:
+		# NULLs are last, so nothing comes after a NULL
+		return None if value is None else or_(column < value, column.is_(None))
+	else:
+		# NULLs are first
+		return column.isnot(None) if value is None else column > value
+
+
+def _equal(column, value):
+	return column.is_(None) if value is None else column == value
+
+
+def _encode_value(value):
+	if isinstance(value, datetime):
+		return {'$datetime': value.strftime(_DATETIME_FORMAT)}
+	if isinstance(value, Decimal):
+		return {'$decimal': str(value)}
+	raise TypeError(repr(value) + " is not JSON serializable")
+
+
+def _decode_value(dictionary):
+	if '$datetime' in dictionary:
+		return datetime.strptime(dictionary['$datetime'], _DATETIME_FORMAT)
+	if '$decimal' in dictionary:
+		return Decimal(dictionary['$decimal'])
+	return dictionary
+
+
+def combine_cursors(cursors):
+	"""
+	Combine the cursors of several lists returned together (e.g. the following lists) into a single cursor.
+	:param cursors: a dictionary {list name: cursor of the list, or None if the list has no more pages}
+	:return: the combined cursor, or None if no list has more pages
+	"""
+	cursors = dict((name, cursor) for name, cursor in cursors.iteritems() if cursor is not None)
+	if not cursors:
+		return None
+
+	return base64.urlsafe_b64encode(json.dumps(cursors, separators=(',', ':')))
+
+
+def split_cursors(cursor, names):
+	"""
+	Split a cursor returned by combine_cursors().
+	:param cursor: the combined cursor, or "" for the first page of all the lists
+	:param names: the names of the lists
+	:return: a dictionary {list name: cursor of the list ("" for its first page), or None if the list has ended}
+	"""
+	if not cursor:
+		return dict((name, "") for name in names)
+
+	try:
+		cursors = json.loads(base64.urlsafe_b64decode(str(cursor)))
+	except (TypeError, ValueError):
+		raise WrongArgumentValueError('cursor')
+
+	if not isinstance(cursors, dict) or not set(cursors).issubset(names):
+		raise WrongArgumentValueError('cursor')
+
+	return dict((name, cursors.get(name)) for name in names)
@@ -0,0 +1,170 @@
+# coding=utf-8
+"""
+This module contains an in-process LRU/TTL cache for the serialized responses of web services that return the same
+result to every caller (e.g. the anonymous catalog lists).
+Every entry depends on a set of tables (and optionally on some of their columns). When a db_crud transaction that
+changed those tables commits, the entries are invalidated (see lib.db_changes). A response read before such a commit
+but cached after it would miss the invalidation, so responses are cached with the generation of the cache taken before
+their read, and refused if their tables were invalidated since. They're read from the primary (see
+db_crud.RequestSession.primary_reads): a replica still lagging behind the invalidating commit would pass the generation
+check with a stale response. Each worker process has its own cache, so the writes made in other processes only become
+visible when the entries expire.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from lib import db_changes
+from settings import settings
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+
+class ResponseCache(object):
+	"""
+	A size-limited LRU cache of serialized responses, with a time to live. All methods are thread-safe.
+	"""
+
+	def __init__(self, max_entries, max_bytes, ttl_seconds):
+		"""
+		:param max_entries: the max number of cached responses
+		:param max_bytes: the max total size of the cached responses
+		:param ttl_seconds: the number of seconds a response stays cached
+		"""
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.ttl_seconds = ttl_seconds
+
+		self._lock = threading.Lock()
+		self._entries = OrderedDict()  # key -> (response, expiration time, dependencies), least recently used first
+		self._bytes = 0
+		self._generation = 0  # Incremented by every invalidation
+		self._table_generations = {}  # table name -> generation of its last invalidation
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+		self.stale_sets = 0
+
+	@staticmethod
+	def make_key(ws_name, arguments):
+		"""
+		Build the cache key of a web service call. The order of the arguments does not matter.
+		:param ws_name: the name of the web service
+		:param arguments: the request arguments (a dictionary with a list of values per argument)
+		:return: a hashable key
+		"""
+		return ws_name, tuple(sorted((name, tuple(values)) for name, values in arguments.iteritems()))
+
+	def get(self, key):
+		"""
+		:param key: a key made with make_key
+		:return: the cached response, or None if it's not cached or has expired
+		"""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None or entry[1] <= time.time():
+				if entry is not None:
+					self._remove(key)
+				self.misses += 1
+				return None
+
+			# Move the entry to the most recently used end
+			del self._entries[key]
+			self._entries[key] = entry
+			self.hits += 1
+
+			return entry[0]
+
+	def generation(self):
+		"""
+		:return: the current generation of the cache, to be taken before reading a response to cache (see set)
+		"""
+		with self._lock:
+			return self._generation
+
+	def set(self, key, response, dependencies, generation):
+		"""
+		Cache a response, unless one of its tables was invalidated after its generation (it may be stale then).
+		:param key: a key made with make_key
+		:param response: the serialized response (a string)
+		:param dependencies: a dictionary {table name: set of column names, or None for any column} with the data the
+			response was built from
+		:param generation: the generation of the cache taken before the response was read (see generation())
+		"""
+		if len(response) > self.max_bytes:
+			return
+
+		with self._lock:
+			if any(self._table_generations.get(table, 0) > generation for table in dependencies):
+				self.stale_sets += 1
+				return
+
+			if key in self._entries:
+				self._remove(key)
+			self._entries[key] = (response, time.time() + self.ttl_seconds, dependencies)
+			self._bytes += len(response)
+
+			while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+				self._remove(next(iter(self._entries)))
+				self.evictions += 1
+
+	def _remove(self, key):
+		response, expiration_time, dependencies = self._entries.pop(key)
+		self._bytes -= len(response)
+
+	def invalidate(self, changes):
+		"""
+		Remove the entries that depend on the changed rows.
+		:param changes: a list of db_changes.RowChange
+		"""
+		with self._lock:
+			self._generation += 1
+			for change in changes:
+				self._table_generations[change.table] = self._generation
+
+			stale_keys = [key for key, (response, expiration_time, dependencies) in self._entries.iteritems()
+			              if any(_depends_on(dependencies, change) for change in changes)]
+			for key in stale_keys:
+				self._remove(key)
+			self.invalidations += len(stale_keys)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._bytes = 0
+
+	def statistics(self):
+		"""
+		:return: a dictionary with the size and the counters of the cache
+		"""
+		with self._lock:
+			return dict(entries=len(self._entries),
+			            bytes=self._bytes,
+			            max_entries=self.max_entries,
+			            max_bytes=self.max_bytes,
+			            ttl_seconds=self.ttl_seconds,
+			            hits=self.hits,
+			            misses=self.misses,
+			            evictions=self.evictions,
+			            invalidations=self.invalidations,
+			            stale_sets=self.stale_sets)
+
+
+def _depends_on(dependencies, change):
+	if change.table not in dependencies:
+		return False
+
+	columns = dependencies[change.table]
+	if columns is None or change.action != db_changes.ACTION_UPDATE or change.changed is None:
+		return True
+
+	return not columns.isdisjoint(change.changed)
+
+
+cache = ResponseCache(settings['RESPONSE_CACHE_MAX_ENTRIES'], settings['RESPONSE_CACHE_MAX_BYTES'],
+                      settings['RESPONSE_CACHE_TTL_SECONDS'])
+db_changes.add_commit_listener(cache.invalidate)
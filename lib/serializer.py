@@ -0,0 +1,138 @@
+# coding=utf-8
+"""
+This module serializes the requests and responses of the web services to and from JSON.
+The JSON library is chosen by settings['JSON_LIBRARY']: simplejson (if it's installed with its C extension) or the
+standard json module. Both use their C encoder with a single encoder built once, and convert the Decimals (to floats)
+and datetimes of the results the same way (other objects raise a TypeError), so the responses are the same with
+either library.
+
+Micro-benchmark of the libraries, on a synthetic following_lists payload or on responses captured from the API:
+    python -m lib.serializer [response.json ...]
+"""
+
+import decimal
+import json
+import logging
+import sys
+import timeit
+from datetime import date, datetime
+
+from lib.utils import DecimalEncoder
+from settings import settings
+
+try:
+	import simplejson
+	from simplejson import _speedups  # Only faster than the json module with its C extension
+except ImportError:
+	simplejson = None
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+
+def _default(o):
+	# Convert the objects the JSON encoders don't know
+	if isinstance(o, decimal.Decimal):
+		return float(o)
+	elif isinstance(o, datetime):
+		return o.strftime(settings['DATETIME_DISPLAY_FORMAT'])
+	elif isinstance(o, date):
+		return o.strftime(settings['DATE_DISPLAY_FORMAT'])
+	raise TypeError("{0!r} is not JSON serializable".format(o))
+
+
+class Serializer(object):
+	"""
+	A JSON library, with the encoder and decoder of the web services.
+	"""
+
+	def __init__(self, name, dumps, loads):
+		"""
+		:param name: the name of the library
+		:param dumps: a function that receives a result and returns it as a JSON string
+		:param loads: a function that receives a JSON string and returns its value (it raises a ValueError if the
+			string is not valid JSON)
+		"""
+		self.name = name
+		self.dumps = dumps
+		self.loads = loads
+
+
+SERIALIZERS = {
+	"json": Serializer("json", json.JSONEncoder(default=_default).encode, json.loads),
+}
+if simplejson is not None:
+	# Without use_decimal, a Decimal is encoded as a float like with the json module (1000.0, not 1000.00)
+	SERIALIZERS["simplejson"] = Serializer("simplejson",
+	                                       simplejson.JSONEncoder(default=_default, use_decimal=False).encode,
+	                                       simplejson.loads)
+
+
+def get_serializer(name):
+	"""
+	:param name: "auto" (simplejson if available, the json module otherwise), "simplejson" or "json"
+	:return: the Serializer of the library, or of the json module if it isn't available
+	"""
+	if name == "auto":
+		name = "simplejson" if "simplejson" in SERIALIZERS else "json"
+	if name not in SERIALIZERS:
+		logger.warning("JSON library {0} is not available, using json".format(name))
+		name = "json"
+
+	return SERIALIZERS[name]
+
+
+serializer = get_serializer(settings['JSON_LIBRARY'])
+
+
+def dumps(result):
+	"""
+	:param result: a result of a web service (dictionaries, lists, strings, numbers, Decimals, datetimes...)
+	:return: the result as a JSON string
+	"""
+	return serializer.dumps(result)
+
+
+def loads(text):
+	"""
+	Raises a ValueError if the text is not valid JSON.
+	:param text: a JSON string (e.g. the body of a request)
+	:return: the value of the JSON string
+	"""
+	return serializer.loads(text)
+
+
+def _synthetic_payload(rows):
+	# A following_lists response with some Decimal amounts
+	def artwork(i):
+		return dict(artwork_id=i, artwork_name=u"Artwork {0} 藝術".format(i), artwork_image="path/{0}".format(i),
+		            artist_name="artist{0}".format(i % 50), artwork_price=decimal.Decimal("{0}.50".format(i * 10)))
+
+	return dict(response="success", count=rows, next_cursor=None,
+	            followed_artwork=[artwork(i) for i in xrange(rows)], favorite_artwork=[artwork(i) for i in xrange(rows)])
+
+
+def benchmark(payloads, number=20):
+	"""
+	Print the mean time to encode and decode each payload with every available library, and with the former
+	json.dumps(result, cls=DecimalEncoder).
+	:param payloads: a list of (name, result)
+	:param number: the number of runs of each measure
+	"""
+	for payload_name, payload in payloads:
+		text = json.dumps(payload, cls=DecimalEncoder)
+		print "{0} ({1} bytes)".format(payload_name, len(text))
+		measures = [("json.dumps(cls=DecimalEncoder)", lambda: json.dumps(payload, cls=DecimalEncoder))]
+		for name, library in sorted(SERIALIZERS.iteritems()):
+			measures.append((name + " dumps", lambda library=library: library.dumps(payload)))
+			measures.append((name + " loads", lambda library=library: library.loads(text)))
+		for name, function in measures:
+			print "  {0:<32} {1:8.3f} ms".format(name, timeit.timeit(function, number=number) / number * 1000)
+
+
+if __name__ == "__main__":
+	payloads = [("following_lists, 2 x 2000 rows", _synthetic_payload(2000))]
+	for path in sys.argv[1:]:
+		with open(path) as payload_file:
+			payloads.append((path, json.load(payload_file)))
+	benchmark(payloads)
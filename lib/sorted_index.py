@@ -0,0 +1,121 @@
+# coding=utf-8
+"""
+This module contains a sorted index of ids, used to keep in-memory rankings (e.g. the home feeds) up to date with
+cheap updates and O(page) slicing.
+"""
+
+import bisect
+import calendar
+import logging
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+
+class SortedIndex(object):
+	"""
+	A list of ids sorted by a sort key (ascending), with ties broken by id. Updating the sort key of an id costs a
+	binary search plus a list move, and reading a page costs O(page) regardless of the offset.
+	This class is not thread-safe; its owner must synchronize the access.
+	"""
+
+	def __init__(self, entries=()):
+		"""
+		:param entries: an iterable of (item_id, sort_key) to build the index with
+		"""
+		self._key_by_id = dict(entries)
+		self._entries = sorted((sort_key, item_id) for item_id, sort_key in self._key_by_id.iteritems())
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, item_id):
+		return item_id in self._key_by_id
+
+	def __iter__(self):
+		return (item_id for sort_key, item_id in self._entries)
+
+	def get_key(self, item_id):
+		"""
+		:param item_id: the id of an item
+		:return: the sort key of the item, or None if it isn't in the index
+		"""
+		return self._key_by_id.get(item_id)
+
+	def upsert(self, item_id, sort_key):
+		"""
+		Add an item, or move it to the position of its new sort key.
+		:param item_id: the id of the item
+		:param sort_key: the sort key of the item (e.g. a tuple)
+		"""
+		old_key = self._key_by_id.get(item_id)
+		if old_key is not None:
+			if old_key == sort_key:
+				return
+			self._remove_entry(old_key, item_id)
+
+		bisect.insort(self._entries, (sort_key, item_id))
+		self._key_by_id[item_id] = sort_key
+
+	def remove(self, item_id):
+		"""
+		Remove an item, if it's in the index.
+		:param item_id: the id of the item
+		"""
+		old_key = self._key_by_id.pop(item_id, None)
+		if old_key is not None:
+			self._remove_entry(old_key, item_id)
+
+	def _remove_entry(self, sort_key, item_id):
+		position = bisect.bisect_left(self._entries, (sort_key, item_id))
+		del self._entries[position]
+
+	def get_page(self, limit, offset=0, after=None):
+		"""
+		:param limit: the max number of ids to return
+		:param offset: the position of the first id to return
+		:param after: a (sort_key, item_id) position; if given, the page starts at the first id after it (the item
+		doesn't need to be in the index anymore) and offset is ignored
+		:return: a list of ids in index order
+		"""
+		if after is not None:
+			offset = bisect.bisect_right(self._entries, after)
+		return [item_id for sort_key, item_id in self._entries[offset:offset + limit]]
+
+	def rank(self, item_id):
+		"""
+		:param item_id: the id of an item
+		:return: the position of the item in the index, or None if it isn't in the index
+		"""
+		sort_key = self._key_by_id.get(item_id)
+		if sort_key is None:
+			return None
+		return bisect.bisect_left(self._entries, (sort_key, item_id))
+
+
+def descending(value):
+	"""
+	Build a sort key component that sorts numbers (or datetimes) in descending order, with None (NULL) last,
+	like MySQL's ORDER BY ... DESC.
+	:param value: a number, a datetime or None
+	:return: a value to use in an ascending sort key
+	"""
+	if value is None:
+		return 1, 0
+	if hasattr(value, 'timetuple'):
+		value = calendar.timegm(value.timetuple()) + getattr(value, 'microsecond', 0) / 1000000.0
+	return 0, -value
+
+
+def ascending(value):
+	"""
+	Build a sort key component that sorts numbers (or datetimes) in ascending order, with None (NULL) first,
+	like MySQL's ORDER BY ... ASC.
+	:param value: a number, a datetime or None
+	:return: a value to use in an ascending sort key
+	"""
+	if value is None:
+		return 0, 0
+	if hasattr(value, 'timetuple'):
+		value = calendar.timegm(value.timetuple()) + getattr(value, 'microsecond', 0) / 1000000.0
+	return 1, value
@@ -0,0 +1,382 @@
+# coding=utf-8
+"""
+This module keeps the JWT tokens revoked before they expire, so that they're rejected by security.authenticate_token.
+A single token (e.g. a refreshed one) is revoked by its key (its "jti" claim, see security.token_key), and all the
+tokens of a User (e.g. when it logs out) by the time they must have been issued after.
+The revocations are kept in a store, in a SQLite file shared by the worker processes of a host (or in memory, for a
+single process), and every process has a Bloom filter of the revoked keys in front of the store: a key that is not in
+the filter (almost every request) is known not to be revoked without looking it up in the store. The Users' times are
+kept in memory. A background thread picks up the revocations of other processes every sync_seconds, so a token
+revoked by one process is accepted by the others for up to sync_seconds; requests never wait for it.
+The revocations are purged from the store once their tokens can't be used anymore.
+A refreshed token is revoked with its replacement (the token issued for it), which is kept for a few seconds, so that
+a refresh whose response was lost can be repeated (see security.refresh_jwt).
+"""
+
+import atexit
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+
+logger = logging.getLogger('artmego.' + __name__)
+
+# Interval between the purges of the keys of the tokens that can't be used anymore
+_PURGE_SECONDS = 3600
+
+
+class BloomFilter(object):
+	"""
+	A Bloom filter of strings: "key in bloom_filter" is False for the keys never added, and True for the added keys
+	and for a few others (about error_rate of them, while no more than capacity keys are added). Not thread-safe.
+	"""
+
+	def __init__(self, capacity, error_rate=0.01):
+		"""
+		:param capacity: the number of keys the filter is sized for
+		:param error_rate: the rate of false positives when the filter has capacity keys
+		"""
+		capacity = max(1, capacity)
+		self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))  # Number of bits
+		self.hash_count = max(1, int(round(float(self.size) / capacity * math.log(2))))
+
+		self._bits = bytearray((self.size + 7) // 8)
+
+	def add(self, key):
+		for position in self._positions(key):
+			self._bits[position >> 3] |= 1 << (position & 7)
+
+	def __contains__(self, key):
+		return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+	def _positions(self, key):
+		# Double hashing: the positions are h1 + i * h2, with the two halves of an MD5 digest as h1 and h2
+		if isinstance(key, unicode):
+			key = key.encode("utf-8")
+		h1, h2 = struct.unpack("<QQ", hashlib.md5(key).digest())
+		return [(h1 + i * h2) % self.size for i in xrange(self.hash_count)]
+
+
+class MemoryRevocationStore(object):
+	"""
+	The revocations of a single process. Not thread-safe.
+	"""
+
+	shared = False  # Whether other processes revoke tokens in the store
+
+	def __init__(self):
+		self._keys = {}  # key -> expiration time (None if it never expires)
+		self._replacements = {}  # key -> (replacement token, expiration time of the replacement)
+		self._users = {}  # user_id -> (issued_before, expiration time)
+
+	def revoke(self, key, expiration_time, replacement=None, replacement_expiration_time=None):
+		"""
+		:return: False if the key was already revoked, True otherwise
+		"""
+		if key in self._keys:
+			return False
+		self._keys[key] = expiration_time
+		if replacement is not None:
+			self._replacements[key] = (replacement, replacement_expiration_time)
+		return True
+
+	def get_replacement(self, key, now):
+		"""
+		:return: the replacement the key was revoked with, None if it had none or it expired before now
+		"""
+		replacement, expiration_time = self._replacements.get(key, (None, None))
+		return replacement if replacement is not None and expiration_time >= now else None
+
+	def revoke_user(self, user_id, issued_before, expiration_time):
+		if user_id not in self._users or self._users[user_id][0] < issued_before:
+			self._users[user_id] = (issued_before, expiration_time)
+
+	def is_revoked(self, key):
+		return key in self._keys
+
+	def load(self, after_ids=(0, 0)):
+		"""
+		:param after_ids: ignored, the tokens are never revoked by other processes
+		:return: a tuple (list of all the revoked keys, list of all the (user_id, issued_before), (0, 0))
+		"""
+		users = [(user_id, issued_before) for user_id, (issued_before, _) in self._users.iteritems()]
+		return self._keys.keys(), users, (0, 0)
+
+	def purge(self, now):
+		"""
+		Forget the revocations that expired before now.
+		"""
+		for key, expiration_time in self._keys.items():
+			if expiration_time is not None and expiration_time < now:
+				del self._keys[key]
+		for key, (_, expiration_time) in self._replacements.items():
+			if expiration_time < now:
+				del self._replacements[key]
+		for user_id, (issued_before, expiration_time) in self._users.items():
+			if expiration_time is not None and expiration_time < now:
+				del self._users[user_id]
+
+
+class SQLiteRevocationStore(object):
+	"""
+	The revocations of the processes sharing a SQLite file. Not thread-safe.
+	"""
+
+	shared = True
+
+	def __init__(self, path):
+		"""
+		:param path: the path of the SQLite file, created if it doesn't exist
+		"""
+		self.path = path
+
+		self._connection = None
+		self._pid = None  # The process that opened the connection (a connection is not used after forking)
+
+	def revoke(self, key, expiration_time, replacement=None, replacement_expiration_time=None):
+		"""
+		:return: False if the key was already revoked (by any process), True otherwise
+		"""
+		# A single statement, so that two processes can't both revoke the key
+		return self._execute("INSERT INTO Revoked_Token (token_key, expiration_time, replacement, "
+		                     "replacement_expiration_time) SELECT ?, ?, ?, ? "
+		                     "WHERE NOT EXISTS (SELECT 1 FROM Revoked_Token WHERE token_key = ?)",
+		                     (key, expiration_time, replacement, replacement_expiration_time, key)).rowcount > 0
+
+	def get_replacement(self, key, now):
+		"""
+		:return: the replacement the key was revoked with, None if it had none or it expired before now
+		"""
+		row = self._execute("SELECT replacement FROM Revoked_Token WHERE token_key = ? "
+		                    "AND replacement_expiration_time >= ? LIMIT 1", (key, now)).fetchone()
+		return row[0] if row is not None else None
+
+	def revoke_user(self, user_id, issued_before, expiration_time):
+		self._execute("INSERT INTO Revoked_User (user_id, issued_before, expiration_time) VALUES (?, ?, ?)",
+		              (user_id, issued_before, expiration_time))
+
+	def is_revoked(self, key):
+		return self._execute("SELECT 1 FROM Revoked_Token WHERE token_key = ? LIMIT 1", (key,)).fetchone() is not None
+
+	def load(self, after_ids=(0, 0)):
+		"""
+		:param after_ids: the last revoked_token_id and revoked_user_id already loaded
+		:return: a tuple (list of the keys revoked after them, list of the (user_id, issued_before) revoked after them,
+			the last (revoked_token_id, revoked_user_id))
+		"""
+		token_rows = self._execute("SELECT revoked_token_id, token_key FROM Revoked_Token WHERE revoked_token_id > ? "
+		                           "ORDER BY revoked_token_id", (after_ids[0],)).fetchall()
+		user_rows = self._execute("SELECT revoked_user_id, user_id, issued_before FROM Revoked_User "
+		                          "WHERE revoked_user_id > ? ORDER BY revoked_user_id", (after_ids[1],)).fetchall()
+		last_ids = (token_rows[-1][0] if token_rows else after_ids[0], user_rows[-1][0] if user_rows else after_ids[1])
+		users = [(user_id, issued_before) for _, user_id, issued_before in user_rows]
+		return [key for _, key in token_rows], users, last_ids
+
+	def purge(self, now):
+		"""
+		Forget the revocations that expired before now.
+		"""
+		self._execute("DELETE FROM Revoked_Token WHERE expiration_time < ?", (now,))
+		self._execute("UPDATE Revoked_Token SET replacement = NULL, replacement_expiration_time = NULL "
+		              "WHERE replacement_expiration_time < ?", (now,))
+		self._execute("DELETE FROM Revoked_User WHERE expiration_time < ?", (now,))
+		# Only the last time of a User matters
+		self._execute("DELETE FROM Revoked_User WHERE revoked_user_id NOT IN "
+		              "(SELECT MAX(revoked_user_id) FROM Revoked_User GROUP BY user_id)", ())
+
+	def _execute(self, statement, parameters):
+		if self._connection is None or self._pid != os.getpid():
+			self._connection = self._connect()
+			self._pid = os.getpid()
+		return self._connection.execute(statement, parameters)
+
+	def _connect(self):
+		connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+		connection.execute("PRAGMA journal_mode=WAL")  # The readers don't wait for the writers
+		connection.execute("CREATE TABLE IF NOT EXISTS Revoked_Token (revoked_token_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+		                   "token_key TEXT NOT NULL, expiration_time REAL, replacement TEXT, "
+		                   "replacement_expiration_time REAL)")
+		columns = [row[1] for row in connection.execute("PRAGMA table_info(Revoked_Token)")]
+		if "replacement" not in columns:  # A file created before the replacements were kept
+			connection.execute("ALTER TABLE Revoked_Token ADD COLUMN replacement TEXT")
+			connection.execute("ALTER TABLE Revoked_Token ADD COLUMN replacement_expiration_time REAL")
+		connection.execute("CREATE INDEX IF NOT EXISTS Revoked_Token_key ON Revoked_Token (token_key)")
+		connection.execute("CREATE TABLE IF NOT EXISTS Revoked_User (revoked_user_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+		                   "user_id INTEGER NOT NULL, issued_before REAL NOT NULL, expiration_time REAL)")
+		return connection
+
+
+class RevocationList(object):
+	"""
+	The revoked tokens, as seen by a process. All methods are thread-safe.
+	"""
+
+	def __init__(self, store, sync_seconds, capacity, enabled=True):
+		"""
+		:param store: a MemoryRevocationStore or a SQLiteRevocationStore
+		:param sync_seconds: the interval between the loads of the revocations of other processes (shared stores)
+		:param capacity: the number of revoked keys the Bloom filter is sized for (it's resized when they're more)
+		:param enabled: whether the tokens can be revoked at all
+		"""
+		self.store = store
+		self.sync_seconds = sync_seconds
+		self.capacity = capacity
+		self.enabled = enabled
+
+		self._lock = threading.Lock()  # Held without I/O, the requests check the revocations with it
+		self._store_lock = threading.Lock()  # Held while the store is used (before self._lock, when both are)
+		self._bloom_filter = None  # None until the revocations of the store are loaded
+		self._issued_before = {}  # user_id -> the time the tokens of the User must have been issued after
+		self._last_ids = (0, 0)  # The last ids of the store loaded into the Bloom filter and _issued_before
+		self._purge_time = 0
+		self._thread = None
+		self._stopped = threading.Event()
+		self._exit_handler_registered = False
+
+	def start(self):
+		"""
+		Load the revocations of the store, and start picking up the revocations of other processes (and purging the
+		expired ones) in a background thread. Called by the first check if it wasn't called before.
+		"""
+		if not self.enabled:
+			return
+
+		with self._store_lock:
+			if self._thread is not None:
+				return
+			self._sync()
+			self._stopped.clear()
+			self._thread = threading.Thread(target=self._run, name="token-revocation")
+			self._thread.daemon = True
+			self._thread.start()
+			if not self._exit_handler_registered:
+				atexit.register(self.stop)
+				self._exit_handler_registered = True
+
+	def stop(self):
+		"""
+		Stop the background thread.
+		"""
+		with self._store_lock:
+			thread, self._thread = self._thread, None
+		if thread is not None:
+			self._stopped.set()
+			thread.join()
+
+	def revoke(self, key, expiration_time, replacement=None, replacement_expiration_time=None):
+		"""
+		Revoke a token.
+		:param key: the key of the token (see security.token_key)
+		:param expiration_time: the time after which the token can't be used anymore (None if never)
+		:param replacement: the token issued in place of the revoked one (e.g. by a refresh), if any
+		:param replacement_expiration_time: the time after which the replacement isn't returned by get_replacement
+		:return: False if the token was already revoked, True otherwise (e.g. so that a token is only refreshed once)
+		"""
+		if not self.enabled:
+			return True
+
+		self.start()
+		with self._store_lock:
+			revoked = self.store.revoke(key, expiration_time, replacement, replacement_expiration_time)
+			with self._lock:
+				self._bloom_filter.add(key)
+
+		return revoked
+
+	def get_replacement(self, key):
+		"""
+		:param key: the key of a revoked token
+		:return: the token issued in place of it (by any process), None if it had none or it expired
+		"""
+		if not self.enabled:
+			return None
+
+		with self._store_lock:
+			return self.store.get_replacement(key, time.time())
+
+	def revoke_user(self, user_id, issued_before, expiration_time):
+		"""
+		Revoke all the tokens of a User issued before a time.
+		:param user_id: the user_id of the User
+		:param issued_before: the time (the tokens whose "iat" is lower are revoked)
+		:param expiration_time: the time after which the tokens issued before can't be used anymore (None if never)
+		"""
+		if not self.enabled:
+			return
+
+		self.start()
+		with self._store_lock:
+			self.store.revoke_user(user_id, issued_before, expiration_time)
+			with self._lock:
+				self._add_user(user_id, issued_before)
+
+	def is_revoked(self, key, user_id=None, issued_at=None):
+		"""
+		:param key: the key of a token (see security.token_key), None if it can't be revoked by key
+		:param user_id: the user_id of the token
+		:param issued_at: the time the token was issued ("iat" claim), None if unknown
+		:return: whether the token was revoked
+		"""
+		if not self.enabled:
+			return False
+
+		if self._thread is None:
+			self.start()
+		with self._lock:
+			issued_before = self._issued_before.get(user_id)
+			if issued_before is not None and issued_at is not None and issued_at < issued_before:
+				return True
+			if key is None or key not in self._bloom_filter:
+				return False
+
+		# A revoked key, or a false positive of the Bloom filter
+		with self._store_lock:
+			return self.store.is_revoked(key)
+
+	def _run(self):
+		while not self._stopped.wait(self.sync_seconds):
+			try:
+				with self._store_lock:
+					self._sync()
+			except Exception, e:
+				logger.exception("Error loading the revoked tokens: {0}".format(e))
+
+	def _sync(self):
+		# Load the revocations of other processes, and purge the expired ones once in a while (with the store lock)
+		now = time.time()
+		if self._bloom_filter is None or now - self._purge_time >= _PURGE_SECONDS:
+			self._purge_time = now
+			self.store.purge(now)
+			keys, users, last_ids = self.store.load()
+			bloom_filter = BloomFilter(max(self.capacity, 2 * len(keys)))
+			for key in keys:
+				bloom_filter.add(key)
+			with self._lock:
+				self._bloom_filter = bloom_filter
+				self._issued_before = {}
+				self._last_ids = last_ids
+				for user_id, issued_before in users:
+					self._add_user(user_id, issued_before)
+		elif self.store.shared:
+			keys, users, last_ids = self.store.load(self._last_ids)
+			with self._lock:
+				for key in keys:
+					self._bloom_filter.add(key)
+				self._last_ids = last_ids
+				for user_id, issued_before in users:
+					self._add_user(user_id, issued_before)
+		else:
+			return
+
+		if keys or users:
+			logger.debug("Loaded {0} revoked tokens and {1} revoked users".format(len(keys), len(users)))
+
+	def _add_user(self, user_id, issued_before):
+		# With the lock
+		if self._issued_before.get(user_id, issued_before) <= issued_before:
+			self._issued_before[user_id] = issued_before
@@ -0,0 +1,186 @@
+# coding=utf-8
+"""
+This module implements the registry of the web services of an API: their name, HTTP method, arguments and function.
+A request is dispatched with a single dictionary lookup, and its arguments are checked against a JSON schema (compiled
+once, when the web service is registered) before the function is called. The URL patterns of the API are generated
+from the registry too (see urls.py).
+"""
+
+import inspect
+
+from jsonschema import Draft4Validator
+
+from lib.exceptions import InexistentResourceError, MissingArgumentsError, WrongArgumentValueError
+
+# The schemas of the argument types
+INTEGER = {"type": "integer"}
+NUMBER = {"type": "number"}
+STRING = {"type": "string"}
+BOOLEAN = {"type": "boolean"}
+
+
+def _parse_boolean(value):
+	if value.lower() in ("true", "1"):
+		return True
+	if value.lower() in ("false", "0"):
+		return False
+	raise ValueError(value)
+
+
+# Converters of the URL arguments of GET web services (strings) to the types of their schemas
+_QUERY_CONVERTERS = {"integer": int, "number": float}
+# Converters of the string values of POST arguments to the types of their schemas, for the clients that send e.g.
+# "artwork_id": "12" or "follow": "true" (accepted before the arguments were checked against the schemas)
+_BODY_CONVERTERS = {"integer": int, "number": float, "boolean": _parse_boolean}
+
+# The validators whose errors mean that an argument is missing (the "anyOf" of the schemas only require arguments)
+_MISSING_VALIDATORS = ("required", "anyOf")
+
+
+class WebService(object):
+	"""
+	A web service of an API.
+	"""
+
+	def __init__(self, name, method, function, arguments, required, require_token, constraints):
+		"""
+		:param name: the name of the web service, i.e. its path without "/" (e.g. "artwork_page")
+		:param method: "GET" or "POST"
+		:param function: the function of the web service. It's called with the arguments as keyword arguments, and the
+			context of the request (see call()) if it has parameters with their names
+		:param arguments: a dictionary {argument name: JSON schema of its value}
+		:param required: the list of the required arguments
+		:param require_token: whether the web service requires a JWT token
+		:param constraints: other keywords of the JSON schema of the arguments (e.g. "anyOf")
+		"""
+		self.name = name
+		self.method = method
+		self.function = function
+		self.arguments = arguments
+		self.require_token = require_token
+
+		self.schema = dict(constraints, type="object", properties=arguments)
+		if required:
+			self.schema['required'] = list(required)
+		Draft4Validator.check_schema(self.schema)
+
+		self._validator = Draft4Validator(self.schema)
+		self._parameters = frozenset(inspect.getargspec(function).args)
+
+	def parse_query(self, query_arguments):
+		"""
+		Get the arguments of a GET request.
+		Raises a WrongArgumentValueError if an argument doesn't have the type of its schema.
+		:param query_arguments: the URL arguments of the request, i.e. a dictionary {name: list of values}
+		:return: a dictionary {argument name: value} of the arguments of the web service in the request
+		"""
+		arguments = {}
+		for name, schema in self.arguments.iteritems():
+			if name not in query_arguments:
+				continue
+			value = query_arguments[name][0]
+			converter = _converter(_QUERY_CONVERTERS, schema)
+			if converter is not None:
+				try:
+					value = converter(value)
+				except ValueError:
+					raise WrongArgumentValueError(name)
+			arguments[name] = value
+
+		return arguments
+
+	def parse_body(self, body_arguments):
+		"""
+		Get the arguments of a POST request. The integer, number and boolean arguments sent as strings (e.g. "12" or
+		"true") are converted to the types of their schemas; other values are left to validate().
+		:param body_arguments: the JSON object of the body of the request
+		:return: a dictionary {argument name: value}
+		"""
+		if not isinstance(body_arguments, dict):
+			return body_arguments  # Rejected by validate()
+
+		arguments = dict(body_arguments)
+		for name, schema in self.arguments.iteritems():
+			value = arguments.get(name)
+			converter = _converter(_BODY_CONVERTERS, schema)
+			if converter is not None and isinstance(value, basestring):
+				try:
+					arguments[name] = converter(value)
+				except ValueError:
+					pass  # Rejected by validate()
+
+		return arguments
+
+	def validate(self, arguments):
+		"""
+		Check the arguments of the web service against its schema.
+		Raises a MissingArgumentsError if an argument is missing, or a WrongArgumentValueError if an argument doesn't
+		match its schema.
+		:param arguments: a dictionary {argument name: value}
+		"""
+		error = next(self._validator.iter_errors(arguments), None)
+		if error is not None:
+			if error.validator in _MISSING_VALIDATORS or not error.path:
+				raise MissingArgumentsError()
+			raise WrongArgumentValueError(error.path[0])
+
+	def call(self, arguments, **context):
+		"""
+		Check the arguments of the web service (see validate()) and call its function.
+		:param arguments: a dictionary {argument name: value} (arguments not in the schema are ignored)
+		:param context: the values of the request passed to the function if it has parameters with their names
+			(e.g. user_id)
+		:return: the result of the function
+		"""
+		self.validate(arguments)
+
+		keyword_arguments = dict((name, value) for name, value in arguments.iteritems()
+		                         if name in self.arguments and name in self._parameters)
+		for name, value in context.iteritems():
+			if name in self._parameters:
+				keyword_arguments[name] = value
+
+		return self.function(**keyword_arguments)
+
+
+def _converter(converters, schema):
+	# The converter of the type of a schema, None if it has none (or several types)
+	schema_type = schema.get('type')
+	return converters.get(schema_type) if isinstance(schema_type, basestring) else None
+
+
+class WebServiceRegistry(object):
+	"""
+	The web services of an API, in the order they're registered.
+	"""
+
+	def __init__(self):
+		self._web_services = {}  # (method, name) -> WebService
+		self._order = []
+
+	def add(self, name, method, function, arguments=None, required=(), require_token=True, **constraints):
+		"""
+		Register a web service (see WebService).
+		"""
+		if (method, name) in self._web_services:
+			raise ValueError("Web service {0} {1} registered twice".format(method, name))
+
+		web_service = WebService(name, method, function, arguments or {}, required, require_token, constraints)
+		self._web_services[(method, name)] = web_service
+		self._order.append(web_service)
+
+	def get(self, method, name):
+		"""
+		Raises an InexistentResourceError if there is no such web service.
+		:param method: "GET" or "POST"
+		:param name: the name of the web service
+		:return: the WebService
+		"""
+		web_service = self._web_services.get((method, name))
+		if web_service is None:
+			raise InexistentResourceError()
+
+		return web_service
+
+	def __iter__(self):
+		return iter(self._order)
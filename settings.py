@@ -13,6 +13,13 @@ define("host", default="localhost", help="app host", type=str)
 define("port", default=8888, help="run on the given port", type=int)
 define("config", default=None, help="tornado config file")
 define("debug", default=False, help="debug mode")
+define("workers", default=1, help="number of worker processes to fork (0 for one per CPU core)", type=int)
+define("reuse_port", default=False, help="bind one SO_REUSEPORT socket per worker instead of sharing a socket",
+       type=bool)
+define("graceful_timeout", default=10, help="seconds a worker waits for pending requests on graceful restart",
+       type=int)
+define("max_restarts", default=100000, help="number of times the workers can be forked again, including graceful "
+       "restarts", type=int)
 tornado.options.parse_command_line()
 
 STATIC_ROOT = path(ROOT, 'static')
@@ -49,6 +56,18 @@ settings['template_loader'] = tornado.template.Loader(TEMPLATE_ROOT)
 # Security
 settings['JWT_SECRET'] = "secret"  # TODO: Secret should be different for every User
 settings['JWT_ALGORITHM'] = "HS256"
+settings['JWT_EXPIRATION_SECONDS'] = 24 * 3600  # Lifetime of the issued tokens (refresh them with refresh_token)
+settings['JWT_REFRESH_LEEWAY_SECONDS'] = 7 * 24 * 3600  # Tokens expired less than this ago can still be refreshed
+settings['JWT_REFRESH_GRACE_SECONDS'] = 30  # A token refreshed less than this ago is refreshed to the same new token
+settings['JWT_MAX_SESSION_SECONDS'] = 30 * 24 * 3600  # Max age of a session (its tokens can't be refreshed after it)
+settings['JWT_REQUIRE_EXP'] = False  # True to reject the tokens without "exp", once the clients have refreshed them
+settings['JWT_CACHE_MAX_ENTRIES'] = 10000  # Max verified tokens cached (per process), 0 to verify every request
+settings['JWT_CACHE_TTL_SECONDS'] = 300  # Max seconds a verified token stays cached
+settings['TOKEN_REVOCATION_ENABLED'] = True  # False to keep accepting the tokens of the Users who logged out
+settings['TOKEN_REVOCATION_STORE'] = "sqlite"  # values: ["sqlite", "memory"] (memory: a single worker process only)
+settings['TOKEN_REVOCATION_SQLITE_PATH'] = path(ROOT, "revoked_tokens.sqlite")
+settings['TOKEN_REVOCATION_SYNC_SECONDS'] = 1  # Load the tokens revoked by other processes after this (sqlite)
+settings['TOKEN_REVOCATION_BLOOM_CAPACITY'] = 100000  # Revoked tokens the Bloom filter is sized for (1% false hits)
 
 # MySQL Database settings
 settings['DB_LOCATION'] = "production"  # values: ["local", "production"]
@@ -60,6 +79,68 @@ settings['DB_USER'] = "local-user" if settings['DB_LOCATION'] == "local" else "p
 settings['DB_PASSWORD'] = "local-password" if settings['DB_LOCATION'] == "local" else "production-password"
 settings['DB_SCHEMA'] = "local-schema" if settings['DB_LOCATION'] == "local" else "production-schema"
 
+# Database connection pool (per process). DB_POOL_SIZE should be at least DB_EXECUTOR_POOL_SIZE
+settings['DB_POOL_SIZE'] = 10  # Connections kept open in the pool
+settings['DB_POOL_MAX_OVERFLOW'] = 10  # Extra connections opened when the pool is exhausted
+settings['DB_POOL_RECYCLE_SECONDS'] = 3600  # Reopen connections older than this (must be below MySQL's wait_timeout)
+settings['DB_POOL_TIMEOUT_SECONDS'] = 30  # Max seconds to wait for a free connection
+settings['DB_POOL_PRE_PING'] = True  # Test idle connections with "SELECT 1" before using them
+settings['DB_POOL_PRE_PING_IDLE_SECONDS'] = 60  # Only test connections idle for longer than this
+settings['INTERNAL_API_ALLOWED_IPS'] = ["127.0.0.1", "::1"]  # Clients allowed to call the /internal/ web services
+
+# Read replicas (read-only db_crud functions decorated with read_from_replica are routed to them)
+settings['DB_REPLICA_HOSTS'] = []  # Same port, user, password and schema as the primary. Empty to read from the primary
+settings['DB_REPLICA_ROUTING'] = "round_robin"  # values: ["round_robin", "least_latency"]
+settings['DB_READ_YOUR_WRITES_SECONDS'] = 5  # Seconds a User reads from the primary after writing (per process)
+
+# Database executor (runs the web services in a thread pool, off the IOLoop thread)
+settings['DB_EXECUTOR_ENABLED'] = True  # False to run the web services directly in the IOLoop thread
+settings['DB_EXECUTOR_POOL_SIZE'] = 10  # Number of worker threads
+settings['DB_EXECUTOR_QUEUE_DEPTH'] = 100  # Max requests waiting for a worker thread before answering "server busy"
+settings['DB_EXECUTOR_TIMEOUT_SECONDS'] = 30  # Max seconds to wait for a web service (0 for no timeout)
+
+# Response cache for the anonymous catalog web services (per process)
+settings['RESPONSE_CACHE_ENABLED'] = True
+settings['RESPONSE_CACHE_MAX_ENTRIES'] = 1000  # Max number of cached responses
+settings['RESPONSE_CACHE_MAX_BYTES'] = 32 * 1024 * 1024  # Max total size of the cached responses
+settings['RESPONSE_CACHE_TTL_SECONDS'] = 60  # Also bounds how long other processes' writes take to be visible
+settings['RESPONSE_CACHE_BYPASS_HEADER'] = "X-Cache-Bypass"  # Requests with this header skip the cached response
+
+# Home feeds materialized in memory (per process)
+settings['FEED_MATERIALIZER_ENABLED'] = True  # False to sort the Artwork table in every request (and not by price)
+settings['FEED_REFRESH_SECONDS'] = 60  # Rebuild the feeds after this, to pick up the writes of other processes
+
+# Directory of the Artwork owners (Buyers, Galleries, Auction Houses, Artists) materialized in memory (per process)
+settings['OWNER_DIRECTORY_ENABLED'] = True  # False to query the owner tables for every page with Artwork owners
+settings['OWNER_DIRECTORY_REFRESH_SECONDS'] = 300  # Rebuild after this, to pick up the writes of other processes
+
+# Locations of the Galleries and Auction Houses indexed in memory (per process), for the nearby home feed
+settings['GEO_INDEX_ENABLED'] = True  # False to ignore the location of the nearby feed (sorting_rule=5)
+settings['GEO_INDEX_REFRESH_SECONDS'] = 300  # Rebuild after this, to pick up the writes of other processes
+settings['NEARBY_RADIUS_KM'] = 100  # Max distance of the venues whose Artwork are shown in the nearby feed
+
+# Follow graph of the Buyers materialized in memory (per process), for the watched home feeds (sorting_rule=2, 3, 4)
+settings['FOLLOW_GRAPH_ENABLED'] = True  # False to join the Follow tables in every watched feed request
+settings['FOLLOW_GRAPH_REFRESH_SECONDS'] = 300  # Rebuild after this, to pick up the writes of other processes
+
+# Write-behind counters (followed and vote counts), buffered in memory (per process) and written in batches
+settings['COUNTER_BUFFER_ENABLED'] = True  # False to update the counter rows in the transactions that change them
+settings['COUNTER_FLUSH_SECONDS'] = 1  # Write the buffered deltas after this (other processes see them then)
+settings['COUNTER_LOG_DIR'] = path(ROOT, "counter_log")  # Local log of the deltas not written yet (one per host)
+settings['COUNTER_LOG_FSYNC'] = False  # True to sync every delta to disk, to survive OS crashes (not only process ones)
+
+# Auction engine: the bids on each Artwork Auction are validated in memory and written in batches (per process)
+settings['AUCTION_ENGINE_ENABLED'] = True  # False to validate and write every bid in its own request transaction
+settings['AUCTION_REFRESH_SECONDS'] = 60  # Reload an auction after this, to pick up the edits of other processes
+settings['AUCTION_MAX_BATCH'] = 100  # Max bids written in a single transaction
+settings['AUCTION_MAX_QUEUE'] = 1000  # Max bids waiting on an auction, more get a ServerBusyError
+settings['AUCTION_ENGINE_WORKERS'] = 4  # Threads writing the bids (each one processes the bids of an auction at a time)
+
+# Live updates of the Artwork Auctions (WebSocket and long-poll), pushed by one polling thread per process
+settings['AUCTION_EVENTS_ENABLED'] = True  # False to only serve the Artwork Auctions with the artwork_auction service
+settings['AUCTION_EVENTS_POLL_SECONDS'] = 1  # Poll the watched auctions after this, to pick up other processes' bids
+settings['AUCTION_LONG_POLL_SECONDS'] = 30  # Max seconds a long-poll request waits for a new bid
+
 # Static file settings
 settings['FILE_EXPORT_PATH'] = "static/exportfiles"  # Relative path where export files will be stored
 settings['FILE_DELETE_INTERVAL_HOURS'] = 1  # Interval to run delete file export scheduled task
@@ -68,6 +149,7 @@ settings['FILE_EXPORT_LIFETIME_HOURS'] = 1  # Number of hours export files can l
 # Formatting
 settings['DATE_DISPLAY_FORMAT'] = "%Y-%m-%d"
 settings['DATETIME_DISPLAY_FORMAT'] = "%Y-%m-%d %H:%M:%S"
+settings['JSON_LIBRARY'] = "auto"  # values: ["auto", "simplejson", "json"] (auto: simplejson if it's installed)
 
 # Purchases
 COIN_PRICES = {5: 250,
@@ -0,0 +1,68 @@
+# coding=utf-8
+"""
+A SQLite database for the tests: it has the tables of lib.db_tables, and db_crud.Session is bound to it.
+MySQLdb must be installed (db_crud creates its MySQL engine when it's imported, without connecting).
+"""
+
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import BigInteger, create_engine
+from sqlalchemy.ext.compiler import compiles
+
+from lib import db_crud
+from lib.db_routing import ReplicaRouter
+from lib.db_tables import BaseTable
+
+
+@compiles(BigInteger, "sqlite")
+def _compile_big_integer(type_, compiler, **kwargs):
+	# SQLite only auto-increments the "INTEGER PRIMARY KEY" columns
+	return "INTEGER"
+
+
+class TestDatabase(object):
+	"""
+	SQLite files with the tables of lib.db_tables, in a temporary directory.
+	"""
+
+	def __init__(self):
+		self.directory = tempfile.mkdtemp(prefix="artmego-tests-")
+		self._engines = []
+		self._db_crud_engine = db_crud.engine  # Bound again by close()
+		self._db_crud_replica_router = db_crud.replica_router
+
+	def create_engine(self, name="primary"):
+		"""
+		:param name: the name of the SQLite file
+		:return: an engine of a new SQLite file with the tables
+		"""
+		engine = create_engine("sqlite:///" + os.path.join(self.directory, name + ".sqlite"),
+		                       connect_args={"check_same_thread": False})
+		BaseTable.metadata.create_all(engine)
+		self._engines.append(engine)
+		return engine
+
+	def bind(self, engine, replica_engines=(), pin_seconds=5):
+		"""
+		Bind db_crud.Session to an engine, and route the reads of db_crud to the replica engines (see
+		db_crud.replica_router).
+		:param engine: the engine of the primary
+		:param replica_engines: the engines of the read replicas
+		:param pin_seconds: the number of seconds a user reads from the primary after writing
+		"""
+		db_crud.engine = engine
+		db_crud.Session.configure(bind=engine)
+		db_crud.replica_router = ReplicaRouter(replica_engines, pin_seconds=pin_seconds)
+
+	def close(self):
+		"""
+		Close the engines and delete the SQLite files, and bind db_crud.Session to its engine again.
+		"""
+		db_crud.engine = self._db_crud_engine
+		db_crud.Session.configure(bind=self._db_crud_engine)
+		db_crud.replica_router = self._db_crud_replica_router
+		for engine in self._engines:
+			engine.dispose()
+		shutil.rmtree(self.directory, ignore_errors=True)
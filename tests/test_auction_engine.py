@@ -0,0 +1,148 @@
+# coding=utf-8
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from lib import db_changes
+from lib.auction_engine import AuctionEngine
+from lib.exceptions import InexistentResourceError, UnauthorizedError
+
+
+class AuctionStorage(object):
+	"""
+	An Artwork Auction shared by the engines of several processes, written like db_crud.write_auction_bids.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.auction = dict(artwork_auction_id=1, artwork_auction_minimum_bid=10, artwork_auction_bid_increment=10,
+		                    artwork_auction_start_time=datetime.now() - timedelta(days=1),
+		                    artwork_auction_end_time=datetime.now() + timedelta(days=1), artwork_auction_max_bid=None)
+		self.bids = []  # (user_id, amount) of the written bids
+
+	def load_auction(self, artwork_auction_id):
+		with self.lock:
+			return dict(self.auction) if artwork_auction_id == 1 else None
+
+	def write_bids(self, auction, bids):
+		time.sleep(0.001)  # The transaction
+		with self.lock:
+			if self.auction['artwork_auction_max_bid'] != auction['artwork_auction_max_bid']:
+				return None
+			self.bids.extend((user_id, amount) for user_id, amount, bid_time in bids)
+			self.auction['artwork_auction_max_bid'] = bids[-1][1]
+			return dict(self.auction)
+
+
+class AuctionEngineTest(unittest.TestCase):
+
+	def setUp(self):
+		self.storage = AuctionStorage()
+		self.engines = [AuctionEngine(self.storage.load_auction, self.storage.write_bids, 60, workers=2)
+		                for _ in xrange(3)]
+
+	def tearDown(self):
+		for engine in self.engines:
+			if engine._pool is not None:
+				engine._pool.shutdown(wait=True)
+
+	def test_bids(self):
+		engine = self.engines[0]
+		self.assertEqual(engine.bid(1, 1, 100), 0)
+		self.assertEqual(engine.submit(1, 2, 120).result(), 100)
+		self.assertRaises(UnauthorizedError, engine.bid, 1, 1, 120)
+		self.assertRaises(UnauthorizedError, engine.bid, 1, 1, 135)
+		self.assertRaises(InexistentResourceError, engine.bid, 2, 1, 500)
+
+		self.assertEqual(self.storage.bids, [(1, 100), (2, 120)])
+		self.assertEqual(engine.pending, 0)
+
+	def test_submit_does_not_wait(self):
+		engine = self.engines[0]
+		written = threading.Event()
+		write_bids = self.storage.write_bids
+		engine.write_bids = lambda auction, bids: written.wait(10) and write_bids(auction, bids)
+
+		futures = [engine.submit(1, user_id, 100 + 10 * user_id) for user_id in xrange(5)]
+		self.assertFalse(any(future.done() for future in futures))
+		self.assertEqual(engine.pending, 5)
+
+		written.set()
+		self.assertEqual([future.result(10) for future in futures], [0, 100, 110, 120, 130])
+		self.assertEqual(engine.pending, 0)
+
+	def test_edit_committed_while_bids_are_written_is_not_lost(self):
+		engine = self.engines[0]
+		engine.bid(1, 1, 100)
+		end_time = datetime.now() - timedelta(seconds=1)
+
+		def write_bids_and_edit(auction, bids):
+			new_auction = self.storage.write_bids(auction, bids)
+			# Committed by another thread before the engine keeps the state of the written bids
+			with self.storage.lock:
+				self.storage.auction['artwork_auction_end_time'] = end_time
+			engine.apply_changes([db_changes.RowChange("Artwork_Auction", db_changes.ACTION_UPDATE,
+			                                           dict(artwork_auction_id=1, artwork_auction_end_time=end_time),
+			                                           set(["artwork_auction_end_time"]))])
+			return new_auction
+
+		engine.write_bids = write_bids_and_edit
+		self.assertEqual(engine.bid(1, 2, 110), 100)
+		engine.write_bids = self.storage.write_bids
+		self.assertRaises(InexistentResourceError, engine.bid, 1, 3, 120)
+
+	def test_own_writes_keep_the_state(self):
+		engine = self.engines[0]
+		loads = []
+
+		def load_auction(artwork_auction_id):
+			loads.append(artwork_auction_id)
+			return self.storage.load_auction(artwork_auction_id)
+
+		def write_bids(auction, bids):
+			# The commit listener sees the bids written by the engine
+			new_auction = self.storage.write_bids(auction, bids)
+			engine.apply_changes([db_changes.RowChange("Artwork_Auction", db_changes.ACTION_UPDATE, dict(new_auction),
+			                                           set(["artwork_auction_max_bid"]))])
+			return new_auction
+
+		engine.load_auction = load_auction
+		engine.write_bids = write_bids
+		for amount in (100, 110, 120):
+			engine.bid(1, 1, amount)
+		self.assertEqual(loads, [1])
+
+	def test_concurrent_bids_are_ordered(self):
+		accepted = []  # (amount, current bid amount before the bid)
+		rejected = []
+		lock = threading.Lock()
+
+		def bid(engine, user_id):
+			for amount in xrange(10, 1000, 10):
+				try:
+					previous_amount = engine.bid(1, user_id, amount)
+				except UnauthorizedError:
+					with lock:
+						rejected.append(amount)
+				else:
+					with lock:
+						accepted.append((amount, previous_amount))
+
+		threads = [threading.Thread(target=bid, args=(engine, user_id))
+		           for engine in self.engines for user_id in xrange(12)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join(60)
+
+		amounts = [amount for user_id, amount in self.storage.bids]
+		self.assertEqual(amounts, sorted(set(amounts)))
+		self.assertEqual(sorted(accepted), zip(amounts, [0] + amounts[:-1]))
+		self.assertEqual(len(accepted) + len(rejected), 3 * 12 * 99)
+		self.assertEqual(self.storage.auction['artwork_auction_max_bid'], 990)
+		self.assertEqual([engine.pending for engine in self.engines], [0, 0, 0])
+
+
+if __name__ == "__main__":
+	unittest.main()
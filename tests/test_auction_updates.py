@@ -0,0 +1,55 @@
+# coding=utf-8
+import unittest
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from handlers import auction_updates
+from lib import db_crud
+from lib.auction_events import AuctionEventHub
+
+
+def _state(artwork_auction_id, bid_count):
+	return dict(artwork_auction_id=artwork_auction_id, bid_id=bid_count or None, current_bid=100 * bid_count,
+	            high_bidder_user_id=1 if bid_count else None, high_bidder_name="bu****" if bid_count else None,
+	            bid_count=bid_count)
+
+
+class EndLiveUpdatesTest(AsyncTestCase):
+
+	def setUp(self):
+		super(EndLiveUpdatesTest, self).setUp()
+		self.auction_events = db_crud.auction_events
+		db_crud.auction_events = AuctionEventHub(lambda ids: dict((i, 3) for i in ids),
+		                                         lambda ids: dict((i, _state(i, 3)) for i in ids), 60)
+
+	def tearDown(self):
+		db_crud.auction_events = self.auction_events
+		auction_updates._ending = False
+		super(EndLiveUpdatesTest, self).tearDown()
+
+	@gen_test
+	def test_long_poll_returns_the_current_state(self):
+		future = auction_updates.wait_for_auction_state(1, 3)
+		while db_crud.auction_events.get_state(1) is None:
+			yield gen.sleep(0.01)
+		self.assertEqual(auction_updates.live_update_count(), 1)
+		self.assertFalse(future.done())
+
+		auction_updates.end_live_updates()
+		state = yield future
+
+		self.assertEqual(state, _state(1, 3))
+		self.assertEqual(auction_updates.live_update_count(), 0)
+
+	@gen_test
+	def test_new_long_poll_returns_at_once(self):
+		auction_updates.end_live_updates()
+
+		with self.assertRaises(gen.TimeoutError):
+			yield auction_updates.wait_for_auction_state(1, 3)  # Not loaded yet
+		self.assertEqual(auction_updates.live_update_count(), 0)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,143 @@
+# coding=utf-8
+import json
+import os
+import unittest
+from datetime import datetime
+
+from lib import db_changes, db_crud, entity_versions
+from lib.counter_buffer import CounterBuffer, SEGMENT_PREFIX, SEGMENT_SUFFIX
+from lib.db_tables import Artist, Artwork, Counter_Flush, Critique, Entity_Version
+from tests.database import TestDatabase
+
+UPVOTES = ("Critique", (1, 11), "critique_upvote_count")
+FOLLOWERS = ("Artist", (4,), "artist_followed_count")
+
+
+class CounterBufferTest(unittest.TestCase):
+
+	def setUp(self):
+		self.database = TestDatabase()
+		self.database.bind(self.database.create_engine())
+		session = db_crud.Session()
+		session.add(Artist(user_id=4, artist_nickname="artist", artist_followed_count=2))
+		session.add(Artwork(artwork_id=1, artist_user_id=4, artwork_name="artwork", artwork_top_critique_upvote_count=5))
+		for critic_user_id, upvote_count, status in ((11, 5, "APPROVED"), (12, 3, "APPROVED"), (13, 50, "REJECTED")):
+			session.add(Critique(artwork_id=1, critic_user_id=critic_user_id, critique_upvote_count=upvote_count,
+			                     critique_downvote_count=0, critique_status=status,
+			                     critique_creation_time=datetime.now()))
+		session.commit()
+		session.close()
+
+		self.log_dir = os.path.join(self.database.directory, "counter_log")
+		self.counter_buffer = CounterBuffer(db_crud.write_counter_deltas, self.log_dir, 60)
+		self.other_counter_buffers = []
+
+	def tearDown(self):
+		for counter_buffer in [self.counter_buffer] + self.other_counter_buffers:
+			counter_buffer.stop()
+		self.database.close()
+
+	def query(self, *columns):
+		session = db_crud.Session()
+		try:
+			return session.query(*columns).all()
+		finally:
+			session.close()
+
+	def counters(self):
+		session = db_crud.Session()
+		try:
+			return (session.query(Critique).get((1, 11)).critique_upvote_count,
+			        session.query(Artist).get(4).artist_followed_count,
+			        session.query(Artwork).get(1).artwork_top_critique_upvote_count)
+		finally:
+			session.close()
+
+	def versions(self):
+		return dict(((entity_type, entity_id), version) for entity_type, entity_id, version
+		            in self.query(Entity_Version.entity_type, Entity_Version.entity_id, Entity_Version.entity_version))
+
+	def write_segment(self, segment_id, lines):
+		path = os.path.join(self.log_dir, SEGMENT_PREFIX + segment_id + SEGMENT_SUFFIX)
+		if not os.path.isdir(self.log_dir):
+			os.makedirs(self.log_dir)
+		with open(path, "wb") as segment_file:
+			segment_file.write("".join(lines))
+		return path
+
+	def test_segment_is_written_once(self):
+		deltas = {UPVOTES: 4, FOLLOWERS: 1}
+		db_crud.write_counter_deltas("segment", deltas)
+		versions = self.versions()
+		db_crud.write_counter_deltas("segment", deltas)
+
+		self.assertEqual(self.counters(), (9, 3, 9))
+		self.assertEqual(self.versions(), versions)
+		self.assertEqual(self.query(Counter_Flush.counter_flush_id), [("segment",)])
+
+	def test_upvotes_update_the_top_critique_when_written(self):
+		versions = self.versions()
+		changes = []
+		db_changes.add_commit_listener(changes.extend)
+		try:
+			db_crud.write_counter_deltas("segment", {UPVOTES: 1, ("Critique", (1, 12), "critique_upvote_count"): 4})
+		finally:
+			db_changes.remove_commit_listener(changes.extend)
+
+		self.assertEqual(self.counters(), (6, 2, 7))
+		self.assertEqual(self.versions()[(entity_versions.ARTWORK, 1)],
+		                 versions.get((entity_versions.ARTWORK, 1), 0) + 1)
+		self.assertIn(("Artwork", dict(artwork_id=1, artwork_top_critique_upvote_count=7)),
+		              [(change.table, change.values) for change in changes])
+
+	def test_followers_bump_the_profile_version_when_written(self):
+		follow = db_changes.RowChange("Follow_Artist", db_changes.ACTION_INSERT,
+		                              dict(buyer_user_id=1, artist_user_id=4), set())
+		self.assertNotIn((entity_versions.PROFILE, 4), entity_versions.version_keys(follow))
+
+		versions = self.versions()
+		db_crud.write_counter_deltas("segment", {FOLLOWERS: 1})
+		self.assertEqual(self.versions()[(entity_versions.PROFILE, 4)],
+		                 versions.get((entity_versions.PROFILE, 4), 0) + 1)
+
+	def test_segment_of_a_stopped_process_is_recovered(self):
+		path = self.write_segment("stopped", [json.dumps([list(UPVOTES) + [2]]) + "\n",
+		                                      json.dumps([list(FOLLOWERS) + [1]]) + "\n",
+		                                      json.dumps([list(UPVOTES) + [100]])])  # Left incomplete by the crash
+
+		self.counter_buffer.flush()
+		self.assertEqual(self.counters(), (7, 3, 7))
+		self.assertFalse(os.path.exists(path))
+
+		# Written again by a process that crashed after the commit and before removing the segment
+		self.write_segment("stopped", [json.dumps([list(UPVOTES) + [2]]) + "\n"])
+		self.counter_buffer.flush()
+		self.assertEqual(self.counters(), (7, 3, 7))
+
+	def test_segment_of_a_live_process_is_not_recovered(self):
+		other_counter_buffer = CounterBuffer(db_crud.write_counter_deltas, self.log_dir, 60)
+		self.other_counter_buffers.append(other_counter_buffer)
+		other_counter_buffer.add([UPVOTES + (2,)])
+
+		self.counter_buffer.flush()
+		self.assertEqual(self.counters(), (5, 2, 5))
+		self.assertEqual(len(os.listdir(self.log_dir)), 1)
+
+		other_counter_buffer.flush()
+		self.assertEqual(self.counters(), (7, 2, 7))
+		self.assertEqual(os.listdir(self.log_dir), [])
+
+	def test_segment_is_kept_until_it_is_written(self):
+		self.counter_buffer.write_deltas = lambda segment_id, deltas: 1 / 0
+		self.counter_buffer.add([FOLLOWERS + (1,)])
+		self.counter_buffer.flush()
+		self.assertEqual(self.counter_buffer.get_delta(*FOLLOWERS), 1)
+
+		self.counter_buffer.write_deltas = db_crud.write_counter_deltas
+		self.counter_buffer.flush()
+		self.assertEqual(self.counter_buffer.get_delta(*FOLLOWERS), 0)
+		self.assertEqual(self.counters(), (5, 3, 5))
+
+
+if __name__ == "__main__":
+	unittest.main()
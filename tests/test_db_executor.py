@@ -0,0 +1,143 @@
+# coding=utf-8
+import threading
+import unittest
+
+from concurrent import futures
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from lib import db_crud
+from lib.db_executor import AsyncResult, DBExecutor
+from lib.db_tables import Label
+from tests.database import TestDatabase
+
+
+def _add_label(label_name, wait_event=None):
+	session = db_crud.get_session()
+	session.add(Label(label_name=label_name))
+	session.commit()
+	if wait_event is not None:
+		wait_event.wait(10)
+
+
+def _label_names():
+	session = db_crud.Session()
+	try:
+		return [label.label_name for label in session.query(Label).order_by(Label.label_id)]
+	finally:
+		session.close()
+
+
+class RequestSessionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.database = TestDatabase()
+		self.database.bind(self.database.create_engine())
+
+	def tearDown(self):
+		self.database.close()
+
+	def test_commit(self):
+		request_session = db_crud.RequestSession()
+		db_crud.run_unit_of_work(request_session, _add_label, "committed")
+		request_session.close()
+
+		self.assertEqual(_label_names(), ["committed"])
+
+	def test_released_request_is_not_abandoned(self):
+		request_session = db_crud.RequestSession()
+
+		def add_label_and_release():
+			_add_label("released")
+			self.assertTrue(db_crud.release_request_session())
+			self.assertFalse(request_session.abandon())
+
+		db_crud.run_unit_of_work(request_session, add_label_and_release)
+		request_session.close()
+
+		self.assertEqual(_label_names(), ["released"])
+
+	def test_abandoned_request_is_not_released(self):
+		request_session = db_crud.RequestSession()
+
+		def add_label_abandon_and_release():
+			_add_label("abandoned")
+			self.assertTrue(request_session.abandon())
+			self.assertFalse(db_crud.release_request_session())
+
+		db_crud.run_unit_of_work(request_session, add_label_abandon_and_release)
+		request_session.close()
+
+		self.assertEqual(_label_names(), [])
+
+	def test_abandoned_request_is_rolled_back(self):
+		request_session = db_crud.RequestSession()
+
+		def add_label_and_abandon():
+			_add_label("abandoned")
+			self.assertTrue(request_session.abandon())
+
+		db_crud.run_unit_of_work(request_session, add_label_and_abandon)
+		request_session.close()
+
+		self.assertEqual(_label_names(), [])
+
+
+class DBExecutorTest(AsyncTestCase):
+
+	def setUp(self):
+		super(DBExecutorTest, self).setUp()
+		self.database = TestDatabase()
+		self.database.bind(self.database.create_engine())
+		self.executor = DBExecutor(True, 2, 10, 0.2)
+
+	def tearDown(self):
+		self.executor._get_pool().shutdown(wait=True)
+		self.database.close()
+		super(DBExecutorTest, self).tearDown()
+
+	@gen_test
+	def test_result(self):
+		request_session = db_crud.RequestSession()
+		result = yield self.executor.run(request_session, lambda: _add_label("committed") or 42)
+		request_session.close()
+
+		self.assertEqual(result, 42)
+		self.assertEqual(_label_names(), ["committed"])
+
+	@gen_test
+	def test_async_result_is_not_subject_to_the_timeout(self):
+		request_session = db_crud.RequestSession()
+		future = futures.Future()
+
+		def add_label():
+			_add_label("committed")
+			db_crud.release_request_session()
+			return AsyncResult(future, lambda value: value + 1)
+
+		result = self.executor.run(request_session, add_label)
+		yield gen.sleep(0.4)
+		self.assertEqual(self.executor.pending, 0)  # No thread waits for the future
+		self.assertEqual(_label_names(), ["committed"])
+
+		threading.Thread(target=future.set_result, args=(41,)).start()
+		self.assertEqual((yield result), 42)
+		request_session.close()
+
+	@gen_test
+	def test_timed_out_request_is_rolled_back(self):
+		request_session = db_crud.RequestSession()
+		wait_event = threading.Event()
+		with self.assertRaises(gen.TimeoutError):
+			yield self.executor.run(request_session, _add_label, "timed out", wait_event)
+
+		# The unit of work finishes after the client was told that the request failed
+		wait_event.set()
+		self.executor._get_pool().shutdown(wait=True)
+		request_session.close()
+
+		self.assertEqual(_label_names(), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,93 @@
+# coding=utf-8
+import time
+import unittest
+
+from sqlalchemy.orm import sessionmaker
+
+from lib import db_crud
+from lib.db_tables import Follow_Artist, Label
+from tests.database import TestDatabase
+
+
+class ReplicaRoutingTest(unittest.TestCase):
+	"""
+	Two SQLite files stand for the primary and a lagging replica.
+	"""
+
+	def setUp(self):
+		self.database = TestDatabase()
+		self.primary = self.database.create_engine("primary")
+		self.replica = self.database.create_engine("replica")
+		for engine, label_name in ((self.primary, "primary"), (self.replica, "replica")):
+			session = sessionmaker(bind=engine)()
+			session.add(Label(label_name=label_name))
+			session.commit()
+			session.close()
+		self.database.bind(self.primary, [self.replica])
+
+	def tearDown(self):
+		self.database.close()
+
+	def run_request(self, user_id, function, *args, **kwargs):
+		request_session = db_crud.RequestSession(user_id=user_id, **kwargs)
+		try:
+			return db_crud.run_unit_of_work(request_session, function, *args)
+		finally:
+			request_session.close()
+
+	def label_names(self, user_id=None):
+		return self.run_request(user_id, lambda: [label.label_name for label in db_crud.get_label_list()])
+
+	def test_reads_go_to_the_replica(self):
+		self.assertEqual(self.label_names(), ["replica"])
+		self.assertEqual([label.label_name for label in db_crud.get_label_list()], ["replica"])
+
+	def test_writes_go_to_the_primary(self):
+		def add_label():
+			session = db_crud.get_session()
+			session.add(Label(label_name="written"))
+			session.commit()
+			return [label.label_name for label in db_crud.get_label_list()]
+
+		# Once a session writes, it also reads from the primary
+		self.assertEqual(self.run_request(1, add_label), ["primary", "written"])
+
+	def test_read_your_writes(self):
+		db_crud.replica_router.pin_seconds = 0.2
+		self.run_request(1, lambda: db_crud.get_session().add(Label(label_name="written")) or
+		                 db_crud.get_session().commit())
+
+		self.assertEqual(self.label_names(1), ["primary", "written"])
+		self.assertEqual(self.label_names(2), ["replica"])
+		time.sleep(0.3)
+		self.assertEqual(self.label_names(1), ["replica"])
+
+	def test_cached_responses_are_read_from_the_primary(self):
+		label_names = lambda: [label.label_name for label in db_crud.get_label_list()]
+		self.assertEqual(self.run_request(None, label_names, primary_reads=True), ["primary"])
+
+	def test_views_are_loaded_from_the_primary(self):
+		session = sessionmaker(bind=self.primary)()
+		session.add(Follow_Artist(buyer_user_id=1, artist_user_id=4, follow_artist_status="FOLLOWING"))
+		session.commit()
+		session.close()
+
+		self.assertEqual(self.run_request(None, db_crud.get_follow_graph_rows), [("ARTIST", 1, 4)])
+		# e.g. when the follow graph is rebuilt by get_artwork_list
+		read = db_crud.read_from_replica(db_crud.get_follow_graph_rows)
+		self.assertEqual(self.run_request(None, read), [("ARTIST", 1, 4)])
+
+	def test_views_are_not_loaded_in_the_session_of_the_request(self):
+		def load_after_write():
+			session = db_crud.get_session()
+			session.add(Follow_Artist(buyer_user_id=2, artist_user_id=5, follow_artist_status="FOLLOWING"))
+			session.commit()  # Only flushed until the end of the request
+			return db_crud.get_follow_graph_rows()
+
+		# The rows written by the request are not committed yet (and could still be rolled back)
+		self.assertEqual(self.run_request(None, load_after_write), [])
+		self.assertEqual(db_crud.get_follow_graph_rows(), [("ARTIST", 2, 5)])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,90 @@
+# coding=utf-8
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from lib import db_crud, entity_versions
+from lib.db_tables import Artwork, Artwork_Auction, Entity_Version, Image
+from tests.database import TestDatabase
+
+
+class EntityVersionsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.database = TestDatabase()
+		self.database.bind(self.database.create_engine())
+		session = db_crud.Session()
+		session.add(Image(image_id=1, image_name="image", image_path="path/1"))
+		session.add(Artwork(artwork_id=1, artist_user_id=4, artwork_name="artwork"))
+		session.add(Artwork_Auction(artwork_auction_id=7, artwork_id=1, artwork_auction_minimum_bid=100,
+		                            artwork_auction_bid_increment=10,
+		                            artwork_auction_start_time=datetime.now() - timedelta(days=1),
+		                            artwork_auction_end_time=datetime.now() + timedelta(days=1)))
+		session.commit()
+		session.close()
+
+	def tearDown(self):
+		self.database.close()
+
+	def versions(self):
+		session = db_crud.Session()
+		try:
+			return dict(((version.entity_type, version.entity_id), version.entity_version)
+			            for version in session.query(Entity_Version))
+		finally:
+			session.close()
+
+	def update(self, table, primary_key, **values):
+		session = db_crud.Session()
+		row = session.query(table).get(primary_key)
+		for column, value in values.iteritems():
+			setattr(row, column, value)
+		session.commit()
+		session.close()
+
+	def test_artwork_version(self):
+		versions = self.versions()
+		self.update(Artwork, 1, artwork_name="new name")
+
+		self.assertEqual(self.versions()[(entity_versions.ARTWORK, 1)], versions[(entity_versions.ARTWORK, 1)] + 1)
+		self.assertNotIn(entity_versions.GLOBAL_KEY, self.versions())
+
+	def test_auction_bids_bump_the_artwork_version(self):
+		versions = self.versions()
+		auction = db_crud.write_auction_bids(db_crud.get_live_auction(7), [(2, 100, datetime.now())])
+		self.assertEqual(auction['artwork_auction_bid_count'], 1)
+
+		self.assertEqual(self.versions()[(entity_versions.ARTWORK, 1)], versions[(entity_versions.ARTWORK, 1)] + 1)
+
+	def test_global_version_is_bumped_after_the_commit(self):
+		global_bumps = []  # Whether each bump of the GLOBAL version was made in the session of the writer
+		original_bump_version = entity_versions._bump_version
+
+		def bump_version(session, entity_type, entity_id):
+			if (entity_type, entity_id) == entity_versions.GLOBAL_KEY:
+				global_bumps.append(isinstance(session, Session))
+			original_bump_version(session, entity_type, entity_id)
+
+		entity_versions._bump_version = bump_version
+		try:
+			self.update(Image, 1, image_path="path/2")
+			self.update(Image, 1, image_path="path/3")
+		finally:
+			entity_versions._bump_version = original_bump_version
+
+		self.assertEqual(self.versions()[entity_versions.GLOBAL_KEY], 2)
+		self.assertEqual(global_bumps, [False, False])
+
+	def test_rolled_back_transaction_does_not_bump_the_global_version(self):
+		session = db_crud.Session()
+		session.query(Image).get(1).image_path = "path/2"
+		session.flush()
+		session.rollback()
+		session.close()
+
+		self.assertNotIn(entity_versions.GLOBAL_KEY, self.versions())
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,39 @@
+# coding=utf-8
+import unittest
+from datetime import datetime
+
+from lib.feed_materializer import FeedMaterializer
+
+
+def _row(artwork_id, followed_count):
+	return dict(artwork_id=artwork_id, artwork_status="AVAILABLE", artist_user_id=4,
+	            artwork_followed_count=followed_count, artwork_display_weight=0, artwork_creation_time=datetime.now(),
+	            artwork_critique_count=0, artwork_top_critique_upvote_count=0, auctions=[])
+
+
+class FeedMaterializerTest(unittest.TestCase):
+
+	def setUp(self):
+		# The most popular Artwork first: 1, 2, 3, 4, 5, 6
+		self.feed = FeedMaterializer(lambda: [_row(artwork_id, 60 - 10 * artwork_id) for artwork_id in xrange(1, 7)],
+		                             300)
+
+	def test_pages(self):
+		self.assertEqual(self.feed.get_page(1, 3), [1, 2, 3])
+		self.assertEqual(self.feed.get_page(1, 3, 3), [4, 5, 6])
+		self.assertEqual(self.feed.get_page(1, 3, after=dict(artwork_id=3, artwork_followed_count=30,
+		                                                     artwork_display_weight=0)), [4, 5, 6])
+
+	def test_cursor_of_an_artwork_with_buffered_increments(self):
+		self.feed.rebuild()
+		# Artwork 5 gets 35 followers, not written to its row yet: 1, 5, 2, 3, 4, 6
+		self.feed.apply_counter_deltas([("Artwork", (5,), "artwork_followed_count", 35)])
+		self.assertEqual(self.feed.get_page(1, 2), [1, 5])
+
+		# The cursor of the first page is built from the row of Artwork 5, without the increments
+		page = self.feed.get_page(1, 2, after=dict(artwork_id=5, artwork_followed_count=10, artwork_display_weight=0))
+		self.assertEqual(page, [2, 3])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,59 @@
+# coding=utf-8
+import unittest
+
+from lib import db_changes
+from lib.follow_graph import CRITIQUE, FollowGraph
+
+
+class FollowGraphTest(unittest.TestCase):
+
+	def setUp(self):
+		self.rows = [("ARTIST", 1, 4), ("ARTIST", 2, 4), ("ARTWORK", 1, 10), (CRITIQUE, 11, 10)]
+		self.buyer_loads = []
+		self.graph = FollowGraph(lambda: list(self.rows), self.load_buyer_rows, 300)
+
+	def load_buyer_rows(self, buyer_user_id):
+		self.buyer_loads.append(buyer_user_id)
+		return [row for row in self.rows if row[0] != CRITIQUE and row[1] == buyer_user_id]
+
+	def test_build(self):
+		self.assertEqual(self.graph.get_following("ARTIST", 1), [4])
+		self.assertEqual(self.graph.get_followers("ARTIST", 4), [1, 2])
+		self.assertEqual(self.graph.get_following(CRITIQUE, 11), [10])
+
+	def test_apply_changes(self):
+		self.graph.rebuild()
+		self.graph.apply_changes([db_changes.RowChange("Follow_Artist", db_changes.ACTION_INSERT,
+		                                               dict(buyer_user_id=3, artist_user_id=4,
+		                                                    follow_artist_status="FOLLOWING"))])
+
+		self.assertEqual(self.graph.get_followers("ARTIST", 4), [1, 2, 3])
+
+	def test_sync_buyer_reloads_the_follows_written_by_other_processes(self):
+		self.graph.rebuild()
+		self.graph.sync_buyer(1, 0)
+		self.graph.sync_buyer(1, 0)
+		self.assertEqual(self.buyer_loads, [1])
+
+		# Another process follows an Artist and unfollows an Artwork for Buyer 1, and bumps its version
+		self.rows = [("ARTIST", 1, 4), ("ARTIST", 1, 5), ("ARTIST", 2, 4), (CRITIQUE, 11, 10)]
+		self.graph.sync_buyer(1, 1)
+
+		self.assertEqual(self.buyer_loads, [1, 1])
+		self.assertEqual(self.graph.get_following("ARTIST", 1), [4, 5])
+		self.assertEqual(self.graph.get_following("ARTWORK", 1), [])
+		self.assertEqual(self.graph.get_followers("ARTIST", 5), [1])
+		self.assertEqual(self.graph.get_followers("ARTWORK", 10), [])
+		self.assertEqual(self.graph.get_followers("ARTIST", 4), [1, 2])
+		self.assertEqual(self.graph.get_following(CRITIQUE, 11), [10])
+
+	def test_rebuild_forgets_the_synced_versions(self):
+		self.graph.sync_buyer(1, 0)
+		self.graph.rebuild()
+		self.graph.sync_buyer(1, 0)
+
+		self.assertEqual(self.buyer_loads, [1, 1])
+
+
+if __name__ == "__main__":
+	unittest.main()
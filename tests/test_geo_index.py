@@ -0,0 +1,187 @@
+# coding=utf-8
+import random
+import unittest
+
+from lib import db_crud
+from lib.db_tables import Address, Artwork, Auction_House, Gallery
+from lib.exceptions import WrongArgumentValueError
+from lib.geo_index import GeoGrid, GeoIndex, parse_geolocation
+from tests.database import TestDatabase
+
+
+class Row(object):
+
+	def __init__(self, **values):
+		self.__dict__.update(values)
+
+
+class ParseGeolocationTest(unittest.TestCase):
+
+	def assertLocation(self, text, latitude, longitude):
+		location = parse_geolocation(text)
+		self.assertIsNotNone(location, text)
+		self.assertAlmostEqual(location[0], latitude, 9)
+		self.assertAlmostEqual(location[1], longitude, 9)
+
+	def test_decimal_degrees(self):
+		self.assertLocation("24.971059,121.241765", 24.971059, 121.241765)
+		self.assertLocation(" -33.8688 , 151.2093 ", -33.8688, 151.2093)
+		self.assertLocation("24.9;121", 24.9, 121)
+		self.assertLocation("+24 -121", 24, -121)
+		self.assertLocation("90,-180", 90, -180)
+
+	def test_degrees_minutes_seconds(self):
+		self.assertLocation(u"24°49′N 120°59′E", 24 + 49 / 60.0, 120 + 59 / 60.0)
+		self.assertLocation(u"25°2′3″N 121°33′54″E", 25 + 2 / 60.0 + 3 / 3600.0, 121 + 33 / 60.0 + 54 / 3600.0)
+		self.assertLocation(u"33°52′S 151°12′E", -(33 + 52 / 60.0), 151.2)
+		self.assertLocation(u"74.0°W, 40.7°N", 40.7, -74)
+		self.assertLocation(u"24°49'n 120°59'e", 24 + 49 / 60.0, 120 + 59 / 60.0)
+		self.assertLocation(u"24°49′N 120°59′E".encode("utf-8"), 24 + 49 / 60.0, 120 + 59 / 60.0)
+
+	def test_invalid_locations(self):
+		for text in (None, "", "   ", "garbage", "24.9", "24.9,121.2,3", "91,0", "0,180.5", "-90.1,0", "1e3,2",
+		             u"24°49′N", u"24°N 25°N", u"120°E 121°W", u"91°N 120°E", u"24°N 181°E", "\xff\xfe"):
+			self.assertIsNone(parse_geolocation(text), repr(text))
+
+
+class GeoGridTest(unittest.TestCase):
+
+	def setUp(self):
+		self.random = random.Random(1)
+
+	def make_grid(self, points, cell_km=10.0):
+		grid = GeoGrid(cell_km)
+		for key, (latitude, longitude) in enumerate(points):
+			grid.add(key, latitude, longitude)
+		return grid
+
+	def brute_force(self, grid, points, latitude, longitude, k=None, radius=None):
+		distances = sorted((grid.distance(key, latitude, longitude), key) for key in xrange(len(points)))
+		if radius is not None:
+			distances = [(distance, key) for distance, key in distances if distance <= radius]
+		return distances[:k] if k is not None else distances
+
+	def random_points(self, count, latitudes=(-90, 90), longitudes=(-180, 180)):
+		return [(self.random.uniform(*latitudes), self.random.uniform(*longitudes)) for _ in xrange(count)]
+
+	def check_queries(self, grid, points, queries):
+		for latitude, longitude in queries:
+			for k, radius in ((1, None), (5, None), (50, None), (len(points) + 1, None), (None, 5), (None, 30),
+			                  (None, 500), (3, 30), (20, 100), (None, None)):
+				self.assertEqual(grid.nearest(latitude, longitude, k, radius),
+				                 self.brute_force(grid, points, latitude, longitude, k, radius),
+				                 (latitude, longitude, k, radius))
+
+	def test_nearest_in_a_dense_area(self):
+		# Many points per cell: the query stops after a few rings
+		area = dict(latitudes=(24.5, 25.5), longitudes=(121, 122))
+		points = self.random_points(2000, **area)
+		grid = self.make_grid(points, cell_km=5)
+		self.check_queries(grid, points, self.random_points(20, **area) + [(24, 120), (60, 10)])
+
+	def test_nearest_around_the_world(self):
+		# Fewer occupied cells than cells on the rings: the query checks the occupied cells directly
+		points = self.random_points(300)
+		grid = self.make_grid(points)
+		self.check_queries(grid, points, self.random_points(20) + [(90, 0), (-90, 0), (0, 180), (0, -180)])
+
+	def test_nearest_across_the_antimeridian(self):
+		points = self.random_points(200, latitudes=(-5, 5), longitudes=(179, 180)) + \
+			self.random_points(200, latitudes=(-5, 5), longitudes=(-180, -179))
+		grid = self.make_grid(points)
+		self.check_queries(grid, points, [(0, 180), (0, -179.99), (1, 179.5)])
+
+	def test_bounds(self):
+		grid = self.make_grid([(25, 121), (25, 121), (25.1, 121)])
+		self.assertEqual(grid.nearest(25, 121, k=0), [])
+		self.assertEqual([key for distance, key in grid.nearest(25, 121, radius=0)], [0, 1])
+		self.assertEqual([key for distance, key in grid.nearest(25, 121, k=1)], [0])
+		self.assertEqual(GeoGrid().nearest(25, 121), [])
+
+	def test_points_are_replaced_and_removed(self):
+		grid = self.make_grid([(25, 121), (40, -74)])
+		grid.add(0, 48.85, 2.35)
+		grid.remove(1)
+		grid.remove(2)
+
+		self.assertEqual(len(grid), 1)
+		self.assertEqual([key for distance, key in grid.nearest(25, 121)], [0])
+		self.assertIsNone(grid.distance(1, 25, 121))
+		self.assertEqual(grid.nearest(25, 121, radius=100), [])
+
+
+class NearbyArtworkListTest(unittest.TestCase):
+	"""
+	The nearby feed (sorting_rule=5 with a location), paginated with offsets and cursors.
+	"""
+
+	def setUp(self):
+		self.database = TestDatabase()
+		self.database.bind(self.database.create_engine())
+		self.geo_index = db_crud.geo_index
+		db_crud.geo_index = GeoIndex(db_crud.get_venue_location_rows, 300)
+
+		session = db_crud.Session()
+		for address_id, geolocation in ((1, "25.0,121.5"), (2, "25.1,121.5"), (3, "25.2,121.5"), (4, "30,121.5")):
+			session.add(Address(address_id=address_id, geolocation=geolocation))
+		# Galleries 2 and 3 are at the same distance, Gallery 5 is too far, Gallery 6 has no location
+		for user_id, address_id in ((1, 1), (2, 2), (3, 2), (5, 4), (6, None)):
+			session.add(Gallery(user_id=user_id, gallery_name="gallery", address_id=address_id))
+		session.add(Auction_House(user_id=4, auction_house_name="auction house", address_id=3))
+		for artwork_id, gallery_id, auction_house_id, display_weight, status, buyer_id in (
+				(1, 1, None, 5, "AVAILABLE", None), (2, 1, None, 5, "AVAILABLE", None),
+				(3, 1, None, None, "AVAILABLE", None), (4, 1, None, 9, "AVAILABLE", None),
+				(5, 2, None, 1, "AVAILABLE", None), (6, 2, None, None, "AVAILABLE", None),
+				(7, 3, None, 1, "AVAILABLE", None), (8, 3, None, 3, "AVAILABLE", None),
+				(9, None, 4, 2, "AVAILABLE", None), (10, 1, 4, 0, "AVAILABLE", None),
+				(11, 5, None, 1, "AVAILABLE", None), (12, 1, None, 1, "SOLD", None),
+				(13, 1, None, 1, "AVAILABLE", 7), (14, 6, None, 1, "AVAILABLE", None)):
+			session.add(Artwork(artwork_id=artwork_id, artwork_name="artwork", owner_gallery_user_id=gallery_id,
+			                    owner_auction_house_user_id=auction_house_id, owner_buyer_user_id=buyer_id,
+			                    artwork_display_weight=display_weight, artwork_status=status))
+		session.commit()
+		session.close()
+
+		# By distance, then display weight (NULLs last); Artwork 10 is owned by its Gallery
+		self.expected_ids = [4, 1, 2, 10, 3, 8, 5, 7, 6, 9]
+
+	def tearDown(self):
+		db_crud.geo_index = self.geo_index
+		self.database.close()
+
+	def artwork_ids(self, limit, offset=0, cursor=None):
+		artwork_list, artwork_images = db_crud.get_artwork_list(5, limit=limit, offset=offset, location="25.0,121.5",
+		                                                        cursor=cursor)
+		return [artwork.artwork_id for artwork in artwork_list], artwork_list
+
+	def test_offset_pages(self):
+		self.assertEqual(self.artwork_ids(0)[0], self.expected_ids)
+		for limit in xrange(1, 11):
+			ids = []
+			for offset in xrange(0, len(self.expected_ids), limit):
+				ids.extend(self.artwork_ids(limit, offset)[0])
+			self.assertEqual(ids, self.expected_ids, limit)
+
+	def test_cursor_pages(self):
+		self.assertIs(db_crud.get_artwork_list_order(5, "25.0,121.5"), db_crud.NEARBY_ARTWORK_ORDER)
+		for limit in xrange(1, 12):
+			ids = []
+			cursor = ""
+			while cursor is not None:
+				page_ids, artwork_list = self.artwork_ids(limit, cursor=cursor)
+				ids.extend(page_ids)
+				cursor = db_crud.NEARBY_ARTWORK_ORDER.next_cursor(artwork_list, limit)
+			self.assertEqual(ids, self.expected_ids, limit)
+
+	def test_wrong_location_or_cursor(self):
+		self.assertRaises(WrongArgumentValueError, db_crud.get_artwork_list, 5, location="garbage")
+		self.assertRaises(WrongArgumentValueError, db_crud.get_artwork_list, 5, location="95,121.5")
+
+		# The owner of the Artwork of the cursor has no location
+		cursor = db_crud.NEARBY_ARTWORK_ORDER.next_cursor([Row(owner_gallery_user_id=6, owner_auction_house_user_id=None,
+		                                                       artwork_display_weight=1, artwork_id=14)], 1)
+		self.assertRaises(WrongArgumentValueError, self.artwork_ids, 5, 0, cursor)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,144 @@
+# coding=utf-8
+import base64
+import json
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from lib import db_crud
+from lib.db_tables import Artwork, Label
+from lib.exceptions import WrongArgumentValueError
+from lib.pagination import Keyset, combine_cursors, split_cursors
+from tests.database import TestDatabase
+
+
+class Row(object):
+
+	def __init__(self, **values):
+		self.__dict__.update(values)
+
+
+class KeysetTest(unittest.TestCase):
+
+	def setUp(self):
+		self.database = TestDatabase()
+		self.database.bind(self.database.create_engine())
+
+		# Ties and NULLs in the sort columns
+		now = datetime(2026, 1, 2, 3, 4, 5, 678901)
+		session = db_crud.Session()
+		for label_id, label_name in enumerate(["b", None, "a", "b", None, "c", "a", "b"], 1):
+			session.add(Label(label_id=label_id, label_name=label_name))
+		for artwork_id, followed_count, display_weight in ((1, 5, 1), (2, None, 3), (3, 5, None), (4, 2, 2),
+		                                                   (5, 5, 1), (6, None, None), (7, 2, 9), (8, 5, 3)):
+			session.add(Artwork(artwork_id=artwork_id, artwork_name="artwork", artwork_followed_count=followed_count,
+			                    artwork_display_weight=display_weight,
+			                    artwork_creation_time=now - timedelta(seconds=artwork_id % 3)))
+		session.commit()
+		session.close()
+
+	def tearDown(self):
+		self.database.close()
+
+	def page_through(self, table, order, limit):
+		# The ids of all the pages of a list, following the cursors
+		session = db_crud.Session()
+		try:
+			ids = []
+			cursor = ""
+			while cursor is not None:
+				query = session.query(table)
+				cursor_filter = order.filter(cursor)
+				if cursor_filter is not None:
+					query = query.filter(cursor_filter)
+				rows = query.order_by(*order.order_by()).limit(limit).all()
+				self.assertLessEqual(len(rows), limit)
+				ids.extend(row.__mapper__.primary_key_from_instance(row)[0] for row in rows)
+				cursor = order.next_cursor(rows, limit)
+			return ids
+		finally:
+			session.close()
+
+	def all_ids(self, table, order):
+		session = db_crud.Session()
+		try:
+			return [row.__mapper__.primary_key_from_instance(row)[0]
+			        for row in session.query(table).order_by(*order.order_by()).all()]
+		finally:
+			session.close()
+
+	def test_ascending_order_with_ties_and_nulls(self):
+		# NULLs first, then the ties by label_id
+		self.assertEqual(self.all_ids(Label, db_crud.LABEL_LIST_ORDER), [2, 5, 3, 7, 1, 4, 8, 6])
+		for limit in xrange(1, 10):
+			self.assertEqual(self.page_through(Label, db_crud.LABEL_LIST_ORDER, limit), [2, 5, 3, 7, 1, 4, 8, 6])
+
+	def test_descending_order_with_ties_and_nulls(self):
+		order = db_crud.ARTWORK_LIST_ORDERS[1]  # followed count and display weight, descending (NULLs last)
+		self.assertEqual(self.all_ids(Artwork, order), [8, 1, 5, 3, 7, 4, 2, 6])
+		for limit in xrange(1, 10):
+			self.assertEqual(self.page_through(Artwork, order, limit), [8, 1, 5, 3, 7, 4, 2, 6])
+
+	def test_datetime_order(self):
+		order = db_crud.ARTWORK_LIST_ORDERS[6]  # newest first, with microseconds
+		for limit in xrange(1, 4):
+			self.assertEqual(self.page_through(Artwork, order, limit), self.all_ids(Artwork, order))
+
+	def test_values_are_decoded(self):
+		order = Keyset("list", [(Artwork.artwork_creation_time, True), (Artwork.artwork_display_weight, False)],
+		               [Artwork.artwork_id])
+		row = Row(artwork_creation_time=datetime(2026, 1, 2, 3, 4, 5, 6), artwork_display_weight=Decimal("1.50"),
+		          artwork_id=7)
+		self.assertEqual(order.decode(order.next_cursor([row], 1)),
+		                 dict(artwork_creation_time=datetime(2026, 1, 2, 3, 4, 5, 6),
+		                      artwork_display_weight=Decimal("1.50"), artwork_id=7))
+		self.assertIsNone(order.decode(""))
+
+	def test_last_page_has_no_cursor(self):
+		order = db_crud.LABEL_LIST_ORDER
+		self.assertIsNone(order.next_cursor([Row(label_name="a", label_id=1)], 2))
+		self.assertIsNone(order.next_cursor([Row(label_name="a", label_id=1)], 0))
+		self.assertIsNotNone(order.next_cursor([Row(label_name="a", label_id=1)], 1))
+
+	def test_wrong_cursors_are_rejected(self):
+		order = db_crud.LABEL_LIST_ORDER
+		cursor = order.next_cursor([Row(label_name="a", label_id=1)], 1)
+		other_list_cursor = db_crud.ARTIST_LIST_ORDER.next_cursor([Row(artist_nickname="a", user_id=1)], 1)
+		tampered_cursor = base64.urlsafe_b64encode(json.dumps(["label_list", ["a"]]))
+		for wrong_cursor in (other_list_cursor, tampered_cursor, cursor[:-4], "not a cursor", "e30=",
+		                     base64.urlsafe_b64encode(json.dumps(["label_list", {"label_name": "a"}]))):
+			self.assertRaises(WrongArgumentValueError, order.filter, wrong_cursor)
+
+	def test_offset_still_works(self):
+		pages = [[label.label_name for label in db_crud.get_label_list(limit=3, offset=offset)]
+		         for offset in (0, 3, 6)]
+		self.assertEqual(pages, [[None, None, "a"], ["a", "b", "b"], ["b", "c"]])
+
+		labels = db_crud.get_label_list(limit=3, cursor="")
+		self.assertEqual([label.label_id for label in labels], [2, 5, 3])
+		labels = db_crud.get_label_list(limit=3, cursor=db_crud.LABEL_LIST_ORDER.next_cursor(labels, 3))
+		self.assertEqual([label.label_id for label in labels], [7, 1, 4])
+
+
+class CombinedCursorsTest(unittest.TestCase):
+
+	def test_cursors_are_combined(self):
+		names = ["followed_artwork", "followed_artists", "followed_critics"]
+		self.assertEqual(split_cursors("", names), dict((name, "") for name in names))
+
+		cursor = combine_cursors(dict(followed_artwork="artwork cursor", followed_artists=None,
+		                              followed_critics="critics cursor"))
+		self.assertEqual(split_cursors(cursor, names), dict(followed_artwork="artwork cursor", followed_artists=None,
+		                                                    followed_critics="critics cursor"))
+
+		self.assertIsNone(combine_cursors(dict(followed_artwork=None, followed_artists=None)))
+
+	def test_wrong_cursors_are_rejected(self):
+		names = ["followed_artwork", "followed_artists"]
+		cursor = combine_cursors(dict(favorite_artwork="cursor"))
+		for wrong_cursor in (cursor, "not a cursor", base64.urlsafe_b64encode(json.dumps(["cursor"]))):
+			self.assertRaises(WrongArgumentValueError, split_cursors, wrong_cursor, names)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,46 @@
+# coding=utf-8
+import unittest
+
+from lib import db_changes
+from lib.response_cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cache = ResponseCache(10, 1000, 60)
+		self.key = ResponseCache.make_key("label_list", {"limit": ["10"]})
+		self.dependencies = {"Label": None, "Artist": set(["artist_nickname"])}
+
+	def test_get_and_set(self):
+		self.assertIsNone(self.cache.get(self.key))
+		self.cache.set(self.key, '{"response":"success"}', self.dependencies, self.cache.generation())
+		self.assertEqual(self.cache.get(self.key), '{"response":"success"}')
+
+	def test_invalidate(self):
+		self.cache.set(self.key, "response", self.dependencies, self.cache.generation())
+		self.cache.invalidate([db_changes.RowChange("Artist", db_changes.ACTION_UPDATE, changed=set(["image_id"]))])
+		self.assertEqual(self.cache.get(self.key), "response")
+
+		self.cache.invalidate([db_changes.RowChange("Label", db_changes.ACTION_INSERT)])
+		self.assertIsNone(self.cache.get(self.key))
+
+	def test_response_read_before_an_invalidation_is_not_cached(self):
+		generation = self.cache.generation()
+		# A write to a table of the response commits while the response is read
+		self.cache.invalidate([db_changes.RowChange("Label", db_changes.ACTION_INSERT)])
+		self.cache.set(self.key, "stale response", self.dependencies, generation)
+
+		self.assertIsNone(self.cache.get(self.key))
+		self.assertEqual(self.cache.statistics()['stale_sets'], 1)
+
+	def test_response_read_before_an_unrelated_invalidation_is_cached(self):
+		generation = self.cache.generation()
+		self.cache.invalidate([db_changes.RowChange("Buyer", db_changes.ACTION_UPDATE)])
+		self.cache.set(self.key, "response", self.dependencies, generation)
+
+		self.assertEqual(self.cache.get(self.key), "response")
+
+
+if __name__ == "__main__":
+	unittest.main()
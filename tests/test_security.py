@@ -0,0 +1,173 @@
+# coding=utf-8
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import jwt
+
+from handlers import mobile_app_api
+from lib import security, token_revocation
+from lib.db_tables import User
+from lib.exceptions import AuthenticationError
+from settings import settings
+
+
+class RefreshTokenTest(unittest.TestCase):
+
+	def setUp(self):
+		self.revocation_list = security.revocation_list
+		security.revocation_list = token_revocation.RevocationList(token_revocation.MemoryRevocationStore(), 1, 100)
+		security.token_cache.clear()
+		self.user = User(user_id=1, user_type="BUYER")
+
+	def tearDown(self):
+		security.revocation_list.stop()
+		security.revocation_list = self.revocation_list
+		security.token_cache.clear()
+
+	def make_token(self, **claims):
+		claims = dict(dict(user_id=1, user_type="BUYER", jti="token"), **claims)
+		return jwt.encode(claims, settings['JWT_SECRET'], algorithm=settings['JWT_ALGORITHM'])
+
+	def test_refreshed_token_is_revoked(self):
+		token = security.generate_jwt(self.user)
+		new_token = security.refresh_jwt(token, self.user)
+
+		self.assertEqual(security.authenticate_user_token(new_token), 1)
+		self.assertRaises(AuthenticationError, security.authenticate_user_token, token)
+
+	def test_repeated_refresh_returns_the_same_token(self):
+		token = security.generate_jwt(self.user)
+		new_token = security.refresh_jwt(token, self.user)
+		# The response of the refresh was lost
+		self.assertEqual(security.authenticate_refresh_token(token), 1)
+		self.assertEqual(security.refresh_jwt(token, self.user), new_token)
+		self.assertRaises(AuthenticationError, security.authenticate_user_token, token)
+
+		# Not once the new token is revoked
+		security.revoke_token(new_token)
+		self.assertRaises(AuthenticationError, security.authenticate_refresh_token, token)
+		self.assertRaises(AuthenticationError, security.refresh_jwt, token, self.user)
+
+	def test_refreshed_token_is_not_refreshed_after_the_grace_period(self):
+		grace_seconds = settings['JWT_REFRESH_GRACE_SECONDS']
+		settings['JWT_REFRESH_GRACE_SECONDS'] = -1  # Over as soon as the token is refreshed
+		try:
+			token = security.generate_jwt(self.user)
+			security.refresh_jwt(token, self.user)
+			self.assertRaises(AuthenticationError, security.refresh_jwt, token, self.user)
+		finally:
+			settings['JWT_REFRESH_GRACE_SECONDS'] = grace_seconds
+
+	def test_refreshed_token_keeps_the_session_start(self):
+		now = int(time.time())
+		token = self.make_token(iat=now - 3600, exp=now - 60, auth_time=now - 10 * 24 * 3600)
+		claims = jwt.decode(security.refresh_jwt(token, self.user), verify=False)
+
+		self.assertEqual(claims['auth_time'], now - 10 * 24 * 3600)
+		self.assertGreaterEqual(claims['iat'], now)
+
+	def test_session_expires(self):
+		now = int(time.time())
+		session_start_time = now - settings['JWT_MAX_SESSION_SECONDS'] + 60
+		token = self.make_token(iat=now, exp=now + 3600, auth_time=session_start_time)
+		claims = jwt.decode(security.refresh_jwt(token, self.user), verify=False)
+		self.assertEqual(claims['exp'], session_start_time + settings['JWT_MAX_SESSION_SECONDS'])
+
+		old_token = self.make_token(iat=now - 3600, exp=now + 3600, jti="old token",
+		                            auth_time=now - settings['JWT_MAX_SESSION_SECONDS'] - 1)
+		self.assertRaises(AuthenticationError, security.refresh_jwt, old_token, self.user)
+		self.assertEqual(security.authenticate_user_token(old_token), 1)  # Until it expires
+
+		# The tokens issued before the tokens had an "auth_time"
+		legacy_token = self.make_token(iat=now - settings['JWT_MAX_SESSION_SECONDS'] - 1, exp=now - 60,
+		                               jti="legacy token")
+		self.assertRaises(AuthenticationError, security.refresh_jwt, legacy_token, self.user)
+
+	def test_logout_revokes_the_refreshed_tokens(self):
+		now = int(time.time())
+		refreshed_token = self.make_token(iat=now - 60, exp=now + 3600)
+		token = security.refresh_jwt(self.make_token(iat=now - 3600, exp=now + 3600, jti="first token"), self.user)
+		other_user_token = self.make_token(user_id=2, iat=now - 60, exp=now + 3600, jti="other user token")
+		security.revoke_token(token)
+
+		self.assertRaises(AuthenticationError, security.authenticate_user_token, token)
+		self.assertRaises(AuthenticationError, security.authenticate_user_token, refreshed_token)
+		self.assertRaises(AuthenticationError, security.refresh_jwt, refreshed_token, self.user)
+		self.assertEqual(security.authenticate_user_token(other_user_token), 2)
+
+		# Logging in again
+		self.assertEqual(security.authenticate_user_token(security.generate_jwt(self.user)), 1)
+
+	def test_token_of_another_user_is_not_refreshed(self):
+		token = security.generate_jwt(User(user_id=2, user_type="BUYER"))
+		self.assertRaises(AuthenticationError, security.refresh_jwt, token, self.user)
+
+	def test_stale_token_is_ignored_by_login(self):
+		now = int(time.time())
+		self.assertEqual(mobile_app_api.authenticate_login_token(self.make_token(iat=now, exp=now + 3600)), 1)
+
+		expired_token = self.make_token(iat=now - 3600, exp=now - settings['JWT_REFRESH_LEEWAY_SECONDS'] - 1)
+		revoked_token = self.make_token(iat=now, exp=now + 3600, jti="revoked token")
+		security.revoke_token(revoked_token)
+		for token in (expired_token, revoked_token, "garbage"):
+			self.assertIsNone(mobile_app_api.authenticate_login_token(token))
+
+
+class SQLiteRevocationStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix="artmego-tests-")
+		self.path = os.path.join(self.directory, "revoked_tokens.sqlite")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+	def test_key_is_revoked_once(self):
+		stores = [token_revocation.SQLiteRevocationStore(self.path) for _ in xrange(2)]  # Two processes
+
+		self.assertTrue(stores[0].revoke("token", None))
+		self.assertFalse(stores[1].revoke("token", None))
+		self.assertTrue(stores[1].is_revoked("token"))
+		self.assertEqual(stores[1].load(), (["token"], [], (1, 0)))
+
+	def test_replacement_is_kept_until_it_expires(self):
+		stores = [token_revocation.SQLiteRevocationStore(self.path) for _ in xrange(2)]  # Two processes
+
+		self.assertTrue(stores[0].revoke("token", None, "new token", 1000))
+		self.assertEqual(stores[1].get_replacement("token", 1000), "new token")
+		self.assertIsNone(stores[1].get_replacement("other token", 1000))
+
+		stores[1].purge(1001)
+		self.assertIsNone(stores[0].get_replacement("token", 0))
+		self.assertTrue(stores[0].is_revoked("token"))
+
+	def test_revocations_of_other_processes_are_loaded_in_the_background(self):
+		revocation_lists = [token_revocation.RevocationList(token_revocation.SQLiteRevocationStore(self.path), 0.05, 100)
+		                    for _ in xrange(2)]  # Two processes
+		try:
+			for revocation_list in revocation_lists:
+				revocation_list.start()
+			revocation_lists[0].revoke("token", None)
+			revocation_lists[0].revoke_user(1, 1000, None)
+
+			# The checks never use the store for the keys that were never revoked
+			revocation_lists[1].store.is_revoked = None
+			self.assertFalse(revocation_lists[1].is_revoked("other token", 1, 1000))
+
+			deadline = time.time() + 5
+			while not revocation_lists[1].is_revoked(None, 1, 999) and time.time() < deadline:
+				time.sleep(0.01)
+			self.assertTrue(revocation_lists[1].is_revoked(None, 1, 999))
+			self.assertFalse(revocation_lists[1].is_revoked(None, 2, 999))
+			del revocation_lists[1].store.is_revoked
+			self.assertTrue(revocation_lists[1].is_revoked("token"))
+		finally:
+			for revocation_list in revocation_lists:
+				revocation_list.stop()
+
+
+if __name__ == "__main__":
+	unittest.main()
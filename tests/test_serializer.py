@@ -0,0 +1,35 @@
+# coding=utf-8
+import decimal
+import unittest
+from datetime import date, datetime
+
+from lib import serializer
+
+
+class SerializerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.result = dict(response="success", artwork_price=decimal.Decimal("1000.00"), artwork_name=u"藝術",
+		                   bid_time=datetime(2026, 1, 2, 3, 4, 5), artwork_date=date(2026, 1, 2), count=2)
+
+	def test_decimals_are_encoded_as_floats(self):
+		self.assertEqual(serializer.loads(serializer.SERIALIZERS["json"].dumps(self.result))['artwork_price'], 1000.0)
+		self.assertIn('"artwork_price": 1000.0,', serializer.SERIALIZERS["json"].dumps(self.result))
+
+	def test_libraries_encode_the_same_json(self):
+		expected = serializer.SERIALIZERS["json"].dumps(self.result)
+		for name, library in serializer.SERIALIZERS.iteritems():
+			self.assertEqual(library.dumps(self.result), expected, name)
+
+	@unittest.skipIf(serializer.simplejson is None, "simplejson is not installed")
+	def test_auto_library_encodes_the_same_json(self):
+		self.assertEqual(serializer.get_serializer("auto").dumps(self.result),
+		                 serializer.SERIALIZERS["json"].dumps(self.result))
+
+	def test_unknown_objects_are_not_encoded(self):
+		for library in serializer.SERIALIZERS.itervalues():
+			self.assertRaises(TypeError, library.dumps, dict(value=object()))
+
+
+if __name__ == "__main__":
+	unittest.main()
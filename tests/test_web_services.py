@@ -0,0 +1,130 @@
+# coding=utf-8
+import json
+import unittest
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from handlers import mobile_app_api
+from handlers.mobile_app_api import MobileAppAPIHandler, OFFSET_OR_CURSOR, PAGE_ARGUMENTS
+from lib.exceptions import InexistentResourceError, MissingArgumentsError, WrongArgumentValueError
+from lib.web_services import BOOLEAN, INTEGER, NUMBER, WebServiceRegistry
+
+
+class WebServiceRegistryTest(unittest.TestCase):
+
+	def setUp(self):
+		self.calls = []
+		self.web_services = WebServiceRegistry()
+		self.web_services.add("list", "GET", lambda limit, offset=0, cursor=None, user_id=None:
+		                      self.calls.append((limit, offset, cursor, user_id)),
+		                      dict(PAGE_ARGUMENTS, price=NUMBER), required=["limit"], **OFFSET_OR_CURSOR)
+		self.web_services.add("follow", "POST", lambda user_id, artwork_id, follow:
+		                      self.calls.append((user_id, artwork_id, follow)),
+		                      dict(artwork_id=INTEGER, follow=BOOLEAN), required=["artwork_id", "follow"])
+
+	def get(self, name, **query_arguments):
+		web_service = self.web_services.get("GET", name)
+		arguments = web_service.parse_query(dict((name, [value]) for name, value in query_arguments.iteritems()))
+		web_service.call(arguments, user_id=1, token="token")
+		return self.calls.pop()
+
+	def post(self, name, body):
+		web_service = self.web_services.get("POST", name)
+		web_service.call(web_service.parse_body(body), user_id=1, token="token")
+		return self.calls.pop()
+
+	def test_query_arguments_are_converted(self):
+		self.assertEqual(self.get("list", limit="10", offset="20"), (10, 20, None, 1))
+		self.assertEqual(self.get("list", limit="10", cursor="abc"), (10, 0, "abc", 1))
+		self.assertEqual(self.web_services.get("GET", "list").parse_query(dict(price=["1.5"], other=["x"])),
+		                 dict(price=1.5))
+		self.assertRaises(WrongArgumentValueError, self.get, "list", limit="ten", offset="0")
+		self.assertRaises(WrongArgumentValueError, self.get, "list", limit="10", offset="1.5")
+
+	def test_offset_or_cursor_is_required(self):
+		self.assertRaises(MissingArgumentsError, self.get, "list", limit="10")
+		self.assertRaises(MissingArgumentsError, self.get, "list", offset="0")
+
+	def test_body_arguments_are_checked(self):
+		self.assertEqual(self.post("follow", dict(artwork_id=12, follow=True, other="x")), (1, 12, True))
+		self.assertRaises(MissingArgumentsError, self.post, "follow", dict(artwork_id=12))
+		self.assertRaises(MissingArgumentsError, self.post, "follow", [12, True])
+		self.assertRaises(WrongArgumentValueError, self.post, "follow", dict(artwork_id=1.5, follow=True))
+		self.assertRaises(WrongArgumentValueError, self.post, "follow", dict(artwork_id=12, follow="yes"))
+		self.assertRaises(WrongArgumentValueError, self.post, "follow", dict(artwork_id=12, follow=None))
+
+	def test_string_body_arguments_are_converted(self):
+		# Sent by the clients before the arguments were checked
+		self.assertEqual(self.post("follow", dict(artwork_id="12", follow="true")), (1, 12, True))
+		self.assertEqual(self.post("follow", dict(artwork_id=u"12", follow="False")), (1, 12, False))
+		self.assertEqual(self.post("follow", dict(artwork_id=12, follow="0")), (1, 12, False))
+		self.assertRaises(WrongArgumentValueError, self.post, "follow", dict(artwork_id="twelve", follow=True))
+
+	def test_unknown_web_service(self):
+		self.assertRaises(InexistentResourceError, self.web_services.get, "GET", "follow")
+		self.assertRaises(InexistentResourceError, self.web_services.get, "POST", "unknown")
+		self.assertRaises(ValueError, self.web_services.add, "list", "GET", lambda: None)
+
+
+class MobileAppWebServicesTest(unittest.TestCase):
+	"""
+	The argument rules of the Mobile APP web services (checked before any query).
+	"""
+
+	def validate(self, method, name, arguments):
+		web_service = mobile_app_api.web_services.get(method, name)
+		if method == "GET":
+			arguments = web_service.parse_query(dict((name, [value]) for name, value in arguments.iteritems()))
+		else:
+			arguments = web_service.parse_body(arguments)
+		web_service.validate(arguments)
+
+	def test_nearby_feed_requires_a_location(self):
+		self.validate("GET", "home_artwork", dict(sorting_rule="5", limit="10", offset="0", location="25,121"))
+		self.validate("GET", "home_artwork", dict(sorting_rule="1", limit="10", offset="0"))
+		self.assertRaises(MissingArgumentsError, self.validate, "GET", "home_artwork",
+		                  dict(sorting_rule="5", limit="10", offset="0"))
+		self.assertRaises(MissingArgumentsError, self.validate, "GET", "home_artwork",
+		                  dict(sorting_rule="1", limit="10"))
+
+	def test_lists_require_an_offset_or_a_cursor(self):
+		for name in ("artist_list", "gallery_list", "auction_house_list", "label_list", "following_lists"):
+			self.validate("GET", name, dict(limit="10", offset="0"))
+			self.validate("GET", name, dict(limit="10", cursor=""))
+			self.assertRaises(MissingArgumentsError, self.validate, "GET", name, dict(limit="10"))
+
+	def test_post_arguments(self):
+		self.validate("POST", "make_bid", dict(artwork_auction_id=3, bid_amount=100))
+		self.validate("POST", "make_bid", dict(artwork_auction_id="3", bid_amount="100.5"))
+		self.validate("POST", "signup_facebook", dict(fb_id="123", user_name="a", user_email="b", user_image="c"))
+		self.validate("POST", "follow_artist", dict(artist_id="4", follow="true"))
+		self.assertRaises(WrongArgumentValueError, self.validate, "POST", "add_favorite_artwork",
+		                  dict(artwork_id=3, is_favorite="maybe"))
+
+	def test_unknown_web_service(self):
+		self.assertRaises(InexistentResourceError, mobile_app_api.get_ws, "unknown", {})
+		self.assertRaises(InexistentResourceError, mobile_app_api.post_ws, "artwork_page", {}, "{}")
+
+
+class MobileAppErrorCodesTest(AsyncHTTPTestCase):
+	"""
+	The error codes of the requests rejected by the registry.
+	"""
+
+	def get_app(self):
+		return tornado.web.Application([(r"/(?:label_list|banner_list)", MobileAppAPIHandler,
+		                                 dict(require_token=False))])
+
+	def error_code(self, path, method="GET", body=None):
+		response = self.fetch(path, method=method, body=body)
+		return json.loads(response.body).get('error_code')
+
+	def test_error_codes(self):
+		self.assertEqual(self.error_code("/banner_list", "POST", "{}"), "0002")  # Only a GET web service
+		self.assertEqual(self.error_code("/label_list?limit=10"), "0003")
+		self.assertEqual(self.error_code("/label_list?limit=ten&offset=0"), "0006")
+
+
+if __name__ == "__main__":
+	unittest.main()